@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Incremental update of the action processor based on the package content file of the action processor product.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from OPSI.Util.File.Opsi import PackageContentFile  # type: ignore[import]
+from opsicommon.logging import get_logger
+
+from opsiclientd.FileVerification import hash_file
+
+__all__ = [
+	"ActionProcessorFile",
+	"InstalledManifest",
+	"build_action_processor_dir",
+	"get_action_processor_files",
+	"local_changed_files",
+	"swap_directories",
+]
+
+logger = get_logger()
+
+MANIFEST_VERSION = 1
+
+
+@dataclass(frozen=True)
+class ActionProcessorFile:
+	# Path relative to the depot dir
+	source: str
+	# "d" = directory, "f" = file, "l" = link
+	type: str
+	size: int = 0
+	md5sum: str = ""
+	target: str = ""
+
+	def to_list(self) -> list[Any]:
+		return [self.source, self.type, self.size, self.md5sum, self.target]
+
+
+def _split_path(path: str) -> list[str]:
+	return [part for part in path.replace("\\", "/").split("/") if part and part != "."]
+
+
+def get_action_processor_files(depot_dir: str, remote_dir: str, remote_common_dir: str = "") -> dict[str, ActionProcessorFile]:
+	"""
+	Reads the package content file (`<product>.files`) of the action processor product.
+	`remote_dir` and `remote_common_dir` are relative to `depot_dir`, the first path component is the product id.
+	Returns the files of the action processor by path relative to the local action processor dir,
+	files of the common dir are placed in the local dir like in a full copy.
+	"""
+	remote_parts = _split_path(remote_dir)
+	if len(remote_parts) < 2:
+		raise ValueError(f"Action processor dir {remote_dir!r} is not a sub dir of a product dir")
+	product_id = remote_parts[0]
+	package_content_file = os.path.join(depot_dir, product_id, f"{product_id}.files")
+	if not os.path.isfile(package_content_file):
+		raise FileNotFoundError(f"Package content file {package_content_file!r} not found")
+
+	prefixes = ["/".join(remote_parts[1:])]
+	common_parts = _split_path(remote_common_dir)
+	if common_parts:
+		if common_parts[0] != product_id or len(common_parts) < 2:
+			raise ValueError(f"Action processor common dir {remote_common_dir!r} is not a sub dir of product dir {product_id!r}")
+		prefixes.append("/".join(common_parts[1:]))
+
+	package_info: dict[str, dict[str, Any]] = PackageContentFile(package_content_file).parse()
+	files: dict[str, ActionProcessorFile] = {}
+	for prefix in prefixes:
+		for path, info in package_info.items():
+			path = "/".join(_split_path(path))
+			if not path.startswith(f"{prefix}/"):
+				continue
+			files[path[len(prefix) + 1 :]] = ActionProcessorFile(
+				source=f"{product_id}/{path}",
+				type=info.get("type", ""),
+				size=int(info.get("size") or 0),
+				md5sum=info.get("md5sum") or "",
+				target=info.get("target") or "",
+			)
+	if not any(file.type == "f" for file in files.values()):
+		raise ValueError(f"No action processor files found in package content file {package_content_file!r}")
+	return files
+
+
+class InstalledManifest:
+	"""
+	Manifest of the installed action processor files, stored after every update.
+	"""
+
+	def __init__(self, path: str | Path) -> None:
+		self.path = Path(path)
+
+	def load(self, local_dir: str) -> dict[str, ActionProcessorFile]:
+		"""
+		Returns the installed files, empty if the manifest is missing or belongs to another action processor dir.
+		"""
+		try:
+			data = json.loads(self.path.read_text(encoding="utf-8"))
+			if data.get("version") != MANIFEST_VERSION or data.get("local_dir") != local_dir:
+				return {}
+			return {path: ActionProcessorFile(*values) for path, values in data["files"].items()}
+		except FileNotFoundError:
+			return {}
+		except (OSError, ValueError, TypeError, KeyError) as err:
+			logger.warning("Failed to read action processor manifest %s: %s", self.path, err)
+			return {}
+
+	def save(self, local_dir: str, files: dict[str, ActionProcessorFile]) -> None:
+		data = {"version": MANIFEST_VERSION, "local_dir": local_dir, "files": {path: file.to_list() for path, file in files.items()}}
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		tmp_file = self.path.with_name(f"{self.path.name}.tmp")
+		tmp_file.write_text(json.dumps(data), encoding="utf-8")
+		os.replace(tmp_file, self.path)
+
+	def remove(self) -> None:
+		self.path.unlink(missing_ok=True)
+
+	def changed_files(self, local_dir: str, files: dict[str, ActionProcessorFile]) -> list[str]:
+		"""
+		Returns the paths of the files which differ between the installed and the given files,
+		including files removed from the installation.
+		Without a manifest the files in the local dir are compared, the manifest is created if they match.
+		"""
+		installed = self.load(local_dir)
+		if not installed:
+			changed = local_changed_files(local_dir, files)
+			if not changed:
+				self.save(local_dir, files)
+			return changed
+		changed = [path for path, file in files.items() if not _same_content(installed.get(path), file)]
+		changed += [path for path in installed if path not in files]
+		return changed
+
+
+def _same_content(installed: ActionProcessorFile | None, file: ActionProcessorFile) -> bool:
+	if not installed or installed.type != file.type:
+		return False
+	if file.type == "f":
+		return (installed.size, installed.md5sum) == (file.size, file.md5sum)
+	if file.type == "l":
+		return installed.target == file.target
+	return True
+
+
+def local_changed_files(local_dir: str, files: dict[str, ActionProcessorFile]) -> list[str]:
+	"""
+	Returns the paths of the files which are missing in the local dir or differ in size or checksum.
+	"""
+	changed = []
+	for path, file in files.items():
+		local_path = os.path.join(local_dir, *path.split("/"))
+		try:
+			if file.type == "d":
+				if not os.path.isdir(local_path):
+					changed.append(path)
+			elif file.type == "l":
+				if not os.path.islink(local_path) or os.readlink(local_path) != file.target:
+					changed.append(path)
+			elif file.type == "f":
+				if os.path.getsize(local_path) != file.size or (file.md5sum and hash_file(local_path) != file.md5sum):
+					changed.append(path)
+		except OSError:
+			changed.append(path)
+	return changed
+
+
+def build_action_processor_dir(
+	files: dict[str, ActionProcessorFile],
+	depot_dir: str,
+	local_dir: str,
+	build_dir: str,
+	changed: list[str],
+	copy_function: Callable[[str, str], Any] = shutil.copy2,
+) -> int:
+	"""
+	Builds the new action processor dir in `build_dir`.
+	Changed files are copied from the depot dir with `copy_function` and verified,
+	unchanged files are copied from the installed action processor dir.
+	Returns the number of files transferred from the depot.
+	"""
+	if os.path.exists(build_dir):
+		shutil.rmtree(build_dir)
+	os.makedirs(build_dir)
+	changed_paths = set(changed)
+	transferred = 0
+	for path, file in sorted(files.items()):
+		destination = os.path.join(build_dir, *path.split("/"))
+		if file.type == "d":
+			os.makedirs(destination, exist_ok=True)
+			continue
+		os.makedirs(os.path.dirname(destination), exist_ok=True)
+		if file.type == "l":
+			os.symlink(file.target, destination)
+			continue
+		if file.type != "f":
+			continue
+
+		installed = os.path.join(local_dir, *path.split("/"))
+		if path not in changed_paths:
+			try:
+				if os.path.getsize(installed) == file.size:
+					shutil.copy2(installed, destination)
+					continue
+			except OSError:
+				pass
+			logger.info("Installed action processor file %r is missing or modified", path)
+
+		copy_function(os.path.join(depot_dir, *file.source.split("/")), destination)
+		transferred += 1
+		if file.md5sum and hash_file(destination) != file.md5sum:
+			raise RuntimeError(f"Checksum mismatch of action processor file {path!r} after transfer")
+	return transferred
+
+
+def swap_directories(new_dir: str, target_dir: str) -> None:
+	"""
+	Replaces `target_dir` with `new_dir` by renames, the old dir is restored if the replacement fails.
+	"""
+	old_dir = f"{target_dir}.old"
+	if os.path.exists(old_dir):
+		shutil.rmtree(old_dir)
+	if os.path.exists(target_dir):
+		os.rename(target_dir, old_dir)
+	try:
+		os.rename(new_dir, target_dir)
+	except OSError:
+		if os.path.exists(old_dir):
+			os.rename(old_dir, target_dir)
+		raise
+	if os.path.exists(old_dir):
+		shutil.rmtree(old_dir, ignore_errors=True)
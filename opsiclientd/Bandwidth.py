@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Process-wide bandwidth management of depot transfers.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Any, Callable, Generator
+
+from opsicommon.logging import get_logger
+
+logger = get_logger()
+
+COPY_CHUNK_SIZE = 64 * 1024
+# Rate in bytes per second lower priority transfers are throttled to while higher priority transfers are running
+MIN_RATE = 64 * 1024
+# Time window in seconds of the current rate measurement
+RATE_WINDOW = 2.0
+# Transferred bytes are summed up in samples of this length in seconds
+RATE_SAMPLE_INTERVAL = 0.1
+# Number of round trip times the base round trip time is taken from
+RTT_WINDOW = 30
+# The link is considered congested if the smoothed round trip time exceeds the base round trip time by this factor
+CONGESTION_RTT_FACTOR = 2.0
+RTT_TOLERANCE = 0.01
+RATE_DECREASE_FACTOR = 0.7
+RATE_INCREASE_FACTOR = 1.1
+# Minimum time in seconds between two adjustments of the dynamic rate
+RATE_ADJUST_INTERVAL = 1.0
+
+
+class TransferPriority(IntEnum):
+	"""Transfers with a lower value are served first."""
+
+	ACTION_PROCESSOR = 0
+	DOWNLOAD = 1
+	CACHING = 2
+	PREFETCH = 3
+
+
+class RateLimiter:
+	"""
+	Token bucket, a rate of 0 means unlimited.
+	Consumers sleep until the bytes they consumed are covered by the rate.
+	"""
+
+	def __init__(self, rate: float = 0.0) -> None:
+		self.rate = rate
+		self._tokens = 0.0
+		self._last = time.monotonic()
+		self._lock = threading.Lock()
+
+	def consume(self, amount: int) -> None:
+		if self.rate <= 0:
+			return
+		with self._lock:
+			now = time.monotonic()
+			# Allow bursts of up to one second
+			self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate) - amount
+			self._last = now
+			wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+		if wait:
+			time.sleep(wait)
+
+
+class Transfer:
+	"""
+	A transfer registered at the bandwidth manager.
+	Transfers metered by opsiclientd call `consume` for every block of data.
+	Transfers done by other libraries are not metered, they get their current limit passed to `on_limit`.
+	"""
+
+	_ids = itertools.count(1)
+
+	def __init__(
+		self,
+		manager: BandwidthManager,
+		name: str,
+		priority: TransferPriority,
+		max_bandwidth: int = 0,
+		on_limit: Callable[[int], None] | None = None,
+	) -> None:
+		self.id = next(self._ids)
+		self.name = name
+		self.priority = priority
+		self.max_bandwidth = max(int(max_bandwidth), 0)
+		self.started = time.time()
+		self.transferred = 0
+		self.queued_bytes = 0
+		# Bytes per second, 0 = unlimited
+		self.limit = 0
+		self.own_limit = 0
+		self.metered = on_limit is None
+		self._manager = manager
+		self._on_limit = on_limit
+		self._rate_limiter = RateLimiter()
+
+	def set_limit(self, limit: int, own_limit: int) -> None:
+		"""
+		`limit` includes the global rate, metered transfers take the global rate from the shared bucket
+		and only enforce `own_limit` themselves.
+		"""
+		self.limit = limit
+		self.own_limit = own_limit
+		self._rate_limiter.rate = own_limit
+		if self._on_limit:
+			try:
+				self._on_limit(limit)
+			except Exception as err:
+				logger.warning("Failed to set bandwidth limit of transfer %r: %s", self.name, err)
+
+	def consume(self, amount: int) -> None:
+		"""
+		Blocks until `amount` bytes may be transferred.
+		"""
+		self.queued_bytes += amount
+		try:
+			self._manager.acquire(self, amount)
+			self._rate_limiter.consume(amount)
+		finally:
+			self.queued_bytes -= amount
+		self.transferred += amount
+
+	def report_rtt(self, rtt: float) -> None:
+		self._manager.report_rtt(rtt)
+
+	def copy_file(self, src: str, dst: str) -> str:
+		"""
+		Copies the file `src` like `shutil.copy2` with the transferred bytes metered.
+		Can be used as `copy_function` of `shutil.copytree`.
+		"""
+		if os.path.isdir(dst):
+			dst = os.path.join(dst, os.path.basename(src))
+		with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+			while data := fsrc.read(COPY_CHUNK_SIZE):
+				self.consume(len(data))
+				fdst.write(data)
+		shutil.copystat(src, dst)
+		return dst
+
+	def to_dict(self) -> dict[str, Any]:
+		return {
+			"id": self.id,
+			"name": self.name,
+			"priority": self.priority.name.lower(),
+			"started": self.started,
+			"transferred": self.transferred,
+			"queued_bytes": self.queued_bytes,
+			"max_bandwidth": self.max_bandwidth,
+			"limit": self.limit,
+		}
+
+
+class BandwidthManager:
+	"""
+	Shares a global bandwidth between all depot transfers of the process.
+	Every unmetered transfer gets an equal share of the global rate, the metered transfers together get one share.
+	Metered transfers take their bytes from one token bucket, waiting transfers are served by priority.
+	While a transfer of higher priority is running, transfers of lower priority are throttled to `MIN_RATE`.
+	In dynamic mode the global rate is lowered if the round trip times reported by the transfers
+	indicate a congested link and raised again as long as they do not.
+	"""
+
+	def __init__(self, max_bandwidth: int = 0, dynamic: bool = False) -> None:
+		# Bytes per second, 0 = unlimited
+		self.max_bandwidth = max_bandwidth
+		self.dynamic = dynamic
+		self.adjust_interval = RATE_ADJUST_INTERVAL
+		self._dynamic_rate = 0.0
+		self._transfers: dict[int, Transfer] = {}
+		self._condition = threading.Condition()
+		self._tokens = 0.0
+		self._last_refill = time.monotonic()
+		# Waiting transfers as (priority, sequence number)
+		self._waiting: list[tuple[int, int]] = []
+		self._sequence = itertools.count()
+		self._rtts: deque[float] = deque(maxlen=RTT_WINDOW)
+		self._srtt = 0.0
+		self._last_adjust = 0.0
+		# Transferred bytes as (start time, bytes) per sample interval
+		self._samples: deque[tuple[float, int]] = deque(maxlen=int(RATE_WINDOW / RATE_SAMPLE_INTERVAL) + 2)
+
+	def configure(self, max_bandwidth: int, dynamic: bool) -> None:
+		with self._condition:
+			self.max_bandwidth = max(int(max_bandwidth), 0)
+			self.dynamic = bool(dynamic)
+			if not self.dynamic:
+				self._dynamic_rate = 0.0
+			self._update_limits()
+			self._condition.notify_all()
+
+	@property
+	def rate(self) -> float:
+		"""The current global rate in bytes per second, 0 = unlimited"""
+		rates = [rate for rate in (self.max_bandwidth, self._dynamic_rate if self.dynamic else 0.0) if rate > 0]
+		return min(rates) if rates else 0.0
+
+	def open_transfer(
+		self, name: str, priority: TransferPriority, max_bandwidth: int = 0, on_limit: Callable[[int], None] | None = None
+	) -> Transfer:
+		transfer = Transfer(self, name, priority, max_bandwidth, on_limit)
+		with self._condition:
+			self._transfers[transfer.id] = transfer
+			transfer.set_limit(self._get_limit(transfer), self._get_limit(transfer, include_global=False))
+			self._update_limits()
+		logger.debug("Transfer %r opened with priority %s, limit %d", name, priority.name, transfer.limit)
+		return transfer
+
+	def close_transfer(self, transfer: Transfer) -> None:
+		with self._condition:
+			self._transfers.pop(transfer.id, None)
+			self._update_limits()
+			self._condition.notify_all()
+		logger.debug("Transfer %r closed after %d bytes", transfer.name, transfer.transferred)
+
+	@contextmanager
+	def transfer(
+		self, name: str, priority: TransferPriority, max_bandwidth: int = 0, on_limit: Callable[[int], None] | None = None
+	) -> Generator[Transfer, None, None]:
+		transfer = self.open_transfer(name, priority, max_bandwidth, on_limit)
+		try:
+			yield transfer
+		finally:
+			self.close_transfer(transfer)
+
+	def _get_limit(self, transfer: Transfer, include_global: bool = True) -> int:
+		global_rate = self.rate if include_global else 0.0
+		if global_rate > 0 and not transfer.metered:
+			unmetered = sum(1 for other in self._transfers.values() if not other.metered)
+			metered = any(other.metered for other in self._transfers.values())
+			global_rate /= max(unmetered + metered, 1)
+		limits = [rate for rate in (transfer.max_bandwidth, global_rate) if rate > 0]
+		if any(other.priority < transfer.priority for other in self._transfers.values()):
+			limits.append(MIN_RATE)
+		return int(min(limits)) if limits else 0
+
+	def _update_limits(self) -> None:
+		for transfer in self._transfers.values():
+			limit = self._get_limit(transfer)
+			own_limit = self._get_limit(transfer, include_global=False)
+			if limit != transfer.limit or own_limit != transfer.own_limit:
+				transfer.set_limit(limit, own_limit)
+
+	def _refill(self, now: float, rate: float) -> None:
+		if rate > 0:
+			# Allow bursts of up to one second
+			self._tokens = min(rate, self._tokens + (now - self._last_refill) * rate)
+		self._last_refill = now
+
+	def _bucket_rate(self) -> float:
+		"""
+		The global rate left to the metered transfers by the unmetered transfers, 0 = unlimited.
+		"""
+		rate = self.rate
+		if rate <= 0:
+			return 0.0
+		unmetered = sum(transfer.limit for transfer in self._transfers.values() if not transfer.metered)
+		return max(rate - unmetered, MIN_RATE)
+
+	def _prune_samples(self, now: float) -> None:
+		while self._samples and self._samples[0][0] < now - RATE_WINDOW:
+			self._samples.popleft()
+
+	def _add_sample(self, now: float, amount: int) -> None:
+		if self._samples and now - self._samples[-1][0] < RATE_SAMPLE_INTERVAL:
+			start, transferred = self._samples[-1]
+			self._samples[-1] = (start, transferred + amount)
+		else:
+			self._samples.append((now, amount))
+		self._prune_samples(now)
+
+	def _current_rate(self, now: float) -> float:
+		self._prune_samples(now)
+		return sum(amount for _time, amount in self._samples) / RATE_WINDOW
+
+	def acquire(self, transfer: Transfer, amount: int) -> None:
+		"""
+		Takes `amount` bytes from the global bucket, the waiting transfer with the highest priority is served first.
+		"""
+		with self._condition:
+			entry = (int(transfer.priority), next(self._sequence))
+			heapq.heappush(self._waiting, entry)
+			try:
+				while True:
+					rate = self._bucket_rate()
+					now = time.monotonic()
+					self._refill(now, rate)
+					if rate <= 0:
+						break
+					if self._waiting[0] == entry:
+						if self._tokens >= 0:
+							self._tokens -= amount
+							break
+						self._condition.wait(-self._tokens / rate)
+					else:
+						self._condition.wait(0.5)
+			finally:
+				self._waiting.remove(entry)
+				heapq.heapify(self._waiting)
+				self._condition.notify_all()
+			self._add_sample(now, amount)
+
+	def report_rtt(self, rtt: float) -> None:
+		"""
+		Round trip time feedback of a transfer, for example the time to the first response byte of a request.
+		"""
+		with self._condition:
+			self._rtts.append(rtt)
+			self._srtt = rtt if not self._srtt else 0.75 * self._srtt + 0.25 * rtt
+			now = time.monotonic()
+			if not self.dynamic or now - self._last_adjust < self.adjust_interval:
+				return
+			self._last_adjust = now
+
+			current_rate = self._current_rate(now)
+			if self._srtt > min(self._rtts) * CONGESTION_RTT_FACTOR + RTT_TOLERANCE:
+				rate = self._dynamic_rate or current_rate or self.max_bandwidth
+				if rate:
+					self._dynamic_rate = max(MIN_RATE, rate * RATE_DECREASE_FACTOR)
+					logger.info("Congestion detected (rtt %0.3fs), lowering bandwidth to %d bytes/s", self._srtt, self._dynamic_rate)
+			elif self._dynamic_rate:
+				self._dynamic_rate *= RATE_INCREASE_FACTOR
+				if (self.max_bandwidth and self._dynamic_rate >= self.max_bandwidth) or (
+					not self.max_bandwidth and current_rate and self._dynamic_rate > current_rate * 2
+				):
+					# The dynamic rate is no longer the bottleneck
+					self._dynamic_rate = 0.0
+					logger.info("Bandwidth no longer limited by congestion")
+			self._update_limits()
+			self._condition.notify_all()
+
+	def get_state(self) -> dict[str, Any]:
+		with self._condition:
+			transfers = sorted(self._transfers.values(), key=lambda transfer: (transfer.priority, transfer.id))
+			return {
+				"max_bandwidth": self.max_bandwidth,
+				"dynamic": self.dynamic,
+				"rate_limit": int(self.rate),
+				"current_rate": int(self._current_rate(time.monotonic())),
+				"queued_bytes": sum(transfer.queued_bytes for transfer in transfers),
+				"smoothed_rtt": self._srtt,
+				"base_rtt": min(self._rtts) if self._rtts else 0.0,
+				"transfers": [transfer.to_dict() for transfer in transfers],
+			}
+
+
+bandwidth_manager = BandwidthManager()
@@ -14,9 +14,14 @@ from __future__ import annotations
 import os
 import platform
 import re
+import shutil
 import sys
+import threading
+import time
 from dataclasses import dataclass, field
-from typing import TYPE_CHECKING, Any
+from hashlib import sha256
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Callable, Iterator
 from urllib.parse import urlparse
 
 import netifaces  # type: ignore[import]
@@ -36,6 +41,9 @@ from opsicommon.types import (
 )
 from opsicommon.utils import Singleton
 
+from opsiclientd.Bandwidth import bandwidth_manager
+from opsiclientd.DepotSelection import latency_depot_selector
+from opsiclientd.RPCProfiler import rpc_profiler
 from opsiclientd.SystemCheck import (
 	RUNNING_ON_DARWIN,
 	RUNNING_ON_LINUX,
@@ -84,6 +92,10 @@ kGOsCMSImzajpmtonx3ccPgSOyEWyoEaGij6u80QtFkj9g==
 -----END CERTIFICATE-----"""
 
 OPSI_SETUP_USER_NAME = "opsisetupuser"
+TEMPLATE_CACHE_SIZE = 1024
+DEPOT_SELECTION_CACHE_SIZE = 32
+# Attempts to build a config snapshot without locking before locking out concurrent changes
+SNAPSHOT_BUILD_ATTEMPTS = 10
 
 logger = get_logger()
 
@@ -103,6 +115,52 @@ class RestartMarkerConfig:
 			self.product_id = self.product_id.strip().lower()
 
 
+@dataclass
+class DepotSelection:
+	depot: OpsiDepotserver
+	depot_protocol: str
+	# Products the depot was selected for, the selection is valid for every subset
+	product_ids: frozenset[str]
+	network_fingerprint: tuple[str, ...]
+	expires: float
+
+
+class ConfigTemplate:
+	"""
+	A string containing %section.option% placeholders, split into literal and placeholder parts.
+	"""
+
+	__slots__ = ("parts", "quoted")
+
+	def __init__(self, string: str) -> None:
+		self.parts: list[str | tuple[str, str]] = []
+		# Placeholders enclosed in double quotes
+		self.quoted: set[tuple[str, str]] = set()
+		literal_start = 0
+		pos = 0
+		while (start := string.find("%", pos)) != -1:
+			end = string.find("%", start + 1)
+			if end == -1:
+				break
+			section, sep, option = string[start + 1 : end].partition(".")
+			if not sep or not section or not option or " " in section or " " in option:
+				# Not a placeholder, the closing % can start the next placeholder
+				pos = start + 1
+				continue
+			if start > literal_start:
+				self.parts.append(string[literal_start:start])
+			self.parts.append((section, option))
+			if string[start - 1 : start] == '"' and string[end + 1 : end + 2] == '"':
+				self.quoted.add((section, option))
+			literal_start = pos = end + 1
+		if literal_start < len(string):
+			self.parts.append(string[literal_start:])
+
+	@property
+	def is_literal(self) -> bool:
+		return all(isinstance(part, str) for part in self.parts)
+
+
 class SectionNotFoundException(ValueError):
 	pass
 
@@ -111,6 +169,76 @@ class NoConfigOptionFoundException(ValueError):
 	pass
 
 
+class ConfigSection:
+	"""
+	Read-only resolved values of a config section, options are accessible as attributes.
+	"""
+
+	def __init__(self, name: str, values: dict[str, Any]) -> None:
+		# Values are stored as instance attributes, attribute access is as fast as possible
+		self.__dict__.update(values)
+		self.__dict__["_name"] = name
+
+	def __repr__(self) -> str:
+		return f"<{self.__class__.__name__}({self._name!r})>"
+
+	def __getattr__(self, option: str) -> Any:
+		# Only called if there is no such attribute
+		raise AttributeError(f"No such config option in section '{self._name}': {option}")
+
+	def __setattr__(self, name: str, value: Any) -> None:
+		raise AttributeError("Config snapshot is read-only")
+
+	def __delattr__(self, name: str) -> None:
+		raise AttributeError("Config snapshot is read-only")
+
+	def __contains__(self, option: str) -> bool:
+		return option in self.__dict__ and option != "_name"
+
+	def __iter__(self) -> Iterator[str]:
+		return (option for option in self.__dict__ if option != "_name")
+
+	def __getitem__(self, option: str) -> Any:
+		if option not in self:
+			raise NoConfigOptionFoundException(f"No such config option in section '{self._name}': {option}")
+		return self.__dict__[option]
+
+
+class ConfigSnapshot:
+	"""
+	Immutable snapshot of the config with all values resolved like returned by `Config.get`.
+	Lists are stored as tuples.
+	Sections are accessible as attributes, `global_` is the global section.
+	"""
+
+	def __init__(self, sections: dict[str, ConfigSection], generation: int) -> None:
+		self.__dict__.update(sections)
+		self.__dict__["global_"] = sections.get("global")
+		self.__dict__["generation"] = generation
+		self.__dict__["sections"] = MappingProxyType(sections)
+
+	def __getattr__(self, section: str) -> ConfigSection:
+		# Only called if there is no such attribute
+		raise AttributeError(f"No such config section: {section}")
+
+	def __setattr__(self, name: str, value: Any) -> None:
+		raise AttributeError("Config snapshot is read-only")
+
+	def __delattr__(self, name: str) -> None:
+		raise AttributeError("Config snapshot is read-only")
+
+	def __contains__(self, section: str) -> bool:
+		return section in self.sections
+
+	def __getitem__(self, section: str) -> ConfigSection:
+		if section not in self.sections:
+			raise SectionNotFoundException(f"No such config section: {section}")
+		return self.sections[section]
+
+	def get(self, section: str, option: str) -> Any:
+		return self[section or "global"][option]
+
+
 class Config(metaclass=Singleton):
 	_initialized = False
 	WINDOWS_DEFAULT_PATHS = {
@@ -174,7 +302,27 @@ class Config(metaclass=Singleton):
 		self._temporaryDepotDrive: str | None = None
 		self._temporary_depot_path: str | None = None
 		self._config_file_mtime: float = 0.0
+		# Parsed config file (path, mtime, config, comments) and options changed since the file was written
+		self._config_file_cache: tuple[str, float, Any, Any] | None = None
+		self._dirty_options: set[tuple[str, str]] = set()
 		self.disabledEventTypes: list[str] = []
+		# Compiled templates do not depend on the config values, replaced strings are invalidated on change
+		self._templates: dict[str, ConfigTemplate] = {}
+		self._replaced: dict[tuple[str, bool], str] = {}
+		self._replaced_lock = threading.Lock()
+		# Held while options are changed
+		self._config_lock = threading.RLock()
+		# Incremented on every change of the config
+		self._generation = 0
+		# Sections changed since the snapshot was built, only these and the sections referring to them are rebuilt
+		self._changed_sections: set[str] = set()
+		self._snapshot: ConfigSnapshot | None = None
+		self._snapshot_lock = threading.Lock()
+		# Depot selections by (host id, master only, forced protocol, event protocol)
+		self._depot_selections: dict[tuple[str, bool, str, str], list[DepotSelection]] = {}
+		self._depot_selection_lock = threading.Lock()
+		# Compiled depot selection algorithm (source hash, selectDepot function)
+		self._depot_selection_algorithm: tuple[str, Callable] | None = None
 
 		self._config = {
 			"system": {
@@ -203,6 +351,8 @@ class Config(metaclass=Singleton):
 				"tmp_dir_cleanup": False,
 				"post_trusted_installer_delay": 15,
 				"message_of_the_day_enabled": False,
+				"process_sampler_interval": 5.0,  # In seconds, 0 = disabled
+				"process_sampler_history_size": 720,
 			},
 			"config_service": {
 				"url": [],
@@ -213,6 +363,8 @@ class Config(metaclass=Singleton):
 				"permanent_connection": False,
 				"reconnect_wait_min": 5,
 				"reconnect_wait_max": 120,
+				# Maximum number of rpcs per operation, format: <operation>:<max calls>[,<operation>:<max calls>]
+				"rpc_call_budgets": "",
 			},
 			"depot_server": {
 				# The id of the depot the client is assigned to
@@ -222,6 +374,17 @@ class Config(metaclass=Singleton):
 				"url": "",
 				"drive": "",
 				"username": "pcpatch",
+				# Time in seconds a depot selection is reused (0 = disabled)
+				"selection_cache_ttl": 300,
+				# "algorithm" = depot selection algorithm of the service, "latency" = probe depots and select the fastest
+				"selection_mode": "algorithm",
+				# Timeout in seconds and size of the range read when probing depots
+				"probe_timeout": 3.0,
+				"probe_read_size": 65536,
+				# Bandwidth in bytes per second shared by all depot transfers (0 = unlimited)
+				"max_bandwidth": 0,
+				# Lower the bandwidth of depot transfers if rising round trip times indicate a congested link
+				"dynamic_bandwidth": False,
 			},
 			"cache_service": {
 				"product_cache_max_size": 6000000000,
@@ -229,6 +392,28 @@ class Config(metaclass=Singleton):
 				"include_product_group_ids": [],
 				"exclude_product_group_ids": [],
 				"sync_products_with_actions_only": True,
+				# Files of at least this size (bytes) are downloaded resumable from webdav depots (0 = disabled)
+				"resumable_download_min_size": 50000000,
+				"download_max_retries": 10,
+				# Files of at least this size (bytes) are downloaded in chunks over multiple connections (0 = disabled)
+				"parallel_download_min_size": 200000000,
+				"parallel_download_connections": 4,
+				# Verify cached products in background after this many seconds (0 = disabled)
+				"product_verification_interval": 86400,
+				"verify_products_before_use": True,
+				# Number of files hashed in parallel
+				"verification_workers": 4,
+				# Fetch product files from clients on the local network which have cached the same product version
+				"peer_cache_enabled": False,
+				# Shared secret of the clients sharing their product cache
+				"peer_cache_secret": "",
+				# Cache newer versions of installed products and the products of the prefetch groups ahead of action requests
+				"prefetch_enabled": False,
+				"prefetch_product_group_ids": [],
+				# Prefetch only inside of this time window, like: 22:00-06:00 (empty = always)
+				"prefetch_working_window": "",
+				# Minimum time in seconds between two prefetch runs
+				"prefetch_interval": 3600,
 			},
 			"control_server": {
 				"interface": ["0.0.0.0", "::"],
@@ -388,7 +573,10 @@ class Config(metaclass=Singleton):
 		return True
 
 	def del_option(self, section: str, option: str) -> None:
-		del self._config[section][option]
+		with self._config_lock:
+			del self._config[section][option]
+			self._dirty_options.add((section, option))
+			self._config_changed(section)
 
 	def get(self, section: str, option: str, raw: bool = False) -> Any:
 		if not section:
@@ -459,9 +647,12 @@ class Config(metaclass=Singleton):
 			and "productids" not in option
 			and "exclude_product_group_ids" not in option
 			and "include_product_group_ids" not in option
+			and "prefetch_product_group_ids" not in option
 			and "proxy_url" not in option
 			and "working_window" not in option
 			and "alt_ids" not in option
+			and "rpc_call_budgets" not in option
+			and "peer_cache_secret" not in option
 		):
 			if section == "action_processor" and option == "remote_common_dir":
 				return
@@ -474,7 +665,7 @@ class Config(metaclass=Singleton):
 				return
 
 		# Preprocess values, convert to correct type
-		if option in ("exclude_product_group_ids", "include_product_group_ids", "alt_ids", "interface"):
+		if option in ("exclude_product_group_ids", "include_product_group_ids", "prefetch_product_group_ids", "alt_ids", "interface"):
 			if not isinstance(value, list):
 				value = [x.strip() for x in value.split(",") if x.strip()]
 			value = forceList(value)
@@ -528,6 +719,8 @@ class Config(metaclass=Singleton):
 					if len(value) != 32:
 						raise ValueError("Bad opsi host key, length != 32")
 					secret_filter.add_secrets(value)
+				elif option == "peer_cache_secret" and value:
+					secret_filter.add_secrets(value)
 				elif option in ("depot_id", "host_id"):
 					value = forceHostId(value.replace("_", "-"))
 
@@ -537,29 +730,147 @@ class Config(metaclass=Singleton):
 
 		logger.info("Setting config %s.%s to %r", section, option, value)
 
-		if section not in self._config:
-			self._config[section] = {}
-		self._config[section][option] = value
+		with self._config_lock:
+			if section not in self._config:
+				self._config[section] = {}
+			if option not in self._config[section] or self._config[section][option] != value:
+				self._dirty_options.add((section, option))
+				self._config[section][option] = value
+				self._config_changed(section)
 
 		if section == "global" and option == "log_level":
 			logging_config(file_level=self._config[section][option])
+		elif section == "depot_server" and option in ("max_bandwidth", "dynamic_bandwidth"):
+			bandwidth_manager.configure(self._config[section]["max_bandwidth"], self._config[section]["dynamic_bandwidth"])
+		elif section == "config_service" and option == "rpc_call_budgets":
+			try:
+				rpc_profiler.configure_budgets(value)
+			except ValueError as err:
+				logger.error("Failed to set rpc call budgets: %s", err)
+
+	def _config_changed(self, section: str) -> None:
+		with self._replaced_lock:
+			self._replaced = {}
+			self._generation += 1
+			self._changed_sections.add(section)
+
+	def _affected_sections(self, changed_sections: set[str]) -> set[str]:
+		"""
+		Returns the changed sections and the sections with placeholders referring to them, also indirectly.
+		"""
+		references: dict[str, set[str]] = {}
+		for section, options in list(self._config.items()):
+			for value in list(options.values()):
+				if isinstance(value, str) and value.count("%") >= 2:
+					template = self._compile_template(value)
+					references.setdefault(section, set()).update(part[0] for part in template.parts if isinstance(part, tuple))
+		affected = set(changed_sections)
+		while referring := {section for section, referenced in references.items() if section not in affected and referenced & affected}:
+			affected |= referring
+		return affected
+
+	def _read_snapshot(self, generation: int, previous: ConfigSnapshot | None, changed_sections: set[str]) -> ConfigSnapshot:
+		affected = self._affected_sections(changed_sections) if previous else set()
+		sections = {}
+		for section, options in list(self._config.items()):
+			if previous and section not in affected and section in previous:
+				sections[section] = previous[section]
+				continue
+			values = {}
+			for option in list(options):
+				value = self.get(section, option)
+				values[option] = tuple(value) if isinstance(value, list) else value
+			sections[section] = ConfigSection(section, values)
+		return ConfigSnapshot(sections, generation)
+
+	def _build_snapshot(self, generation: int, previous: ConfigSnapshot | None, changed_sections: set[str]) -> ConfigSnapshot:
+		for attempt in range(1, SNAPSHOT_BUILD_ATTEMPTS + 1):
+			try:
+				return self._read_snapshot(generation, previous, changed_sections)
+			except (RuntimeError, KeyError, NoConfigOptionFoundException) as err:
+				# Config changed while building the snapshot
+				logger.debug("Failed to build config snapshot (attempt %d): %s", attempt, err)
+		logger.debug("Building config snapshot while holding the config lock")
+		with self._config_lock:
+			return self._read_snapshot(generation, previous, changed_sections)
 
-	def replace(self, string: str, escaped: bool = False) -> str:
-		for section, values in self._config.items():
-			if not isinstance(values, dict):
+	@property
+	def snapshot(self) -> ConfigSnapshot:
+		"""
+		Immutable snapshot of the current config, for fast and consistent reads without locking.
+		After a change only the changed sections and the sections referring to them are rebuilt.
+		"""
+		snapshot = self._snapshot
+		if snapshot and snapshot.generation == self._generation:
+			return snapshot
+		with self._snapshot_lock:
+			snapshot = self._snapshot
+			if not snapshot or snapshot.generation != self._generation:
+				with self._replaced_lock:
+					generation = self._generation
+					changed_sections = self._changed_sections
+					self._changed_sections = set()
+				try:
+					snapshot = self._snapshot = self._build_snapshot(generation, snapshot, changed_sections)
+				except BaseException:
+					with self._replaced_lock:
+						self._changed_sections |= changed_sections
+					raise
+		return snapshot
+
+	def _compile_template(self, string: str) -> ConfigTemplate:
+		template = self._templates.get(string)
+		if not template:
+			if len(self._templates) >= TEMPLATE_CACHE_SIZE:
+				self._templates = {}
+			template = self._templates[string] = ConfigTemplate(string)
+		return template
+
+	def _render_template(self, string: str, escaped: bool, resolving: tuple[tuple[str, str], ...] = ()) -> str:
+		template = self._compile_template(string)
+		if template.is_literal:
+			return string
+		result = []
+		for part in template.parts:
+			if isinstance(part, str):
+				result.append(part)
+				continue
+			section, option = part
+			values = self._config.get(section)
+			if not isinstance(values, dict) or option not in values:
+				result.append(f"%{section}.{option}%")
 				continue
-			for key, value in values.items():
-				value = forceUnicode(value)
-				if string.find('"%' + forceUnicode(section) + "." + forceUnicode(key) + '%"') != -1 and escaped:
-					if os.name == "posix":
-						value = value.replace('"', '\\"')
-					elif RUNNING_ON_WINDOWS:
-						value = value.replace('"', '^"')
-				newString = string.replace("%" + forceUnicode(section) + "." + forceUnicode(key) + "%", value)
-
-				if newString != string:
-					string = self.replace(newString, escaped)
-		return forceUnicode(string)
+			if part in resolving:
+				logger.warning("Circular reference in config placeholder %%%s.%s%%", section, option)
+				result.append(f"%{section}.{option}%")
+				continue
+			value = self._render_template(forceUnicode(values[option]), escaped, resolving + (part,))
+			if escaped and part in template.quoted:
+				if os.name == "posix":
+					value = value.replace('"', '\\"')
+				elif RUNNING_ON_WINDOWS:
+					value = value.replace('"', '^"')
+			result.append(value)
+		return "".join(result)
+
+	def replace(self, string: str, escaped: bool = False) -> str:
+		"""
+		Replaces all %section.option% placeholders by the config values, placeholders in values are replaced recursively.
+		If `escaped` is True, double quotes are escaped in values of placeholders enclosed in double quotes.
+		"""
+		string = forceUnicode(string)
+		key = (string, escaped)
+		replaced = self._replaced
+		result = replaced.get(key)
+		if result is None:
+			result = self._render_template(string, escaped)
+			with self._replaced_lock:
+				# Do not cache the result if the config was changed in the meantime
+				if replaced is self._replaced:
+					if len(replaced) >= TEMPLATE_CACHE_SIZE:
+						replaced = self._replaced = {}
+					replaced[key] = result
+		return result
 
 	def readConfigFile(self) -> None:
 		"""Get settings from config file"""
@@ -597,72 +908,123 @@ class Config(metaclass=Singleton):
 		logger.notice("Config read")
 		logger.debug("Config is now:\n %s", objectToBeautifiedText(self._config))
 
-	def updateConfigFile(self, force: bool = False) -> None:
-		logger.info("Updating config file: '%s'", self.get("global", "config_file"))
+	@staticmethod
+	def _config_file_value(value: Any) -> str:
+		if isinstance(value, list):
+			value = ", ".join(forceUnicodeList(value))
+		elif isinstance(value, bool):
+			value = str(value).lower()
+		else:
+			value = forceUnicode(value)
+
+		if value.lower() in ("true", "false"):
+			value = value.lower()
+		return value
+
+	def _update_config_file_option(self, config: Any, section: str, option: str) -> bool:
+		"""
+		Applies the current value of the option to the parsed config file, returns True if changed.
+		"""
+		if section == "system" or (section == "global" and option == "config_file"):
+			# Do not store these options
+			return False
+		values = self._config.get(section)
+		if not isinstance(values, dict):
+			# Keep sections unknown to the config as they are
+			return False
+		if option not in values:
+			if config.has_section(section) and config.has_option(section, option):
+				logger.info("Removing obsolete config option: %s.%s", section, option)
+				config.remove_option(section, option)
+				return True
+			return False
+
+		value = self._config_file_value(values[option])
+		if not config.has_section(section):
+			logger.debug("Config changed - new section: %s", section)
+			config.add_section(section)
+		if not config.has_option(section, option):
+			logger.debug("Config changed - new option: %s.%s = %s", section, option, value)
+			config.set(section, option, value)
+			return True
+		if config.get(section, option) != value:
+			logger.debug("Config changed - changed value: %s.%s = %s => %s", section, option, config.get(section, option), value)
+			config.set(section, option, value)
+			return True
+		return False
 
-		if self._config_file_mtime and os.path.getmtime(self.get("global", "config_file")) > self._config_file_mtime:
+	def updateConfigFile(self, force: bool = False) -> None:
+		"""
+		Writes changed options to the config file.
+		The parsed config file is cached, only options changed by `set` since the last update are applied.
+		The whole config is compared to the file only if the file is not cached or was changed by another program.
+		"""
+		config_file = self.get("global", "config_file")
+		logger.info("Updating config file: '%s'", config_file)
+
+		mtime = os.path.getmtime(config_file)
+		if self._config_file_mtime and mtime > self._config_file_mtime:
 			msg = "overwriting changes is forced" if force else "keeping file as is"
-			logger.warning("The config file '%s' has been changed by another program, %s", self.get("global", "config_file"), msg)
+			logger.warning("The config file '%s' has been changed by another program, %s", config_file, msg)
 			if not force:
 				return
 
+		dirty_options, self._dirty_options = self._dirty_options, set()
 		try:
-			configFile = IniFile(filename=self.get("global", "config_file"), raw=True)
-			configFile.setKeepOrdering(True)
-			(config, comments) = configFile.parse(returnComments=True)
+			cache = self._config_file_cache
+			if cache and cache[0] == config_file and cache[1] == mtime:
+				if not dirty_options:
+					logger.info("No need to write config file '%s', config file is up to date", config_file)
+					return
+				_path, _mtime, config, comments = cache
+				options = sorted(dirty_options)
+			else:
+				configFile = IniFile(filename=config_file, raw=True)
+				configFile.setKeepOrdering(True)
+				(config, comments) = configFile.parse(returnComments=True)
+				options = [
+					(section, option)
+					for section, values in self._config.items()
+					if isinstance(values, dict) and section != "system"
+					for option in values
+				]
+				options += [
+					(section, option)
+					for section in config.sections()
+					if isinstance(self._config.get(section), dict)
+					for option in config.options(section)
+					if option not in self._config[section]
+				]
+			self._config_file_cache = None
+
 			changed = False
-			for section, values in self._config.items():
-				if not isinstance(values, dict):
-					continue
-				if section == "system":
-					continue
-				if not config.has_section(section):
-					logger.debug("Config changed - new section: %s", section)
-					config.add_section(section)
+			for section, option in options:
+				if self._update_config_file_option(config, section, option):
 					changed = True
 
-				for option, value in values.items():
-					if (section == "global") and (option == "config_file"):
-						# Do not store these option
-						continue
-					if isinstance(value, list):
-						value = ", ".join(forceUnicodeList(value))
-					elif isinstance(value, bool):
-						value = str(value).lower()
-					else:
-						value = forceUnicode(value)
-
-					if value.lower() in ("true", "false"):
-						value = value.lower()
-
-					if not config.has_option(section, option):
-						logger.debug("Config changed - new option: %s.%s = %s", section, option, value)
-						config.set(section, option, value)
-						changed = True
-					elif config.get(section, option) != value:
-						logger.debug(
-							"Config changed - changed value: %s.%s = %s => %s", section, option, config.get(section, option), value
-						)
-						config.set(section, option, value)
-						changed = True
-
-				for option in config.options(section):
-					if option not in values:
-						logger.info("Removing obsolete config option: %s.%s", section, option)
-						config.remove_option(section, option)
-						changed = True
-
 			if changed:
-				# Write back config file if changed
-				configFile.generate(config, comments=comments)
-				logger.notice("Config file '%s' written", self.get("global", "config_file"))
-				self._config_file_mtime = os.path.getmtime(self.get("global", "config_file"))
+				# Write back config file if changed, atomically replace the file
+				tmp_file = f"{config_file}.tmp"
+				try:
+					tmpConfigFile = IniFile(filename=tmp_file, raw=True)
+					tmpConfigFile.setKeepOrdering(True)
+					tmpConfigFile.generate(config, comments=comments)
+					shutil.copymode(config_file, tmp_file)
+					os.replace(tmp_file, config_file)
+				except Exception:
+					if os.path.exists(tmp_file):
+						os.remove(tmp_file)
+					raise
+				logger.notice("Config file '%s' written", config_file)
+				self._config_file_mtime = os.path.getmtime(config_file)
 			else:
-				logger.info("No need to write config file '%s', config file is up to date", self.get("global", "config_file"))
+				logger.info("No need to write config file '%s', config file is up to date", config_file)
+			self._config_file_cache = (config_file, os.path.getmtime(config_file), config, comments)
 		except Exception as err:
 			# An error occured while trying to write the config file
+			self._dirty_options.update(dirty_options)
 			logger.error(err, exc_info=True)
-			logger.error("Failed to write config file '%s': %s", self.get("global", "config_file"), err)
+			logger.error("Failed to write config file '%s': %s", config_file, err)
 
 	def setTemporaryDepotDrive(self, temporaryDepotDrive: str | None) -> None:
 		self._temporaryDepotDrive = temporaryDepotDrive
@@ -689,6 +1051,50 @@ class Config(metaclass=Singleton):
 
 		return self.get("config_service", "url")
 
+	def _get_network_config(self) -> dict[str, str]:
+		gateways = netifaces.gateways()
+		gateway, iface_name = gateways["default"][netifaces.AF_INET]
+		addr = netifaces.ifaddresses(iface_name)[netifaces.AF_INET][0]
+		return {"interface": iface_name, "ipAddress": addr["addr"], "netmask": addr["netmask"], "defaultGateway": gateway}
+
+	def _get_network_fingerprint(self) -> tuple[str, ...]:
+		try:
+			return tuple(self._get_network_config().values())
+		except Exception as err:
+			logger.debug("Failed to get network config: %s", err)
+			return ()
+
+	def clearDepotSelectionCache(self) -> None:
+		with self._depot_selection_lock:
+			self._depot_selections = {}
+
+	def _get_depot_selection_function(self, configService: JSONRPCBackend) -> Callable:
+		depotSelectionAlgorithm = configService.getDepotSelectionAlgorithm()
+		algorithm_hash = sha256(depotSelectionAlgorithm.encode("utf-8")).hexdigest()
+		if self._depot_selection_algorithm and self._depot_selection_algorithm[0] == algorithm_hash:
+			return self._depot_selection_algorithm[1]
+
+		logger.trace("depotSelectionAlgorithm:\n%s", depotSelectionAlgorithm)
+		namespace: dict[str, Any] = dict(globals())
+		exec(compile(depotSelectionAlgorithm, "<depot selection algorithm>", "exec"), namespace)
+		self._depot_selection_algorithm = (algorithm_hash, namespace["selectDepot"])
+		return self._depot_selection_algorithm[1]
+
+	def _select_depot_by_latency(self, masterDepot: OpsiDepotserver, alternativeDepots: list[OpsiDepotserver]) -> OpsiDepotserver | None:
+		ca_cert_file = None
+		if self.get("global", "verify_server_cert") and os.path.exists(self.ca_cert_file):
+			ca_cert_file = self.ca_cert_file
+		return latency_depot_selector.select_depot(
+			master_depot=masterDepot,
+			alternative_depots=alternativeDepots,
+			timeout=self.get("depot_server", "probe_timeout"),
+			read_size=self.get("depot_server", "probe_read_size"),
+			username=self.get("global", "host_id"),
+			password=self.get("global", "opsi_host_key"),
+			ca_cert_file=ca_cert_file,
+		)
+
+	@rpc_profiler.operation("Config.getDepot")
 	def getDepot(
 		self,
 		configService: JSONRPCBackend,
@@ -697,11 +1103,68 @@ class Config(metaclass=Singleton):
 		masterOnly: bool = False,
 		forceDepotProtocol: str | None = None,
 	) -> tuple[OpsiDepotserver, str]:
+		"""
+		Returns the depot to use for the given products and the depot protocol.
+		Selections are reused for subsets of the products until the ttl expires or the network config changes.
+		"""
 		productIds = forceProductIdList(productIds or [])
 		if not configService:
 			raise RuntimeError("Not connected to config service")
 
+		ttl = self.get("depot_server", "selection_cache_ttl")
+		cache_key = (
+			self.get("global", "host_id"),
+			bool(masterOnly),
+			forceDepotProtocol or "",
+			(event.eventConfig.depotProtocol or "") if event else "",
+		)
+		network_fingerprint = self._get_network_fingerprint()
+		now = time.monotonic()
+		if ttl > 0:
+			with self._depot_selection_lock:
+				selections = [
+					selection
+					for selection in self._depot_selections.get(cache_key, [])
+					if selection.expires > now and selection.network_fingerprint == network_fingerprint
+				]
+				self._depot_selections[cache_key] = selections
+				for selection in selections:
+					if selection.product_ids.issuperset(productIds):
+						logger.info("Using cached depot selection %s for products %s", selection.depot.id, productIds)
+						return selection.depot, selection.depot_protocol
+
+		selectedDepot, depotProtocol, cacheable = self._select_depot(
+			configService=configService, event=event, productIds=productIds, masterOnly=masterOnly, forceDepotProtocol=forceDepotProtocol
+		)
+		if ttl > 0 and cacheable:
+			with self._depot_selection_lock:
+				selections = self._depot_selections.setdefault(cache_key, [])
+				selections.insert(
+					0,
+					DepotSelection(
+						depot=selectedDepot,
+						depot_protocol=depotProtocol,
+						product_ids=frozenset(productIds),
+						network_fingerprint=network_fingerprint,
+						expires=now + ttl,
+					),
+				)
+				del selections[DEPOT_SELECTION_CACHE_SIZE:]
+		return selectedDepot, depotProtocol
+
+	def _select_depot(
+		self,
+		configService: JSONRPCBackend,
+		event: Event | None = None,
+		productIds: list[str] | None = None,
+		masterOnly: bool = False,
+		forceDepotProtocol: str | None = None,
+	) -> tuple[OpsiDepotserver, str, bool]:
+		"""
+		Returns the selected depot, the depot protocol and if the selection can be reused.
+		"""
 		selectedDepot = None
+		cacheable = True
 
 		depotIds = []
 		dynamicDepot = False
@@ -789,48 +1252,55 @@ class Config(metaclass=Singleton):
 				for index, depot in enumerate(alternativeDepots, start=1):
 					logger.info("%d. alternative depot is %s", index, depot.id)
 
-				try:
-					clientConfig = {
-						"clientId": self.get("global", "host_id"),
-						"opsiHostKey": self.get("global", "opsi_host_key"),
-						"ipAddress": None,
-						"netmask": None,
-						"defaultGateway": None,
-					}
+				latencyDepot = None
+				if self.get("depot_server", "selection_mode") == "latency":
 					try:
-						gateways = netifaces.gateways()
-						clientConfig["defaultGateway"], iface_name = gateways["default"][netifaces.AF_INET]
-						addr = netifaces.ifaddresses(iface_name)[netifaces.AF_INET][0]
-						clientConfig["netmask"] = addr["netmask"]
-						clientConfig["ipAddress"] = addr["addr"]
-						logger.info(
-							"Using the following network config for depot selection algorithm: iface=%s addr=%s/%s gw=%s",
-							iface_name,
-							addr["addr"],
-							addr["netmask"],
-							gateways["default"],
-						)
-					except Exception as gwe:
-						raise RuntimeError(f"Failed to get network interface with default gateway: {gwe}") from gwe
-
-					logger.info("Passing client configuration to depot selection algorithm: %s", clientConfig)
-
-					depotSelectionAlgorithm = configService.getDepotSelectionAlgorithm()
-					logger.trace("depotSelectionAlgorithm:\n%s", depotSelectionAlgorithm)
-
-					currentLocals = locals()
-					exec(depotSelectionAlgorithm, None, currentLocals)
-					selectDepot = currentLocals["selectDepot"]
-
-					selectedDepot = selectDepot(clientConfig=clientConfig, masterDepot=masterDepot, alternativeDepots=alternativeDepots)
-					if not selectedDepot:
-						selectedDepot = masterDepot
-				except Exception as err:
-					logger.error("Failed to select depot: %s", err, exc_info=True)
+						latencyDepot = self._select_depot_by_latency(masterDepot, alternativeDepots)
+					except Exception as err:
+						logger.error("Failed to select depot by latency: %s", err, exc_info=True)
+					if not latencyDepot:
+						logger.warning("Depot selection by latency failed, using depot selection algorithm")
+
+				if latencyDepot:
+					selectedDepot = latencyDepot
+				else:
+					try:
+						clientConfig = {
+							"clientId": self.get("global", "host_id"),
+							"opsiHostKey": self.get("global", "opsi_host_key"),
+							"ipAddress": None,
+							"netmask": None,
+							"defaultGateway": None,
+						}
+						try:
+							network_config = self._get_network_config()
+							clientConfig["defaultGateway"] = network_config["defaultGateway"]
+							clientConfig["netmask"] = network_config["netmask"]
+							clientConfig["ipAddress"] = network_config["ipAddress"]
+							logger.info(
+								"Using the following network config for depot selection algorithm: iface=%s addr=%s/%s gw=%s",
+								network_config["interface"],
+								network_config["ipAddress"],
+								network_config["netmask"],
+								network_config["defaultGateway"],
+							)
+						except Exception as gwe:
+							raise RuntimeError(f"Failed to get network interface with default gateway: {gwe}") from gwe
+
+						logger.info("Passing client configuration to depot selection algorithm: %s", clientConfig)
+
+						selectDepot = self._get_depot_selection_function(configService)
+						selectedDepot = selectDepot(clientConfig=clientConfig, masterDepot=masterDepot, alternativeDepots=alternativeDepots)
+						if not selectedDepot:
+							selectedDepot = masterDepot
+					except Exception as err:
+						# Do not reuse the fallback to the master depot
+						cacheable = False
+						logger.error("Failed to select depot: %s", err, exc_info=True)
 			else:
 				logger.info("No alternative depot for products: %s", productIds)
 
-		return selectedDepot, depotProtocol
+		return selectedDepot, depotProtocol, cacheable
 
 	def selectDepotserver(
 		self,
@@ -892,6 +1362,9 @@ class Config(metaclass=Singleton):
 		if not service_client:
 			raise RuntimeError("Config service is undefined")
 
+		# Depot settings may have been changed on the service
+		self.clearDepotSelectionCache()
+
 		config_ids = [
 			"clientconfig.configserver.url",
 			"clientconfig.depot.drive",
@@ -14,16 +14,36 @@ The classes are used to create named pipes for remote procedure calls.
 from __future__ import annotations
 
 import os
-import socket
+import re
 import threading
 import time
-from pathlib import Path
+from asyncio import (
+	AbstractEventLoop,
+	BaseTransport,
+	Future,
+	Protocol,
+	Server,
+	Task,
+	Transport,
+	gather,
+	get_running_loop,
+	run_coroutine_threadsafe,
+	sleep,
+	wait_for,
+)
+from asyncio import Event as AsyncioEvent
+from asyncio import Queue as AsyncioQueue
+from asyncio import TimeoutError as AsyncioTimeoutError
+from asyncio import run as asyncio_run
 from ctypes import byref, c_char_p, c_ulong, create_string_buffer
 from datetime import datetime
-from typing import TYPE_CHECKING, Any
+from itertools import count
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Coroutine, TypeVar
 
 from opsicommon.logging import get_logger, log_context
 
+from opsiclientd.RPCMetrics import rpc_metrics
 from opsiclientd.webserver.rpc.control import get_pipe_control_interface
 from opsiclientd.webserver.rpc.jsonrpc import (
 	JSONRPC20ErrorResponse,
@@ -31,6 +51,7 @@ from opsiclientd.webserver.rpc.jsonrpc import (
 	JSONRPC20Response,
 	JSONRPCErrorResponse,
 	JSONRPCResponse,
+	deserialize_data,
 	jsonrpc_request_from_data,
 	jsonrpc_response_from_data,
 	process_rpcs,
@@ -45,6 +66,8 @@ else:
 if TYPE_CHECKING:
 	from opsiclientd.Opsiclientd import Opsiclientd
 
+T = TypeVar("T")
+
 logger = get_logger()
 
 
@@ -56,23 +79,83 @@ def ControlPipeFactory(opsiclientd: Opsiclientd) -> ControlPipe:
 	raise NotImplementedError(f"Unsupported operating system: {os.name}")
 
 
-class ClientConnection(threading.Thread):
-	def __init__(self, controller: ControlPipe, connection: socket.socket, client_id: str) -> None:
-		threading.Thread.__init__(self, name="ControlPipe-ClientConnection")
+class ClientConnection:
+	"""
+	Base class for a client connected to the control pipe.
+	"""
+
+	def __init__(self, controller: ControlPipe, client_id: str) -> None:
 		self._controller = controller
-		self._connection = connection
 		self.client_id = client_id
 		self.clientInfo: list[str] = []
-		self.comLock = threading.Lock()
-		self._stopEvent = threading.Event()
-		self._stopEvent.clear()
 		self.login_capable = False
 		self.login_user_executed: datetime | None = None
-		logger.trace("%s created controller=%s connection=%s", self.__class__.__name__, self._controller, self._connection)
 
 	def __str__(self) -> str:
 		return f"<{self.__class__.__name__} {self.client_id}>"
 
+	def stop(self) -> None:
+		pass
+
+	def clientDisconnected(self) -> None:
+		self.stop()
+		self._controller.clientDisconnected(self)
+
+	def processIncomingRpc(self, rpc_data: bytes) -> bytes:
+		try:
+			rpc = jsonrpc_request_from_data(rpc_data, "json")[0]
+			if rpc.method == "registerClient":
+				# New client protocol
+				self.clientInfo = list(rpc.params)
+				self.login_capable = True
+				logger.info("Client %s info set to: %s", self, self.clientInfo)
+				res_class = JSONRPC20Response if isinstance(rpc, JSONRPC20Request) else JSONRPCResponse
+				return serialize_data(
+					res_class(id=rpc.id, result=f"client {'/'.join(self.clientInfo)}/{self.client_id} registered", error=None), "json"
+				)
+
+			interface = self._controller._opsiclientdRpcInterface
+
+			async def process() -> list[JSONRPCErrorResponse | JSONRPCResponse | JSONRPC20ErrorResponse | JSONRPC20Response]:
+				return [response async for response in process_rpcs(interface, rpc, transport="pipe")]
+
+			response_data = serialize_data(asyncio_run(process())[0], "json")
+			rpc_metrics.observe_payload(interface.__class__.__name__, [rpc.method], len(rpc_data), len(response_data), transport="pipe")
+			return response_data
+		except Exception as rpc_error:
+			logger.error(rpc_error, exc_info=True)
+			return serialize_data(JSONRPCErrorResponse(id=0, error=str(rpc_error)), "json")
+
+	def rpcResponseReceived(
+		self, method: str, response: JSONRPCErrorResponse | JSONRPCResponse | JSONRPC20ErrorResponse | JSONRPC20Response
+	) -> None:
+		if method == "loginUser" and isinstance(response, (JSONRPCResponse, JSONRPC20Response)) and response.result:
+			self.login_user_executed = datetime.now()
+			# Credential provider can only handle one successful login.
+			# Ensure, that the credential provider is not used for a
+			# second login if it keeps the pipe connection open.
+			self.login_capable = False
+
+	def executeRpc(
+		self, method: str, params: list[Any] | tuple[Any, ...] | None = None
+	) -> JSONRPCErrorResponse | JSONRPCResponse | JSONRPC20ErrorResponse | JSONRPC20Response:
+		raise NotImplementedError()
+
+
+class ThreadedClientConnection(ClientConnection, threading.Thread):
+	"""
+	Client connection handled by a dedicated thread, which polls the connection for requests.
+	"""
+
+	def __init__(self, controller: ControlPipe, connection: Any, client_id: str) -> None:
+		ClientConnection.__init__(self, controller, client_id)
+		threading.Thread.__init__(self, name="ControlPipe-ClientConnection")
+		self._connection = connection
+		self.comLock = threading.Lock()
+		self._stopEvent = threading.Event()
+		self._stopEvent.clear()
+		logger.trace("%s created controller=%s connection=%s", self.__class__.__name__, self._controller, self._connection)
+
 	def run(self) -> None:
 		with log_context({"instance": "control pipe"}):
 			try:
@@ -115,28 +198,6 @@ class ClientConnection(threading.Thread):
 	def checkConnection(self) -> None:
 		pass
 
-	def clientDisconnected(self) -> None:
-		self.stop()
-		self._controller.clientDisconnected(self)
-
-	def processIncomingRpc(self, rpc_data: bytes) -> bytes:
-		try:
-			rpc = jsonrpc_request_from_data(rpc_data, "json")[0]
-			if rpc.method == "registerClient":
-				# New client protocol
-				self.clientInfo = list(rpc.params)
-				self.login_capable = True
-				logger.info("Client %s info set to: %s", self, self.clientInfo)
-				res_class = JSONRPC20Response if isinstance(rpc, JSONRPC20Request) else JSONRPCResponse
-				return serialize_data(
-					res_class(id=rpc.id, result=f"client {'/'.join(self.clientInfo)}/{self.client_id} registered", error=None), "json"
-				)
-
-			return serialize_data(process_rpcs(self._controller._opsiclientdRpcInterface, rpc), "json")
-		except Exception as rpc_error:
-			logger.error(rpc_error, exc_info=True)
-			return serialize_data(JSONRPCErrorResponse(id=0, error=str(rpc_error)), "json")
-
 	def executeRpc(
 		self, method: str, params: list[Any] | tuple[Any, ...] | None = None, with_lock: bool = True
 	) -> JSONRPCErrorResponse | JSONRPCResponse | JSONRPC20ErrorResponse | JSONRPC20Response:
@@ -160,12 +221,7 @@ class ClientConnection(threading.Thread):
 						return JSONRPCResponse(id=rpc_id)
 					logger.info("Received response '%s' from client %s", response_json, self)
 					response = jsonrpc_response_from_data(response_json, "json")[0]
-					if method == "loginUser" and isinstance(response, (JSONRPCResponse, JSONRPC20Response)) and response.result:
-						self.login_user_executed = datetime.now()
-						# Credential provider can only handle one successful login.
-						# Ensure, that the credential provider is not used for a
-						# second login if it keeps the pipe connection open.
-						self.login_capable = False
+					self.rpcResponseReceived(method, response)
 					return response
 				finally:
 					if with_lock:
@@ -180,7 +236,7 @@ class ControlPipe(threading.Thread):
 	Base class for a named pipe which handles remote procedure calls.
 	"""
 
-	connection_class = ClientConnection
+	connection_class: type[ClientConnection] = ThreadedClientConnection
 
 	def __init__(self, opsiclientd: Opsiclientd) -> None:
 		threading.Thread.__init__(self, name="ControlPipe")
@@ -204,7 +260,8 @@ class ControlPipe(threading.Thread):
 						if self._stopEvent.is_set():
 							break
 						with self._clientLock:
-							connection = self.connection_class(self, client, client_id)
+							connection = self.connection_class(self, client, client_id)  # type: ignore[call-arg]
+							assert isinstance(connection, ThreadedClientConnection)
 							self._clients.append(connection)
 							connection.daemon = True
 							connection.start()
@@ -232,6 +289,11 @@ class ControlPipe(threading.Thread):
 	def waitForClient(self) -> tuple[Any, str]:
 		return (None, "")
 
+	def clientConnected(self, client: ClientConnection) -> None:
+		with self._clientLock:
+			if client not in self._clients:
+				self._clients.append(client)
+
 	def clientDisconnected(self, client: ClientConnection) -> None:
 		with self._clientLock:
 			if client in self._clients:
@@ -262,6 +324,11 @@ class ControlPipe(threading.Thread):
 				return True
 		return False
 
+	def executeClientRpcs(
+		self, clients: list[ClientConnection], method: str, params: list[Any] | tuple[Any, ...]
+	) -> list[JSONRPCResponse | JSONRPCErrorResponse | JSONRPC20Response | JSONRPC20ErrorResponse]:
+		return [client.executeRpc(method, params) for client in clients]
+
 	def executeRpc(
 		self, method: str, *params: Any
 	) -> list[JSONRPCResponse | JSONRPCErrorResponse | JSONRPC20Response | JSONRPC20ErrorResponse]:
@@ -269,59 +336,211 @@ class ControlPipe(threading.Thread):
 			if not self._clients:
 				raise RuntimeError("Cannot execute rpc, no client connected")
 
-			clients = self._clients
+			clients = list(self._clients)
 			if method == "loginUser":
-				# Send loginUser to latest connected credential provider only
-				self._clients = [self.getLoginCapableCredentialProvider()]
-
-			responses = []
-			errors = []
-			for client in clients:
-				if method == "loginUser" and not client.login_capable:
-					continue
-				response = client.executeRpc(method, params)
-				responses.append(response)
-				if isinstance(response, (JSONRPCErrorResponse, JSONRPC20ErrorResponse)):
-					errors.append(str(response.error))
+				# Send loginUser to latest connected login capable credential provider only
+				clients = [self.getLoginCapableCredentialProvider()]
 
+			responses = self.executeClientRpcs(clients, method, params)
+			errors = [str(response.error) for response in responses if isinstance(response, (JSONRPCErrorResponse, JSONRPC20ErrorResponse))]
 			if len(errors) == len(responses):
 				raise RuntimeError(", ".join(errors))
 
 			return responses
 
 
-class PosixClientConnection(ClientConnection):
-	def checkConnection(self) -> None:
-		# TODO
-		pass
+class JSONStreamDecoder:
+	"""
+	Incremental splitter for a stream of json documents.
+	Clients send the rpcs without delimiter, so the end of a document is found
+	by tracking the nesting depth of objects and arrays outside of strings.
+	Every byte is scanned only once, incomplete documents are kept until the rest is received.
+	"""
 
-	def read(self, timeout: float = 1.0) -> bytes:
-		logger.trace("Reading from connection %s", self._connection)
-		self._connection.settimeout(timeout)
+	_special_chars = re.compile(rb'["\\{}\[\]]')
+
+	def __init__(self, max_size: int = 1024 * 1024) -> None:
+		self.max_size = max_size
+		self._buffer = bytearray()
+		self._pos = 0
+		self._depth = 0
+		self._in_string = False
+
+	def __len__(self) -> int:
+		return len(self._buffer)
+
+	def feed(self, data: bytes) -> None:
+		self._buffer += data
+
+	def next_document(self) -> bytes | None:
+		"""
+		Returns the next complete json document or None if more data is needed.
+		"""
+		buffer = self._buffer
+		pos = self._pos
+		while match := self._special_chars.search(buffer, pos):
+			pos = match.start()
+			char = buffer[pos]
+			if self._in_string:
+				if char == 0x5C:  # backslash, skip escaped char
+					pos += 2
+					continue
+				if char == 0x22:  # quote
+					self._in_string = False
+			elif char == 0x22:
+				self._in_string = True
+			elif char in (0x7B, 0x5B):  # { [
+				self._depth += 1
+			elif char in (0x7D, 0x5D):  # } ]
+				self._depth -= 1
+				if self._depth <= 0:
+					document = bytes(buffer[: pos + 1]).strip(b"\0 \t\r\n")
+					del buffer[: pos + 1]
+					self._pos = 0
+					self._depth = 0
+					return document
+			pos += 1
+		self._pos = max(pos, len(buffer))
+		if len(buffer) > self.max_size:
+			raise ValueError(f"Document size exceeds maximum of {self.max_size} bytes")
+		return None
+
+
+class PosixClientConnection(ClientConnection, Protocol):
+	"""
+	Client connection handled by the event loop of the control socket.
+	Requests are matched to responses by rpc id, so multiple rpcs can be outstanding at the same time.
+	"""
+
+	def __init__(self, controller: PosixControlDomainSocket, client_id: str, rpc_timeout: float = 3.0) -> None:
+		ClientConnection.__init__(self, controller, client_id)
+		self._controller: PosixControlDomainSocket = controller
+		self.rpc_timeout = rpc_timeout
+		self._transport: Transport | None = None
+		self._decoder = JSONStreamDecoder()
+		self._rpc_ids = count(1)
+		self._pending_rpcs: dict[Any, Future] = {}
+		self._requests: AsyncioQueue[bytes] = AsyncioQueue()
+		self._request_task: Task | None = None
+
+	def connection_made(self, transport: BaseTransport) -> None:
+		assert isinstance(transport, Transport)
+		self._transport = transport
+		logger.notice("Client %s connected to %s", self, self._controller._socketName)
+		self._request_task = get_running_loop().create_task(self._process_requests())
+		self._controller.clientConnected(self)
+
+	def connection_lost(self, exc: Exception | None = None) -> None:
+		self._transport = None
+		if self._request_task:
+			self._request_task.cancel()
+		for future in self._pending_rpcs.values():
+			if not future.done():
+				future.set_exception(ConnectionError(f"Client {self} disconnected"))
+		self._pending_rpcs.clear()
+		self.clientDisconnected()
+
+	def stop(self) -> None:
+		if self._transport:
+			self._transport.close()
+
+	def data_received(self, data: bytes) -> None:
+		logger.trace("Data received from %s: %r", self, data)
+		self._decoder.feed(data)
+		while True:
+			try:
+				document = self._decoder.next_document()
+			except ValueError as err:
+				logger.error("Invalid data received from %s: %s", self, err)
+				self.stop()
+				return
+			if document is None:
+				return
+			if document:
+				self._message_received(document)
+
+	def _message_received(self, data: bytes) -> None:
 		try:
-			data = self._connection.recv(4096)
-			if not data:
-				self.clientDisconnected()
-			return data
+			message = deserialize_data(data, "json")
 		except Exception as err:
-			logger.trace("Failed to read from socket: %s", err)
-		return b""
+			logger.error("Invalid data received from %s: %s", self, err)
+			return
+		if isinstance(message, dict) and "method" not in message:
+			self._response_received(data, message)
+		else:
+			logger.info("Received request '%s' from %s", data, self)
+			self._requests.put_nowait(data)
+
+	def _response_received(self, data: bytes, response: dict[str, Any]) -> None:
+		future = self._pending_rpcs.pop(response.get("id"), None)
+		if not future and len(self._pending_rpcs) == 1:
+			# Client did not return the rpc id
+			_rpc_id, future = self._pending_rpcs.popitem()
+		if not future:
+			logger.warning("Received unexpected response '%s' from client %s", data, self)
+			return
+		if not future.done():
+			future.set_result(data)
+
+	async def _process_requests(self) -> None:
+		# Requests are processed in order, outside of the event loop,
+		# because processing may execute rpcs on the clients
+		loop = get_running_loop()
+		while True:
+			request = await self._requests.get()
+			was_registered = bool(self.clientInfo)
+			response = await loop.run_in_executor(None, self._process_request, request)
+			logger.info("Sending response '%s' to %s", response, self)
+			if self._transport:
+				self._transport.write(response)
+			if self.clientInfo and not was_registered:
+				# Switch to new protocol, give the client some time to switch too
+				await sleep(1.0)
+				await self.async_execute_rpc("blockLogin", [self._controller._opsiclientd._blockLogin])
+
+	def _process_request(self, request: bytes) -> bytes:
+		with log_context({"instance": "control pipe"}):
+			return self.processIncomingRpc(request)
 
-	def write(self, data: bytes, timeout: float = 1.0) -> bool:
-		if not data or not self._connection:
-			return False
-		logger.trace("Writing to connection %s", self._connection)
-		self._connection.settimeout(timeout)
+	async def async_execute_rpc(
+		self, method: str, params: list[Any] | tuple[Any, ...] | None = None
+	) -> JSONRPCErrorResponse | JSONRPCResponse | JSONRPC20ErrorResponse | JSONRPC20Response:
+		rpc_id = next(self._rpc_ids)
+		if not self.clientInfo:
+			return JSONRPCErrorResponse(id=rpc_id, error=f"Cannot execute rpc, not supported by client {self}")
+		if not self._transport:
+			return JSONRPCErrorResponse(id=rpc_id, error=f"Cannot execute rpc, client {self} disconnected")
+
+		request_json = serialize_data({"id": rpc_id, "method": method, "params": list(params or [])}, "json")
+		future = get_running_loop().create_future()
+		self._pending_rpcs[rpc_id] = future
 		try:
-			self._connection.sendall(data)
-		except Exception as err:
-			raise RuntimeError(f"Failed to write to socket: {err}") from err
-		return True
+			logger.info("Sending request '%s' to client %s", request_json, self)
+			self._transport.write(request_json)
+			response_json = await wait_for(future, self.rpc_timeout)
+			logger.info("Received response '%s' from client %s", response_json, self)
+			response = jsonrpc_response_from_data(response_json, "json")[0]
+			self.rpcResponseReceived(method, response)
+			return response
+		except AsyncioTimeoutError:
+			logger.warning("No response for method '%s' received from client %s", method, self)
+			return JSONRPCResponse(id=rpc_id)
+		except Exception as client_err:
+			logger.error(client_err, exc_info=True)
+			return JSONRPCErrorResponse(id=rpc_id, error=str(client_err))
+		finally:
+			self._pending_rpcs.pop(rpc_id, None)
+
+	def executeRpc(
+		self, method: str, params: list[Any] | tuple[Any, ...] | None = None
+	) -> JSONRPCErrorResponse | JSONRPCResponse | JSONRPC20ErrorResponse | JSONRPC20Response:
+		return self._controller.run_coroutine(self.async_execute_rpc(method, params), timeout=self.rpc_timeout + 5.0)
 
 
 class PosixControlDomainSocket(ControlPipe):
 	"""
-	PosixControlDomainSocket implements a control socket for posix operating systems
+	PosixControlDomainSocket implements a control socket for posix operating systems.
+	All clients are handled by a single asyncio event loop.
 	"""
 
 	connection_class = PosixClientConnection
@@ -329,44 +548,103 @@ class PosixControlDomainSocket(ControlPipe):
 	def __init__(self, opsiclientd: Opsiclientd) -> None:
 		ControlPipe.__init__(self, opsiclientd)
 		self._socketName = "/var/run/opsiclientd/socket"
-		self._socket: socket.socket | None = None
 		self._client_id = 0
+		self._loop: AbstractEventLoop | None = None
+		self._loop_thread_id: int | None = None
+		self._server: Server | None = None
+		self._async_stop_event: AsyncioEvent | None = None
+		self._socket_inode: int | None = None
 
 	def setup(self) -> None:
-		logger.trace("Creating socket %s", self._socketName)
-		self.teardown()
+		if os.path.exists(self._socketName):
+			os.remove(self._socketName)
 		Path(self._socketName).parent.mkdir(parents=True, exist_ok=True)
-		self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-		self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-		self._socket.bind(self._socketName)
-		self._socket.listen(1)
-		logger.trace("Socket %s created", self._socketName)
 
 	def teardown(self) -> None:
-		if self._socket:
+		# Do not remove a socket created by another instance in the meantime
+		try:
+			if self._socket_inode and os.stat(self._socketName).st_ino == self._socket_inode:
+				os.remove(self._socketName)
+		except FileNotFoundError:
+			pass
+		self._socket_inode = None
+
+	def run(self) -> None:
+		with log_context({"instance": "control pipe"}):
+			self._running = True
 			try:
-				self._socket.close()
-			except socket.error:
-				pass
-		if os.path.exists(self._socketName):
-			os.remove(self._socketName)
+				asyncio_run(self._async_main())
+			except Exception as err:
+				logger.error(err, exc_info=True)
+			finally:
+				self._loop = None
+				self._running = False
+				self.teardown()
+
+	async def _async_main(self) -> None:
+		self._loop = get_running_loop()
+		self._loop_thread_id = threading.get_ident()
+		self._async_stop_event = AsyncioEvent()
+		if self._stopEvent.is_set():
+			return
+		self.setup()
+		logger.trace("Creating socket %s", self._socketName)
+		self._server = await self._loop.create_unix_server(self._create_connection, self._socketName)
+		self._socket_inode = os.stat(self._socketName).st_ino
+		logger.trace("Socket %s created", self._socketName)
+		await self._async_stop_event.wait()
 
-	def waitForClient(self) -> tuple[Any, str]:
-		logger.debug("Waiting for client to connect to %s", self._socketName)
-		assert self._socket
-		self._socket.settimeout(2.0)
-		while True:
+		self._server.close()
+		with self._clientLock:
+			clients = list(self._clients)
+		for client in clients:
+			client.stop()
+		await self._server.wait_closed()
+
+	def _create_connection(self) -> PosixClientConnection:
+		self._client_id += 1
+		return PosixClientConnection(self, f"#{self._client_id}")
+
+	def stop(self) -> None:
+		logger.debug("Stopping %s", self)
+		self._stopEvent.set()
+		loop = self._loop
+		if loop and self._async_stop_event:
 			try:
-				connection, client_address = self._socket.accept()
-				logger.notice("Client %s connected to %s", client_address, self._socketName)
-				self._client_id += 1
-				return (connection, f"#{self._client_id}")
-			except socket.timeout:
-				if self._stopEvent.is_set():
-					return (None, "")
+				loop.call_soon_threadsafe(self._async_stop_event.set)
+			except RuntimeError as err:
+				# Event loop closed
+				logger.debug(err)
+
+	def run_coroutine(self, coroutine: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+		"""
+		Run coroutine in the event loop of the control socket and wait for the result.
+		"""
+		loop = self._loop
+		if not loop or not loop.is_running():
+			coroutine.close()
+			raise RuntimeError(f"{self} not running")
+		if threading.get_ident() == self._loop_thread_id:
+			coroutine.close()
+			raise RuntimeError("Cannot wait for coroutine in event loop thread")
+		return run_coroutine_threadsafe(coroutine, loop).result(timeout=timeout)
+
+	def executeClientRpcs(
+		self, clients: list[ClientConnection], method: str, params: list[Any] | tuple[Any, ...]
+	) -> list[JSONRPCResponse | JSONRPCErrorResponse | JSONRPC20Response | JSONRPC20ErrorResponse]:
+		# Send the rpc to all clients at once
+		timeout = max([c.rpc_timeout for c in clients if isinstance(c, PosixClientConnection)] + [0.0]) + 5.0
+		return self.run_coroutine(self._execute_client_rpcs(clients, method, params), timeout=timeout)
+
+	async def _execute_client_rpcs(
+		self, clients: list[ClientConnection], method: str, params: list[Any] | tuple[Any, ...]
+	) -> list[JSONRPCResponse | JSONRPCErrorResponse | JSONRPC20Response | JSONRPC20ErrorResponse]:
+		return list(
+			await gather(*[client.async_execute_rpc(method, params) for client in clients if isinstance(client, PosixClientConnection)])
+		)
 
 
-class NTPipeClientConnection(ClientConnection):
+class NTPipeClientConnection(ThreadedClientConnection):
 	def checkConnection(self) -> None:
 		chBuf = create_string_buffer(self._controller.bufferSize)
 		cbRead = c_ulong(0)
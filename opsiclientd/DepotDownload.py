@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Resumable downloads of depot files over webdav.
+"""
+
+from __future__ import annotations
+
+import http.client
+import json
+import os
+import ssl
+import threading
+import time
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5, sha256
+from pathlib import Path
+from typing import Any, Callable
+from urllib.parse import quote, urlparse
+
+from opsicommon.logging import get_logger
+
+from opsiclientd.Bandwidth import BandwidthManager, Transfer, TransferPriority, bandwidth_manager
+
+logger = get_logger()
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadError(RuntimeError):
+	"""Download failed and retrying will not help."""
+
+
+class RangeNotSupportedError(DownloadError):
+	pass
+
+
+_write_lock = threading.Lock()
+
+
+def _pwrite(fd: int, data: bytes, offset: int) -> None:
+	if not hasattr(os, "pwrite"):
+		# Windows
+		with _write_lock:
+			os.lseek(fd, offset, os.SEEK_SET)
+			os.write(fd, data)
+		return
+	view = memoryview(data)
+	while view:
+		written = os.pwrite(fd, view, offset)
+		view = view[written:]
+		offset += written
+
+
+def file_md5sum(path: str | Path) -> str:
+	hash = md5(usedforsecurity=False)
+	with open(path, "rb") as file:
+		while data := file.read(HASH_CHUNK_SIZE):
+			hash.update(data)
+	return hash.hexdigest()
+
+
+class VerifiedHTTPSConnection(http.client.HTTPSConnection):
+	"""
+	HTTPS connection to `host` which verifies the server certificate against `server_hostname`.
+	"""
+
+	def __init__(self, host: str, port: int, server_hostname: str, timeout: float, context: ssl.SSLContext) -> None:
+		super().__init__(host, port, timeout=timeout, context=context)
+		self.server_hostname = server_hostname
+		self.ssl_context = context
+
+	def connect(self) -> None:
+		http.client.HTTPConnection.connect(self)
+		self.sock = self.ssl_context.wrap_socket(self.sock, server_hostname=self.server_hostname)
+
+
+class DepotFileDownloader:
+	"""
+	Downloads files from a webdav depot.
+	Partial downloads are kept in `partial_dir` together with the expected size and checksum
+	and are resumed by range requests, after connection errors and in later runs.
+	Large files are split into byte ranges which are fetched in parallel into a preallocated file.
+	Failed attempts are retried with exponential backoff, the backoff is reset when an attempt made progress.
+	All connections of a download share one transfer of the bandwidth manager.
+	The server certificate is verified against `server_hostname` if given, otherwise against the host of the url.
+	"""
+
+	def __init__(
+		self,
+		url: str,
+		partial_dir: str | Path,
+		username: str | None = None,
+		password: str | None = None,
+		ca_cert_file: str | None = None,
+		server_hostname: str | None = None,
+		timeout: float = 30.0,
+		max_retries: int = 10,
+		retry_wait: float = 1.0,
+		max_retry_wait: float = 60.0,
+		max_bandwidth: int = 0,
+		connections: int = 1,
+		parallel_min_size: int = 0,
+		priority: TransferPriority = TransferPriority.CACHING,
+		manager: BandwidthManager | None = None,
+	) -> None:
+		parsed = urlparse(url)
+		self._use_tls = parsed.scheme in ("webdavs", "https")
+		self._host = parsed.hostname or ""
+		self._port = parsed.port or (443 if self._use_tls else 80)
+		self._base_path = parsed.path.rstrip("/")
+		self._server_hostname = server_hostname
+		self._ssl_context: ssl.SSLContext | None = None
+		if self._use_tls:
+			self._ssl_context = ssl.create_default_context(cafile=ca_cert_file)
+			if not ca_cert_file:
+				self._ssl_context.check_hostname = False
+				self._ssl_context.verify_mode = ssl.CERT_NONE
+		self._headers = {"User-Agent": "opsiclientd"}
+		if username and password:
+			self._headers["Authorization"] = "Basic " + b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+		self.partial_dir = Path(partial_dir)
+		self.timeout = timeout
+		self.max_retries = max_retries
+		self.retry_wait = retry_wait
+		self.max_retry_wait = max_retry_wait
+		self.connections = max(int(connections), 1)
+		self.parallel_min_size = parallel_min_size
+		# Bytes per second over all connections
+		self.max_bandwidth = max_bandwidth
+		self.priority = priority
+		self._bandwidth_manager = manager or bandwidth_manager
+
+	def _connect(self) -> http.client.HTTPConnection:
+		if self._ssl_context and self._server_hostname:
+			return VerifiedHTTPSConnection(self._host, self._port, self._server_hostname, timeout=self.timeout, context=self._ssl_context)
+		if self._ssl_context:
+			return http.client.HTTPSConnection(self._host, self._port, timeout=self.timeout, context=self._ssl_context)
+		return http.client.HTTPConnection(self._host, self._port, timeout=self.timeout)
+
+	def _url_path(self, path: str) -> str:
+		return f"{self._base_path}/{quote(path.lstrip('/'))}"
+
+	def _partial_files(self, url_path: str) -> tuple[Path, Path]:
+		name = sha256(f"{self._host}:{self._port}{url_path}".encode("utf-8")).hexdigest()[:32]
+		return self.partial_dir / f"{name}.part", self.partial_dir / f"{name}.json"
+
+	def _load_partial_info(self, info_file: Path, info: dict[str, Any]) -> dict[str, Any] | None:
+		"""
+		Returns the stored info of a partial download if it belongs to the same file version.
+		"""
+		try:
+			stored_info = json.loads(info_file.read_text(encoding="utf-8"))
+		except (OSError, ValueError):
+			return None
+		if {key: stored_info.get(key) for key in info} != info:
+			return None
+		return stored_info
+
+	def _fetch_range(
+		self, transfer: Transfer, url_path: str, fd: int, start: int, end: int, size: int, on_data: Callable[[int], None] | None = None
+	) -> None:
+		"""
+		Fetches the bytes `start` to `end` (exclusive) and writes them at their offset into `fd`.
+		If the server does not support range requests, a download of the whole file is restarted.
+		Ranges of chunked downloads (`end` < `size`) cannot be restarted.
+		"""
+		connection = self._connect()
+		try:
+			headers = dict(self._headers)
+			if end < size:
+				headers["Range"] = f"bytes={start}-{end - 1}"
+			elif start:
+				headers["Range"] = f"bytes={start}-"
+			request_start = time.monotonic()
+			connection.request("GET", url_path, headers=headers)
+			response = connection.getresponse()
+			transfer.report_rtt(time.monotonic() - request_start)
+			if response.status == 206:
+				content_range = response.getheader("Content-Range", "")
+				if not content_range.startswith(f"bytes {start}-"):
+					raise ConnectionError(f"Unexpected content range {content_range!r}")
+			elif response.status == 200:
+				if end < size:
+					raise RangeNotSupportedError(f"Server does not support range requests for {url_path}")
+				if start:
+					logger.info("Server does not support range requests, restarting download of %s", url_path)
+					start = 0
+					os.ftruncate(fd, 0)
+			elif response.status in (408, 429) or response.status >= 500:
+				raise ConnectionError(f"HTTP status {response.status} {response.reason}")
+			else:
+				raise DownloadError(f"Failed to download {url_path}: HTTP status {response.status} {response.reason}")
+
+			offset = start
+			while offset < end:
+				data = response.read(min(DOWNLOAD_CHUNK_SIZE, end - offset))
+				if not data:
+					break
+				transfer.consume(len(data))
+				_pwrite(fd, data, offset)
+				offset += len(data)
+				if on_data:
+					on_data(len(data))
+			if offset < end:
+				raise ConnectionError(f"Connection closed after {offset} of {end} bytes")
+		finally:
+			connection.close()
+
+	def _retry(self, description: str, attempt: Callable[[], None], progress: Callable[[], int]) -> None:
+		"""
+		Runs `attempt` until it succeeds, the backoff is reset if an attempt made progress.
+		"""
+		failures = 0
+		while True:
+			start = progress()
+			try:
+				attempt()
+				return
+			except (OSError, http.client.HTTPException) as err:
+				if progress() > start:
+					failures = 0
+				failures += 1
+				if failures > self.max_retries:
+					raise DownloadError(f"Failed to download {description} after {self.max_retries} retries: {err}") from err
+				wait = min(self.retry_wait * 2 ** (failures - 1), self.max_retry_wait)
+				logger.warning("Download of %s failed: %s, retrying in %0.1f seconds", description, err, wait)
+				time.sleep(wait)
+
+	def _download_sequential(
+		self, transfer: Transfer, path: str, url_path: str, partial_file: Path, info_file: Path, info: dict[str, Any]
+	) -> None:
+		if self._load_partial_info(info_file, info) != info or not partial_file.exists() or partial_file.stat().st_size > info["size"]:
+			partial_file.unlink(missing_ok=True)
+			info_file.write_text(json.dumps(info), encoding="utf-8")
+		elif offset := partial_file.stat().st_size:
+			logger.notice("Resuming download of %s at %d of %d bytes", path, offset, info["size"])
+
+		def progress() -> int:
+			return partial_file.stat().st_size if partial_file.exists() else 0
+
+		def attempt() -> None:
+			fd = os.open(partial_file, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+			try:
+				offset = os.fstat(fd).st_size
+				if offset < info["size"]:
+					self._fetch_range(transfer, url_path, fd, offset, info["size"], info["size"])
+			finally:
+				os.close(fd)
+			if info["md5sum"] and file_md5sum(partial_file) != info["md5sum"]:
+				partial_file.unlink()
+				raise ConnectionError(f"Checksum mismatch of {path}")
+
+		self._retry(path, attempt, progress)
+
+	def _download_chunked(
+		self, transfer: Transfer, path: str, url_path: str, partial_file: Path, info_file: Path, info: dict[str, Any]
+	) -> None:
+		size = info["size"]
+		stored_info = self._load_partial_info(info_file, info)
+		# Chunks as [start, end, received bytes]
+		chunks: list[list[int]] = (stored_info or {}).get("chunks") or []
+		fd = os.open(partial_file, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+		try:
+			if not chunks or os.fstat(fd).st_size != size:
+				chunk_size = -(-size // self.connections)
+				chunks = [[start, min(start + chunk_size, size), 0] for start in range(0, size, chunk_size)]
+				os.ftruncate(fd, size)
+				if hasattr(os, "posix_fallocate"):
+					try:
+						os.posix_fallocate(fd, 0, size)
+					except OSError as err:
+						logger.debug("Failed to preallocate %s: %s", partial_file, err)
+			else:
+				logger.notice("Resuming download of %s at %d of %d bytes", path, sum(chunk[2] for chunk in chunks), size)
+
+			def download_chunk(chunk: list[int]) -> None:
+				def on_data(length: int) -> None:
+					chunk[2] += length
+
+				def attempt() -> None:
+					if chunk[0] + chunk[2] < chunk[1]:
+						self._fetch_range(transfer, url_path, fd, chunk[0] + chunk[2], chunk[1], size, on_data)
+
+				self._retry(f"{path} (bytes {chunk[0]}-{chunk[1] - 1})", attempt, lambda: chunk[2])
+
+			try:
+				with ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix="DepotDownload") as executor:
+					futures = [executor.submit(download_chunk, chunk) for chunk in chunks]
+				for future in futures:
+					future.result()
+			finally:
+				# Keep the progress of the chunks for the next run
+				info_file.write_text(json.dumps(dict(info, chunks=chunks)), encoding="utf-8")
+		finally:
+			os.close(fd)
+
+		if info["md5sum"] and file_md5sum(partial_file) != info["md5sum"]:
+			partial_file.unlink()
+			info_file.unlink(missing_ok=True)
+			raise DownloadError(f"Checksum mismatch of {path}")
+
+	def download(self, path: str, destination: str | Path, size: int, md5sum: str | None = None) -> None:
+		"""
+		Downloads the depot file `path` to `destination`.
+		Files of at least `parallel_min_size` bytes are downloaded in chunks over `connections` parallel connections.
+		The file is moved to the destination after the size and the checksum are verified.
+		"""
+		destination = Path(destination)
+		url_path = self._url_path(path)
+		self.partial_dir.mkdir(parents=True, exist_ok=True)
+		partial_file, info_file = self._partial_files(url_path)
+		info = {"path": url_path, "size": size, "md5sum": md5sum}
+
+		chunked = self.connections > 1 and self.parallel_min_size > 0 and size >= self.parallel_min_size
+		with self._bandwidth_manager.transfer(path, self.priority, self.max_bandwidth) as transfer:
+			if chunked:
+				try:
+					self._download_chunked(transfer, path, url_path, partial_file, info_file, info)
+				except RangeNotSupportedError as err:
+					logger.info("%s, downloading over a single connection", err)
+					chunked = False
+			if not chunked:
+				self._download_sequential(transfer, path, url_path, partial_file, info_file, info)
+
+		destination.parent.mkdir(parents=True, exist_ok=True)
+		os.replace(partial_file, destination)
+		info_file.unlink(missing_ok=True)
+		logger.info("Downloaded %s (%d bytes) to %s", path, size, destination)
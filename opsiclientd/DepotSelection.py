@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Depot selection by measured latency and throughput.
+"""
+
+from __future__ import annotations
+
+import http.client
+import socket
+import ssl
+import threading
+import time
+from base64 import b64encode
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+from urllib.parse import urlparse
+
+from opsicommon.logging import get_logger
+
+if TYPE_CHECKING:
+	from opsicommon.objects import OpsiDepotserver
+
+logger = get_logger()
+
+DEFAULT_PROBE_TIMEOUT = 3.0
+DEFAULT_PROBE_READ_SIZE = 64 * 1024
+# Age in seconds after which a measurement has half of the weight of a current one
+DEFAULT_SCORE_HALF_LIFE = 3600.0
+MAX_RESULTS_PER_DEPOT = 20
+
+
+@dataclass
+class DepotProbeResult:
+	depot_id: str
+	timestamp: float
+	connect_time: float = 0.0
+	tls_time: float = 0.0
+	read_time: float = 0.0
+	read_bytes: int = 0
+	error: str | None = None
+
+	@property
+	def throughput(self) -> float:
+		"""Bytes per second of the range read"""
+		return self.read_bytes / self.read_time if self.read_time > 0 else 0.0
+
+	@property
+	def score(self) -> float:
+		"""Time in seconds to connect and read the probe data, lower is better"""
+		return self.connect_time + self.tls_time + self.read_time
+
+	def to_dict(self) -> dict[str, Any]:
+		return {
+			"depot_id": self.depot_id,
+			"timestamp": self.timestamp,
+			"connect_time": self.connect_time,
+			"tls_time": self.tls_time,
+			"read_time": self.read_time,
+			"read_bytes": self.read_bytes,
+			"throughput": self.throughput,
+			"error": self.error,
+		}
+
+
+def probe_depot(
+	depot_id: str,
+	url: str,
+	timeout: float = DEFAULT_PROBE_TIMEOUT,
+	read_size: int = DEFAULT_PROBE_READ_SIZE,
+	username: str | None = None,
+	password: str | None = None,
+	ca_cert_file: str | None = None,
+) -> DepotProbeResult:
+	"""
+	Measures the tcp connect and tls handshake time to the webdav url of a depot
+	and the time of a range read of `read_size` bytes.
+	Certificates are only verified if `ca_cert_file` is passed.
+	"""
+	result = DepotProbeResult(depot_id=depot_id, timestamp=time.time())
+	parsed = urlparse(url)
+	use_tls = parsed.scheme in ("webdavs", "https")
+	host = parsed.hostname or ""
+	port = parsed.port or (443 if use_tls else 80)
+	deadline = time.monotonic() + timeout
+	sock: socket.socket | None = None
+	try:
+		start = time.monotonic()
+		sock = socket.create_connection((host, port), timeout=timeout)
+		result.connect_time = time.monotonic() - start
+
+		if use_tls:
+			context = ssl.create_default_context(cafile=ca_cert_file)
+			if not ca_cert_file:
+				context.check_hostname = False
+				context.verify_mode = ssl.CERT_NONE
+			start = time.monotonic()
+			sock.settimeout(max(deadline - time.monotonic(), 0.001))
+			sock = context.wrap_socket(sock, server_hostname=host)
+			result.tls_time = time.monotonic() - start
+
+		headers = {"Range": f"bytes=0-{read_size - 1}", "User-Agent": "opsiclientd depot probe"}
+		if username and password:
+			headers["Authorization"] = "Basic " + b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+		connection = http.client.HTTPConnection(host, port)
+		connection.sock = sock
+		start = time.monotonic()
+		sock.settimeout(max(deadline - time.monotonic(), 0.001))
+		connection.request("GET", parsed.path or "/", headers=headers)
+		response = connection.getresponse()
+		if response.status not in (200, 206):
+			raise RuntimeError(f"HTTP status {response.status}")
+		# The connection closes the socket if the server does not keep it alive, single reads are bounded by the socket timeout
+		while result.read_bytes < read_size:
+			if time.monotonic() > deadline:
+				raise TimeoutError("timed out")
+			data = response.read(min(read_size - result.read_bytes, 16 * 1024))
+			if not data:
+				break
+			result.read_bytes += len(data)
+		result.read_time = time.monotonic() - start
+	except Exception as err:
+		result.error = str(err) or err.__class__.__name__
+	finally:
+		if sock:
+			try:
+				sock.close()
+			except OSError:
+				pass
+	return result
+
+
+class DepotScoreHistory:
+	"""
+	Keeps the last probe results per depot.
+	The score of a depot is the mean of the result scores weighted by their age,
+	failed probes count as `failure_score`.
+	"""
+
+	def __init__(self, half_life: float = DEFAULT_SCORE_HALF_LIFE, failure_score: float = DEFAULT_PROBE_TIMEOUT * 2) -> None:
+		self.half_life = half_life
+		self.failure_score = failure_score
+		self._results: dict[str, deque[DepotProbeResult]] = {}
+		self._lock = threading.Lock()
+
+	def add(self, result: DepotProbeResult) -> None:
+		with self._lock:
+			self._results.setdefault(result.depot_id, deque(maxlen=MAX_RESULTS_PER_DEPOT)).append(result)
+
+	def get_results(self, depot_id: str) -> list[DepotProbeResult]:
+		with self._lock:
+			return list(self._results.get(depot_id, []))
+
+	def score(self, depot_id: str, now: float | None = None) -> float | None:
+		now = time.time() if now is None else now
+		weighted_sum = 0.0
+		weights = 0.0
+		for result in self.get_results(depot_id):
+			weight = 0.5 ** (max(now - result.timestamp, 0.0) / self.half_life)
+			weighted_sum += weight * (self.failure_score if result.error else result.score)
+			weights += weight
+		if not weights:
+			return None
+		return weighted_sum / weights
+
+	def to_dict(self) -> dict[str, Any]:
+		now = time.time()
+		with self._lock:
+			depot_ids = list(self._results)
+		return {
+			depot_id: {"score": self.score(depot_id, now), "results": [result.to_dict() for result in self.get_results(depot_id)]}
+			for depot_id in depot_ids
+		}
+
+
+class LatencyDepotSelector:
+	"""
+	Probes the master depot and the alternative depots in parallel and selects the depot with the best score.
+	"""
+
+	def __init__(self, history: DepotScoreHistory | None = None) -> None:
+		self.history = history or DepotScoreHistory()
+
+	def select_depot(
+		self,
+		master_depot: OpsiDepotserver,
+		alternative_depots: list[OpsiDepotserver],
+		timeout: float = DEFAULT_PROBE_TIMEOUT,
+		read_size: int = DEFAULT_PROBE_READ_SIZE,
+		username: str | None = None,
+		password: str | None = None,
+		ca_cert_file: str | None = None,
+	) -> OpsiDepotserver | None:
+		"""
+		Returns the selected depot or None if no depot could be probed successfully.
+		"""
+		depots = [depot for depot in [master_depot, *alternative_depots] if depot.depotWebdavUrl]
+		if not depots:
+			return None
+
+		results: dict[str, DepotProbeResult] = {}
+		executor = ThreadPoolExecutor(max_workers=len(depots), thread_name_prefix="DepotProbe")
+		try:
+			futures = [
+				executor.submit(probe_depot, depot.id, depot.depotWebdavUrl, timeout, read_size, username, password, ca_cert_file)
+				for depot in depots
+			]
+			# Probes are bounded by the timeout, the margin covers thread startup
+			done, _not_done = wait(futures, timeout=timeout + 1.0)
+			for future in done:
+				result = future.result()
+				results[result.depot_id] = result
+		finally:
+			# Do not wait for hanging probes
+			executor.shutdown(wait=False, cancel_futures=True)
+		now = time.time()
+		for depot in depots:
+			result = results.get(depot.id) or DepotProbeResult(depot_id=depot.id, timestamp=now, error="timed out")
+			self.history.add(result)
+			if result.error:
+				logger.info("Probing depot %s failed: %s", depot.id, result.error)
+			else:
+				logger.info(
+					"Probed depot %s: connect=%0.3fs tls=%0.3fs read=%d bytes in %0.3fs",
+					depot.id,
+					result.connect_time,
+					result.tls_time,
+					result.read_bytes,
+					result.read_time,
+				)
+
+		# Only depots reachable now are candidates, the master depot wins ties
+		selected: OpsiDepotserver | None = None
+		selected_score = 0.0
+		for depot in depots:
+			result = results.get(depot.id)
+			if not result or result.error:
+				continue
+			score = self.history.score(depot.id, now)
+			if score is not None and (selected is None or score < selected_score):
+				selected = depot
+				selected_score = score
+		if selected:
+			logger.notice("Selected depot %s by latency (score %0.3f)", selected.id, selected_score)
+		return selected
+
+
+latency_depot_selector = LatencyDepotSelector()
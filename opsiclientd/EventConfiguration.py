@@ -19,6 +19,9 @@ from .State import State
 
 state = State()
 
+# Events which are only meaningful when they occur, they are never queued
+UNQUEUED_EVENT_NAMES = ("on_shutdown",)
+
 
 class EventConfig:
 	def __init__(self, eventId: str, **kwargs: Any) -> None:
@@ -92,7 +95,14 @@ class EventConfig:
 		self.syncConfigToServer = forceBool(conf.get("syncConfigToServer", False))
 		self.syncConfigFromServer = forceBool(conf.get("syncConfigFromServer", False))
 		self.useCachedConfig = forceBool(conf.get("useCachedConfig", False))
+		# Memoize config service reads while processing the event
+		self.cacheServiceReads = forceBool(conf.get("cacheServiceReads", True))
 		self.workingWindow = str(conf.get("workingWindow", ""))
+		# Queue the event if it can not be processed because another event is running
+		self.queueIfBusy = forceBool(conf.get("queueIfBusy", True)) and self.name not in UNQUEUED_EVENT_NAMES
+		self.queuePriority = int(conf.get("queuePriority", 0))
+		# Queued events with the same key are coalesced, defaults to the id of the event generator
+		self.queueKey = str(conf.get("queueKey", ""))
 
 	def getConfig(self) -> dict[str, Any]:
 		config = {}
@@ -22,15 +22,19 @@ import sys
 import tempfile
 import threading
 import time
-from dataclasses import dataclass
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from functools import wraps
 from ipaddress import IPv6Address, ip_address
 from pathlib import Path
-from typing import TYPE_CHECKING, Callable, Literal
+from typing import TYPE_CHECKING, Any, Callable, Generator, Literal, TypeVar, cast
 from urllib.parse import urlparse
 
 import psutil  # type: ignore[import]
 from OPSI import System  # type: ignore[import]
 from OPSI.Object import ProductOnClient  # type: ignore[import]
+from OPSI.Util import timestamp  # type: ignore[import]
 from OPSI.Util.Message import (  # type: ignore[import]
 	ChoiceSubject,
 	MessageSubject,
@@ -54,6 +58,14 @@ from opsicommon.types import (  # type: ignore[import]
 )
 
 from opsiclientd import __version__
+from opsiclientd.ActionProcessorUpdate import (
+	ActionProcessorFile,
+	InstalledManifest,
+	build_action_processor_dir,
+	get_action_processor_files,
+	swap_directories,
+)
+from opsiclientd.Bandwidth import Transfer, TransferPriority, bandwidth_manager
 from opsiclientd.Config import Config
 from opsiclientd.Events.SyncCompleted import SyncCompletedEvent
 from opsiclientd.Events.Utilities.Generators import reconfigureEventGenerators
@@ -61,6 +73,8 @@ from opsiclientd.Exceptions import CanceledByUserError, ConfigurationError
 from opsiclientd.Localization import _
 from opsiclientd.notification_server import NotificationServer
 from opsiclientd.OpsiService import ServiceConnection
+from opsiclientd.RPCProfiler import rpc_profiler
+from opsiclientd.ServiceReadCache import ServiceReadCache
 from opsiclientd.State import State
 from opsiclientd.SystemCheck import (
 	RUNNING_ON_DARWIN,
@@ -74,6 +88,7 @@ from opsiclientd.utils import (
 	get_version_from_dos_binary,
 	get_version_from_elf_binary,
 	get_version_from_mach_binary,
+	in_working_window,
 )
 
 if RUNNING_ON_WINDOWS:
@@ -94,6 +109,12 @@ state = State()
 timeline = Timeline()
 
 
+# Phase records of the last finished event occurrences
+_phase_history: deque[dict[str, Any]] = deque(maxlen=25)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
 @dataclass
 class ProductInfo:
 	id: str
@@ -102,10 +123,50 @@ class ProductInfo:
 	name: str
 
 
+@dataclass
+class PhaseSpan:
+	name: str
+	start: float
+	end: float | None = None
+	depth: int = 0
+	rpc_count: int = 0
+	request_count: int = 0
+	bytes_sent: int = 0
+	bytes_received: int = 0
+	error: str | None = None
+
+	@property
+	def duration(self) -> float:
+		return (self.end or time.time()) - self.start
+
+	def to_dict(self) -> dict[str, Any]:
+		return asdict(self) | {"duration": self.duration}
+
+
 class EventProcessingCanceled(Exception):
 	pass
 
 
+def get_phase_history() -> list[dict[str, Any]]:
+	return list(_phase_history)
+
+
+def processing_phase(name: str) -> Callable[[F], F]:
+	"""
+	Records the execution of the decorated EventProcessingThread method as processing phase.
+	"""
+
+	def decorator(func: F) -> F:
+		@wraps(func)
+		def wrapper(self: EventProcessingThread, *args: Any, **kwargs: Any) -> Any:
+			with self.phase(name):
+				return func(self, *args, **kwargs)
+
+		return cast(F, wrapper)
+
+	return decorator
+
+
 class EventProcessingThread(KillableThread, ServiceConnection):
 	def __init__(self, opsiclientd: Opsiclientd, event: Event) -> None:
 		KillableThread.__init__(self, name="EventProcessingThread")
@@ -153,6 +214,74 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 		if self.isLoginEvent:
 			logger.info("Event is user login event")
 
+		self._phases: list[PhaseSpan] = []
+		self._phaseDepth = 0
+		self._startTime: float | None = None
+		self._endTime: float | None = None
+
+	@contextmanager
+	def phase(self, name: str) -> Generator[PhaseSpan, None, None]:
+		span = PhaseSpan(name=name, start=time.time(), depth=self._phaseDepth)
+		self._phases.append(span)
+		self._phaseDepth += 1
+		rpc_statistics = self.getRPCStatistics()
+		is_error = False
+		try:
+			with rpc_profiler.operation(name):
+				yield span
+		except BaseException as err:
+			span.error = str(err) or err.__class__.__name__
+			is_error = not isinstance(err, EventProcessingCanceled)
+			raise
+		finally:
+			span.end = time.time()
+			self._phaseDepth -= 1
+			rpc_statistics = self.getRPCStatistics().diff(rpc_statistics)
+			span.rpc_count = rpc_statistics.rpc_count
+			span.request_count = rpc_statistics.request_count
+			span.bytes_sent = rpc_statistics.bytes_sent
+			span.bytes_received = rpc_statistics.bytes_received
+			logger.info(
+				"Event processing phase %r finished after %0.3f seconds (rpcs: %d, sent: %d bytes, received: %d bytes)",
+				name,
+				span.duration,
+				span.rpc_count,
+				span.bytes_sent,
+				span.bytes_received,
+			)
+			timeline.addEvent(
+				title=f"Phase {name}",
+				description=(
+					f"Event {self.event.eventConfig.getId()}: phase {name} took {span.duration:0.3f} seconds\n"
+					f"rpcs: {span.rpc_count}, requests: {span.request_count}, "
+					f"sent: {span.bytes_sent} bytes, received: {span.bytes_received} bytes"
+					+ (f"\nerror: {span.error}" if span.error else "")
+				),
+				category="event_processing_phase",
+				isError=is_error,
+				start=timestamp(span.start),
+				end=timestamp(span.end),
+			)
+
+	def getPhaseInfo(self) -> dict[str, Any]:
+		return {
+			"event_id": self.event.eventConfig.getId(),
+			"event_name": self.event.eventConfig.getName(),
+			"thread": self.name,
+			"running": self.running,
+			"start": self._startTime,
+			"end": self._endTime,
+			"phases": [span.to_dict() for span in self._phases],
+		}
+
+	def _finishPhases(self) -> None:
+		"""
+		Sets the end of the event processing and adds the phases to the phase history.
+		"""
+		self._endTime = time.time()
+		if self._phases:
+			_phase_history.append(self.getPhaseInfo())
+
 	def _cancelable_sleep(self, secs: int) -> bool:
 		"""Wait for the given number of seconds.
 		The running event can be canceled in the meantime.
@@ -244,6 +373,9 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 		if self._notificationServer and self._choiceSubject:
 			self._notificationServer.removeSubject(self._choiceSubject)
 		self._detailSubjectProxy.setMessage("")
+		if self._configService and self.event.eventConfig.cacheServiceReads:
+			logger.info("Memoizing config service reads while processing event")
+			self._configService = ServiceReadCache(self._configService)  # type: ignore[assignment]
 
 	def connectionFailed(self, error: str) -> None:
 		if self._notificationServer and self._choiceSubject:
@@ -251,8 +383,20 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 		self._detailSubjectProxy.setMessage("")
 		ServiceConnection.connectionFailed(self, error)
 
+	def disconnectConfigService(self) -> None:
+		if isinstance(self._configService, ServiceReadCache):
+			logger.info("Config service read cache statistics: %s", self._configService.get_statistics())
+		ServiceConnection.disconnectConfigService(self)
+
 	# End of ServiceConnection
 
+	def clearServiceReadCache(self) -> None:
+		"""
+		Discards the memoized config service reads, needed after others (like the action processor) changed the config.
+		"""
+		if isinstance(self._configService, ServiceReadCache):
+			self._configService.clear()
+
 	def getSessionId(self) -> int:
 		if RUNNING_ON_WINDOWS:
 			if self.isLoginEvent:
@@ -287,6 +431,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			return None
 		return self._notificationServer.port
 
+	@processing_phase("notification_server_start")
 	def startNotificationServer(self) -> None:
 		logger.notice("Starting notification server")
 
@@ -336,6 +481,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			return
 		threading.Thread(target=self._stopNotificationServer, name="stopNotificationServer").start()
 
+	@processing_phase("get_config_from_service")
 	def getConfigFromService(self) -> None:
 		"""Get settings from service"""
 		logger.notice("Getting config from service")
@@ -359,6 +505,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			logger.error("Failed to get config from service: %s", err)
 			raise
 
+	@processing_phase("write_log_to_service")
 	def writeLogToService(self) -> None:
 		logger.notice("Writing log to service")
 		try:
@@ -492,6 +639,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 		logger.notice("Action processor name '%s', version '%s'", name, version)
 		self._actionProcessorInfoSubject.setMessage(f"{name} {version}")
 
+	@processing_phase("mount_depot_share")
 	def mountDepotShare(self) -> None:
 		if self._depotShareMounted:
 			logger.debug("Depot share already mounted")
@@ -577,6 +725,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 		except Exception as err:
 			logger.warning(err)
 
+	@processing_phase("update_action_processor")
 	def updateActionProcessor(self) -> None:
 		logger.notice("Updating action processor")
 		self.setStatusMessage(_("Updating action processor"))
@@ -587,17 +736,19 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			url = urlparse(config.get("depot_server", "url"))
 			actionProcessorRemoteDir = None
 			actionProcessorCommonDir = None
-			if url.hostname.lower() in ("127.0.0.1", "localhost", "::1"):
+			fromCache = url.hostname.lower() in ("127.0.0.1", "localhost", "::1")
+			if fromCache:
 				dirname = config.get("action_processor", "remote_dir")
 				dirname.lstrip(os.sep)
 				dirname.lstrip("install" + os.sep)
 				dirname.lstrip(os.sep)
-				actionProcessorRemoteDir = os.path.join(self.opsiclientd.getCacheService().getProductCacheDir(), dirname)
+				actionProcessorDepotDir = self.opsiclientd.getCacheService().getProductCacheDir()
+				actionProcessorRemoteDir = os.path.join(actionProcessorDepotDir, dirname)
 				commonname = config.get("action_processor", "remote_common_dir")
 				commonname.lstrip(os.sep)
 				commonname.lstrip("install" + os.sep)
 				commonname.lstrip(os.sep)
-				actionProcessorCommonDir = os.path.join(self.opsiclientd.getCacheService().getProductCacheDir(), commonname)
+				actionProcessorCommonDir = os.path.join(actionProcessorDepotDir, commonname)
 				logger.notice(
 					"Updating action processor from local cache '%s' (common dir '%s')", actionProcessorRemoteDir, actionProcessorCommonDir
 				)
@@ -605,6 +756,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 				dd = config.getDepotDrive()
 				if RUNNING_ON_WINDOWS:
 					dd += os.sep
+				actionProcessorDepotDir = dd
 				dirname = config.get("action_processor", "remote_dir")
 				dirname.lstrip(os.sep)
 				actionProcessorRemoteDir = os.path.join(dd, dirname)
@@ -621,14 +773,41 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			assert actionProcessorLocalDir
 			actionProcessorLocalFile = os.path.join(actionProcessorLocalDir, actionProcessorFilename)
 			actionProcessorRemoteFile = os.path.join(actionProcessorRemoteDir, actionProcessorFilename)
+			unified = "opsi-script" in actionProcessorLocalDir
+
+			# The package content file of the action processor product is compared with the manifest of the installed files,
+			# so the check does not need to read the action processor files from the depot
+			manifest = InstalledManifest(
+				os.path.join(os.path.dirname(config.get("global", "state_file")), "action_processor_manifest.json")
+			)
+			files: dict[str, ActionProcessorFile] | None = None
+			changedFiles: list[str] = []
+			try:
+				files = get_action_processor_files(
+					actionProcessorDepotDir, dirname, commonname if unified and (RUNNING_ON_LINUX or RUNNING_ON_WINDOWS) else ""
+				)
+			except Exception as err:
+				logger.info("Comparing action processor files, failed to read package content file: %s", err)
 
+			upToDate = False
 			if not os.path.exists(actionProcessorLocalFile):
 				logger.notice("Action processor needs update because file '%s' not found", actionProcessorLocalFile)
+			elif files is not None:
+				changedFiles = manifest.changed_files(actionProcessorLocalDir, files)
+				if changedFiles:
+					logger.notice(
+						"Action processor needs update because %d files changed: %s", len(changedFiles), ", ".join(changedFiles[:10])
+					)
+				else:
+					upToDate = True
 			elif abs(os.stat(actionProcessorLocalFile).st_mtime - os.stat(actionProcessorRemoteFile).st_mtime) > 10:
 				logger.notice("Action processor needs update because modification time difference is more than 10 seconds")
 			elif not filecmp.cmp(actionProcessorLocalFile, actionProcessorRemoteFile):
 				logger.notice("Action processor needs update because file changed")
 			else:
+				upToDate = True
+
+			if upToDate:
 				logger.notice("Local action processor exists and seems to be up to date")
 				if self.event.eventConfig.useCachedProducts:
 					self._configService.productOnClient_updateObjects(
@@ -654,11 +833,20 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 					except (PermissionError, psutil.AccessDenied, ValueError):
 						pass
 
-			# Update files
-			if "opsi-script" in actionProcessorLocalDir:
-				self.updateActionProcessorUnified(actionProcessorRemoteDir, actionProcessorCommonDir)
+			# Update files, copies from the depot are metered by the bandwidth manager
+			with (
+				nullcontext() if fromCache else bandwidth_manager.transfer("Update action processor", TransferPriority.ACTION_PROCESSOR)
+			) as transfer:
+				if unified and files is not None:
+					self.updateActionProcessorIncremental(actionProcessorDepotDir, files, changedFiles, transfer)
+				elif unified:
+					self.updateActionProcessorUnified(actionProcessorRemoteDir, actionProcessorCommonDir, transfer)
+				else:
+					self.updateActionProcessorOld(actionProcessorRemoteDir, transfer)
+			if files is not None:
+				manifest.save(actionProcessorLocalDir, files)
 			else:
-				self.updateActionProcessorOld(actionProcessorRemoteDir)
+				manifest.remove()
 			logger.notice("Local action processor successfully updated")
 
 			productVersion = None
@@ -693,25 +881,53 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 		except Exception as err:
 			logger.error("Failed to update action processor: %s", err, exc_info=True)
 
-	def updateActionProcessorUnified(self, actionProcessorRemoteDir: str, actionProcessorCommonDir: str) -> None:
-		actionProcessorFilename = config.get("action_processor", "filename")
+	def updateActionProcessorUnified(
+		self, actionProcessorRemoteDir: str, actionProcessorCommonDir: str, transfer: Transfer | None = None
+	) -> None:
+		copyFunction = transfer.copy_file if transfer else shutil.copy2
 		actionProcessorLocalDir = config.get("action_processor", "local_dir")
 		actionProcessorLocalTmpDir = actionProcessorLocalDir + ".tmp"
-		actionProcessorLocalFile = os.path.join(actionProcessorLocalDir, actionProcessorFilename)
 
 		logger.notice("Start copying the action processor files")
 		if os.path.exists(actionProcessorLocalTmpDir):
 			logger.info("Deleting dir '%s'", actionProcessorLocalTmpDir)
 			shutil.rmtree(actionProcessorLocalTmpDir)
 		logger.info("Copying from '%s' to '%s'", actionProcessorRemoteDir, actionProcessorLocalTmpDir)
-		shutil.copytree(actionProcessorRemoteDir, actionProcessorLocalTmpDir)
+		shutil.copytree(actionProcessorRemoteDir, actionProcessorLocalTmpDir, copy_function=copyFunction)
 		if RUNNING_ON_LINUX or RUNNING_ON_WINDOWS:
 			for common in os.listdir(actionProcessorCommonDir):
 				source = os.path.join(actionProcessorCommonDir, common)
 				if os.path.isdir(source):
-					shutil.copytree(source, os.path.join(actionProcessorLocalTmpDir, common))
+					shutil.copytree(source, os.path.join(actionProcessorLocalTmpDir, common), copy_function=copyFunction)
 				else:
-					shutil.copy2(source, os.path.join(actionProcessorLocalTmpDir, common))
+					copyFunction(source, os.path.join(actionProcessorLocalTmpDir, common))
+		self.installActionProcessorDir(actionProcessorLocalTmpDir)
+
+	def updateActionProcessorIncremental(
+		self, actionProcessorDepotDir: str, files: dict[str, ActionProcessorFile], changedFiles: list[str], transfer: Transfer | None = None
+	) -> None:
+		"""
+		Builds the new action processor dir from the installed files and the changed files of the depot.
+		"""
+		actionProcessorLocalDir = config.get("action_processor", "local_dir")
+		actionProcessorLocalTmpDir = actionProcessorLocalDir + ".tmp"
+		logger.notice("Start copying %d changed action processor files", len(changedFiles))
+		transferred = build_action_processor_dir(
+			files,
+			actionProcessorDepotDir,
+			actionProcessorLocalDir,
+			actionProcessorLocalTmpDir,
+			changedFiles,
+			copy_function=transfer.copy_file if transfer else shutil.copy2,
+		)
+		logger.info("%d action processor files transferred from depot", transferred)
+		self.installActionProcessorDir(actionProcessorLocalTmpDir)
+
+	def installActionProcessorDir(self, actionProcessorLocalTmpDir: str) -> None:
+		actionProcessorFilename = config.get("action_processor", "filename")
+		actionProcessorLocalDir = config.get("action_processor", "local_dir")
+		actionProcessorLocalFile = os.path.join(actionProcessorLocalDir, actionProcessorFilename)
+
 		if RUNNING_ON_WINDOWS:
 			# saving current opsi-script skin (set during opsi-client-agent setup with optional corporate identity)
 			if os.path.exists(os.path.join(actionProcessorLocalDir, "skin")) and os.listdir(os.path.join(actionProcessorLocalDir, "skin")):
@@ -722,12 +938,8 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 		if not os.path.exists(os.path.join(actionProcessorLocalTmpDir, actionProcessorFilename)):
 			raise RuntimeError(f"File '{os.path.join(actionProcessorLocalTmpDir, actionProcessorFilename)}' does not exist after copy")
 
-		if os.path.exists(actionProcessorLocalDir):
-			logger.info("Deleting dir '%s'", actionProcessorLocalDir)
-			shutil.rmtree(actionProcessorLocalDir)
-
-		logger.info("Moving dir '%s' to '%s'", actionProcessorLocalTmpDir, actionProcessorLocalDir)
-		shutil.move(actionProcessorLocalTmpDir, actionProcessorLocalDir)
+		logger.info("Replacing dir '%s' with '%s'", actionProcessorLocalDir, actionProcessorLocalTmpDir)
+		swap_directories(actionProcessorLocalTmpDir, actionProcessorLocalDir)
 
 		if RUNNING_ON_WINDOWS:
 			logger.notice("Setting permissions for opsi-script")
@@ -755,7 +967,8 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 				for subdir in dirs:
 					os.chmod(os.path.join(root, subdir), 0o755)
 
-	def updateActionProcessorOld(self, actionProcessorRemoteDir: str) -> None:
+	def updateActionProcessorOld(self, actionProcessorRemoteDir: str, transfer: Transfer | None = None) -> None:
+		copyFunction = transfer.copy_file if transfer else shutil.copy2
 		if not RUNNING_ON_WINDOWS and not RUNNING_ON_LINUX:
 			logger.error("Update of action processor without installed opsi-script package not implemented on this os")
 			return
@@ -770,7 +983,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 				logger.info("Deleting dir '%s'", actionProcessorLocalTmpDir)
 				shutil.rmtree(actionProcessorLocalTmpDir)
 			logger.info("Copying from '%s' to '%s'", actionProcessorRemoteDir, actionProcessorLocalTmpDir)
-			shutil.copytree(actionProcessorRemoteDir, actionProcessorLocalTmpDir)
+			shutil.copytree(actionProcessorRemoteDir, actionProcessorLocalTmpDir, copy_function=copyFunction)
 
 			if not os.path.exists(os.path.join(actionProcessorLocalTmpDir, actionProcessorFilename)):
 				raise RuntimeError(f"File '{os.path.join(actionProcessorLocalTmpDir, actionProcessorFilename)}' does not exist after copy")
@@ -795,12 +1008,13 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			logger.info("Copying from '%s' to '%s'", actionProcessorRemoteDir, actionProcessorLocalDir)
 			for fn in os.listdir(actionProcessorRemoteDir):
 				if os.path.isfile(os.path.join(actionProcessorRemoteDir, fn)):
-					shutil.copy2(os.path.join(actionProcessorRemoteDir, fn), os.path.join(actionProcessorLocalDir, fn))
+					copyFunction(os.path.join(actionProcessorRemoteDir, fn), os.path.join(actionProcessorLocalDir, fn))
 				else:
 					logger.warning(
 						"Skipping '%s' while updating action processor because it is not a file", os.path.join(actionProcessorRemoteDir, fn)
 					)
 
+	@processing_phase("process_user_login_actions")
 	def processUserLoginActions(self) -> None:
 		self.setStatusMessage(_("Processing login actions"))
 		try:
@@ -863,6 +1077,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			logger.error("Failed to process login actions: %s", err, exc_info=True)
 			self.setStatusMessage(_("Failed to process login actions: %s") % forceUnicode(err))
 
+	@processing_phase("process_product_action_requests")
 	def processProductActionRequests(self) -> None:
 		self.setStatusMessage(_("Getting action requests from config service"))
 
@@ -879,8 +1094,9 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			if not self._configService:
 				raise RuntimeError("Not connected to config service")
 
-			productIds: list[str] = []
-			productInfo: list[ProductInfo] = []
+			productIds: set[str] = set()
+			# Product info by product id in the order of the product on clients
+			productInfo: dict[str, ProductInfo] = {}
 			includeProductIds: list[str] = []
 			excludeProductIds: list[str] = []
 			actionRequests = ["setup", "uninstall", "update", "always", "once", "custom"]
@@ -897,26 +1113,25 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 						self._configService, self.event.eventConfig.includeProductGroupIds, self.event.eventConfig.excludeProductGroupIds
 					)
 
+			excludedProductIds = set(excludeProductIds)
 			for productOnClient in [
 				poc
 				for poc in self._configService.productOnClient_getObjects(
 					productType="LocalbootProduct",
-					clientId=config.get("global", "host_id"),
+					clientId=config.snapshot.global_.host_id,
 					actionRequest=actionRequests,
 					attributes=["actionRequest", "productVersion", "packageVersion"],
 					productId=includeProductIds,
 				)
-				if poc.productId not in excludeProductIds
+				if poc.productId not in excludedProductIds
 			]:
 				if productOnClient.productId not in productIds:
-					productIds.append(productOnClient.productId)
-					productInfo.append(
-						ProductInfo(
-							productOnClient.productId,
-							productOnClient.productVersion,
-							productOnClient.packageVersion,
-							"",
-						)
+					productIds.add(productOnClient.productId)
+					productInfo[productOnClient.productId] = ProductInfo(
+						productOnClient.productId,
+						productOnClient.productVersion,
+						productOnClient.packageVersion,
+						"",
 					)
 					logger.notice(
 						"   [%2s] product %-20s %s", len(productIds), productOnClient.productId + ":", productOnClient.actionRequest
@@ -941,7 +1156,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 				logger.notice("Start processing action requests")
 				if productIds:
 					if self.event.eventConfig.useCachedProducts:
-						if self.opsiclientd.getCacheService().productCacheCompleted(self._configService, productIds):
+						if self.opsiclientd.getCacheService().productCacheCompleted(self._configService, list(productInfo)):
 							logger.notice("Event '%s' uses cached products and product caching is done", self.event.eventConfig.getId())
 						else:
 							raise RuntimeError(
@@ -951,44 +1166,36 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 				additionalParams = ""
 				if includeProductIds or excludeProductIds:
 					if RUNNING_ON_LINUX or RUNNING_ON_DARWIN:
-						additionalParams = "-processproducts " + ",".join(productIds)
+						additionalParams = "-processproducts " + ",".join(productInfo)
 					elif RUNNING_ON_WINDOWS:
-						additionalParams = "/processproducts " + ",".join(productIds)
+						additionalParams = "/processproducts " + ",".join(productInfo)
 					else:
 						logger.error("Unknown operating system - skipping processproducts parameter for action processor call")
 
 				if productInfo:
-					depot_id = config.get("depot_server", "depot_id")
-					count = 0
-					for product in self._configService.productOnDepot_getObjects(
-						attributes=["productId", "productVersion", "packageVersion"], productId=productIds, depotId=depot_id
+					depot_id = config.snapshot.depot_server.depot_id
+					# The version on the depot is the version the action processor will install
+					for productOnDepot in self._configService.productOnDepot_getObjects(
+						attributes=["productId", "productVersion", "packageVersion"], productId=list(productInfo), depotId=depot_id
 					):
-						for p_info in productInfo:
-							if p_info.id == product.productId:
-								p_info.productVersion = product.productVersion
-								p_info.packageVersion = product.packageVersion
-								count += 1
-								break
-						if count == len(productIds):
-							break
+						p_info = productInfo.get(productOnDepot.productId)
+						if p_info:
+							p_info.productVersion = productOnDepot.productVersion
+							p_info.packageVersion = productOnDepot.packageVersion
 
-					count = 0
+					# Only request the versions on the depot instead of all versions of the products
+					product_infos = {(p_info.id, p_info.productVersion, p_info.packageVersion): p_info for p_info in productInfo.values()}
 					for product in self._configService.product_getObjects(
-						attributes=["id", "name", "productVersion", "packageVersion"], id=productIds
+						attributes=["id", "name", "productVersion", "packageVersion"],
+						id=list(productInfo),
+						productVersion=list({p_info.productVersion for p_info in productInfo.values() if p_info.productVersion}),
+						packageVersion=list({p_info.packageVersion for p_info in productInfo.values() if p_info.packageVersion}),
 					):
-						for p_info in productInfo:
-							if p_info.id == product.id:
-								if p_info.productVersion == product.productVersion and p_info.packageVersion == product.packageVersion:
-									p_info.name = product.name
-								count += 1
-								break
-						if count == len(productIds):
-							break
-
-
+						p_info = product_infos.get((product.id, product.productVersion, product.packageVersion))
+						if p_info:
+							p_info.name = product.name
 
-
-				self.processActionWarningTime(productInfo)
+				self.processActionWarningTime(list(productInfo.values()))
 				try:
 					try:
 						cache_service = self.opsiclientd.getCacheService()
@@ -1001,7 +1208,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 				except Exception as err:
 					logger.error(err)
 
-				self.runActions(productInfo, additionalParams=additionalParams)
+				self.runActions(list(productInfo.values()), additionalParams=additionalParams)
 				try:
 					try:
 						cache_service = self.opsiclientd.getCacheService()
@@ -1045,6 +1252,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			)
 		time.sleep(3)
 
+	@processing_phase("action_processor_run")
 	def runActions(self, productInfo: list[ProductInfo], additionalParams: str = "") -> None:
 		productIds = [p.id for p in productInfo]
 		description = f"Running actions {', '.join(productIds)}"
@@ -1263,6 +1471,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 		finally:
 			timeline.setEventEnd(eventId=runActionsEventId)
 			self.umountDepotShare()
+			self.clearServiceReadCache()
 
 	def setEnvironment(self) -> None:
 		try:
@@ -1458,6 +1667,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			return True
 		return False
 
+	@processing_phase("shutdown_handling")
 	def processShutdownRequests(self) -> None:
 		try:
 			assert self.opsiclientd
@@ -1720,34 +1930,21 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			logger.error(err, exc_info=True)
 
 	def inWorkingWindow(self) -> bool:
-		start_str, end_str, now = (None, None, None)
+		working_window = self.event.eventConfig.workingWindow
+		now = datetime.datetime.now().time()
 		try:
-			# Working window is specified like: 07:00-22:00
-			start_str, end_str = self.event.eventConfig.workingWindow.split("-")
-			start = datetime.time(int(start_str.split(":")[0]), int(start_str.split(":")[1]))
-			end = datetime.time(int(end_str.split(":")[0]), int(end_str.split(":")[1]))
-			now = datetime.datetime.now().time()
-
-			logger.debug("Working window configuration: start=%s, end=%s, now=%s", start, end, now)
-
-			in_window = False
-			if start <= end:
-				in_window = start <= now <= end
-			else:
-				# Crosses midnight
-				in_window = now >= start or now <= end
-
-			if in_window:
-				logger.info("Current time %s is within the configured working window (%s-%s)", now, start, end)
+			if in_working_window(working_window, now):
+				logger.info("Current time %s is within the configured working window (%s)", now, working_window)
 				return True
 
-			logger.info("Current time %s is outside the configured working window (%s-%s)", now, start, end)
+			logger.info("Current time %s is outside the configured working window (%s)", now, working_window)
 			return False
 
 		except Exception as err:
-			logger.error("Working window processing failed (start=%s, end=%s, now=%s): %s", start_str, end_str, now, err, exc_info=True)
+			logger.error("Working window processing failed (working window=%s, now=%s): %s", working_window, now, err, exc_info=True)
 			return True
 
+	@processing_phase("cache_products")
 	def cache_products(self, wait_for_ending: bool = False) -> None:
 		assert self.opsiclientd
 		if self.opsiclientd.getCacheService().isProductCacheServiceWorking():
@@ -1775,6 +1972,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			except Exception as err:
 				logger.error(err, exc_info=True)
 
+	@processing_phase("sync_config")
 	def sync_config(self, wait_for_ending: bool = False) -> None:
 		assert self.opsiclientd
 		if self.opsiclientd.getCacheService().isConfigCacheServiceWorking():
@@ -1791,6 +1989,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			self.opsiclientd.getCacheService().syncConfigFromServer(waitForEnding=wait_for_ending)
 			if wait_for_ending:
 				self.setStatusMessage(_("Sync completed"))
+		self.clearServiceReadCache()
 
 	def cleanup_temp_dir(self) -> None:
 		tmp_dir = config.get("global", "tmp_dir")
@@ -1810,6 +2009,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 			timelineEventId = None
 			notifierPids: list[int] = []
 			notifierHandles: list[Popen | int] = []
+			self._startTime = time.time()
 
 			try:
 				if self.event.eventConfig.workingWindow:
@@ -1861,13 +2061,14 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 						desktops = [self.event.eventConfig.eventNotifierDesktop]
 						if RUNNING_ON_WINDOWS and self.event.eventConfig.eventNotifierDesktop == "all":
 							desktops = ["winlogon", "default"]
-						for desktop in desktops:
-							notifier_handle, notifier_pid = self.startNotifierApplication(
-								command=self.event.eventConfig.eventNotifierCommand, notifierId=notifierId, desktop=desktop
-							)
-							if notifier_handle and notifier_pid:
-								notifierPids.append(notifier_pid)
-								notifierHandles.append(notifier_handle)
+						with self.phase("notifier_start"):
+							for desktop in desktops:
+								notifier_handle, notifier_pid = self.startNotifierApplication(
+									command=self.event.eventConfig.eventNotifierCommand, notifierId=notifierId, desktop=desktop
+								)
+								if notifier_handle and notifier_pid:
+									notifierPids.append(notifier_pid)
+									notifierHandles.append(notifier_handle)
 
 					if self.event.eventConfig.useCachedConfig:
 						if self.opsiclientd.getCacheService().configCacheCompleted():
@@ -1880,7 +2081,8 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 
 					if self.event.eventConfig.getConfigFromService or self.event.eventConfig.processActions:
 						if not self.isConfigServiceConnected():
-							self.connectConfigService()
+							with self.phase("config_service_connect"):
+								self.connectConfigService()
 
 						if self.event.eventConfig.getConfigFromService:
 							config.readConfigFile()
@@ -2002,6 +2204,7 @@ class EventProcessingThread(KillableThread, ServiceConnection):
 
 			self.opsiclientd.setBlockLogin(False)
 			self.running = False
+			self._finishPhases()
 			logger.notice("============= EventProcessingThread for event '%s' ended =============", self.event.eventConfig.getId())
 			if timelineEventId:
 				timeline.setEventEnd(eventId=timelineEventId)
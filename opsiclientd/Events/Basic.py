@@ -20,6 +20,8 @@ from opsicommon.logging import get_logger
 from opsicommon.types import forceList
 
 from opsiclientd.EventConfiguration import EventConfig
+from opsiclientd.Events.Utilities.Queue import event_queue
+from opsiclientd.Events.Utilities.Scheduler import ScheduledJob, event_scheduler
 from opsiclientd.State import State
 
 if TYPE_CHECKING:
@@ -35,24 +37,36 @@ class CannotCancelEventError(RuntimeError):
 	pass
 
 
-class EventGenerator(threading.Thread):
+class EventGenerator:
+	"""
+	Generators implementing `getNextEvent` wait for their events in a thread of their own.
+	All other generators are timed by the event scheduler (activation delay, start interval and interval)
+	or fired from outside and need no thread.
+	"""
+
 	def __init__(self, opsiclientd: Opsiclientd, generatorConfig: EventConfig) -> None:
-		threading.Thread.__init__(self, daemon=True, name=f"EventGenerator-{generatorConfig.getId()}")
+		self.name = f"EventGenerator-{generatorConfig.getId()}"
 		self._opsiclientd = opsiclientd
 		self._generatorConfig = generatorConfig
 		self._eventConfigs: list[EventConfig] = []
 		self._eventListeners: list[EventListener] = []
 		self._eventsOccured = 0
-		self._threadId = None
 		self._stopped = False
+		self._stopEvent = threading.Event()
 		self._event: threading.Event | None = None
 		self._lastEventOccurence: float | None = None
+		self._thread: threading.Thread | None = None
+		self._scheduledJob: ScheduledJob | None = None
+		self._activated = False
 
 	def __str__(self) -> str:
 		return f"<{self.__class__.__name__} {self._generatorConfig.getId()}>"
 
 	__repr__ = __str__
 
+	def getId(self) -> str:
+		return self._generatorConfig.getId()
+
 	def setEventConfigs(self, eventConfigs: list[EventConfig]) -> None:
 		self._eventConfigs = forceList(eventConfigs)
 
@@ -85,8 +99,8 @@ class EventGenerator(threading.Thread):
 
 		return actualConfig
 
-	def createAndFireEvent(self, eventInfo: dict[str, str | list[str]] | None = None, can_cancel: bool = False) -> None:
-		self.fireEvent(self.createEvent(eventInfo), can_cancel=can_cancel)
+	def createAndFireEvent(self, eventInfo: dict[str, str | list[str]] | None = None, can_cancel: bool = False) -> bool:
+		return self.fireEvent(self.createEvent(eventInfo), can_cancel=can_cancel)
 
 	def createEvent(self, eventInfo: dict[str, str | list[str]] | None = None) -> Event | None:
 		logger.debug("Creating event config from info: %s", eventInfo)
@@ -101,40 +115,42 @@ class EventGenerator(threading.Thread):
 		pass
 
 	def getNextEvent(self) -> Event | None:
-		self._event = threading.Event()
-		logger.debug(
-			"getNextEvent: eventsOccured=%d, startInterval=%d, interval=%d",
-			self._eventsOccured,
-			self._generatorConfig.startInterval,
-			self._generatorConfig.interval,
-		)
-		if self._eventsOccured == 0 and self._generatorConfig.startInterval > 0:
-			logger.debug("Waiting for start interval %d", self._generatorConfig.startInterval)
-			self._event.wait(self._generatorConfig.startInterval)
-			if self._stopped:
-				return None
-			return self.createEvent()
-		if self._generatorConfig.interval > 0:
-			logger.debug("Waiting for interval %d", self._generatorConfig.interval)
-			self._event.wait(self._generatorConfig.interval)
-			if self._stopped:
-				return None
-			return self.createEvent()
-		self._event.wait()
-		return None
+		"""
+		Blocks until the next event occurs.
+		Generators which do not implement this are timed by the event scheduler.
+		"""
+		raise NotImplementedError(f"{self}: getNextEvent() not implemented")
+
+	def isScheduled(self) -> bool:
+		return type(self).getNextEvent is EventGenerator.getNextEvent
+
+	def getNextFireTime(self) -> float | None:
+		"""
+		Returns the unix timestamp of the next timed event or None if no event is scheduled.
+		"""
+		job = self._scheduledJob
+		if not job or job.cancelled or not self._activated:
+			return None
+		return job.next_fire_time
 
 	def cleanup(self) -> None:
 		pass
 
-	def fireEvent(self, event: Event | None = None, can_cancel: bool = False) -> None:
+	def fireEvent(self, event: Event | None = None, can_cancel: bool = False, queue_if_busy: bool = True) -> bool:
+		"""
+		Fires the event if all listeners can process it.
+		An event which can not be processed because another event is running is queued, if `queue_if_busy`
+		and the event config allow it, otherwise CannotCancelEventError is raised.
+		Returns True if the event was queued instead of fired.
+		"""
 		logger.debug("Trying to fire event %s", event)
 		if self._stopped:
 			logger.debug("%s is stopped, not firing event", self)
-			return
+			return False
 
 		if not event:
 			logger.info("No event to fire")
-			return
+			return False
 
 		self._lastEventOccurence = time.time()
 
@@ -151,14 +167,6 @@ class EventGenerator(threading.Thread):
 
 			def run(self) -> None:
 				with opsicommon.logging.log_context({"instance": "event generator " + self._event.eventConfig.getId()}):
-					if self._event.eventConfig.notificationDelay > 0:
-						logger.debug(
-							"Waiting %d seconds before notifying listener '%s' of event '%s'",
-							self._event.eventConfig.notificationDelay,
-							self._eventListener,
-							self._event,
-						)
-						time.sleep(self._event.eventConfig.notificationDelay)
 					try:
 						logger.info("Calling processEvent on listener %s", self._eventListener)
 						self._eventListener.processEvent(self._event)
@@ -172,19 +180,157 @@ class EventGenerator(threading.Thread):
 		if not self._opsiclientd.eventLock.acquire(timeout=5):
 			raise ValueError("Could not get event handling lock due to another event currently running")
 		try:
-			for listener in self._eventListeners:
-				# Check if all event listeners can handle the event
-				# raises CannotCancelEventError if another event is already running
-				listener.canProcessEvent(event, can_cancel=can_cancel)
+			try:
+				for listener in self._eventListeners:
+					# Check if all event listeners can handle the event
+					# raises CannotCancelEventError if another event is already running
+					listener.canProcessEvent(event, can_cancel=can_cancel)
+			except CannotCancelEventError as cce_error:
+				if queue_if_busy and self.queueEvent(event, cce_error):
+					return True
+				raise
 			for listener in self._eventListeners:
 				# Create a new thread for each event listener
-				FireEventThread(listener, event).start()
+				fireEventThread = FireEventThread(listener, event)
+				if event.eventConfig.notificationDelay > 0:
+					logger.debug(
+						"Waiting %d seconds before notifying listener '%s' of event '%s'",
+						event.eventConfig.notificationDelay,
+						listener,
+						event,
+					)
+					event_scheduler.schedule(
+						event.eventConfig.notificationDelay,
+						fireEventThread.start,
+						name=f"Notify {listener} of event {event.eventConfig.getId()}",
+					)
+				else:
+					fireEventThread.start()
 			keep_lock = True
 			logger.debug("keeping event processing lock (Basic)")
 		finally:
 			if not keep_lock:
 				logger.trace("release lock (Basic)")
 				self._opsiclientd.eventLock.release()
+		return False
+
+	def _repetitionsLeft(self) -> bool:
+		return (self._generatorConfig.maxRepetitions < 0) or (self._eventsOccured <= self._generatorConfig.maxRepetitions)
+
+	def _fireNextEvent(self, event: Event | None) -> None:
+		self._eventsOccured += 1  # Count as occured, even if event is None!
+		if event:
+			logger.info("Got new event: %s (%d/%d)", event, self._eventsOccured, self._generatorConfig.maxRepetitions + 1)
+			try:
+				self.fireEvent(event)
+			except CannotCancelEventError as cce_error:
+				logger.warning("Event generator '%s' could not fire: %s", self, cce_error)
+
+	def canQueueEvents(self) -> bool:
+		"""
+		Events of generators like daemon startup and shutdown are only meaningful when they occur and are never queued.
+		"""
+		return self._generatorConfig.queueIfBusy
+
+	def queueEvent(self, event: Event, reason: Exception) -> bool:
+		"""
+		Queues an event which can not be processed now, queued events are processed when the running event ends.
+		Returns False if queueing is disabled by the event config.
+		"""
+		eventConfig = event.eventConfig
+		if not eventConfig.queueIfBusy:
+			return False
+		logger.notice("Event '%s' can not be processed now, queueing: %s", event, reason)
+		event_queue.put(
+			generator_id=self.getId(),
+			event_config_id=eventConfig.getId(),
+			event_info=event.eventInfo,
+			priority=eventConfig.queuePriority,
+			key=eventConfig.queueKey,
+		)
+		return True
+
+	def _cleanup(self) -> None:
+		try:
+			self.cleanup()
+		except Exception as err:
+			if not self._stopped:
+				logger.error("Failed to clean up: %s", err)
+
+	def start(self) -> None:
+		if not self.isScheduled():
+			self._thread = threading.Thread(target=self.run, daemon=True, name=self.name)
+			self._thread.start()
+			return
+
+		if self._generatorConfig.activationDelay > 0:
+			logger.debug("Waiting %d seconds before activation of event generator '%s'", self._generatorConfig.activationDelay, self)
+		self._scheduledJob = event_scheduler.schedule(
+			self._generatorConfig.activationDelay, self._activate, name=f"Activate event generator {self._generatorConfig.getId()}"
+		)
+
+	def join(self, timeout: float | None = None) -> None:
+		if self._thread:
+			self._thread.join(timeout)
+
+	def is_alive(self) -> bool:
+		if self._thread:
+			return self._thread.is_alive()
+		return not self._stopped and (self._activated or self._scheduledJob is not None)
+
+	def _deactivate(self) -> None:
+		self._scheduledJob = None
+		if self._activated:
+			self._activated = False
+			self._cleanup()
+
+	def _activate(self) -> None:
+		with opsicommon.logging.log_context({"instance": f"event generator {self._generatorConfig.getId()}"}):
+			if self._stopped:
+				return
+			try:
+				logger.info("Initializing event generator '%s'", self)
+				self.initialize()
+			except Exception as err:
+				logger.error("Failure in event generator '%s': %s", self, err, exc_info=True)
+				self._cleanup()
+				return
+			logger.info("Activating event generator '%s'", self)
+			self._activated = True
+			self._scheduledJob = None
+			self._scheduleNextEvent()
+
+	def _scheduleNextEvent(self) -> None:
+		if self._stopped:
+			return
+		if not self._repetitionsLeft():
+			logger.notice("Event generator '%s' now deactivated after %d event occurrences", self, self._eventsOccured)
+			self._deactivate()
+			return
+
+		if self._eventsOccured == 0 and self._generatorConfig.startInterval > 0:
+			delay = self._generatorConfig.startInterval
+		elif self._generatorConfig.interval > 0:
+			delay = self._generatorConfig.interval
+		else:
+			# Events are fired from outside only
+			logger.debug("No timed events for event generator '%s'", self)
+			return
+		logger.debug("Next event of event generator '%s' in %d seconds", self, delay)
+		self._scheduledJob = event_scheduler.schedule(delay, self._fireScheduledEvent, name=f"Event {self._generatorConfig.getId()}")
+
+	def _fireScheduledEvent(self) -> None:
+		with opsicommon.logging.log_context({"instance": f"event generator {self._generatorConfig.getId()}"}):
+			if self._stopped:
+				return
+			try:
+				self._fireNextEvent(self.createEvent())
+			except Exception as err:
+				if not self._stopped:
+					logger.error("Failure in event generator '%s': %s", self, err, exc_info=True)
+				self._deactivate()
+				return
+			self._scheduleNextEvent()
 
 	def run(self) -> None:
 		with opsicommon.logging.log_context({"instance": f"event generator {self._generatorConfig.getId()}"}):
@@ -196,42 +342,30 @@ class EventGenerator(threading.Thread):
 					logger.debug(
 						"Waiting %d seconds before activation of event generator '%s'", self._generatorConfig.activationDelay, self
 					)
-					time.sleep(self._generatorConfig.activationDelay)
+					self._stopEvent.wait(self._generatorConfig.activationDelay)
 
 				logger.info("Activating event generator '%s'", self)
-				while not self._stopped and (
-					(self._generatorConfig.maxRepetitions < 0) or (self._eventsOccured <= self._generatorConfig.maxRepetitions)
-				):
+				while not self._stopped and self._repetitionsLeft():
 					logger.info("Getting next event...")
-					event = self.getNextEvent()
-					self._eventsOccured += 1  # Count as occured, even if event is None!
-					if event:
-						logger.info("Got new event: %s (%d/%d)", event, self._eventsOccured, self._generatorConfig.maxRepetitions + 1)
-						try:
-							self.fireEvent(event)
-						except CannotCancelEventError as cce_error:
-							logger.warning("Event generator '%s' could not fire: %s", self, cce_error, exc_info=True)
-					for _unused in range(10):
-						if self._stopped:
-							break
-						time.sleep(1)
+					self._fireNextEvent(self.getNextEvent())
+					self._stopEvent.wait(10)
 				if not self._stopped:
 					logger.notice("Event generator '%s' now deactivated after %d event occurrences", self, self._eventsOccured)
 			except Exception as err:
 				if not self._stopped:
 					logger.error("Failure in event generator '%s': %s", self, err, exc_info=True)
-			try:
-				self.cleanup()
-			except Exception as err:
-				if not self._stopped:
-					logger.error("Failed to clean up: %s", err)
+			self._cleanup()
 
 			logger.info("Event generator '%s' exiting ", self)
 
 	def stop(self) -> None:
 		self._stopped = True
+		self._stopEvent.set()
 		if self._event:
 			self._event.set()
+		if self._scheduledJob:
+			event_scheduler.cancel(self._scheduledJob)
+		self._deactivate()
 
 
 class Event:
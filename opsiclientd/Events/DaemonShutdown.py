@@ -21,6 +21,7 @@ class DaemonShutdownEventConfig(EventConfig):
 	def setConfig(self, conf: dict[str, str]) -> None:
 		EventConfig.setConfig(self, conf)
 		self.maxRepetitions = 0
+		self.queueIfBusy = False
 
 
 class DaemonShutdownEventGenerator(EventGenerator):
@@ -23,6 +23,7 @@ class DaemonStartupEventConfig(EventConfig):
 	def setConfig(self, conf: dict[str, Any]) -> None:
 		EventConfig.setConfig(self, conf)
 		self.maxRepetitions = 0
+		self.queueIfBusy = False
 
 
 class DaemonStartupEventGenerator(EventGenerator):
@@ -35,6 +35,7 @@ class GUIStartupEventConfig(EventConfig):
 	def setConfig(self, conf: dict[str, Any]) -> None:
 		EventConfig.setConfig(self, conf)
 		self.maxRepetitions = 0
+		self.queueIfBusy = False
 
 
 class GUIStartupEventGenerator(EventGenerator):
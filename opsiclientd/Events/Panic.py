@@ -23,6 +23,7 @@ class PanicEventConfig(EventConfig):
 	def setConfig(self, conf: dict[str, Any]) -> None:
 		EventConfig.setConfig(self, conf)
 		self.maxRepetitions = -1
+		self.queueIfBusy = False
 		self.actionMessage = "Panic event"
 		self.activationDelay = 0
 		self.notificationDelay = 0
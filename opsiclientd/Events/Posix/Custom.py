@@ -8,16 +8,27 @@
 """
 Posix-specific custom event.
 
-This does not use WMI.
+This does not use WMI, custom events are triggered by the Linux event sources.
 """
 
 from opsicommon.logging import logger
 
+from opsiclientd.Events.Posix.Sources import SourceEventConfig, SourceEventGenerator
+
 __all__ = ["CustomEvent", "CustomEventConfig", "CustomEventGenerator"]
 
 try:
-	from opsiclientd.nonfree.Events.Config import CustomEventConfig
-	from opsiclientd.nonfree.Events.Generator import CustomEvent, CustomEventGenerator
+	from opsiclientd.nonfree.Events.Config import CustomEventConfig as NonFreeCustomEventConfig
+	from opsiclientd.nonfree.Events.Generator import CustomEvent
+	from opsiclientd.nonfree.Events.Generator import CustomEventGenerator as NonFreeCustomEventGenerator
 except ImportError as error:
 	logger.critical("Unable to import from opsiclientd.nonfree, is this the full version?")
 	raise error
+
+
+class CustomEventConfig(SourceEventConfig, NonFreeCustomEventConfig):
+	pass
+
+
+class CustomEventGenerator(SourceEventGenerator, NonFreeCustomEventGenerator):
+	pass
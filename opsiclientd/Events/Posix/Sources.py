@@ -0,0 +1,624 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Linux event sources which trigger custom events.
+
+Sources are configured in the event sections:
+`watch_paths` / `watch_events` (inotify), `session_events` (logind)
+and `network_events` / `network_interfaces` (netlink).
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import selectors
+import socket
+import struct
+import time
+from typing import TYPE_CHECKING, Any
+
+from opsicommon.logging import logger
+
+from opsiclientd.EventConfiguration import EventConfig
+from opsiclientd.Events.Basic import Event, EventGenerator
+
+if TYPE_CHECKING:
+	from opsiclientd.Opsiclientd import Opsiclientd
+
+__all__ = [
+	"EVENT_SOURCES",
+	"EventSource",
+	"InotifySource",
+	"LogindSource",
+	"NetlinkSource",
+	"SourceEventConfig",
+	"SourceEventGenerator",
+]
+
+EventInfo = dict[str, str | list[str]]
+
+# Events occurring within this time in seconds after the first one are combined into one event
+COALESCE_TIME = 0.5
+# Maximum time in seconds to wait for sources before checking if the generator was stopped
+POLL_TIMEOUT = 1.0
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_READ_SIZE = 64 * 1024
+
+# Values of the option watch_events => inotify mask
+INOTIFY_EVENTS = {
+	"create": IN_CREATE,
+	"delete": IN_DELETE | IN_DELETE_SELF,
+	"modify": IN_MODIFY,
+	"close_write": IN_CLOSE_WRITE,
+	"move": IN_MOVED_FROM | IN_MOVED_TO | IN_MOVE_SELF,
+	"attrib": IN_ATTRIB,
+}
+DEFAULT_WATCH_EVENTS = ["create", "delete", "close_write", "move"]
+
+LOGIND_SESSIONS_DIR = "/run/systemd/sessions"
+SESSION_EVENTS = ("login", "logout")
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+IFF_RUNNING = 0x40
+IFLA_IFNAME = 3
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+NLMSGHDR = struct.Struct("IHHII")
+IFINFOMSG = struct.Struct("BxHiII")
+IFADDRMSG = struct.Struct("BBBBI")
+RTATTR = struct.Struct("HH")
+NETLINK_READ_SIZE = 64 * 1024
+NETWORK_EVENTS = ("link_up", "link_down", "address_added", "address_removed")
+
+
+def _align(length: int) -> int:
+	return (length + 3) & ~3
+
+
+def _parse_attributes(data: bytes, offset: int) -> dict[int, bytes]:
+	attributes: dict[int, bytes] = {}
+	while offset + RTATTR.size <= len(data):
+		length, attr_type = RTATTR.unpack_from(data, offset)
+		if length < RTATTR.size:
+			break
+		attributes[attr_type] = data[offset + RTATTR.size : offset + length]
+		offset += _align(length)
+	return attributes
+
+
+class EventSource:
+	"""
+	A source of events which can be waited for by a selector.
+	`read` is called when the file descriptor of the source is readable
+	and returns the event info of the occurred events.
+	"""
+
+	name = ""
+
+	@classmethod
+	def from_config(cls, eventConfig: SourceEventConfig) -> EventSource | None:
+		"""
+		Returns the source configured by the event config or None.
+		"""
+		raise NotImplementedError(f"{cls.__name__}: from_config() not implemented")
+
+	def open(self) -> None:
+		raise NotImplementedError(f"{self.__class__.__name__}: open() not implemented")
+
+	def fileno(self) -> int:
+		raise NotImplementedError(f"{self.__class__.__name__}: fileno() not implemented")
+
+	def read(self) -> list[EventInfo]:
+		raise NotImplementedError(f"{self.__class__.__name__}: read() not implemented")
+
+	def close(self) -> None:
+		pass
+
+	def __str__(self) -> str:
+		return f"<{self.__class__.__name__}>"
+
+
+class Inotify:
+	"""
+	Minimal inotify binding.
+	"""
+
+	_libc: Any = None
+
+	def __init__(self) -> None:
+		if not Inotify._libc:
+			libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+			if not hasattr(libc, "inotify_init1"):
+				raise OSError(errno.ENOSYS, "Inotify is not supported on this platform")
+			Inotify._libc = libc
+		self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self._fd < 0:
+			err = ctypes.get_errno()
+			raise OSError(err, f"Failed to initialize inotify: {os.strerror(err)}")
+		# Watch descriptor => path
+		self.watches: dict[int, str] = {}
+
+	def fileno(self) -> int:
+		return self._fd
+
+	def add_watch(self, path: str, mask: int) -> int:
+		wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), ctypes.c_uint32(mask))
+		if wd < 0:
+			err = ctypes.get_errno()
+			raise OSError(err, f"Failed to watch {path!r}: {os.strerror(err)}", path)
+		self.watches[wd] = path
+		return wd
+
+	def read(self) -> list[tuple[str, int, str]]:
+		"""
+		Returns the available events as (watched path, mask, name).
+		"""
+		try:
+			data = os.read(self._fd, INOTIFY_READ_SIZE)
+		except BlockingIOError:
+			return []
+		events = []
+		offset = 0
+		while offset + INOTIFY_EVENT.size <= len(data):
+			wd, mask, _cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+			offset += INOTIFY_EVENT.size
+			name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+			offset += length
+			if mask & IN_Q_OVERFLOW:
+				logger.warning("Inotify event queue overflow, events lost")
+				continue
+			path = self.watches.get(wd)
+			if mask & IN_IGNORED:
+				self.watches.pop(wd, None)
+				continue
+			if path is not None:
+				events.append((path, mask, name))
+		return events
+
+	def close(self) -> None:
+		if self._fd >= 0:
+			os.close(self._fd)
+			self._fd = -1
+
+
+class InotifySource(EventSource):
+	"""
+	Changes of files and directories.
+	Directories are watched non-recursive, for their entries and themselves.
+	"""
+
+	name = "inotify"
+
+	def __init__(self, paths: list[str], events: list[str] | None = None) -> None:
+		self.paths = paths
+		self.events = events or DEFAULT_WATCH_EVENTS
+		self.mask = 0
+		for event in self.events:
+			if event not in INOTIFY_EVENTS:
+				raise ValueError(f"Invalid watch event {event!r}, valid events: {', '.join(INOTIFY_EVENTS)}")
+			self.mask |= INOTIFY_EVENTS[event]
+		self._inotify: Inotify | None = None
+
+	@classmethod
+	def from_config(cls, eventConfig: SourceEventConfig) -> InotifySource | None:
+		if not eventConfig.watchPaths:
+			return None
+		return cls(eventConfig.watchPaths, eventConfig.watchEvents)
+
+	def open(self) -> None:
+		self._inotify = Inotify()
+		for path in self.paths:
+			try:
+				self._inotify.add_watch(path, self.mask)
+				logger.info("Watching %r for %s", path, ", ".join(self.events))
+			except OSError as err:
+				# Paths may be created later, but are not watched then
+				logger.warning(err)
+		if not self._inotify.watches:
+			self.close()
+			raise OSError(errno.ENOENT, f"None of the paths {self.paths} can be watched")
+
+	def fileno(self) -> int:
+		assert self._inotify
+		return self._inotify.fileno()
+
+	def read(self) -> list[EventInfo]:
+		assert self._inotify
+		infos: list[EventInfo] = []
+		for watch_path, mask, name in self._inotify.read():
+			events = [event for event, event_mask in INOTIFY_EVENTS.items() if event in self.events and mask & event_mask]
+			if not events:
+				continue
+			infos.append(
+				{
+					"source": self.name,
+					"watch_path": watch_path,
+					"path": os.path.join(watch_path, name) if name else watch_path,
+					"name": name,
+					"events": events,
+					"is_dir": str(bool(mask & IN_ISDIR)).lower(),
+				}
+			)
+		return infos
+
+	def close(self) -> None:
+		if self._inotify:
+			self._inotify.close()
+			self._inotify = None
+
+	def __str__(self) -> str:
+		return f"<{self.__class__.__name__} {self.paths}>"
+
+
+class LogindSource(EventSource):
+	"""
+	Start and end of user sessions.
+	systemd-logind keeps one state file per session in its runtime directory,
+	so session changes are watched through inotify without a D-Bus binding.
+	"""
+
+	name = "logind"
+
+	def __init__(self, events: list[str], sessions_dir: str = LOGIND_SESSIONS_DIR) -> None:
+		for event in events:
+			if event not in SESSION_EVENTS:
+				raise ValueError(f"Invalid session event {event!r}, valid events: {', '.join(SESSION_EVENTS)}")
+		self.events = events
+		self.sessions_dir = sessions_dir
+		# Session id => session info
+		self._sessions: dict[str, EventInfo] = {}
+		self._inotify: Inotify | None = None
+
+	@classmethod
+	def from_config(cls, eventConfig: SourceEventConfig) -> LogindSource | None:
+		if not eventConfig.sessionEvents:
+			return None
+		return cls(eventConfig.sessionEvents)
+
+	@staticmethod
+	def _is_session_file(name: str) -> bool:
+		# Skips temporary files (".#<name>...") and references ("<id>.ref")
+		return bool(name) and not name.startswith(".") and "." not in name
+
+	def _read_session(self, session_id: str) -> EventInfo | None:
+		try:
+			with open(os.path.join(self.sessions_dir, session_id), encoding="utf-8") as file:
+				lines = file.read().splitlines()
+		except OSError as err:
+			logger.debug("Failed to read session %r: %s", session_id, err)
+			return None
+		info: EventInfo = {"session_id": session_id}
+		for line in lines:
+			if "=" in line and not line.startswith("#"):
+				key, value = line.split("=", 1)
+				info[key.strip().lower()] = value.strip()
+		return info
+
+	def open(self) -> None:
+		self._inotify = Inotify()
+		try:
+			self._inotify.add_watch(self.sessions_dir, IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM)
+		except OSError:
+			self.close()
+			raise
+		for name in os.listdir(self.sessions_dir):
+			if self._is_session_file(name) and (info := self._read_session(name)):
+				self._sessions[name] = info
+		logger.info("Watching logind sessions for %s, %d sessions", ", ".join(self.events), len(self._sessions))
+
+	def fileno(self) -> int:
+		assert self._inotify
+		return self._inotify.fileno()
+
+	def read(self) -> list[EventInfo]:
+		assert self._inotify
+		infos: list[EventInfo] = []
+		for _watch_path, mask, name in self._inotify.read():
+			if not self._is_session_file(name):
+				continue
+			if mask & (IN_CREATE | IN_MOVED_TO):
+				# logind replaces the file on every state change of the session
+				info = self._read_session(name)
+				if not info:
+					continue
+				known = name in self._sessions
+				self._sessions[name] = info
+				if known or "login" not in self.events:
+					continue
+				infos.append({"source": self.name, "event": "login"} | info)
+			elif mask & (IN_DELETE | IN_MOVED_FROM):
+				info = self._sessions.pop(name, None)
+				if info is None or "logout" not in self.events:
+					continue
+				infos.append({"source": self.name, "event": "logout"} | info)
+		return infos
+
+	def close(self) -> None:
+		if self._inotify:
+			self._inotify.close()
+			self._inotify = None
+
+
+class NetlinkSource(EventSource):
+	"""
+	Network link state and address changes from the rtnetlink multicast groups.
+	"""
+
+	name = "netlink"
+
+	def __init__(self, events: list[str], interfaces: list[str] | None = None) -> None:
+		for event in events:
+			if event not in NETWORK_EVENTS:
+				raise ValueError(f"Invalid network event {event!r}, valid events: {', '.join(NETWORK_EVENTS)}")
+		self.events = events
+		self.interfaces = interfaces or []
+		self._socket: socket.socket | None = None
+		self._dump_seq = 0
+		# Interface index => (name, running)
+		self._links: dict[int, tuple[str, bool]] = {}
+
+	@classmethod
+	def from_config(cls, eventConfig: SourceEventConfig) -> NetlinkSource | None:
+		if not eventConfig.networkEvents:
+			return None
+		return cls(eventConfig.networkEvents, eventConfig.networkInterfaces)
+
+	def open(self) -> None:
+		groups = 0
+		if {"link_up", "link_down"} & set(self.events):
+			groups |= RTMGRP_LINK
+		if {"address_added", "address_removed"} & set(self.events):
+			groups |= RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR
+		if not hasattr(socket, "AF_NETLINK"):
+			raise OSError(errno.EAFNOSUPPORT, "Netlink is not supported on this platform")
+		self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)  # type: ignore[attr-defined]
+		try:
+			self._socket.bind((0, groups))
+			# The current link states are requested, changes are reported relative to them
+			self._dump_seq = int(time.time())
+			request = IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+			header = NLMSGHDR.pack(NLMSGHDR.size + len(request), RTM_GETLINK, NLM_F_REQUEST | NLM_F_DUMP, self._dump_seq, 0)
+			self._socket.send(header + request)
+			self._socket.setblocking(False)
+		except OSError:
+			self.close()
+			raise
+		logger.info("Watching network for %s", ", ".join(self.events))
+
+	def fileno(self) -> int:
+		assert self._socket
+		return self._socket.fileno()
+
+	def read(self) -> list[EventInfo]:
+		assert self._socket
+		infos: list[EventInfo] = []
+		while True:
+			try:
+				data = self._socket.recv(NETLINK_READ_SIZE)
+			except BlockingIOError:
+				break
+			if not data:
+				break
+			infos.extend(self.parse(data))
+		return infos
+
+	def _interface_name(self, index: int) -> str:
+		if index in self._links:
+			return self._links[index][0]
+		try:
+			return socket.if_indextoname(index)
+		except OSError:
+			return str(index)
+
+	def parse(self, data: bytes) -> list[EventInfo]:
+		infos: list[EventInfo] = []
+		offset = 0
+		while offset + NLMSGHDR.size <= len(data):
+			length, msg_type, _flags, seq, _pid = NLMSGHDR.unpack_from(data, offset)
+			if length < NLMSGHDR.size:
+				break
+			message = data[offset + NLMSGHDR.size : offset + length]
+			offset += _align(length)
+			if msg_type == NLMSG_DONE:
+				continue
+			if msg_type in (RTM_NEWLINK, RTM_DELLINK) and len(message) >= IFINFOMSG.size:
+				info = self._parse_link(msg_type, message, dump=seq == self._dump_seq and seq != 0)
+			elif msg_type in (RTM_NEWADDR, RTM_DELADDR) and len(message) >= IFADDRMSG.size:
+				info = self._parse_address(msg_type, message)
+			else:
+				info = None
+			if info and info["event"] in self.events and (not self.interfaces or info["interface"] in self.interfaces):
+				infos.append(info)
+		return infos
+
+	def _parse_link(self, msg_type: int, message: bytes, dump: bool = False) -> EventInfo | None:
+		_family, _type, index, flags, _change = IFINFOMSG.unpack_from(message)
+		attributes = _parse_attributes(message, IFINFOMSG.size)
+		name = attributes[IFLA_IFNAME].rstrip(b"\0").decode() if IFLA_IFNAME in attributes else self._interface_name(index)
+		running = msg_type == RTM_NEWLINK and bool(flags & IFF_RUNNING)
+		previous = self._links.get(index)
+		if msg_type == RTM_DELLINK:
+			self._links.pop(index, None)
+		else:
+			self._links[index] = (name, running)
+		if dump or running == (previous[1] if previous else False):
+			return None
+		return {"source": self.name, "event": "link_up" if running else "link_down", "interface": name, "index": str(index)}
+
+	def _parse_address(self, msg_type: int, message: bytes) -> EventInfo | None:
+		family, prefix_length, _flags, _scope, index = IFADDRMSG.unpack_from(message)
+		attributes = _parse_attributes(message, IFADDRMSG.size)
+		# IFA_LOCAL is the address of the interface for point-to-point links
+		address = attributes.get(IFA_LOCAL) or attributes.get(IFA_ADDRESS)
+		if not address or family not in (socket.AF_INET, socket.AF_INET6):
+			return None
+		return {
+			"source": self.name,
+			"event": "address_added" if msg_type == RTM_NEWADDR else "address_removed",
+			"interface": self._interface_name(index),
+			"index": str(index),
+			"family": "ipv4" if family == socket.AF_INET else "ipv6",
+			"address": socket.inet_ntop(family, address),
+			"prefix_length": str(prefix_length),
+		}
+
+	def close(self) -> None:
+		if self._socket:
+			self._socket.close()
+			self._socket = None
+
+
+EVENT_SOURCES: list[type[EventSource]] = [InotifySource, LogindSource, NetlinkSource]
+
+
+def merge_event_info(infos: list[EventInfo]) -> EventInfo:
+	"""
+	Combines the info of several events, values differing between the events become lists.
+	"""
+	merged: dict[str, list[str]] = {}
+	for info in infos:
+		for key, value in info.items():
+			values = merged.setdefault(key, [])
+			for val in value if isinstance(value, list) else [value]:
+				if val not in values:
+					values.append(val)
+	return {
+		key: values[0] if len(values) == 1 and not any(isinstance(info.get(key), list) for info in infos) else values
+		for key, values in merged.items()
+	}
+
+
+class SourceEventConfig(EventConfig):
+	def setConfig(self, conf: dict[str, Any]) -> None:
+		EventConfig.setConfig(self, conf)
+		self.watchPaths = [str(path) for path in conf.get("watchPaths", [])]
+		self.watchEvents = [str(event).lower() for event in conf.get("watchEvents", [])] or list(DEFAULT_WATCH_EVENTS)
+		self.sessionEvents = [str(event).lower() for event in conf.get("sessionEvents", [])]
+		self.networkEvents = [str(event).lower() for event in conf.get("networkEvents", [])]
+		self.networkInterfaces = [str(interface) for interface in conf.get("networkInterfaces", [])]
+
+	def hasEventSources(self) -> bool:
+		return bool(self.watchPaths or self.sessionEvents or self.networkEvents)
+
+
+class SourceEventGenerator(EventGenerator):
+	"""
+	Fires an event when one of the configured sources reports changes.
+	Without sources the generator is timed by the event scheduler,
+	with sources `start_interval` and `interval` fire additional events if no changes occur.
+	"""
+
+	_generatorConfig: SourceEventConfig
+
+	def __init__(self, opsiclientd: Opsiclientd, generatorConfig: SourceEventConfig) -> None:
+		EventGenerator.__init__(self, opsiclientd, generatorConfig)
+		self._sources: list[EventSource] = []
+		self._selector: selectors.BaseSelector | None = None
+
+	def isScheduled(self) -> bool:
+		return not self._generatorConfig.hasEventSources()
+
+	def initialize(self) -> None:
+		if self._opsiclientd.is_stopping() or not self._generatorConfig.hasEventSources():
+			return
+
+		self._selector = selectors.DefaultSelector()
+		for source_class in EVENT_SOURCES:
+			try:
+				source = source_class.from_config(self._generatorConfig)
+				if not source:
+					continue
+				source.open()
+			except (OSError, ValueError) as err:
+				logger.error("Failed to open %s event source: %s", source_class.name, err)
+				continue
+			self._selector.register(source, selectors.EVENT_READ)
+			self._sources.append(source)
+		logger.debug("Initialized event sources: %s", ", ".join(str(source) for source in self._sources))
+
+	def _read_sources(self, timeout: float) -> list[EventInfo]:
+		if not self._selector or not self._sources:
+			self._stopEvent.wait(timeout)
+			return []
+		infos: list[EventInfo] = []
+		for key, _mask in self._selector.select(timeout):
+			source: EventSource = key.fileobj  # type: ignore[assignment]
+			try:
+				infos.extend(source.read())
+			except OSError as err:
+				logger.error("Failed to read from event source %s: %s", source, err)
+		return infos
+
+	def getNextEvent(self) -> Event | None:
+		interval = self._generatorConfig.interval
+		if self._eventsOccured == 0 and self._generatorConfig.startInterval > 0:
+			interval = self._generatorConfig.startInterval
+		deadline = time.monotonic() + interval if interval > 0 else None
+
+		infos: list[EventInfo] = []
+		coalesce_end = 0.0
+		while not self._stopped and not self._opsiclientd.is_stopping():
+			now = time.monotonic()
+			if infos and now >= coalesce_end:
+				break
+			if not infos and deadline and now >= deadline:
+				logger.debug("No changes within interval of %d seconds", interval)
+				return self.createEvent()
+			timeout = POLL_TIMEOUT
+			if infos:
+				timeout = min(timeout, coalesce_end - now)
+			elif deadline:
+				timeout = min(timeout, deadline - now)
+			new_infos = self._read_sources(timeout)
+			if new_infos and not infos:
+				coalesce_end = time.monotonic() + COALESCE_TIME
+			infos.extend(new_infos)
+
+		if not infos or self._stopped:
+			return None
+		return self.createEvent(merge_event_info(infos))
+
+	def cleanup(self) -> None:
+		if self._selector:
+			self._selector.close()
+			self._selector = None
+		for source in self._sources:
+			try:
+				source.close()
+			except OSError as err:
+				logger.debug("Failed to close event source %s: %s", source, err)
+		self._sources = []
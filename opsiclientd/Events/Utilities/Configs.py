@@ -9,9 +9,14 @@
 Event configuration utilities.
 """
 
-import copy as pycopy
+from __future__ import annotations
+
+import json
 import pprint
-from typing import Any
+from dataclasses import dataclass
+from hashlib import sha256
+from threading import Lock
+from typing import Any, Callable
 
 from opsicommon.logging import logger
 from opsicommon.types import forceBool, forceList, forceUnicodeLower
@@ -19,276 +24,327 @@ from opsicommon.types import forceBool, forceList, forceUnicodeLower
 from opsiclientd.Config import Config
 from opsiclientd.Localization import get_language
 
-__all__ = ["getEventConfigs"]
+__all__ = ["CompiledEventConfigs", "compileEventConfigs", "getEventConfigs"]
 
 config = Config()
 
 
-def getEventConfigs() -> dict[str, dict[str, Any]]:
-	preconditions: dict[str, dict[str, bool]] = {}
+def _to_list(value: Any) -> list[Any]:
+	if not isinstance(value, list):
+		value = [x.strip() for x in value.split(",") if x.strip()]
+	return forceList(value)
+
+
+def _to_command(value: Any) -> str:
+	return config.replace(forceUnicodeLower(value), escaped=True)
+
+
+def _identity(value: Any) -> Any:
+	return value
+
+
+# Event config option => (EventConfig attribute, converter)
+EVENT_CONFIG_OPTIONS: dict[str, tuple[str, Callable[[Any], Any]]] = {
+	"type": ("type", _identity),
+	"wql": ("wql", _identity),
+	"watch_paths": ("watchPaths", _to_list),
+	"watch_events": ("watchEvents", _to_list),
+	"session_events": ("sessionEvents", _to_list),
+	"network_events": ("networkEvents", _to_list),
+	"network_interfaces": ("networkInterfaces", _to_list),
+	"start_interval": ("startInterval", int),
+	"interval": ("interval", int),
+	"max_repetitions": ("maxRepetitions", int),
+	"activation_delay": ("activationDelay", int),
+	"notification_delay": ("notificationDelay", int),
+	"action_warning_time": ("actionWarningTime", int),
+	"action_user_cancelable": ("actionUserCancelable", int),
+	"shutdown": ("shutdown", forceBool),
+	"reboot": ("reboot", forceBool),
+	"shutdown_warning_time": ("shutdownWarningTime", int),
+	"shutdown_warning_repetition_time": ("shutdownWarningRepetitionTime", int),
+	"shutdown_user_cancelable": ("shutdownUserCancelable", int),
+	"shutdown_user_selectable_time": ("shutdownUserSelectableTime", forceBool),
+	"shutdown_latest_selectable_hour": ("shutdownLatestSelectableHour", int),
+	"shutdown_warning_time_after_time_select": ("shutdownWarningTimeAfterTimeSelect", int),
+	"block_login": ("blockLogin", forceBool),
+	"lock_workstation": ("lockWorkstation", forceBool),
+	"logoff_current_user": ("logoffCurrentUser", forceBool),
+	"process_shutdown_requests": ("processShutdownRequests", forceBool),
+	"get_config_from_service": ("getConfigFromService", forceBool),
+	"update_config_file": ("updateConfigFile", forceBool),
+	"write_log_to_service": ("writeLogToService", forceBool),
+	"cache_products": ("cacheProducts", forceBool),
+	"cache_max_bandwidth": ("cacheMaxBandwidth", int),
+	"cache_dynamic_bandwidth": ("cacheDynamicBandwidth", forceBool),
+	"use_cached_products": ("useCachedProducts", forceBool),
+	"sync_config_from_server": ("syncConfigFromServer", forceBool),
+	"sync_config_to_server": ("syncConfigToServer", forceBool),
+	"use_cached_config": ("useCachedConfig", forceBool),
+	"cache_service_reads": ("cacheServiceReads", forceBool),
+	"update_action_processor": ("updateActionProcessor", forceBool),
+	"action_type": ("actionType", forceUnicodeLower),
+	"event_notifier_command": ("eventNotifierCommand", _to_command),
+	"event_notifier_desktop": ("eventNotifierDesktop", forceUnicodeLower),
+	"process_actions": ("processActions", forceBool),
+	"action_notifier_command": ("actionNotifierCommand", _to_command),
+	"action_notifier_desktop": ("actionNotifierDesktop", forceUnicodeLower),
+	"action_processor_command": ("actionProcessorCommand", forceUnicodeLower),
+	"action_processor_desktop": ("actionProcessorDesktop", forceUnicodeLower),
+	"action_processor_timeout": ("actionProcessorTimeout", int),
+	"trusted_installer_detection": ("trustedInstallerDetection", forceBool),
+	"shutdown_notifier_command": ("shutdownNotifierCommand", _to_command),
+	"shutdown_notifier_desktop": ("shutdownNotifierDesktop", forceUnicodeLower),
+	"pre_action_processor_command": ("preActionProcessorCommand", _to_command),
+	"post_action_processor_command": ("postActionProcessorCommand", _to_command),
+	"post_event_command": ("postEventCommand", _to_command),
+	"action_processor_productids": ("actionProcessorProductIds", _to_list),
+	"depot_protocol": ("depotProtocol", forceUnicodeLower),
+	"exclude_product_group_ids": ("excludeProductGroupIds", _to_list),
+	"include_product_group_ids": ("includeProductGroupIds", _to_list),
+	"working_window": ("workingWindow", str),
+	"queue_if_busy": ("queueIfBusy", forceBool),
+	"queue_priority": ("queuePriority", int),
+	"queue_key": ("queueKey", str),
+}
+
+# Localized options "<option>[<language>]": (option prefix, EventConfig attribute, value without language overrides)
+LOCALIZED_EVENT_CONFIG_OPTIONS: tuple[tuple[str, str, bool], ...] = (
+	("action_message", "actionMessage", False),
+	("message", "actionMessage", False),
+	("shutdown_warning_message", "shutdownWarningMessage", False),
+	("name", "name", True),
+)
+
+# Empty values of these options do not overwrite the value inherited from the super event
+INHERIT_IF_EMPTY_OPTIONS = ("include_product_group_ids", "exclude_product_group_ids")
+
+
+@dataclass(frozen=True)
+class CompiledEventConfigs:
+	hash: str
+	configs: dict[str, dict[str, Any]]
+	fingerprints: dict[str, str]
+
+	def get_configs(self) -> dict[str, dict[str, Any]]:
+		"""
+		Returns copies of the compiled event configs which can be modified by the caller.
+		"""
+		return {
+			eventConfigId: {key: value.copy() if isinstance(value, (dict, list)) else value for key, value in eventConfig.items()}
+			for eventConfigId, eventConfig in self.configs.items()
+		}
+
+
+_compiled_event_configs: CompiledEventConfigs | None = None
+_compile_lock = Lock()
+
+
+def _read_raw_config() -> tuple[dict[str, dict[str, Any]], dict[str, dict[str, Any]], str]:
+	"""
+	Returns the raw precondition and event sections and a hash over everything the compiled event configs depend on.
+	"""
+	preconditions: dict[str, dict[str, Any]] = {}
+	events: dict[str, dict[str, Any]] = {}
+	placeholders: list[str] = []
 	for section, options in config.getDict().items():
 		section = section.lower()
 		if section.startswith("precondition_"):
-			preconditionId = section.split("_", 1)[1]
-			preconditions[preconditionId] = {}
-			try:
-				for key in options.keys():
-					if forceBool(options[key]):
-						# Only check if value in precondition is true
-						# false means: do not check state
-						preconditions[preconditionId][key] = True
-				logger.info("Precondition '%s' created: %s", preconditionId, preconditions[preconditionId])
-			except Exception as err:
-				logger.error("Failed to parse precondition '%s': %s", preconditionId, err)
+			preconditions[section.split("_", 1)[1]] = dict(options)
+		elif section.startswith("event_"):
+			events[section.split("_", 1)[1]] = dict(options)
+			# Commands contain placeholders which refer to options of other sections
+			placeholders.extend(
+				_to_command(value) for key, value in options.items() if EVENT_CONFIG_OPTIONS.get(key.lower(), ("", None))[1] is _to_command
+			)
+
+	data = json.dumps([list(preconditions.items()), list(events.items()), placeholders, get_language()], default=repr)
+	return preconditions, events, sha256(data.encode("utf-8")).hexdigest()
+
+
+def _parse_preconditions(raw_preconditions: dict[str, dict[str, Any]]) -> dict[str, dict[str, bool]]:
+	preconditions: dict[str, dict[str, bool]] = {}
+	for preconditionId, options in raw_preconditions.items():
+		preconditions[preconditionId] = {}
+		try:
+			for key in options.keys():
+				if forceBool(options[key]):
+					# Only check if value in precondition is true
+					# false means: do not check state
+					preconditions[preconditionId][key] = True
+			logger.info("Precondition '%s' created: %s", preconditionId, preconditions[preconditionId])
+		except Exception as err:
+			logger.error("Failed to parse precondition '%s': %s", preconditionId, err)
+	return preconditions
 
+
+def _parse_event_sections(raw_events: dict[str, dict[str, Any]]) -> dict[str, dict[str, Any]]:
 	rawEventConfigs: dict[str, dict[str, Any]] = {}
-	for section, options in config.getDict().items():
-		section = section.lower()
-		if section.startswith("event_"):
-			eventConfigId = section.split("_", 1)[1]
-			if not eventConfigId:
-				logger.error("No event config id defined in section '%s'", section)
-				continue
+	for eventConfigId, options in raw_events.items():
+		if not eventConfigId:
+			logger.error("No event config id defined in section 'event_'")
+			continue
 
-			rawEventConfigs[eventConfigId] = {
-				"active": True,
-				"args": {"name": eventConfigId.split("{")[0]},
-				"super": None,
-				"precondition": None,
-			}
+		rawEventConfigs[eventConfigId] = {
+			"active": True,
+			"args": {"name": eventConfigId.split("{")[0]},
+			"super": None,
+			"precondition": None,
+		}
 
-			try:
-				for key in options.keys():
-					if key.lower() == "active":
-						rawEventConfigs[eventConfigId]["active"] = str(options[key]).lower() not in ("0", "false", "off", "no")
-					elif key.lower() == "super":
-						rawEventConfigs[eventConfigId]["super"] = options[key]
-						if rawEventConfigs[eventConfigId]["super"].startswith("event_"):
-							rawEventConfigs[eventConfigId]["super"] = rawEventConfigs[eventConfigId]["super"].split("_", 1)[1]
-					else:
-						rawEventConfigs[eventConfigId]["args"][key.lower()] = options[key]
-
-				if "{" in eventConfigId:
-					superEventName, precondition_id = eventConfigId.split("{", 1)
-					if not rawEventConfigs[eventConfigId]["super"]:
-						rawEventConfigs[eventConfigId]["super"] = superEventName.strip()
-					rawEventConfigs[eventConfigId]["precondition"] = precondition_id.replace("}", "").strip()
-			except Exception as err:
-				logger.error("Failed to parse event config '%s': %s", eventConfigId, err)
-
-	# Process inheritance
-	newRawEventConfigs: dict[str, dict[str, Any]] = {}
-	while rawEventConfigs:
-		num_configs = len(rawEventConfigs)
-		for eventConfigId in sorted(list(rawEventConfigs)):
-			rawEventConfig = rawEventConfigs[eventConfigId]
-			if rawEventConfig["super"]:
-				if rawEventConfig["super"] in newRawEventConfigs:
-					super_args = pycopy.deepcopy(newRawEventConfigs[rawEventConfig["super"]]["args"])
-					# Do not overwrite values with emptystring or emptylist (behaves like no value given)
-					cleaned_args = {
-						key: value
-						for key, value in rawEventConfig["args"].items()
-						if not (key in ("include_product_group_ids", "exclude_product_group_ids") and value in ("", []))
-					}
-					super_args.update(cleaned_args)
-					rawEventConfig["args"] = super_args
-					logger.debug("Inheritance for event '%s' processed", eventConfigId)
-					newRawEventConfigs[eventConfigId] = rawEventConfig
-					rawEventConfigs.pop(eventConfigId)
-				elif rawEventConfig["super"] not in rawEventConfigs:
-					logger.error("Super event '%s' not found", rawEventConfig["super"])
-					rawEventConfigs.pop(eventConfigId)
+		try:
+			for key in options.keys():
+				if key.lower() == "active":
+					rawEventConfigs[eventConfigId]["active"] = str(options[key]).lower() not in ("0", "false", "off", "no")
+				elif key.lower() == "super":
+					rawEventConfigs[eventConfigId]["super"] = options[key]
+					if rawEventConfigs[eventConfigId]["super"].startswith("event_"):
+						rawEventConfigs[eventConfigId]["super"] = rawEventConfigs[eventConfigId]["super"].split("_", 1)[1]
+				else:
+					rawEventConfigs[eventConfigId]["args"][key.lower()] = options[key]
+
+			if "{" in eventConfigId:
+				superEventName, precondition_id = eventConfigId.split("{", 1)
+				if not rawEventConfigs[eventConfigId]["super"]:
+					rawEventConfigs[eventConfigId]["super"] = superEventName.strip()
+				rawEventConfigs[eventConfigId]["precondition"] = precondition_id.replace("}", "").strip()
+		except Exception as err:
+			logger.error("Failed to parse event config '%s': %s", eventConfigId, err)
+	return rawEventConfigs
+
+
+def _resolve_inheritance(rawEventConfigs: dict[str, dict[str, Any]]) -> dict[str, dict[str, Any]]:
+	"""
+	Resolves the super events in a single topological pass, every event is resolved once after its super event.
+	Events with missing super events or inheritance cycles are dropped.
+	"""
+	resolved: dict[str, dict[str, Any]] = {}
+	failed: set[str] = set()
+
+	def resolve(eventConfigId: str, resolving: tuple[str, ...]) -> dict[str, Any] | None:
+		if eventConfigId in resolved:
+			return resolved[eventConfigId]
+		if eventConfigId in failed:
+			return None
+
+		rawEventConfig = rawEventConfigs[eventConfigId]
+		superEventConfigId = rawEventConfig["super"]
+		if superEventConfigId:
+			superEventConfig = None
+			if superEventConfigId not in rawEventConfigs:
+				logger.error("Super event '%s' not found", superEventConfigId)
+			elif superEventConfigId in resolving or superEventConfigId == eventConfigId:
+				logger.error("Failed to process event inheritance: %s", " -> ".join(resolving + (eventConfigId, superEventConfigId)))
 			else:
-				logger.debug("Inheritance for event '%s' processed", eventConfigId)
-				newRawEventConfigs[eventConfigId] = rawEventConfig
-				rawEventConfigs.pop(eventConfigId)
-		if num_configs == len(rawEventConfigs):
-			logger.error("Failed to process event inheritance: %s", rawEventConfigs)
-			break
+				superEventConfig = resolve(superEventConfigId, resolving + (eventConfigId,))
+			if not superEventConfig:
+				failed.add(eventConfigId)
+				return None
 
-	rawEventConfigs = newRawEventConfigs
+			# Do not overwrite values with emptystring or emptylist (behaves like no value given)
+			args = dict(superEventConfig["args"])
+			args.update(
+				{key: value for key, value in rawEventConfig["args"].items() if not (key in INHERIT_IF_EMPTY_OPTIONS and value in ("", []))}
+			)
+			rawEventConfig = dict(rawEventConfig, args=args)
 
-	eventConfigs = {}
-	for eventConfigId, rawEventConfig in rawEventConfigs.items():
-		try:
-			if rawEventConfig["args"].get("type", "template").lower() == "template":
-				continue
+		logger.debug("Inheritance for event '%s' processed", eventConfigId)
+		resolved[eventConfigId] = rawEventConfig
+		return rawEventConfig
 
-			eventConfigs[eventConfigId] = {"active": rawEventConfig["active"], "preconditions": {}}
+	for eventConfigId in sorted(rawEventConfigs):
+		resolve(eventConfigId, ())
+	return resolved
 
-			if rawEventConfig.get("precondition"):
-				precondition = preconditions.get(rawEventConfig["precondition"])
-				if not precondition:
-					logger.error(
-						"Precondition '%s' referenced by event config '%s' not found, deactivating event", precondition, eventConfigId
-					)
-					eventConfigs[eventConfigId]["active"] = False
-				else:
-					eventConfigs[eventConfigId]["preconditions"] = precondition
 
-			for key, value in rawEventConfig["args"].items():
-				try:
-					if key == "type":
-						eventConfigs[eventConfigId]["type"] = value
-					elif key == "wql":
-						eventConfigs[eventConfigId]["wql"] = value
-					elif key.startswith(("action_message", "message")):
-						try:
-							mLanguage = key.split("[")[1].split("]")[0].strip().lower()
-						except Exception:
-							mLanguage = None
-
-						if mLanguage:
-							if mLanguage == get_language():
-								eventConfigs[eventConfigId]["actionMessage"] = value
-						elif not eventConfigs[eventConfigId].get("actionMessage"):
-							eventConfigs[eventConfigId]["actionMessage"] = value
-					elif key.startswith("shutdown_warning_message"):
-						try:
-							mLanguage = key.split("[")[1].split("]")[0].strip().lower()
-						except Exception:
-							mLanguage = None
-
-						if mLanguage:
-							if mLanguage == get_language():
-								eventConfigs[eventConfigId]["shutdownWarningMessage"] = value
-						elif not eventConfigs[eventConfigId].get("shutdownWarningMessage"):
-							eventConfigs[eventConfigId]["shutdownWarningMessage"] = value
-					elif key.startswith("name"):
-						try:
-							mLanguage = key.split("[")[1].split("]")[0].strip().lower()
-						except Exception:
-							mLanguage = None
-
-						if mLanguage:
-							if mLanguage == get_language():
-								eventConfigs[eventConfigId]["name"] = value
-						else:
-							eventConfigs[eventConfigId]["name"] = value
-					elif key == "start_interval":
-						eventConfigs[eventConfigId]["startInterval"] = int(value)
-					elif key == "interval":
-						eventConfigs[eventConfigId]["interval"] = int(value)
-					elif key == "max_repetitions":
-						eventConfigs[eventConfigId]["maxRepetitions"] = int(value)
-					elif key == "activation_delay":
-						eventConfigs[eventConfigId]["activationDelay"] = int(value)
-					elif key == "notification_delay":
-						eventConfigs[eventConfigId]["notificationDelay"] = int(value)
-					elif key == "action_warning_time":
-						eventConfigs[eventConfigId]["actionWarningTime"] = int(value)
-					elif key == "action_user_cancelable":
-						eventConfigs[eventConfigId]["actionUserCancelable"] = int(value)
-					elif key == "shutdown":
-						eventConfigs[eventConfigId]["shutdown"] = forceBool(value)
-					elif key == "reboot":
-						eventConfigs[eventConfigId]["reboot"] = forceBool(value)
-					elif key == "shutdown_warning_time":
-						eventConfigs[eventConfigId]["shutdownWarningTime"] = int(value)
-					elif key == "shutdown_warning_repetition_time":
-						eventConfigs[eventConfigId]["shutdownWarningRepetitionTime"] = int(value)
-					elif key == "shutdown_user_cancelable":
-						eventConfigs[eventConfigId]["shutdownUserCancelable"] = int(value)
-					elif key == "shutdown_user_selectable_time":
-						eventConfigs[eventConfigId]["shutdownUserSelectableTime"] = forceBool(value)
-					elif key == "shutdown_latest_selectable_hour":
-						eventConfigs[eventConfigId]["shutdownLatestSelectableHour"] = int(value)
-					elif key == "shutdown_warning_time_after_time_select":
-						eventConfigs[eventConfigId]["shutdownWarningTimeAfterTimeSelect"] = int(value)
-					elif key == "block_login":
-						eventConfigs[eventConfigId]["blockLogin"] = forceBool(value)
-					elif key == "lock_workstation":
-						eventConfigs[eventConfigId]["lockWorkstation"] = forceBool(value)
-					elif key == "logoff_current_user":
-						eventConfigs[eventConfigId]["logoffCurrentUser"] = forceBool(value)
-					elif key == "process_shutdown_requests":
-						eventConfigs[eventConfigId]["processShutdownRequests"] = forceBool(value)
-					elif key == "get_config_from_service":
-						eventConfigs[eventConfigId]["getConfigFromService"] = forceBool(value)
-					elif key == "update_config_file":
-						eventConfigs[eventConfigId]["updateConfigFile"] = forceBool(value)
-					elif key == "write_log_to_service":
-						eventConfigs[eventConfigId]["writeLogToService"] = forceBool(value)
-					elif key == "cache_products":
-						eventConfigs[eventConfigId]["cacheProducts"] = forceBool(value)
-					elif key == "cache_max_bandwidth":
-						eventConfigs[eventConfigId]["cacheMaxBandwidth"] = int(value)
-					elif key == "cache_dynamic_bandwidth":
-						eventConfigs[eventConfigId]["cacheDynamicBandwidth"] = forceBool(value)
-					elif key == "use_cached_products":
-						eventConfigs[eventConfigId]["useCachedProducts"] = forceBool(value)
-					elif key == "sync_config_from_server":
-						eventConfigs[eventConfigId]["syncConfigFromServer"] = forceBool(value)
-					elif key == "sync_config_to_server":
-						eventConfigs[eventConfigId]["syncConfigToServer"] = forceBool(value)
-					elif key == "use_cached_config":
-						eventConfigs[eventConfigId]["useCachedConfig"] = forceBool(value)
-					elif key == "update_action_processor":
-						eventConfigs[eventConfigId]["updateActionProcessor"] = forceBool(value)
-					elif key == "action_type":
-						eventConfigs[eventConfigId]["actionType"] = forceUnicodeLower(value)
-					elif key == "event_notifier_command":
-						eventConfigs[eventConfigId]["eventNotifierCommand"] = config.replace(forceUnicodeLower(value), escaped=True)
-					elif key == "event_notifier_desktop":
-						eventConfigs[eventConfigId]["eventNotifierDesktop"] = forceUnicodeLower(value)
-					elif key == "process_actions":
-						eventConfigs[eventConfigId]["processActions"] = forceBool(value)
-					elif key == "action_notifier_command":
-						eventConfigs[eventConfigId]["actionNotifierCommand"] = config.replace(forceUnicodeLower(value), escaped=True)
-					elif key == "action_notifier_desktop":
-						eventConfigs[eventConfigId]["actionNotifierDesktop"] = forceUnicodeLower(value)
-					elif key == "action_processor_command":
-						eventConfigs[eventConfigId]["actionProcessorCommand"] = forceUnicodeLower(value)
-					elif key == "action_processor_desktop":
-						eventConfigs[eventConfigId]["actionProcessorDesktop"] = forceUnicodeLower(value)
-					elif key == "action_processor_timeout":
-						eventConfigs[eventConfigId]["actionProcessorTimeout"] = int(value)
-					elif key == "trusted_installer_detection":
-						eventConfigs[eventConfigId]["trustedInstallerDetection"] = forceBool(value)
-					elif key == "shutdown_notifier_command":
-						eventConfigs[eventConfigId]["shutdownNotifierCommand"] = config.replace(forceUnicodeLower(value), escaped=True)
-					elif key == "shutdown_notifier_desktop":
-						eventConfigs[eventConfigId]["shutdownNotifierDesktop"] = forceUnicodeLower(value)
-					elif key == "pre_action_processor_command":
-						eventConfigs[eventConfigId]["preActionProcessorCommand"] = config.replace(forceUnicodeLower(value), escaped=True)
-					elif key == "post_action_processor_command":
-						eventConfigs[eventConfigId]["postActionProcessorCommand"] = config.replace(forceUnicodeLower(value), escaped=True)
-					elif key == "post_event_command":
-						eventConfigs[eventConfigId]["postEventCommand"] = config.replace(forceUnicodeLower(value), escaped=True)
-					elif key == "action_processor_productids":
-						if not isinstance(value, list):
-							value = [x.strip() for x in value.split(",") if x.strip()]
-						eventConfigs[eventConfigId]["actionProcessorProductIds"] = forceList(value)
-					elif key == "depot_protocol":
-						eventConfigs[eventConfigId]["depotProtocol"] = forceUnicodeLower(value)
-					elif key == "exclude_product_group_ids":
-						if not isinstance(value, list):
-							value = [x.strip() for x in value.split(",") if x.strip()]
-						eventConfigs[eventConfigId]["excludeProductGroupIds"] = forceList(value)
-					elif key == "include_product_group_ids":
-						if not isinstance(value, list):
-							value = [x.strip() for x in value.split(",") if x.strip()]
-						eventConfigs[eventConfigId]["includeProductGroupIds"] = forceList(value)
-					elif key == "working_window":
-						eventConfigs[eventConfigId]["workingWindow"] = str(value)
-					else:
-						logger.error("Skipping unknown option '%s' in definition of event '%s'", key, eventConfigId)
-						for section in list(config.getDict()):
-							if section.startswith("event_") and config.has_option(section, key):
-								logger.info("Removing config option %s.%s", section, key)
-								config.del_option(section, key)
-
-				except Exception as err:
-					logger.debug(err, exc_info=True)
-					logger.error("Failed to set event config argument '%s' to '%s': %s", key, value, err)
-
-			logger.info(
-				"Event config '%s' args:\n%s",
+def _compile_event_config(eventConfigId: str, rawEventConfig: dict[str, Any], preconditions: dict[str, dict[str, bool]]) -> dict[str, Any]:
+	eventConfig: dict[str, Any] = {"active": rawEventConfig["active"], "preconditions": {}}
+
+	if rawEventConfig.get("precondition"):
+		precondition = preconditions.get(rawEventConfig["precondition"])
+		if not precondition:
+			logger.error(
+				"Precondition '%s' referenced by event config '%s' not found, deactivating event",
+				rawEventConfig["precondition"],
 				eventConfigId,
-				pprint.pformat(eventConfigs[eventConfigId], indent=4, width=300, compact=False),
 			)
+			eventConfig["active"] = False
+		else:
+			eventConfig["preconditions"] = precondition
+
+	language = get_language()
+	for key, value in rawEventConfig["args"].items():
+		try:
+			option = EVENT_CONFIG_OPTIONS.get(key)
+			if option:
+				attribute, converter = option
+				eventConfig[attribute] = converter(value)
+				continue
+
+			for prefix, attribute, overrides in LOCALIZED_EVENT_CONFIG_OPTIONS:
+				if not key.startswith(prefix):
+					continue
+				try:
+					mLanguage = key.split("[")[1].split("]")[0].strip().lower()
+				except Exception:
+					mLanguage = None
+
+				if mLanguage:
+					if mLanguage == language:
+						eventConfig[attribute] = value
+				elif overrides or not eventConfig.get(attribute):
+					eventConfig[attribute] = value
+				break
+			else:
+				logger.error("Skipping unknown option '%s' in definition of event '%s'", key, eventConfigId)
+				for section in list(config.getDict()):
+					if section.startswith("event_") and config.has_option(section, key):
+						logger.info("Removing config option %s.%s", section, key)
+						config.del_option(section, key)
 		except Exception as err:
-			logger.error(err, exc_info=True)
+			logger.debug(err, exc_info=True)
+			logger.error("Failed to set event config argument '%s' to '%s': %s", key, value, err)
+
+	return eventConfig
+
+
+def compileEventConfigs() -> CompiledEventConfigs:
+	"""
+	Compiles the event configs from the event and precondition sections of the config.
+	The result is cached and only recompiled if the content hash of the config changed.
+	The returned configs are shared and must not be modified, use `CompiledEventConfigs.get_configs` to get copies.
+	"""
+	global _compiled_event_configs
+	with _compile_lock:
+		raw_preconditions, raw_events, config_hash = _read_raw_config()
+		if _compiled_event_configs and _compiled_event_configs.hash == config_hash:
+			return _compiled_event_configs
 
-	return eventConfigs
+		preconditions = _parse_preconditions(raw_preconditions)
+		rawEventConfigs = _resolve_inheritance(_parse_event_sections(raw_events))
+
+		eventConfigs: dict[str, dict[str, Any]] = {}
+		fingerprints: dict[str, str] = {}
+		for eventConfigId, rawEventConfig in rawEventConfigs.items():
+			try:
+				if rawEventConfig["args"].get("type", "template").lower() == "template":
+					continue
+
+				eventConfigs[eventConfigId] = _compile_event_config(eventConfigId, rawEventConfig, preconditions)
+				fingerprints[eventConfigId] = sha256(
+					json.dumps(eventConfigs[eventConfigId], sort_keys=True, default=repr).encode("utf-8")
+				).hexdigest()
+				logger.info(
+					"Event config '%s' args:\n%s",
+					eventConfigId,
+					pprint.pformat(eventConfigs[eventConfigId], indent=4, width=300, compact=False),
+				)
+			except Exception as err:
+				logger.error(err, exc_info=True)
+
+		_compiled_event_configs = CompiledEventConfigs(hash=config_hash, configs=eventConfigs, fingerprints=fingerprints)
+		return _compiled_event_configs
+
+
+def getEventConfigs() -> dict[str, dict[str, Any]]:
+	return compileEventConfigs().get_configs()
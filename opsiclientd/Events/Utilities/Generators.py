@@ -11,16 +11,16 @@ Functions to create, reconfigure and get event generators.
 
 from __future__ import annotations
 
-import copy
-from typing import TYPE_CHECKING, Type
+from typing import TYPE_CHECKING, Any, Type
 
 from opsicommon.logging import get_logger
 from opsicommon.types import forceUnicode
 
 from opsiclientd.Config import Config
+from opsiclientd.EventConfiguration import EventConfig
 from opsiclientd.Events.Basic import EventGenerator
 from opsiclientd.Events.Panic import PanicEventConfig
-from opsiclientd.Events.Utilities.Configs import getEventConfigs
+from opsiclientd.Events.Utilities.Configs import compileEventConfigs
 from opsiclientd.Events.Utilities.Factories import (
 	EventConfigFactory,
 	EventGeneratorFactory,
@@ -38,20 +38,29 @@ __all__ = [
 
 EVENT_CONFIG_TYPE_PANIC = "panic"
 _EVENT_GENERATORS: dict[str, EventGenerator] = {}
+# Hash of the event configuration and fingerprints of the event configs the generators are configured with
+_EVENT_CONFIGS_HASH: str | None = None
+_EVENT_CONFIG_FINGERPRINTS: dict[str, str] = {}
 
 logger = get_logger()
 config = Config()
 
 
+def _createEventConfig(eventConfigId: str, eventConfig: dict[str, Any]) -> EventConfig:
+	# EventConfig copies mutable arguments, the compiled event config is not modified
+	return EventConfigFactory(eventConfig["type"], eventConfigId, **{key: value for key, value in eventConfig.items() if key != "type"})
+
+
 def createEventGenerators(opsiclientd: Opsiclientd) -> None:
+	global _EVENT_CONFIGS_HASH, _EVENT_CONFIG_FINGERPRINTS
 	enabled_events = {}
 	panicEventConfig = PanicEventConfig(EVENT_CONFIG_TYPE_PANIC, actionProcessorCommand=config.get("action_processor", "command", raw=True))
 	_EVENT_GENERATORS[EVENT_CONFIG_TYPE_PANIC] = EventGeneratorFactory(opsiclientd, panicEventConfig)
 	enabled_events[EVENT_CONFIG_TYPE_PANIC] = True
 
-	event_configs = getEventConfigs()
+	compiled = compileEventConfigs()
 	# Create event generators for events without preconditions
-	for eventConfigId, eventConfig in copy.deepcopy(event_configs).items():
+	for eventConfigId, eventConfig in compiled.configs.items():
 		mainEventConfigId = eventConfigId.split("{")[0]
 		if mainEventConfigId != eventConfigId:
 			continue
@@ -66,9 +75,7 @@ def createEventGenerators(opsiclientd: Opsiclientd) -> None:
 			continue
 
 		try:
-			eventType = eventConfig["type"]
-			del eventConfig["type"]
-			ec = EventConfigFactory(eventType, eventConfigId, **eventConfig)
+			ec = _createEventConfig(eventConfigId, eventConfig)
 			_EVENT_GENERATORS[eventConfigId] = EventGeneratorFactory(opsiclientd, ec)
 			logger.info("Event generator '%s' created", eventConfigId)
 			enabled_events[eventConfigId] = True
@@ -76,7 +83,7 @@ def createEventGenerators(opsiclientd: Opsiclientd) -> None:
 			logger.error("Failed to create event generator '%s': %s", mainEventConfigId, err)
 
 	# Create event generators for events with preconditions
-	for eventConfigId, eventConfig in copy.deepcopy(event_configs).items():
+	for eventConfigId, eventConfig in compiled.configs.items():
 		mainEventConfigId = eventConfigId.split("{")[0]
 		if mainEventConfigId not in enabled_events:
 			enabled_events[mainEventConfigId] = False
@@ -91,9 +98,7 @@ def createEventGenerators(opsiclientd: Opsiclientd) -> None:
 			logger.info("Event '%s' of type '%s' is disabled (precondition)", eventConfigId, eventConfig["type"])
 			continue
 
-		eventType = eventConfig["type"]
-		del eventConfig["type"]
-		ec = EventConfigFactory(eventType, eventConfigId, **eventConfig)
+		ec = _createEventConfig(eventConfigId, eventConfig)
 		if mainEventConfigId not in _EVENT_GENERATORS:
 			try:
 				_EVENT_GENERATORS[mainEventConfigId] = EventGeneratorFactory(opsiclientd, ec)
@@ -108,6 +113,8 @@ def createEventGenerators(opsiclientd: Opsiclientd) -> None:
 		except Exception as err:
 			logger.error("Failed to add event config '%s' to event generator '%s': %s", eventConfigId, mainEventConfigId, err)
 
+	_EVENT_CONFIGS_HASH = compiled.hash
+	_EVENT_CONFIG_FINGERPRINTS = dict(compiled.fingerprints)
 	logger.notice("Configured events: %s", ", ".join(sorted(list(enabled_events))))
 	logger.notice("Enabled events: %s", ", ".join(sorted([evt_id for evt_id in enabled_events if enabled_events[evt_id]])))
 
@@ -136,24 +143,37 @@ def getEventGenerator(name: str) -> EventGenerator:
 
 
 def reconfigureEventGenerators() -> None:
-	eventConfigs = getEventConfigs()
-	for eventGenerator in _EVENT_GENERATORS.values():
-		eventGenerator.setEventConfigs([])
-
-	for eventConfigId, eventConfig in eventConfigs.items():
-		mainEventConfigId = eventConfigId.split("{")[0]
-
+	"""
+	Reconfigures the event generators whose event configs changed since the last (re)configuration.
+	"""
+	global _EVENT_CONFIGS_HASH, _EVENT_CONFIG_FINGERPRINTS
+	compiled = compileEventConfigs()
+	if compiled.hash == _EVENT_CONFIGS_HASH:
+		logger.info("Event configuration unchanged, event generators not reconfigured")
+		return
+
+	changedEventConfigIds = {
+		eventConfigId
+		for eventConfigId in set(_EVENT_CONFIG_FINGERPRINTS) | set(compiled.fingerprints)
+		if _EVENT_CONFIG_FINGERPRINTS.get(eventConfigId) != compiled.fingerprints.get(eventConfigId)
+	}
+	for mainEventConfigId in sorted({eventConfigId.split("{")[0] for eventConfigId in changedEventConfigIds}):
 		try:
 			eventGenerator = _EVENT_GENERATORS[mainEventConfigId]
 		except KeyError:
-			logger.info("Cannot reconfigure event generator for event '%s': not found", eventConfigId)
+			logger.info("Cannot reconfigure event generator for event '%s': not found", mainEventConfigId)
 			continue
 
-		try:
-			eventType = eventConfig["type"]
-			del eventConfig["type"]
-			ec = EventConfigFactory(eventType, eventConfigId, **eventConfig)
-			eventGenerator.addEventConfig(ec)
-			logger.notice("Event config '%s' added to event generator '%s'", eventConfigId, mainEventConfigId)
-		except Exception as err:
-			logger.error("Failed to reconfigure event generator '%s': %s", mainEventConfigId, err)
+		eventConfigs = []
+		for eventConfigId, eventConfig in compiled.configs.items():
+			if eventConfigId.split("{")[0] != mainEventConfigId:
+				continue
+			try:
+				eventConfigs.append(_createEventConfig(eventConfigId, eventConfig))
+				logger.notice("Event config '%s' added to event generator '%s'", eventConfigId, mainEventConfigId)
+			except Exception as err:
+				logger.error("Failed to reconfigure event generator '%s': %s", mainEventConfigId, err)
+		eventGenerator.setEventConfigs(eventConfigs)
+
+	_EVENT_CONFIGS_HASH = compiled.hash
+	_EVENT_CONFIG_FINGERPRINTS = dict(compiled.fingerprints)
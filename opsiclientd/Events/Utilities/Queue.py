@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Persistent queue of events which could not be processed when they occurred.
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Collection
+
+from opsicommon.logging import get_logger
+
+__all__ = ["EventQueue", "QueuedEvent", "event_queue"]
+
+logger = get_logger()
+
+QUEUE_VERSION = 1
+
+
+@dataclass
+class QueuedEvent:
+	# Events with the same key are coalesced into one queued event
+	key: str
+	generator_id: str
+	event_config_id: str
+	event_info: dict[str, Any] = field(default_factory=dict)
+	# Events with a higher priority are processed first
+	priority: int = 0
+	# Unix timestamp of the first and the last occurrence
+	enqueued: float = field(default_factory=time.time)
+	updated: float = field(default_factory=time.time)
+	occurrences: int = 1
+	sequence: int = 0
+
+	@property
+	def wait_time(self) -> float:
+		return max(time.time() - self.enqueued, 0.0)
+
+	def to_dict(self) -> dict[str, Any]:
+		return asdict(self) | {"wait_time": self.wait_time}
+
+
+class EventQueue:
+	"""
+	Events are queued by key, an event with the key of an already queued event is coalesced with it:
+	the occurrences are counted, the event info of the latest occurrence and the highest priority are kept.
+	The queue is processed by priority, events of the same priority in the order they were queued.
+	"""
+
+	def __init__(self, path: str | Path | None = None) -> None:
+		self.path = Path(path) if path else None
+		self._events: dict[str, QueuedEvent] = {}
+		self._sequence = itertools.count()
+		self._lock = threading.Lock()
+		self._dispatched = 0
+		self._dropped = 0
+		self._total_wait_time = 0.0
+		self._max_wait_time = 0.0
+
+	def __len__(self) -> int:
+		return len(self._events)
+
+	def load(self, path: str | Path, ignore_generator_ids: Collection[str] = ()) -> None:
+		"""
+		Sets the file the queue is stored in and restores the events queued in it.
+		Events of the generators in `ignore_generator_ids` are not restored.
+		"""
+		with self._lock:
+			self.path = Path(path)
+			queued_before_load = bool(self._events)
+			ignored = 0
+			try:
+				data = json.loads(self.path.read_text(encoding="utf-8"))
+				if data.get("version") == QUEUE_VERSION:
+					for values in sorted(data["events"], key=lambda values: values.get("sequence", 0)):
+						queued_event = QueuedEvent(**values)
+						if queued_event.generator_id in ignore_generator_ids:
+							logger.notice(
+								"Not restoring queued event %r of event generator %r", queued_event.key, queued_event.generator_id
+							)
+							ignored += 1
+							continue
+						queued_event.sequence = next(self._sequence)
+						self._add(queued_event)
+			except FileNotFoundError:
+				pass
+			except (OSError, ValueError, TypeError, KeyError) as err:
+				logger.warning("Failed to read event queue %s: %s", self.path, err)
+			if queued_before_load or ignored:
+				# Store the events queued before the file was set and remove the ignored events
+				self._save()
+			if self._events:
+				logger.notice("Restored %d queued events: %s", len(self._events), ", ".join(self._events))
+
+	def _save(self) -> None:
+		if not self.path:
+			return
+		data = {"version": QUEUE_VERSION, "events": [asdict(queued_event) for queued_event in self._events.values()]}
+		try:
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			tmp_file = self.path.with_name(f"{self.path.name}.tmp")
+			tmp_file.write_text(json.dumps(data), encoding="utf-8")
+			os.replace(tmp_file, self.path)
+		except OSError as err:
+			logger.error("Failed to write event queue %s: %s", self.path, err)
+
+	def _add(self, queued_event: QueuedEvent) -> QueuedEvent:
+		existing = self._events.get(queued_event.key)
+		if not existing:
+			self._events[queued_event.key] = queued_event
+			return queued_event
+		if queued_event.updated >= existing.updated:
+			existing.generator_id = queued_event.generator_id
+			existing.event_config_id = queued_event.event_config_id
+			existing.event_info = queued_event.event_info
+			existing.updated = queued_event.updated
+		existing.enqueued = min(existing.enqueued, queued_event.enqueued)
+		existing.priority = max(existing.priority, queued_event.priority)
+		existing.occurrences += queued_event.occurrences
+		existing.sequence = min(existing.sequence, queued_event.sequence)
+		return existing
+
+	def put(
+		self, generator_id: str, event_config_id: str, event_info: dict[str, Any] | None = None, priority: int = 0, key: str | None = None
+	) -> QueuedEvent:
+		"""
+		Queues an event, the key defaults to the id of the event generator.
+		"""
+		with self._lock:
+			queued_event = self._add(
+				QueuedEvent(
+					key=key or generator_id,
+					generator_id=generator_id,
+					event_config_id=event_config_id,
+					event_info=dict(event_info or {}),
+					priority=priority,
+					sequence=next(self._sequence),
+				)
+			)
+			self._save()
+		logger.info("Event %r queued (%d occurrences), queue depth %d", queued_event.key, queued_event.occurrences, len(self._events))
+		return queued_event
+
+	def pop(self) -> QueuedEvent | None:
+		"""
+		Removes and returns the next event to process.
+		"""
+		with self._lock:
+			if not self._events:
+				return None
+			queued_event = min(self._events.values(), key=lambda queued_event: (-queued_event.priority, queued_event.sequence))
+			del self._events[queued_event.key]
+			self._save()
+			return queued_event
+
+	def requeue(self, queued_event: QueuedEvent) -> None:
+		"""
+		Puts back an event which could not be processed, it keeps its place in the queue.
+		"""
+		with self._lock:
+			self._add(queued_event)
+			self._save()
+
+	def dispatched(self, queued_event: QueuedEvent) -> None:
+		wait_time = queued_event.wait_time
+		with self._lock:
+			self._dispatched += 1
+			self._total_wait_time += wait_time
+			self._max_wait_time = max(self._max_wait_time, wait_time)
+		logger.notice("Queued event %r dispatched after %0.1f seconds", queued_event.key, wait_time)
+
+	def dropped(self, queued_event: QueuedEvent) -> None:
+		with self._lock:
+			self._dropped += 1
+		logger.notice("Queued event %r dropped after %0.1f seconds", queued_event.key, queued_event.wait_time)
+
+	def clear(self) -> int:
+		with self._lock:
+			count = len(self._events)
+			self._dropped += count
+			self._events = {}
+			self._save()
+		return count
+
+	def get_state(self) -> dict[str, Any]:
+		with self._lock:
+			events = sorted(self._events.values(), key=lambda queued_event: (-queued_event.priority, queued_event.sequence))
+			return {
+				"depth": len(events),
+				"events": [queued_event.to_dict() for queued_event in events],
+				"max_queued_wait_time": max((queued_event.wait_time for queued_event in events), default=0.0),
+				"dispatched": self._dispatched,
+				"dropped": self._dropped,
+				"average_wait_time": self._total_wait_time / self._dispatched if self._dispatched else 0.0,
+				"max_wait_time": self._max_wait_time,
+			}
+
+
+event_queue = EventQueue()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Central scheduler for the timing of event generators.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from opsicommon.logging import get_logger
+
+__all__ = ["EventScheduler", "ScheduledJob", "event_scheduler"]
+
+logger = get_logger()
+
+DEFAULT_MAX_WORKERS = 4
+
+
+@dataclass(order=True)
+class ScheduledJob:
+	# Monotonic time the job is due
+	due: float
+	sequence: int
+	name: str = field(compare=False)
+	function: Callable[..., Any] = field(compare=False, repr=False)
+	args: tuple[Any, ...] = field(compare=False, default=(), repr=False)
+	cancelled: bool = field(compare=False, default=False)
+
+	@property
+	def next_fire_time(self) -> float:
+		"""Unix timestamp the job is due"""
+		return time.time() + self.due - time.monotonic()
+
+	def to_dict(self) -> dict[str, Any]:
+		return {"name": self.name, "next_fire_time": self.next_fire_time}
+
+
+class EventScheduler:
+	"""
+	Runs jobs at their due time on a small worker pool.
+	A single timer thread waits for the earliest job of a heap,
+	so generators waiting for an interval need no thread of their own.
+	"""
+
+	def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS) -> None:
+		self.max_workers = max_workers
+		self._heap: list[ScheduledJob] = []
+		self._condition = threading.Condition()
+		self._sequence = itertools.count()
+		self._thread: threading.Thread | None = None
+		self._executor: ThreadPoolExecutor | None = None
+		self._stopped = False
+
+	def schedule(self, delay: float, function: Callable[..., Any], *args: Any, name: str | None = None) -> ScheduledJob:
+		job = ScheduledJob(
+			due=time.monotonic() + max(delay, 0.0),
+			sequence=next(self._sequence),
+			name=name or function.__name__,
+			function=function,
+			args=args,
+		)
+		with self._condition:
+			if self._stopped:
+				raise RuntimeError("Event scheduler stopped")
+			if not self._thread:
+				self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="EventSchedulerWorker")
+				self._thread = threading.Thread(target=self._run, daemon=True, name="EventScheduler")
+				self._thread.start()
+			heapq.heappush(self._heap, job)
+			self._condition.notify()
+		logger.debug("Scheduled job %r in %0.3f seconds", job.name, delay)
+		return job
+
+	def cancel(self, job: ScheduledJob) -> None:
+		with self._condition:
+			# Cancelled jobs are removed from the heap when they are due
+			job.cancelled = True
+			self._condition.notify()
+
+	def get_jobs(self) -> list[ScheduledJob]:
+		with self._condition:
+			return sorted(job for job in self._heap if not job.cancelled)
+
+	def _run(self) -> None:
+		with self._condition:
+			while not self._stopped:
+				while self._heap and self._heap[0].cancelled:
+					heapq.heappop(self._heap)
+				if not self._heap:
+					self._condition.wait()
+					continue
+				wait = self._heap[0].due - time.monotonic()
+				if wait > 0:
+					self._condition.wait(wait)
+					continue
+				job = heapq.heappop(self._heap)
+				assert self._executor
+				self._executor.submit(self._run_job, job)
+
+	def _run_job(self, job: ScheduledJob) -> None:
+		if job.cancelled:
+			return
+		try:
+			job.function(*job.args)
+		except Exception as err:
+			logger.error("Scheduled job %r failed: %s", job.name, err, exc_info=True)
+
+	def stop(self) -> None:
+		with self._condition:
+			self._stopped = True
+			self._heap = []
+			self._condition.notify()
+		if self._executor:
+			self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+event_scheduler = EventScheduler()
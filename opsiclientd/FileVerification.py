@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Parallel checksum verification of cached product files.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from hashlib import md5
+from pathlib import Path
+from typing import Any, Callable
+
+from opsicommon.logging import get_logger
+
+logger = get_logger()
+
+INDEX_VERSION = 1
+DEFAULT_MAX_WORKERS = min(4, os.cpu_count() or 1)
+# Files of at least this size are hashed memory mapped
+MMAP_MIN_SIZE = 1024 * 1024
+
+
+def hash_file(path: str | Path) -> str:
+	"""
+	Returns the md5 sum of a file.
+	Large files are memory mapped and hashed in one call which releases the GIL,
+	if mapping fails the file is read with a large buffer.
+	"""
+	with open(path, "rb") as file:
+		if os.fstat(file.fileno()).st_size >= MMAP_MIN_SIZE:
+			try:
+				with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+					return md5(mapped, usedforsecurity=False).hexdigest()
+			except (OSError, ValueError, OverflowError) as err:
+				logger.debug("Failed to map %s: %s", path, err)
+		return hashlib.file_digest(file, lambda: md5(usedforsecurity=False)).hexdigest()
+
+
+@dataclass(frozen=True)
+class FileState:
+	size: int
+	mtime_ns: int
+	inode: int
+	md5sum: str
+
+	def matches(self, stat: os.stat_result) -> bool:
+		return (self.size, self.mtime_ns, self.inode) == (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+class VerificationIndex:
+	"""
+	Persistent index of the state of verified files per product.
+	Files with an unchanged size, mtime and inode do not need to be hashed again.
+	"""
+
+	def __init__(self, path: str | Path) -> None:
+		self.path = Path(path)
+		self._products: dict[str, dict[str, FileState]] | None = None
+		self._lock = threading.Lock()
+
+	def _load(self) -> dict[str, dict[str, FileState]]:
+		if self._products is None:
+			self._products = {}
+			try:
+				data = json.loads(self.path.read_text(encoding="utf-8"))
+				if data.get("version") == INDEX_VERSION:
+					self._products = {
+						product_id: {path: FileState(*values) for path, values in files.items()}
+						for product_id, files in data["products"].items()
+					}
+			except FileNotFoundError:
+				pass
+			except (OSError, ValueError, TypeError, KeyError) as err:
+				logger.warning("Failed to read verification index %s: %s", self.path, err)
+		return self._products
+
+	def get_product(self, product_id: str) -> dict[str, FileState]:
+		with self._lock:
+			return dict(self._load().get(product_id, {}))
+
+	def set_product(self, product_id: str, files: dict[str, FileState]) -> None:
+		with self._lock:
+			self._load()[product_id] = dict(files)
+			self._save()
+
+	def remove_product(self, product_id: str) -> None:
+		with self._lock:
+			if self._load().pop(product_id, None) is not None:
+				self._save()
+
+	def _save(self) -> None:
+		assert self._products is not None
+		data = {
+			"version": INDEX_VERSION,
+			"products": {
+				product_id: {
+					path: [file_state.size, file_state.mtime_ns, file_state.inode, file_state.md5sum] for path, file_state in files.items()
+				}
+				for product_id, files in self._products.items()
+			},
+		}
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		tmp_file = self.path.with_name(f"{self.path.name}.tmp")
+		tmp_file.write_text(json.dumps(data), encoding="utf-8")
+		os.replace(tmp_file, self.path)
+
+
+@dataclass
+class VerificationResult:
+	product_id: str
+	verified: bool = False
+	cancelled: bool = False
+	files: int = 0
+	hashed_files: int = 0
+	hashed_bytes: int = 0
+	duration: float = 0.0
+	# Relative path => error
+	errors: dict[str, str] = field(default_factory=dict)
+
+	def to_dict(self) -> dict[str, Any]:
+		return asdict(self)
+
+
+class ProductVerifier:
+	"""
+	Verifies the files of a cached product against the package content file (`<product>.files`).
+	Files are hashed in a thread pool, files unchanged since their last verification are taken from the index.
+	"""
+
+	def __init__(self, index: VerificationIndex, max_workers: int = DEFAULT_MAX_WORKERS) -> None:
+		self.index = index
+		self.max_workers = max_workers
+
+	def verify(
+		self,
+		product_id: str,
+		product_dir: str | Path,
+		package_info: dict[str, dict[str, Any]],
+		max_workers: int | None = None,
+		should_stop: Callable[[], bool] | None = None,
+	) -> VerificationResult:
+		"""
+		`package_info` is the parsed package content file, relative path => {"type", "size", "md5sum"}.
+		Verification stops early if `should_stop` returns True, the result is marked as cancelled then.
+		"""
+		start = time.monotonic()
+		result = VerificationResult(product_id=product_id)
+		stored_states = self.index.get_product(product_id)
+		states: dict[str, FileState] = {}
+		# Relative path, absolute path, stat before hashing, expected md5 sum
+		to_hash: list[tuple[str, str, os.stat_result, str]] = []
+
+		for path, file_info in package_info.items():
+			abs_path = os.path.join(product_dir, path)
+			file_type = file_info.get("type")
+			if file_type == "d":
+				if not os.path.isdir(abs_path):
+					result.errors[path] = "directory missing"
+				continue
+			if file_type == "l":
+				if not os.path.lexists(abs_path):
+					result.errors[path] = "link missing"
+				continue
+			if file_type != "f":
+				continue
+
+			result.files += 1
+			try:
+				stat = os.stat(abs_path)
+			except OSError as err:
+				result.errors[path] = f"file missing: {err}"
+				continue
+			size = int(file_info.get("size", 0))
+			if stat.st_size != size:
+				result.errors[path] = f"size mismatch: {stat.st_size} != {size}"
+				continue
+			md5sum = file_info.get("md5sum")
+			if not md5sum:
+				continue
+			stored_state = stored_states.get(path)
+			if stored_state and stored_state.matches(stat):
+				states[path] = stored_state
+				if stored_state.md5sum != md5sum:
+					result.errors[path] = "checksum mismatch"
+				continue
+			to_hash.append((path, abs_path, stat, md5sum))
+
+		def hash_if_running(abs_path: str) -> str | None:
+			if should_stop and should_stop():
+				return None
+			return hash_file(abs_path)
+
+		if to_hash:
+			with ThreadPoolExecutor(max_workers=max_workers or self.max_workers, thread_name_prefix="ProductVerifier") as executor:
+				futures = [
+					(path, abs_path, stat, md5sum, executor.submit(hash_if_running, abs_path)) for path, abs_path, stat, md5sum in to_hash
+				]
+				for path, abs_path, stat, md5sum, future in futures:
+					try:
+						file_md5sum = future.result()
+					except OSError as err:
+						result.errors[path] = f"failed to read file: {err}"
+						continue
+					if file_md5sum is None:
+						result.cancelled = True
+						continue
+					result.hashed_files += 1
+					result.hashed_bytes += stat.st_size
+					if file_md5sum != md5sum:
+						result.errors[path] = "checksum mismatch"
+					# Files changed while hashing are hashed again next time
+					try:
+						if os.stat(abs_path).st_mtime_ns == stat.st_mtime_ns:
+							states[path] = FileState(stat.st_size, stat.st_mtime_ns, stat.st_ino, file_md5sum)
+					except OSError:
+						pass
+
+		# Entries of files removed from the product are dropped
+		self.index.set_product(product_id, states)
+		result.verified = not result.errors and not result.cancelled
+		result.duration = time.monotonic() - start
+		logger.info(
+			"Verification of product %r %s: %d files, %d hashed (%d bytes) in %0.3f seconds, %d errors",
+			product_id,
+			"cancelled" if result.cancelled else "completed",
+			result.files,
+			result.hashed_files,
+			result.hashed_bytes,
+			result.duration,
+			len(result.errors),
+		)
+		return result
@@ -18,11 +18,12 @@ import shutil
 import threading
 import time
 import traceback
+from dataclasses import asdict, dataclass
 from datetime import datetime, timezone
 from pathlib import Path
 from traceback import TracebackException
 from types import TracebackType
-from typing import TYPE_CHECKING, Callable
+from typing import TYPE_CHECKING, Any, Callable
 
 from cryptography import x509
 from cryptography.hazmat.primitives import hashes
@@ -74,9 +75,12 @@ from opsicommon.types import (
 )
 
 from opsiclientd import __version__
+from opsiclientd.Bandwidth import TransferPriority, bandwidth_manager
 from opsiclientd.Config import Config
 from opsiclientd.Exceptions import CanceledByUserError
 from opsiclientd.Localization import _
+from opsiclientd.RPCMetrics import rpc_metrics
+from opsiclientd.RPCProfiler import rpc_profiler
 from opsiclientd.utils import log_network_status
 
 if TYPE_CHECKING:
@@ -298,6 +302,7 @@ class PermanentServiceConnection(threading.Thread, ServiceConnectionListener, Me
 		# logger.devel("Message received: %s", message.to_dict())
 		if isinstance(message, JSONRPCRequestMessage):
 			response = JSONRPCResponseMessage(sender="@", channel=message.back_channel or message.sender, rpc_id=message.rpc_id)
+			start = time.time()
 			try:
 				if message.method.startswith("_"):
 					raise ValueError("Invalid method")
@@ -309,6 +314,13 @@ class PermanentServiceConnection(threading.Thread, ServiceConnectionListener, Me
 					"message": str(err),
 					"data": {"class": err.__class__.__name__, "details": traceback.format_exc()},
 				}
+			rpc_metrics.observe(
+				self._control_interface.__class__.__name__,
+				message.method,
+				time.time() - start,
+				error=response.error is not None,
+				transport="messagebus",
+			)
 			await self.service_client.messagebus.async_send_message(response)
 		elif isinstance(message, TraceRequestMessage):
 			await self.service_client.messagebus.async_send_message(
@@ -335,6 +347,20 @@ class PermanentServiceConnection(threading.Thread, ServiceConnectionListener, Me
 			await process_process_message(message=message, send_message=self.service_client.messagebus.async_send_message)
 
 
+@dataclass
+class RPCStatistics:
+	rpc_count: int = 0
+	request_count: int = 0
+	bytes_sent: int = 0
+	bytes_received: int = 0
+
+	def copy(self) -> RPCStatistics:
+		return RPCStatistics(**asdict(self))
+
+	def diff(self, other: RPCStatistics) -> RPCStatistics:
+		return RPCStatistics(**{key: value - getattr(other, key) for key, value in asdict(self).items()})
+
+
 class ServiceConnection:
 	def __init__(self, opsiclientd: Opsiclientd | None = None):
 		self.opsiclientd = opsiclientd
@@ -342,6 +368,8 @@ class ServiceConnection:
 		self._configServiceUrl: str | None = None
 		self._configService: JSONRPCBackend | None = None
 		self._should_stop = False
+		self._rpc_statistics = RPCStatistics()
+		self._rpc_statistics_lock = threading.Lock()
 
 	def connectionThreadOptions(self) -> dict[str, str]:
 		return {}
@@ -387,6 +415,42 @@ class ServiceConnection:
 	def isConfigServiceConnected(self) -> bool:
 		return bool(self._configService)
 
+	def getRPCStatistics(self) -> RPCStatistics:
+		with self._rpc_statistics_lock:
+			return self._rpc_statistics.copy()
+
+	def _count_service_requests(self) -> None:
+		"""
+		Counts requests and transferred bytes of the connected config service
+		by wrapping the request method of the service client.
+		The RPCs are also recorded by the rpc profiler.
+		"""
+		service = getattr(self._configService, "service", None)
+		if not service or not hasattr(service, "request"):
+			return
+		request = service.request
+
+		def counting_request(*args: Any, **kwargs: Any) -> Any:
+			response = request(*args, **kwargs)
+			method = str(args[0] if args else kwargs.get("method", "")).upper()
+			data = kwargs.get("data")
+			sent = len(data) if isinstance(data, (bytes, str)) else 0
+			try:
+				received = int(response.headers.get("Content-Length") or 0)
+			except (AttributeError, ValueError):
+				received = 0
+			with self._rpc_statistics_lock:
+				self._rpc_statistics.request_count += 1
+				if method == "POST":
+					self._rpc_statistics.rpc_count += 1
+				self._rpc_statistics.bytes_sent += sent
+				self._rpc_statistics.bytes_received += received
+			rpc_profiler.add_transfer(sent, received)
+			return response
+
+		service.request = counting_request
+		rpc_profiler.wrap_service(service)
+
 	def stop(self) -> None:
 		self._should_stop = True
 		self.disconnectConfigService()
@@ -492,6 +556,7 @@ class ServiceConnection:
 						logger.error("Failed to sync time: '%s'", err)
 
 				self._configService = serviceConnectionThread._configService
+				self._count_service_requests()
 				self.update_information_from_header()
 
 				if self._configService and "localhost" not in configServiceURL and "127.0.0.1" not in configServiceURL:
@@ -702,7 +767,12 @@ def download_from_depot(product_id: str, destination: str | Path, sub_path: str
 		proxy_url=config.get("global", "proxy_url"),
 		ip_version=config.get("global", "ip_version"),
 	)
-	repository.copy(path, str(destination))
+	with bandwidth_manager.transfer(
+		f"Download {path}",
+		TransferPriority.DOWNLOAD,
+		on_limit=lambda limit: repository.setBandwidth(dynamicBandwidth=False, maxBandwidth=limit),
+	):
+		repository.copy(path, str(destination))
 	repository.disconnect()
 
 	logger.info("Download completed")
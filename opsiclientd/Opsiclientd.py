@@ -59,11 +59,14 @@ from opsiclientd.Events.Panic import PanicEvent
 from opsiclientd.Events.Utilities.Factories import EventGeneratorFactory
 from opsiclientd.Events.Utilities.Generators import (
 	createEventGenerators,
+	getEventGenerator,
 	getEventGenerators,
 )
+from opsiclientd.Events.Utilities.Queue import event_queue
 from opsiclientd.Localization import _, load_translation
 from opsiclientd.notification_server import NotificationServer
 from opsiclientd.OpsiService import PermanentServiceConnection
+from opsiclientd.ProcessSampler import ProcessSampler
 from opsiclientd.setup import setup
 from opsiclientd.State import State
 from opsiclientd.SystemCheck import RUNNING_ON_DARWIN, RUNNING_ON_LINUX, RUNNING_ON_WINDOWS
@@ -134,6 +137,7 @@ class Opsiclientd(EventListener, threading.Thread):
 		self._cacheService: CacheService | None = None
 		self._controlPipe: ControlPipe | None = None
 		self._webserver: Webserver | None = None
+		self._processSampler: ProcessSampler | None = None
 		self._permanent_service_connection: PermanentServiceConnection | None = None
 		self._selfUpdating = False
 		self.login_detector: LoginDetector | None = None
@@ -487,6 +491,13 @@ class Opsiclientd(EventListener, threading.Thread):
 			except Exception as error:
 				logger.error("Failed to start LoginDetector: %s", error, exc_info=True)
 
+		event_queue.load(
+			os.path.join(os.path.dirname(config.get("global", "state_file")), "event_queue.json"),
+			ignore_generator_ids=[
+				event_generator.getId() for event_generator in getEventGenerators() if not event_generator.canQueueEvents()
+			],
+		)
+
 		for event_generator in getEventGenerators(generatorClass=DaemonStartupEventGenerator):
 			try:
 				event_generator.createAndFireEvent()
@@ -565,6 +576,26 @@ class Opsiclientd(EventListener, threading.Thread):
 				except (NameError, RuntimeError) as stopError:
 					logger.debug("Stopping webserver failed: %s", stopError)
 
+	@contextmanager
+	def runProcessSampler(self) -> Generator[None, None, None]:
+		self._processSampler = None
+		interval = config.get("global", "process_sampler_interval")
+		if interval > 0:
+			logger.info("Starting process sampler")
+			try:
+				self._processSampler = ProcessSampler(interval=interval, history_size=config.get("global", "process_sampler_history_size"))
+				self._processSampler.start()
+			except Exception as err:
+				logger.error("Failed to start process sampler: %s", err, exc_info=True)
+				self._processSampler = None
+		try:
+			yield
+		finally:
+			if self._processSampler:
+				logger.info("Stopping process sampler")
+				self._processSampler.stop()
+				self._processSampler.join(2)
+
 	def run(self) -> None:
 		with log_context({"instance": "opsiclientd"}):
 			try:
@@ -629,7 +660,7 @@ class Opsiclientd(EventListener, threading.Thread):
 				title=event_title, description=event_description, category="opsiclientd_running", durationEvent=True
 			)
 
-			with self.runControlPipe(), self.runWebserver():
+			with self.runProcessSampler(), self.runControlPipe(), self.runWebserver():
 				if config.get("config_service", "permanent_connection"):
 					self.start_permanent_service_connection()
 
@@ -683,6 +714,11 @@ class Opsiclientd(EventListener, threading.Thread):
 					try:
 						while not self._stopEvent.is_set():
 							self._stopEvent.wait(1)
+							if len(event_queue):
+								try:
+									self.processEventQueue()
+								except Exception as err:
+									logger.error("Failed to process event queue: %s", err, exc_info=True)
 					finally:
 						logger.notice("opsiclientd is going down")
 						with self._eptListLock:
@@ -719,6 +755,11 @@ class Opsiclientd(EventListener, threading.Thread):
 			raise RuntimeError("Cache service not started")
 		return self._cacheService
 
+	def getProcessSampler(self) -> ProcessSampler:
+		if not self._processSampler:
+			raise RuntimeError("Process sampler not running")
+		return self._processSampler
+
 	def canProcessEvent(self, event: Event, can_cancel: bool = False) -> bool:
 		# Always process panic events
 		if isinstance(event, PanicEvent):
@@ -823,6 +864,44 @@ class Opsiclientd(EventListener, threading.Thread):
 						self.deleteActionProcessorUser()
 					except Exception as err:
 						logger.warning(err)
+			self.processEventQueue()
+
+	def processEventQueue(self) -> None:
+		"""
+		Fires the next queued event if no event is running.
+		The event is created again, so the preconditions are evaluated at the time it is processed.
+		"""
+		if self.is_stopping():
+			return
+		with self._eptListLock:
+			if self._eventProcessingThreads:
+				return
+		queued_event = event_queue.pop()
+		if not queued_event:
+			return
+		try:
+			eventGenerator = getEventGenerator(queued_event.generator_id)
+		except ValueError as err:
+			logger.warning("Dropping queued event %r: %s", queued_event.key, err)
+			event_queue.dropped(queued_event)
+			return
+		event = eventGenerator.createEvent(queued_event.event_info)
+		if not event:
+			logger.info("Dropping queued event %r, no active event config", queued_event.key)
+			event_queue.dropped(queued_event)
+			return
+		if not event.eventConfig.queueIfBusy:
+			logger.info("Dropping queued event %r, event config %r is not queued", queued_event.key, event.eventConfig.getId())
+			event_queue.dropped(queued_event)
+			return
+		try:
+			# Requeued below to keep the place in the queue
+			eventGenerator.fireEvent(event, queue_if_busy=False)
+		except (ValueError, CannotCancelEventError) as err:
+			logger.info("Queued event %r can not be processed yet: %s", queued_event.key, err)
+			event_queue.requeue(queued_event)
+			return
+		event_queue.dispatched(queued_event)
 
 	def getEventProcessingThreads(self) -> list[EventProcessingThread]:
 		with self._eptListLock:
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Sharing of cached product files between clients on the local network.
+"""
+
+from __future__ import annotations
+
+import http.client
+import ipaddress
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from opsicommon.logging import get_logger
+from opsicommon.system.network import get_ip_addresses
+from zeroconf import ServiceBrowser, ServiceInfo, ServiceStateChange, Zeroconf
+
+from opsiclientd.Bandwidth import BandwidthManager
+from opsiclientd.DepotDownload import DepotFileDownloader, DownloadError
+
+__all__ = [
+	"PEER_CACHE_PATH",
+	"PEER_CACHE_USERNAME",
+	"Peer",
+	"PeerCacheDiscovery",
+	"PeerFetchResult",
+	"decode_properties",
+	"encode_properties",
+	"fetch_from_peers",
+	"peer_bandwidth_manager",
+]
+
+logger = get_logger()
+
+SERVICE_TYPE = "_opsi-peercache._tcp.local."
+# Path of the peer cache on the control server
+PEER_CACHE_PATH = "/peer_cache"
+# Username of peers authenticating with the peer cache secret
+PEER_CACHE_USERNAME = "peer-cache"
+PROPERTY_HOST_ID = "host_id"
+PROPERTY_PRODUCT_PREFIX = "p:"
+# Keep the txt record small enough for a single mDNS packet
+MAX_PROPERTIES_SIZE = 1300
+RESOLVE_TIMEOUT = 3000  # In milliseconds
+# Peers are not used for this many seconds after a failed download
+PEER_BLOCK_TIME = 300
+
+# Transfers from peers stay on the local network and do not share the bandwidth of the depot link
+peer_bandwidth_manager = BandwidthManager()
+
+
+def encode_properties(host_id: str, products: dict[str, str]) -> dict[str, str]:
+	"""
+	Returns the txt record properties advertising the cached products as `product id` => `<product version>-<package version>`.
+	Products which do not fit into the txt record are not advertised.
+	"""
+	properties = {PROPERTY_HOST_ID: host_id}
+	size = len(PROPERTY_HOST_ID) + len(host_id) + 2
+	for product_id, version in sorted(products.items()):
+		key = f"{PROPERTY_PRODUCT_PREFIX}{product_id}"
+		# Length byte and "="
+		entry_size = len(key) + len(version) + 2
+		if size + entry_size > MAX_PROPERTIES_SIZE:
+			logger.warning("Txt record size limit reached, advertising %d of %d cached products", len(properties) - 1, len(products))
+			break
+		properties[key] = version
+		size += entry_size
+	return properties
+
+
+def decode_properties(properties: dict[bytes, bytes | None]) -> tuple[str, dict[str, str]]:
+	"""
+	Returns the host id and the advertised products of the txt record properties.
+	"""
+	host_id = ""
+	products = {}
+	for key, value in properties.items():
+		if value is None:
+			continue
+		_key = key.decode("utf-8", errors="replace")
+		_value = value.decode("utf-8", errors="replace")
+		if _key == PROPERTY_HOST_ID:
+			host_id = _value
+		elif _key.startswith(PROPERTY_PRODUCT_PREFIX):
+			products[_key[len(PROPERTY_PRODUCT_PREFIX) :]] = _value
+	return host_id, products
+
+
+def get_local_addresses() -> list[str]:
+	addresses = []
+	for addr in get_ip_addresses():
+		if addr["family"] not in ("ipv4", "ipv6"):
+			continue
+		try:
+			address = ipaddress.ip_address(addr["address"])
+		except ValueError:
+			continue
+		if not address.is_loopback and not address.is_link_local:
+			addresses.append(address.compressed)
+	return addresses
+
+
+@dataclass
+class Peer:
+	name: str
+	host_id: str
+	addresses: list[str]
+	port: int
+	# Product id => <product version>-<package version>
+	products: dict[str, str] = field(default_factory=dict)
+	blocked_until: float = 0.0
+
+	@property
+	def url(self) -> str:
+		address = self.addresses[0]
+		if ":" in address:
+			address = f"[{address}]"
+		return f"https://{address}:{self.port}{PEER_CACHE_PATH}/files"
+
+
+class PeerCacheDiscovery:
+	"""
+	Advertises the versions of the cached products of this client via mDNS
+	and keeps track of the products advertised by the other clients on the local network.
+	"""
+
+	def __init__(self, host_id: str, port: int, addresses: list[str] | None = None) -> None:
+		self.host_id = host_id
+		self.port = port
+		self.addresses = addresses
+		self._zeroconf: Zeroconf | None = None
+		self._browser: ServiceBrowser | None = None
+		self._service_info: ServiceInfo | None = None
+		self._products: dict[str, str] = {}
+		self._peers: dict[str, Peer] = {}
+		self._lock = threading.Lock()
+
+	@property
+	def running(self) -> bool:
+		return self._zeroconf is not None
+
+	def _create_service_info(self, products: dict[str, str], name: str | None = None) -> ServiceInfo:
+		addresses = self.addresses if self.addresses is not None else get_local_addresses()
+		return ServiceInfo(
+			SERVICE_TYPE,
+			name or f"{self.host_id.replace('.', '-')}.{SERVICE_TYPE}",
+			port=self.port,
+			properties=encode_properties(self.host_id, products),
+			server=f"{self.host_id}.",
+			parsed_addresses=addresses,
+		)
+
+	def start(self, products: dict[str, str]) -> None:
+		if self._zeroconf:
+			return
+		logger.notice("Starting peer cache discovery")
+		self._zeroconf = Zeroconf()
+		try:
+			self._products = dict(products)
+			self._service_info = self._create_service_info(products)
+			self._zeroconf.register_service(self._service_info, allow_name_change=True)
+			self._browser = ServiceBrowser(self._zeroconf, SERVICE_TYPE, handlers=[self._on_service_state_change])
+		except Exception:
+			self.stop()
+			raise
+
+	def stop(self) -> None:
+		if not self._zeroconf:
+			return
+		logger.notice("Stopping peer cache discovery")
+		if self._browser:
+			self._browser.cancel()
+			self._browser = None
+		if self._service_info:
+			try:
+				self._zeroconf.unregister_service(self._service_info)
+			except Exception as err:
+				logger.warning("Failed to unregister peer cache service: %s", err)
+			self._service_info = None
+		self._zeroconf.close()
+		self._zeroconf = None
+		with self._lock:
+			self._peers = {}
+
+	def update_products(self, products: dict[str, str]) -> None:
+		"""
+		Advertises the given products instead of the previously advertised.
+		"""
+		if not self._zeroconf or not self._service_info or products == self._products:
+			return
+		logger.info("Advertising %d cached products to peers", len(products))
+		self._products = dict(products)
+		self._service_info = self._create_service_info(products, name=self._service_info.name)
+		self._zeroconf.update_service(self._service_info)
+
+	def _on_service_state_change(self, zeroconf: Zeroconf, service_type: str, name: str, state_change: ServiceStateChange) -> None:
+		if self._service_info and name == self._service_info.name:
+			return
+		if state_change is ServiceStateChange.Removed:
+			self.remove_peer(name)
+			return
+		info = zeroconf.get_service_info(service_type, name, timeout=RESOLVE_TIMEOUT)
+		if not info or not info.port:
+			logger.debug("Failed to resolve peer %r", name)
+			return
+		host_id, products = decode_properties(info.properties)
+		addresses = info.parsed_scoped_addresses()
+		if not host_id or not addresses:
+			logger.debug("Ignoring peer %r without host id or address", name)
+			return
+		self.add_peer(Peer(name=name, host_id=host_id, addresses=addresses, port=info.port, products=products))
+
+	def add_peer(self, peer: Peer) -> None:
+		with self._lock:
+			if previous := self._peers.get(peer.name):
+				peer.blocked_until = previous.blocked_until
+			self._peers[peer.name] = peer
+		logger.info("Peer %r at %s advertises %d cached products", peer.host_id, peer.addresses, len(peer.products))
+
+	def remove_peer(self, name: str) -> None:
+		with self._lock:
+			if peer := self._peers.pop(name, None):
+				logger.info("Peer %r removed", peer.host_id)
+
+	def block_peer(self, peer: Peer) -> None:
+		logger.info("Not using peer %r for %d seconds", peer.host_id, PEER_BLOCK_TIME)
+		peer.blocked_until = time.monotonic() + PEER_BLOCK_TIME
+
+	def get_peers(self, product_id: str, version: str) -> list[Peer]:
+		"""
+		Returns the peers advertising the product version in random order, to spread the load.
+		"""
+		now = time.monotonic()
+		with self._lock:
+			peers = [peer for peer in self._peers.values() if peer.products.get(product_id) == version and peer.blocked_until <= now]
+		random.shuffle(peers)
+		return peers
+
+
+@dataclass
+class PeerFetchResult:
+	files: int = 0
+	size: int = 0
+	# Paths of the files left to fetch from the depot
+	failed: list[str] = field(default_factory=list)
+
+
+def fetch_from_peers(
+	peers: list[Peer],
+	product_id: str,
+	package_info: dict[str, dict[str, Any]],
+	product_dir: str,
+	create_downloader: Callable[[Peer], DepotFileDownloader],
+	on_peer_failed: Callable[[Peer], None] | None = None,
+) -> PeerFetchResult:
+	"""
+	Fetches the files of the package content file which are missing in `product_dir` from the peers.
+	Every file is verified against the size and checksum of the package content file.
+	A peer is not asked again after a failure, files which no peer could deliver are left for the depot.
+	"""
+	result = PeerFetchResult()
+	peers = list(peers)
+	downloaders: dict[str, DepotFileDownloader] = {}
+	for path, file_info in sorted(package_info.items()):
+		size = int(file_info.get("size") or 0)
+		if file_info.get("type") != "f" or size <= 0:
+			continue
+		destination = os.path.join(product_dir, path)
+		if os.path.exists(destination) and os.path.getsize(destination) == size:
+			continue
+
+		while peers:
+			peer = peers[0]
+			if peer.name not in downloaders:
+				downloaders[peer.name] = create_downloader(peer)
+			try:
+				downloaders[peer.name].download(f"{product_id}/{path}", destination, size=size, md5sum=file_info.get("md5sum"))
+				result.files += 1
+				result.size += size
+				break
+			except (DownloadError, OSError, http.client.HTTPException) as err:
+				logger.warning("Failed to fetch '%s' of product '%s' from peer %r: %s", path, product_id, peer.host_id, err)
+				peers.pop(0)
+				if on_peer_failed:
+					on_peer_failed(peer)
+		else:
+			result.failed.append(path)
+	return result
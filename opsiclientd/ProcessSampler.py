@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Background sampling of process and thread resource usage.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any
+
+import psutil  # type: ignore[import]
+from opsicommon.logging import get_logger, log_context
+
+from opsiclientd.SystemCheck import RUNNING_ON_WINDOWS
+
+logger = get_logger()
+
+
+class ProcessSampler(threading.Thread):
+	"""
+	Samples cpu times, memory and open file handles of the opsiclientd process
+	and the cpu times of all named threads every `interval` seconds.
+	The last `history_size` samples are kept in a ring buffer.
+	Cpu times are stored cumulative, so usage of any window can be computed
+	from the first and the last sample of the window.
+	"""
+
+	def __init__(self, interval: float = 5.0, history_size: int = 720) -> None:
+		super().__init__(name="ProcessSampler", daemon=True)
+		self.interval = max(float(interval), 0.1)
+		self._samples: deque[dict[str, Any]] = deque(maxlen=max(int(history_size), 2))
+		self._samples_lock = threading.Lock()
+		self._should_stop = threading.Event()
+		self._process = psutil.Process()
+
+	def stop(self) -> None:
+		self._should_stop.set()
+
+	def _count_open_files(self) -> int:
+		# Process.open_files() is very expensive and can hang on windows, count handles / descriptors instead
+		try:
+			if RUNNING_ON_WINDOWS:
+				return self._process.num_handles()
+			return self._process.num_fds()
+		except psutil.Error:
+			return -1
+
+	def sample(self, lag: float = 0.0) -> dict[str, Any]:
+		now = time.time()
+		thread_by_id = {t.native_id: t for t in threading.enumerate()}
+		with self._process.oneshot():
+			cpu_times = self._process.cpu_times()
+			memory_info = self._process.memory_info()
+			threads = []
+			for p_thread in self._process.threads():
+				thread = thread_by_id.get(p_thread.id)
+				threads.append(
+					{
+						"id": p_thread.id,
+						"name": thread.name if thread else None,
+						"user": p_thread.user_time,
+						"system": p_thread.system_time,
+					}
+				)
+		sample = {
+			"timestamp": now,
+			"cpu_times": cpu_times._asdict(),
+			"memory_rss": memory_info.rss,
+			"open_files": self._count_open_files(),
+			"num_threads": len(threads),
+			"lag": lag,
+			"threads": threads,
+		}
+		with self._samples_lock:
+			self._samples.append(sample)
+		return sample
+
+	def run(self) -> None:
+		with log_context({"instance": "process sampler"}):
+			logger.info("Process sampler started (interval: %0.1f s, history: %d)", self.interval, self._samples.maxlen)
+			next_sample = time.monotonic()
+			while not self._should_stop.is_set():
+				# Time the sampler was woken up too late, an indicator for gil contention or system load
+				lag = max(time.monotonic() - next_sample, 0.0)
+				try:
+					self.sample(lag=lag)
+				except Exception as err:
+					logger.warning("Failed to sample process info: %s", err, exc_info=True)
+				next_sample += self.interval
+				wait = next_sample - time.monotonic()
+				if wait < 0:
+					next_sample = time.monotonic()
+					wait = 0
+				self._should_stop.wait(wait)
+			logger.info("Process sampler stopped")
+
+	def get_samples(self, seconds: float = 0.0) -> list[dict[str, Any]]:
+		"""
+		Returns the samples of the last `seconds` seconds, all samples if `seconds` is 0.
+		"""
+		with self._samples_lock:
+			samples = list(self._samples)
+		if seconds > 0:
+			min_timestamp = time.time() - seconds
+			samples = [s for s in samples if s["timestamp"] >= min_timestamp]
+		return samples
+
+	def get_summary(self, seconds: float = 60.0) -> dict[str, Any]:
+		"""
+		Returns cpu usage of the process and of every thread, averaged over the last `seconds` seconds.
+		"""
+		with self._samples_lock:
+			samples = list(self._samples)
+		if len(samples) < 2:
+			return {}
+		min_timestamp = samples[-1]["timestamp"] - seconds
+		window = [s for s in samples if s["timestamp"] >= min_timestamp]
+		if len(window) < 2:
+			window = samples[-2:]
+		first = window[0]
+		last = window[-1]
+		duration = last["timestamp"] - first["timestamp"]
+		cpu_times = {k: v - first["cpu_times"][k] for k, v in last["cpu_times"].items()}
+		cpu_times_proc = cpu_times["user"] + cpu_times["system"]
+
+		first_threads = {t["id"]: t for t in first["threads"]}
+		threads = []
+		for thread in last["threads"]:
+			start = first_threads.get(thread["id"])
+			if not start or start["name"] != thread["name"]:
+				# Thread started within the window or native id was reused
+				start = {"user": 0.0, "system": 0.0}
+			user_time = thread["user"] - start["user"]
+			system_time = thread["system"] - start["system"]
+			threads.append(
+				{
+					"id": thread["id"],
+					"name": thread["name"],
+					"cpu_times": {"user": user_time, "system": system_time},
+					"cpu_percent": ((user_time + system_time) * 100.0 / duration) if duration else 0.0,
+					"cpu_share": ((user_time + system_time) / cpu_times_proc) if cpu_times_proc else 0.0,
+				}
+			)
+		threads.sort(key=lambda t: t["cpu_percent"], reverse=True)
+		return {
+			"start": first["timestamp"],
+			"end": last["timestamp"],
+			"duration": duration,
+			"samples": len(window),
+			"cpu_times": cpu_times,
+			"cpu_percent": (cpu_times_proc * 100.0 / duration) if duration else 0.0,
+			"memory_rss": {
+				"current": last["memory_rss"],
+				"max": max(s["memory_rss"] for s in window),
+				"min": min(s["memory_rss"] for s in window),
+			},
+			"open_files": {
+				"current": last["open_files"],
+				"max": max(s["open_files"] for s in window),
+			},
+			"lag": {
+				"max": max(s["lag"] for s in window),
+				"avg": sum(s["lag"] for s in window) / len(window),
+			},
+			"threads": threads,
+		}
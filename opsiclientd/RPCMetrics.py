@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Metrics of the RPCs processed by opsiclientd.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+__all__ = ["LogLinearHistogram", "RPCMetrics", "rpc_metrics"]
+
+# 2^SUB_BUCKET_BITS buckets per power of two, the relative error of a recorded value is below 1 / 2^SUB_BUCKET_BITS
+SUB_BUCKET_BITS = 4
+# Methods per interface which are recorded by name, further methods are recorded as OTHER_METHOD
+MAX_METHODS = 500
+OTHER_METHOD = "_other"
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+# Upper bounds of the buckets of the exported histograms
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+
+class LogLinearHistogram:
+	"""
+	HDR style histogram of non-negative integers with a bounded relative error.
+	Buckets are linear up to 2^SUB_BUCKET_BITS, above every power of two is divided into 2^SUB_BUCKET_BITS buckets.
+	Only used buckets are stored.
+	"""
+
+	def __init__(self, sub_bucket_bits: int = SUB_BUCKET_BITS) -> None:
+		self.sub_bucket_bits = sub_bucket_bits
+		self.sub_bucket_count = 1 << sub_bucket_bits
+		self.counts: dict[int, int] = {}
+		self.count = 0
+		self.sum = 0
+		self.min = 0
+		self.max = 0
+
+	def _index(self, value: int) -> int:
+		if value < self.sub_bucket_count:
+			return value
+		exponent = value.bit_length() - self.sub_bucket_bits - 1
+		return self.sub_bucket_count * (exponent + 1) + (value >> exponent) - self.sub_bucket_count
+
+	def bucket_range(self, index: int) -> tuple[int, int]:
+		"""
+		Returns the lowest value and the lowest value of the next bucket.
+		"""
+		if index < self.sub_bucket_count:
+			return index, index + 1
+		exponent, sub_bucket = divmod(index - self.sub_bucket_count, self.sub_bucket_count)
+		mantissa = self.sub_bucket_count + sub_bucket
+		return mantissa << exponent, (mantissa + 1) << exponent
+
+	def record(self, value: int) -> None:
+		value = max(int(value), 0)
+		index = self._index(value)
+		self.counts[index] = self.counts.get(index, 0) + 1
+		self.min = value if not self.count else min(self.min, value)
+		self.max = max(self.max, value)
+		self.count += 1
+		self.sum += value
+
+	def percentile(self, percentile: float) -> int:
+		if not self.count:
+			return 0
+		rank = max(1, round(self.count * percentile / 100))
+		seen = 0
+		for index in sorted(self.counts):
+			seen += self.counts[index]
+			if seen >= rank:
+				lower, upper = self.bucket_range(index)
+				return min(max((lower + upper - 1) // 2, self.min), self.max)
+		return self.max
+
+	def cumulative_counts(self, bounds: tuple[float, ...]) -> list[int]:
+		"""
+		Returns the number of values lower or equal to each of the bounds, accurate to the bucket precision.
+		"""
+		counts = [0] * len(bounds)
+		for index, count in self.counts.items():
+			lower, upper = self.bucket_range(index)
+			middle = (lower + upper - 1) / 2
+			for num, bound in enumerate(bounds):
+				if middle <= bound:
+					counts[num] += count
+		return counts
+
+	def to_dict(self, scale: float = 1.0) -> dict[str, Any]:
+		return {
+			"count": self.count,
+			"sum": self.sum * scale,
+			"min": self.min * scale,
+			"max": self.max * scale,
+			"mean": self.sum * scale / self.count if self.count else 0.0,
+			"percentiles": {str(percentile): self.percentile(percentile) * scale for percentile in PERCENTILES},
+		}
+
+
+@dataclass
+class MethodMetrics:
+	errors: int = 0
+	# Microseconds
+	durations: LogLinearHistogram = field(default_factory=LogLinearHistogram)
+	# Bytes
+	request_sizes: LogLinearHistogram = field(default_factory=LogLinearHistogram)
+	response_sizes: LogLinearHistogram = field(default_factory=LogLinearHistogram)
+
+	def to_dict(self) -> dict[str, Any]:
+		return {
+			"requests": self.durations.count,
+			"errors": self.errors,
+			"duration": self.durations.to_dict(scale=1e-6),
+			"request_size": self.request_sizes.to_dict(),
+			"response_size": self.response_sizes.to_dict(),
+		}
+
+
+@dataclass
+class TransportMetrics:
+	requests: int = 0
+	errors: int = 0
+	request_bytes: int = 0
+	response_bytes: int = 0
+
+	def to_dict(self) -> dict[str, Any]:
+		return {
+			"requests": self.requests,
+			"errors": self.errors,
+			"request_bytes": self.request_bytes,
+			"response_bytes": self.response_bytes,
+		}
+
+
+def _escape(value: str) -> str:
+	return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str | float) -> str:
+	return ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items())
+
+
+class RPCMetrics:
+	"""
+	Registry of the RPC metrics per interface and method and per transport (http, pipe, messagebus).
+	"""
+
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self._methods: dict[tuple[str, str], MethodMetrics] = {}
+		self._transports: dict[str, TransportMetrics] = {}
+		self._since = time.time()
+
+	def _method_metrics(self, interface: str, method: str) -> MethodMetrics:
+		key = (interface, method)
+		metrics = self._methods.get(key)
+		if not metrics:
+			if method != OTHER_METHOD and sum(1 for _interface, _method in self._methods if _interface == interface) >= MAX_METHODS:
+				return self._method_metrics(interface, OTHER_METHOD)
+			metrics = self._methods[key] = MethodMetrics()
+		return metrics
+
+	def _transport_metrics(self, transport: str) -> TransportMetrics:
+		metrics = self._transports.get(transport)
+		if not metrics:
+			metrics = self._transports[transport] = TransportMetrics()
+		return metrics
+
+	def observe(self, interface: str, method: str, duration: float, error: bool = False, transport: str = "http") -> None:
+		"""
+		Records a processed RPC, `duration` in seconds.
+		"""
+		with self._lock:
+			metrics = self._method_metrics(interface, method)
+			metrics.durations.record(round(duration * 1_000_000))
+			transport_metrics = self._transport_metrics(transport)
+			transport_metrics.requests += 1
+			if error:
+				metrics.errors += 1
+				transport_metrics.errors += 1
+
+	def observe_payload(self, interface: str, methods: list[str], request_size: int, response_size: int, transport: str = "http") -> None:
+		"""
+		Records the payload sizes of a request, the sizes of batch requests are divided between the RPCs.
+		"""
+		with self._lock:
+			transport_metrics = self._transport_metrics(transport)
+			transport_metrics.request_bytes += request_size
+			transport_metrics.response_bytes += response_size
+			for method in methods:
+				metrics = self._method_metrics(interface, method)
+				metrics.request_sizes.record(request_size // len(methods))
+				metrics.response_sizes.record(response_size // len(methods))
+
+	def reset(self) -> None:
+		with self._lock:
+			self._methods = {}
+			self._transports = {}
+			self._since = time.time()
+
+	def get_metrics(self) -> dict[str, Any]:
+		with self._lock:
+			interfaces: dict[str, dict[str, Any]] = {}
+			for (interface, method), metrics in sorted(self._methods.items()):
+				interfaces.setdefault(interface, {})[method] = metrics.to_dict()
+			return {
+				"since": self._since,
+				"interfaces": interfaces,
+				"transports": {transport: metrics.to_dict() for transport, metrics in sorted(self._transports.items())},
+			}
+
+	def _histogram_lines(
+		self, name: str, labels: dict[str, str], histogram: LogLinearHistogram, bounds: tuple[float, ...], scale: float
+	) -> list[str]:
+		lines = []
+		# The recorded values are scaled to the unit of the bounds
+		counts = histogram.cumulative_counts(tuple(bound / scale for bound in bounds))
+		for bound, count in zip(bounds, counts):
+			lines.append(f"{name}_bucket{{{_labels(**labels, le=f'{bound:g}')}}} {count}")
+		lines.append(f"{name}_bucket{{{_labels(**labels, le='+Inf')}}} {histogram.count}")
+		lines.append(f"{name}_sum{{{_labels(**labels)}}} {histogram.sum * scale:g}")
+		lines.append(f"{name}_count{{{_labels(**labels)}}} {histogram.count}")
+		return lines
+
+	def to_prometheus(self) -> str:
+		"""
+		Returns the metrics in the Prometheus text exposition format.
+		"""
+		with self._lock:
+			lines = [
+				"# HELP opsiclientd_rpc_requests_total Processed RPCs.",
+				"# TYPE opsiclientd_rpc_requests_total counter",
+			]
+			methods = sorted(self._methods.items())
+			for (interface, method), metrics in methods:
+				lines.append(f"opsiclientd_rpc_requests_total{{{_labels(interface=interface, method=method)}}} {metrics.durations.count}")
+			lines += ["# HELP opsiclientd_rpc_errors_total Failed RPCs.", "# TYPE opsiclientd_rpc_errors_total counter"]
+			for (interface, method), metrics in methods:
+				lines.append(f"opsiclientd_rpc_errors_total{{{_labels(interface=interface, method=method)}}} {metrics.errors}")
+
+			for name, help_text, attribute, bounds, scale in (
+				("opsiclientd_rpc_duration_seconds", "Duration of RPCs.", "durations", DURATION_BUCKETS, 1e-6),
+				("opsiclientd_rpc_request_size_bytes", "Request payload size of RPCs.", "request_sizes", SIZE_BUCKETS, 1),
+				("opsiclientd_rpc_response_size_bytes", "Response payload size of RPCs.", "response_sizes", SIZE_BUCKETS, 1),
+			):
+				lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+				for (interface, method), metrics in methods:
+					histogram = getattr(metrics, attribute)
+					if histogram.count:
+						lines += self._histogram_lines(name, {"interface": interface, "method": method}, histogram, bounds, scale)
+
+			for name, help_text, attribute in (
+				("opsiclientd_rpc_transport_requests_total", "RPCs per transport.", "requests"),
+				("opsiclientd_rpc_transport_errors_total", "Failed RPCs per transport.", "errors"),
+				("opsiclientd_rpc_transport_received_bytes_total", "Request payload bytes per transport.", "request_bytes"),
+				("opsiclientd_rpc_transport_sent_bytes_total", "Response payload bytes per transport.", "response_bytes"),
+			):
+				lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+				for transport, transport_metrics in sorted(self._transports.items()):
+					lines.append(f"{name}{{{_labels(transport=transport)}}} {getattr(transport_metrics, attribute)}")
+			return "\n".join(lines) + "\n"
+
+
+rpc_metrics = RPCMetrics()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Profiling of the RPCs opsiclientd sends to the config service, grouped by the calling operation.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Generator
+
+from OPSI.Util import timestamp  # type: ignore[import]
+from opsicommon.logging import get_logger
+
+__all__ = ["OperationProfile", "RPCBudgetExceededError", "RPCProfiler", "parse_budgets", "rpc_profiler"]
+
+logger = get_logger()
+
+# Operation of RPCs sent outside of a profiled operation
+UNASSIGNED_OPERATION = "-"
+# Number of budget violations kept
+MAX_VIOLATIONS = 100
+
+
+class RPCBudgetExceededError(AssertionError):
+	pass
+
+
+@dataclass
+class RPCCall:
+	method: str
+	start: float = field(default_factory=time.time)
+	duration: float = 0.0
+	bytes_sent: int = 0
+	bytes_received: int = 0
+	error: bool = False
+
+
+@dataclass
+class MethodProfile:
+	calls: int = 0
+	errors: int = 0
+	duration: float = 0.0
+	bytes_sent: int = 0
+	bytes_received: int = 0
+
+	def add(self, call: RPCCall) -> None:
+		self.calls += 1
+		self.errors += int(call.error)
+		self.duration += call.duration
+		self.bytes_sent += call.bytes_sent
+		self.bytes_received += call.bytes_received
+
+	def merge(self, other: MethodProfile) -> None:
+		self.calls += other.calls
+		self.errors += other.errors
+		self.duration += other.duration
+		self.bytes_sent += other.bytes_sent
+		self.bytes_received += other.bytes_received
+
+	def to_dict(self) -> dict[str, Any]:
+		return {
+			"calls": self.calls,
+			"errors": self.errors,
+			"duration": self.duration,
+			"bytes_sent": self.bytes_sent,
+			"bytes_received": self.bytes_received,
+		}
+
+
+@dataclass
+class OperationProfile(MethodProfile):
+	"""
+	RPCs of one or (in the totals of the profiler) all executions of an operation.
+	RPCs of nested operations are included in the profiles of the enclosing operations.
+	"""
+
+	name: str = ""
+	executions: int = 0
+	methods: dict[str, MethodProfile] = field(default_factory=dict)
+
+	def add(self, call: RPCCall) -> None:
+		super().add(call)
+		method = self.methods.get(call.method)
+		if not method:
+			method = self.methods[call.method] = MethodProfile()
+		method.add(call)
+
+	def merge(self, other: OperationProfile) -> None:  # type: ignore[override]
+		super().merge(other)
+		self.executions += other.executions
+		for name, other_method in other.methods.items():
+			method = self.methods.get(name)
+			if not method:
+				method = self.methods[name] = MethodProfile()
+			method.merge(other_method)
+
+	def summary(self) -> str:
+		lines = [
+			f"rpcs: {self.calls}, errors: {self.errors}, duration: {self.duration:0.3f} seconds, "
+			f"sent: {self.bytes_sent} bytes, received: {self.bytes_received} bytes"
+		]
+		for name, method in sorted(self.methods.items(), key=lambda item: (-item[1].calls, item[0])):
+			lines.append(
+				f"{name}: {method.calls} calls, {method.duration:0.3f} seconds, sent: {method.bytes_sent} bytes, "
+				f"received: {method.bytes_received} bytes" + (f", errors: {method.errors}" if method.errors else "")
+			)
+		return "\n".join(lines)
+
+	def to_dict(self) -> dict[str, Any]:
+		return super().to_dict() | {
+			"name": self.name,
+			"executions": self.executions,
+			"methods": {name: method.to_dict() for name, method in sorted(self.methods.items())},
+		}
+
+
+def parse_budgets(value: str | dict[str, int]) -> dict[str, int]:
+	"""
+	Parses call budgets in the format `<operation>:<max calls>[,<operation>:<max calls>]`.
+	"""
+	if isinstance(value, dict):
+		return {str(operation): int(max_calls) for operation, max_calls in value.items()}
+	budgets = {}
+	for entry in str(value).split(","):
+		entry = entry.strip()
+		if not entry:
+			continue
+		operation, sep, max_calls = entry.rpartition(":")
+		if not sep or not operation.strip():
+			raise ValueError(f"Invalid rpc call budget {entry!r}, expected <operation>:<max calls>")
+		budgets[operation.strip()] = int(max_calls)
+	return budgets
+
+
+class RPCProfiler:
+	"""
+	Records the RPCs sent to the config service with method, duration, payload sizes and the calling operation.
+	Operations are marked with the `operation` context manager / decorator and tracked per thread.
+	If an operation has a call budget and exceeds it, a warning is logged and the violation is recorded.
+	Inside of the `enforce_budgets` context manager violations raise a RPCBudgetExceededError.
+	"""
+
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self._operations: ContextVar[tuple[OperationProfile, ...]] = ContextVar("rpc_profiler_operations", default=())
+		self._call: ContextVar[RPCCall | None] = ContextVar("rpc_profiler_call", default=None)
+		self._totals: dict[str, OperationProfile] = {}
+		self.budgets: dict[str, int] = {}
+		# The latest budget violations and the number of all violations
+		self.violations: deque[str] = deque(maxlen=MAX_VIOLATIONS)
+		self._violation_count = 0
+
+	def configure_budgets(self, budgets: str | dict[str, int]) -> None:
+		self.budgets = parse_budgets(budgets)
+
+	def _add_timeline_event(self, profile: OperationProfile, start: float, is_error: bool) -> None:
+		# Imported here, the timeline depends on the config which uses the profiler
+		from opsiclientd.Timeline import Timeline
+
+		try:
+			Timeline().addEvent(
+				title=f"RPCs {profile.name}",
+				description=profile.summary(),
+				category="rpc_profile",
+				isError=is_error,
+				start=timestamp(start),
+				end=timestamp(time.time()),
+			)
+		except Exception as err:
+			logger.debug("Failed to add rpc profile to timeline: %s", err)
+
+	def _check_budget(self, profile: OperationProfile) -> bool:
+		max_calls = self.budgets.get(profile.name)
+		if max_calls is None or profile.calls <= max_calls:
+			return True
+		violation = f"Operation {profile.name!r} exceeded its rpc call budget: {profile.calls} > {max_calls}"
+		logger.warning("%s\n%s", violation, profile.summary())
+		with self._lock:
+			self.violations.append(violation)
+			self._violation_count += 1
+		return False
+
+	@contextmanager
+	def operation(self, name: str) -> Generator[OperationProfile, None, None]:
+		"""
+		Marks the RPCs sent by the current thread as sent by the operation `name`.
+		Can also be used as decorator.
+		"""
+		profile = OperationProfile(name=name, executions=1)
+		start = time.time()
+		token = self._operations.set(self._operations.get() + (profile,))
+		try:
+			yield profile
+		finally:
+			self._operations.reset(token)
+			with self._lock:
+				total = self._totals.get(name)
+				if not total:
+					total = self._totals[name] = OperationProfile(name=name)
+				total.merge(profile)
+			within_budget = self._check_budget(profile)
+			if profile.calls:
+				logger.info("RPCs of operation %r: %s", name, profile.summary())
+				self._add_timeline_event(profile, start, not within_budget)
+
+	@contextmanager
+	def call(self, method: str) -> Generator[RPCCall, None, None]:
+		"""
+		Records a RPC sent in the current thread.
+		"""
+		rpc_call = RPCCall(method=method)
+		start = time.perf_counter()
+		token = self._call.set(rpc_call)
+		try:
+			yield rpc_call
+		except BaseException:
+			rpc_call.error = True
+			raise
+		finally:
+			self._call.reset(token)
+			rpc_call.duration = time.perf_counter() - start
+			self.record(rpc_call)
+
+	def record(self, rpc_call: RPCCall) -> None:
+		operations = self._operations.get()
+		with self._lock:
+			for profile in operations:
+				profile.add(rpc_call)
+			if not operations:
+				total = self._totals.get(UNASSIGNED_OPERATION)
+				if not total:
+					total = self._totals[UNASSIGNED_OPERATION] = OperationProfile(name=UNASSIGNED_OPERATION)
+				total.add(rpc_call)
+
+	def add_transfer(self, bytes_sent: int, bytes_received: int) -> None:
+		"""
+		Adds the payload of a request to the RPC currently sent in this thread.
+		"""
+		rpc_call = self._call.get()
+		if rpc_call:
+			rpc_call.bytes_sent += bytes_sent
+			rpc_call.bytes_received += bytes_received
+
+	def wrap_service(self, service: Any) -> None:
+		"""
+		Profiles the RPCs sent by the jsonrpc method of a service client.
+		"""
+		jsonrpc: Callable | None = getattr(service, "jsonrpc", None)
+		if not jsonrpc or getattr(jsonrpc, "rpc_profiled", False):
+			return
+
+		def profiled_jsonrpc(*args: Any, **kwargs: Any) -> Any:
+			method = args[0] if args else kwargs.get("method", "")
+			with self.call(str(method)):
+				return jsonrpc(*args, **kwargs)
+
+		profiled_jsonrpc.rpc_profiled = True  # type: ignore[attr-defined]
+		service.jsonrpc = profiled_jsonrpc
+
+	def get_profile(self) -> dict[str, Any]:
+		with self._lock:
+			return {name: profile.to_dict() for name, profile in sorted(self._totals.items())}
+
+	def reset(self) -> None:
+		with self._lock:
+			self._totals = {}
+			self.violations.clear()
+			self._violation_count = 0
+
+	@contextmanager
+	def enforce_budgets(self, budgets: str | dict[str, int] | None = None) -> Generator[RPCProfiler, None, None]:
+		"""
+		Raises a RPCBudgetExceededError on exit if an operation exceeded its call budget inside of the context.
+		Meant for tests, the configured budgets are restored on exit.
+		"""
+		saved_budgets = self.budgets
+		if budgets is not None:
+			self.budgets = self.budgets | parse_budgets(budgets)
+		with self._lock:
+			violation_count = self._violation_count
+		try:
+			yield self
+		finally:
+			self.budgets = saved_budgets
+			with self._lock:
+				new_count = min(self._violation_count - violation_count, len(self.violations))
+				new_violations = list(self.violations)[len(self.violations) - new_count :]
+		if new_violations:
+			raise RPCBudgetExceededError("\n".join(new_violations))
+
+
+rpc_profiler = RPCProfiler()
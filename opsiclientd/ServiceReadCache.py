@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Memoization of config service reads during the processing of an event.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+from copy import deepcopy
+from typing import Any, Callable
+
+from opsicommon.logging import get_logger
+
+__all__ = ["ServiceReadCache", "is_memoized_method", "is_read_method"]
+
+logger = get_logger()
+
+MEMOIZED_METHOD_SUFFIXES = ("_getObjects", "_getIdents")
+MEMOIZED_METHODS = ("configState_getValues",)
+# Reads which are not memoized, besides methods with an operation starting with "get"
+READ_METHODS = ("backend_info", "accessControl_authenticated", "accessControl_userIsAdmin", "accessControl_userIsReadOnlyUser", "log_read")
+OBJECT_CLASSES = (
+	"host",
+	"config",
+	"configState",
+	"product",
+	"productProperty",
+	"productDependency",
+	"productOnDepot",
+	"productOnClient",
+	"productPropertyState",
+	"group",
+	"objectToGroup",
+	"auditSoftware",
+	"auditSoftwareOnClient",
+	"auditHardware",
+	"auditHardwareOnHost",
+	"licenseContract",
+	"softwareLicense",
+	"licensePool",
+	"softwareLicenseToLicensePool",
+	"licenseOnClient",
+	"auditSoftwareToLicensePool",
+)
+# Writes to an object class which change the results of reads of other object classes
+DEPENDENT_OBJECT_CLASSES = {
+	"config": ("configState",),
+	"group": ("objectToGroup",),
+	"productGroup": ("objectToGroup",),
+	"hostGroup": ("objectToGroup",),
+	"product": ("productOnDepot", "productOnClient", "productProperty", "productDependency", "productPropertyState"),
+	"productProperty": ("productPropertyState",),
+}
+
+
+def is_memoized_method(method: str) -> bool:
+	return method in MEMOIZED_METHODS or method.endswith(MEMOIZED_METHOD_SUFFIXES)
+
+
+def is_read_method(method: str) -> bool:
+	operation = method.partition("_")[2] or method
+	return is_memoized_method(method) or method in READ_METHODS or operation.startswith("get")
+
+
+def _normalize(value: Any) -> Any:
+	if isinstance(value, dict):
+		return {str(key): _normalize(val) for key, val in value.items()}
+	if isinstance(value, (list, tuple, set)):
+		values = [_normalize(val) for val in value]
+		if all(isinstance(val, (str, int, float)) for val in values):
+			# Filter values match any of the values, the order is irrelevant
+			return sorted(set(values), key=lambda val: (str(type(val)), val))
+		return values
+	if hasattr(value, "to_hash"):
+		return _normalize(value.to_hash())
+	return value
+
+
+def _cache_key(method: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> str:
+	return json.dumps([method, _normalize(args), _normalize(kwargs)], sort_keys=True, default=repr)
+
+
+class ServiceReadCache:
+	"""
+	Sits in front of a config service backend and memoizes the results of idempotent reads
+	(`*_getObjects`, `*_getIdents`, `configState_getValues`) by method and normalized arguments.
+	Any other call to a method of an object class removes the memoized reads of the object class and its dependent classes,
+	calls of all other methods which are not known as reads (like `setProductActionRequest`) remove all memoized reads.
+	Callers get copies of the memoized results, so modifying a result does not change the cache.
+	The cache is meant to live for the processing of one event, changes made by other clients are not noticed.
+	"""
+
+	def __init__(self, backend: Any) -> None:
+		self._backend = backend
+		self._lock = threading.Lock()
+		# Memoized results by object class and cache key
+		self._results: dict[str, dict[str, Any]] = {}
+		# Incremented on every invalidation, results read before an invalidation are not memoized
+		self._generation = 0
+		self.hits = 0
+		self.misses = 0
+
+	@property
+	def backend(self) -> Any:
+		return self._backend
+
+	def clear(self) -> None:
+		with self._lock:
+			self._results = {}
+			self._generation += 1
+
+	def invalidate(self, object_class: str) -> None:
+		with self._lock:
+			for cls in (object_class, *DEPENDENT_OBJECT_CLASSES.get(object_class, ())):
+				self._results.pop(cls, None)
+			self._generation += 1
+
+	def _call(self, method: str, func: Callable, args: tuple[Any, ...], kwargs: dict[str, Any]) -> Any:
+		if not is_memoized_method(method):
+			if not is_read_method(method):
+				object_class = method.partition("_")[0]
+				if object_class in OBJECT_CLASSES:
+					self.invalidate(object_class)
+				else:
+					logger.trace("Removing all memoized reads on call of %s", method)
+					self.clear()
+			return func(*args, **kwargs)
+
+		object_class = method.partition("_")[0]
+		key = _cache_key(method, args, kwargs)
+		with self._lock:
+			results = self._results.get(object_class)
+			if results and key in results:
+				self.hits += 1
+				logger.trace("Using memoized result of %s", method)
+				return deepcopy(results[key])
+			self.misses += 1
+			generation = self._generation
+
+		result = func(*args, **kwargs)
+		with self._lock:
+			if generation == self._generation:
+				self._results.setdefault(object_class, {})[key] = deepcopy(result)
+		return result
+
+	def __getattr__(self, name: str) -> Any:
+		if name == "_backend":
+			raise AttributeError(name)
+		attribute = getattr(self._backend, name)
+		if name.startswith("_") or not callable(attribute):
+			return attribute
+
+		def memoized(*args: Any, **kwargs: Any) -> Any:
+			return self._call(name, attribute, args, kwargs)
+
+		return memoized
+
+	def get_statistics(self) -> dict[str, int]:
+		with self._lock:
+			return {"hits": self.hits, "misses": self.misses, "entries": sum(len(results) for results in self._results.values())}
@@ -174,6 +174,9 @@ class Timeline(metaclass=Singleton):
 			elif event["category"] in ("event_processing", "event_occurrence"):
 				event["color"] = "#D7CB1E"
 				event["textColor"] = "#D7CB1E"
+			elif event["category"] in ("event_processing_phase",):
+				event["color"] = "#E9E08A"
+				event["textColor"] = "#B8AD17"
 			elif event["category"] in ("opsiclientd_running",):
 				event["color"] = "#80A63D"
 				event["textColor"] = "#80A63D"
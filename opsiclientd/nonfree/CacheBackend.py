@@ -50,6 +50,7 @@ from opsicommon.types import forceHostId
 
 from opsiclientd.Config import Config as OCDConfig
 from opsiclientd.OpsiService import ServiceConnection
+from opsiclientd.RPCProfiler import rpc_profiler
 
 __all__ = ["ClientCacheBackend"]
 
@@ -434,6 +435,7 @@ class ClientCacheBackend(ConfigDataBackend, ModificationTrackingBackend):
 					mergeObjectsFunction_pcs,
 				)
 
+	@rpc_profiler.operation("ClientCacheBackend._replicateMasterToWorkBackend")
 	def _replicateMasterToWorkBackend(self) -> None:
 		if not self._masterBackend:
 			raise BackendConfigurationError("Master backend undefined")
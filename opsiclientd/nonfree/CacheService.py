@@ -18,9 +18,10 @@ import shutil
 import threading
 import time
 from collections import defaultdict
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Type
+from typing import TYPE_CHECKING, Any, Callable, Generator, Type
 from urllib.parse import urlparse
 
 from OPSI import System  # type: ignore[import]
@@ -33,7 +34,7 @@ from OPSI.Backend.SQLite import (  # type: ignore[import]
 )
 from OPSI.Util import randomString  # type: ignore[import]
 from OPSI.Util.File.Opsi import PackageContentFile  # type: ignore[import]
-from OPSI.Util.Message import ProgressSubjectProxy  # type: ignore[import]
+from OPSI.Util.Message import ProgressObserver, ProgressSubjectProxy  # type: ignore[import]
 from OPSI.Util.Repository import (  # type: ignore[import]
 	DepotToLocalDirectorySychronizer,
 	Repository,
@@ -51,9 +52,12 @@ from opsicommon.types import (
 )
 from packaging import version
 
+from opsiclientd.Bandwidth import TransferPriority, bandwidth_manager
 from opsiclientd.Config import Config
+from opsiclientd.DepotDownload import DepotFileDownloader
 from opsiclientd.Events.SyncCompleted import SyncCompletedEventGenerator
 from opsiclientd.Events.Utilities.Generators import getEventGenerators
+from opsiclientd.FileVerification import ProductVerifier, VerificationIndex, VerificationResult
 from opsiclientd.nonfree import verify_modules
 from opsiclientd.nonfree.CacheBackend import (
 	ClientCacheBackend,
@@ -61,10 +65,12 @@ from opsiclientd.nonfree.CacheBackend import (
 )
 from opsiclientd.nonfree.RPCProductDependencyMixin import RPCProductDependencyMixin
 from opsiclientd.OpsiService import ServiceConnection
+from opsiclientd.PeerCache import PEER_CACHE_USERNAME, Peer, PeerCacheDiscovery, fetch_from_peers, peer_bandwidth_manager
+from opsiclientd.RPCProfiler import rpc_profiler
 from opsiclientd.State import State
 from opsiclientd.SystemCheck import RUNNING_ON_DARWIN, RUNNING_ON_WINDOWS
 from opsiclientd.Timeline import Timeline
-from opsiclientd.utils import get_include_exclude_product_ids
+from opsiclientd.utils import get_include_exclude_product_ids, get_prefetch_product_ids, in_working_window
 
 if TYPE_CHECKING:
 	from opsiclientd.Opsiclientd import Opsiclientd
@@ -80,6 +86,24 @@ MIN_HEARTBEAT_INTERVAL = 1.0
 logger = get_logger()
 
 
+class PrefetchCanceled(RuntimeError):
+	pass
+
+
+class PrefetchProgressObserver(ProgressObserver):
+	"""
+	Aborts the synchronization of a prefetched product by raising PrefetchCanceled on the next progress change.
+	"""
+
+	def __init__(self, shouldStop: Callable[[], bool]) -> None:
+		ProgressObserver.__init__(self)
+		self._shouldStop = shouldStop
+
+	def progressChanged(self, subject: Any, state: int, percent: float, timeSpent: float, timeLeft: float, speed: float) -> None:
+		if self._shouldStop():
+			raise PrefetchCanceled("Prefetching cancelled")
+
+
 class TransferSlotHeartbeat(threading.Thread):
 	def __init__(self, service_connection: ServiceConnection, depot_id: str, client_id: str) -> None:
 		super().__init__(daemon=True)
@@ -328,6 +352,12 @@ class CacheService(threading.Thread):
 					return False
 				logger.warning("Ignoring version difference")
 
+			if config.get("cache_service", "verify_products_before_use"):
+				result = self._productCacheService.verifyProduct(productId)
+				if not result.verified:
+					logger.warning("Verification of cached product '%s' failed: %s", productId, result.errors)
+					return False
+
 		return True
 
 	def getProductCacheState(self) -> dict[str, Any]:
@@ -345,11 +375,26 @@ class CacheService(threading.Thread):
 		assert self._productCacheService
 		return self._productCacheService.getProductCacheDir()
 
+	def getCachedProductVersions(self) -> dict[str, str]:
+		self.initializeProductCacheService()
+		assert self._productCacheService
+		return self._productCacheService.getCachedProductVersions()
+
+	def getPeerCacheFile(self, productId: str, path: str) -> str:
+		self.initializeProductCacheService()
+		assert self._productCacheService
+		return self._productCacheService.getPeerCacheFile(productId, path)
+
 	def clear_product_cache(self) -> None:
 		self.initializeProductCacheService()
 		assert self._productCacheService
 		return self._productCacheService.clear_cache()
 
+	def verifyProducts(self, productIds: list[str] | None = None) -> dict[str, dict[str, Any]]:
+		self.initializeProductCacheService()
+		assert self._productCacheService
+		return {productId: result.to_dict() for productId, result in self._productCacheService.verifyProducts(productIds).items()}
+
 
 class ConfigCacheServiceBackendExtension42(RPCProductDependencyMixin):
 	def accessControl_authenticated(self) -> bool:
@@ -897,6 +942,14 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 		self._overallProgressObserver: ProgressSubjectProxy | None = None
 
 		self._repository: Repository | None = None
+		self._peerCache: PeerCacheDiscovery | None = None
+		self._prefetchNotBefore = 0.0
+
+		self._verifier = ProductVerifier(VerificationIndex(os.path.join(self._storageDir, "product_verification.json")))
+		self._verificationLock = threading.Lock()
+		# Number of running verifications which are not in background, background verification is cancelled while > 0
+		self._verificationRequests = 0
+		self._verificationRequestsLock = threading.Lock()
 
 		if not os.path.exists(self._storageDir):
 			logger.notice("Creating cache service storage dir '%s'", self._storageDir)
@@ -913,10 +966,11 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 			self._state = pcss
 
 	def _updateConfig(self) -> None:
-		self._storageDir = config.get("cache_service", "storage_dir")
+		cache_service_config = config.snapshot.cache_service
+		self._storageDir = cache_service_config.storage_dir
 		self._tempDir = os.path.join(self._storageDir, "tmp")
 		self._productCacheDir = os.path.join(self._storageDir, "depot")
-		self._productCacheMaxSize = forceInt(config.get("cache_service", "product_cache_max_size"))
+		self._productCacheMaxSize = forceInt(cache_service_config.product_cache_max_size)
 
 	def getProductCacheDir(self) -> str:
 		return self._productCacheDir
@@ -927,7 +981,7 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 		_state["working"] = self.isWorking()
 		_state["maxBandwidth"] = self._maxBandwidth
 		_state["dynamicBandwidth"] = self._dynamicBandwidth
-		return _state
+		return _state | {"bandwidth": bandwidth_manager.get_state()}
 
 	def isRunning(self) -> bool:
 		return self._running
@@ -938,13 +992,159 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 	def stop(self) -> None:
 		self._stopped = True
 
+	def getCachedProductVersions(self) -> dict[str, str]:
+		"""
+		Returns the versions of the completely cached and verified products, which are shared with peers.
+		"""
+		return dict(self._state.get("cached_product_versions") or {})
+
+	def getPeerCacheFile(self, productId: str, path: str) -> str:
+		"""
+		Returns the local path of a file of a shared product.
+		"""
+		if productId not in self.getCachedProductVersions():
+			raise FileNotFoundError(f"Product '{productId}' not shared")
+		productDir = os.path.realpath(os.path.join(self._productCacheDir, productId))
+		file = os.path.realpath(os.path.join(productDir, path))
+		if not file.startswith(productDir + os.sep) or not os.path.isfile(file):
+			raise FileNotFoundError(f"File '{path}' of product '{productId}' not found")
+		return file
+
+	def _setCachedProductVersion(self, productId: str, productVersion: str | None) -> None:
+		"""
+		Sets the version of a completely cached and verified product, `None` while the product is modified or removed.
+		"""
+		products = self._state.setdefault("cached_product_versions", {})
+		if productVersion:
+			products[productId] = productVersion
+		elif products.pop(productId, None) is None:
+			return
+		state.set("product_cache_service", self._state)
+		if self._peerCache:
+			self._peerCache.update_products(self.getCachedProductVersions())
+
+	def _updatePeerCache(self) -> None:
+		"""
+		Starts or stops the peer cache discovery as configured.
+		"""
+		cache_service_config = config.snapshot.cache_service
+		enabled = cache_service_config.peer_cache_enabled
+		if enabled and not cache_service_config.peer_cache_secret:
+			logger.warning("Peer cache enabled but no peer cache secret configured")
+			enabled = False
+		if not enabled:
+			if self._peerCache:
+				self._peerCache.stop()
+				self._peerCache = None
+			return
+		if self._peerCache:
+			return
+		peerCache = PeerCacheDiscovery(config.snapshot.global_.host_id, config.snapshot.control_server.port)
+		try:
+			peerCache.start(self.getCachedProductVersions())
+		except Exception as err:
+			logger.error("Failed to start peer cache discovery: %s", err, exc_info=True)
+			return
+		self._peerCache = peerCache
+
 	def setMaxBandwidth(self, maxBandwidth: int) -> None:
 		self._maxBandwidth = forceInt(maxBandwidth)
 
 	def setDynamicBandwidth(self, dynamicBandwidth: bool) -> None:
 		self._dynamicBandwidth = forceBool(dynamicBandwidth)
 
-	def start_caching_or_get_waiting_time(self) -> float:
+	@contextmanager
+	def _verificationRequest(self) -> Generator[None, None, None]:
+		with self._verificationRequestsLock:
+			self._verificationRequests += 1
+		try:
+			yield
+		finally:
+			with self._verificationRequestsLock:
+				self._verificationRequests -= 1
+
+	def verifyProduct(
+		self, productId: str, maxWorkers: int | None = None, shouldStop: Callable[[], bool] | None = None, background: bool = False
+	) -> VerificationResult:
+		"""
+		Verifies the cached files of a product against its package content file.
+		A completed product which fails the verification is marked as not completed, so it is cached again.
+		A running background verification is cancelled as soon as a verification which is not in background starts.
+		"""
+		productDir = os.path.join(self._productCacheDir, productId)
+		packageContentFile = os.path.join(productDir, f"{productId}.files")
+		if not os.path.exists(packageContentFile):
+			result = VerificationResult(product_id=productId, errors={f"{productId}.files": "package content file missing"})
+		else:
+			with nullcontext() if background else self._verificationRequest(), self._verificationLock:
+				result = self._verifier.verify(
+					productId,
+					productDir,
+					PackageContentFile(packageContentFile).parse(),
+					max_workers=maxWorkers or config.get("cache_service", "verification_workers"),
+					should_stop=shouldStop,
+				)
+		if result.cancelled:
+			return result
+
+		self._setProductCacheState(productId, "verified", time.time() if result.verified else None, updateProductOnClient=False)
+		if not result.verified:
+			self._setCachedProductVersion(productId, None)
+		if not result.verified and self._state.get("products", {}).get(productId, {}).get("completed"):
+			logger.error("Cached product '%s' is corrupted: %s", productId, result.errors)
+			timeline.addEvent(
+				title=f"Cached product {productId} corrupted",
+				description=f"Verification of cached product '{productId}' failed: {result.errors}",
+				category="product_caching",
+				isError=True,
+			)
+			self._setProductCacheState(productId, "completed", None, updateProductOnClient=False)
+			self._setProductCacheState(productId, "failure", "Verification of cached files failed", updateProductOnClient=False)
+		return result
+
+	def verifyProducts(
+		self,
+		productIds: list[str] | None = None,
+		maxWorkers: int | None = None,
+		shouldStop: Callable[[], bool] | None = None,
+		background: bool = False,
+	) -> dict[str, VerificationResult]:
+		"""
+		Verifies the given or all completely cached products.
+		"""
+		if productIds is None:
+			productIds = [productId for productId, productState in self._state.get("products", {}).items() if productState.get("completed")]
+		results = {}
+		for productId in forceProductIdList(productIds):
+			results[productId] = self.verifyProduct(productId, maxWorkers=maxWorkers, shouldStop=shouldStop, background=background)
+			if results[productId].cancelled:
+				break
+		return results
+
+	def _verifyProductsInBackground(self) -> None:
+		interval = config.get("cache_service", "product_verification_interval")
+		if interval <= 0 or time.time() - self._state.get("products_verified", 0) < interval:
+			return
+
+		logger.info("Verifying cached products in background")
+		# A single worker and cancelled as soon as products are to be cached or verified before use
+		results = self.verifyProducts(
+			maxWorkers=1,
+			shouldStop=lambda: self._stopped or self._cacheProductsRequested or self._verificationRequests > 0,
+			background=True,
+		)
+		if any(result.cancelled for result in results.values()):
+			logger.info("Verification of cached products cancelled")
+			return
+		self._state["products_verified"] = time.time()
+		state.set("product_cache_service", self._state)
+
+	@contextmanager
+	def _transferSlot(self) -> Generator[float, None, None]:
+		"""
+		Acquires a transfer slot of the depot.
+		Yields 0.0 if a slot was acquired, otherwise the waiting time suggested by the server.
+		"""
 		assert self._configService
 		try_after_seconds: float = 0.0
 		heartbeat_thread = None
@@ -957,17 +1157,10 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 				response = heartbeat_thread.acquire()
 				try_after_seconds = float(response.get("retry_after") or 0.0)
 				logger.debug("depot_acquireTransferSlot produced response %s", response)
-			if not try_after_seconds:
-				if heartbeat_thread:
-					logger.info("Starting transfer slot heartbeat thread")
-					heartbeat_thread.start()
-				logger.notice("Starting to cache products")
-				self._cacheProducts()
-				self._cacheProductsRequested = False
-				logger.info("Finished caching products")
-				return 1.0  # check again in 1 second if we have to cache
-			logger.notice("Did not cache Products, server suggested waiting time of %s", try_after_seconds)
-			return try_after_seconds
+			if not try_after_seconds and heartbeat_thread:
+				logger.info("Starting transfer slot heartbeat thread")
+				heartbeat_thread.start()
+			yield try_after_seconds
 		finally:
 			if heartbeat_thread:
 				logger.debug("Releasing transfer slot %s", heartbeat_thread.slot_id)
@@ -976,6 +1169,133 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 					logger.debug("Joining transfer slot heartbeat thread")
 					heartbeat_thread.join()
 
+	def start_caching_or_get_waiting_time(self) -> float:
+		with self._transferSlot() as try_after_seconds:
+			if not try_after_seconds:
+				logger.notice("Starting to cache products")
+				self._cacheProducts()
+				self._cacheProductsRequested = False
+				logger.info("Finished caching products")
+				return 1.0  # check again in 1 second if we have to cache
+		logger.notice("Did not cache Products, server suggested waiting time of %s", try_after_seconds)
+		return try_after_seconds
+
+	def _prefetchProductsInBackground(self) -> None:
+		cache_service_config = config.snapshot.cache_service
+		if not cache_service_config.prefetch_enabled or time.time() < self._prefetchNotBefore:
+			return
+		if time.time() - self._state.get("products_prefetched", 0) < cache_service_config.prefetch_interval:
+			return
+		if cache_service_config.prefetch_working_window:
+			try:
+				if not in_working_window(cache_service_config.prefetch_working_window):
+					return
+			except Exception as err:
+				logger.error("Invalid prefetch working window %r: %s", cache_service_config.prefetch_working_window, err)
+				return
+		if self.opsiclientd and self.opsiclientd.getEventProcessingThreads():
+			logger.debug("Not prefetching products while events are processed")
+			return
+
+		logger.info("Prefetching products in background")
+		connected = False
+		try:
+			if not self._configService:
+				self.connectConfigService()
+				connected = True
+			with self._transferSlot() as try_after_seconds:
+				if try_after_seconds:
+					logger.info("Did not prefetch products, server suggested waiting time of %s", try_after_seconds)
+					self._prefetchNotBefore = time.time() + try_after_seconds
+					return
+				self._prefetchProducts()
+		except Exception as err:
+			logger.error("Failed to prefetch products: %s", err, exc_info=True)
+		finally:
+			if connected:
+				self.disconnectConfigService()
+		self._state["products_prefetched"] = time.time()
+		state.set("product_cache_service", self._state)
+
+	@rpc_profiler.operation("ProductCacheService._prefetchProducts")
+	def _prefetchProducts(self) -> None:
+		"""
+		Caches the newer depot versions of the installed products and the products of the prefetch groups,
+		so the product files are already cached when an action is requested.
+		Prefetching stops as soon as products are to be cached, also while the files of a product are synchronized.
+		Space of other cached products is never freed.
+		"""
+		self._updateConfig()
+		assert self._configService
+		config_snapshot = config.snapshot
+		includeProductIds, excludeProductIds = get_include_exclude_product_ids(
+			self._configService,
+			list(config_snapshot.cache_service.include_product_group_ids),
+			list(config_snapshot.cache_service.exclude_product_group_ids),
+		)
+		installedVersions = {
+			poc.productId: f"{poc.productVersion}-{poc.packageVersion}"
+			for poc in self._configService.productOnClient_getObjects(
+				productType="LocalbootProduct",
+				clientId=config_snapshot.global_.host_id,
+				installationStatus="installed",
+				attributes=["productVersion", "packageVersion"],
+				productId=includeProductIds,
+			)
+		}
+		groupProductIds = []
+		if config_snapshot.cache_service.prefetch_product_group_ids:
+			groupProductIds = [
+				obj.objectId
+				for obj in self._configService.objectToGroup_getObjects(
+					groupType="ProductGroup", groupId=list(config_snapshot.cache_service.prefetch_product_group_ids)
+				)
+				if not includeProductIds or obj.objectId in includeProductIds
+			]
+		candidateProductIds = sorted(set(installedVersions) | set(groupProductIds))
+		if not candidateProductIds:
+			logger.info("No products to prefetch")
+			return
+
+		depotVersions = {
+			pod.productId: f"{pod.productVersion}-{pod.packageVersion}"
+			for pod in self._configService.productOnDepot_getObjects(
+				depotId=config_snapshot.depot_server.master_depot_id, productId=candidateProductIds
+			)
+			if pod.productType == "LocalbootProduct"
+		}
+		productIds = get_prefetch_product_ids(
+			installedVersions, depotVersions, groupProductIds, self.getCachedProductVersions(), excludeProductIds
+		)
+		if not productIds:
+			logger.info("All products to prefetch are cached")
+			return
+
+		p_list = ", ".join(productIds)
+		logger.notice("Prefetching products: %s", p_list)
+		eventId = timeline.addEvent(
+			title="Prefetch products", description=f"Prefetching products: {p_list}", category="product_caching", durationEvent=True
+		)
+		try:
+			for productId in productIds:
+				try:
+					if self._prefetchCanceled():
+						raise PrefetchCanceled("Prefetching cancelled")
+					self._cacheProduct(productId, productIds, prefetch=True)
+				except PrefetchCanceled:
+					logger.notice("Prefetching products cancelled")
+					break
+				except Exception as err:
+					logger.warning("Failed to prefetch product '%s': %s", productId, err)
+		finally:
+			timeline.setEventEnd(eventId)
+			if self._repository:
+				self._repository.disconnect()
+				self._repository = None
+
+	def _prefetchCanceled(self) -> bool:
+		return self._stopped or self._cacheProductsRequested
+
 	def run(self) -> None:
 		with log_context({"instance": "product cache service"}):
 			self._running = True
@@ -987,10 +1307,17 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 						if not self._configService:
 							self.connectConfigService()
 						sleep_time = self.start_caching_or_get_waiting_time()
+					elif not self._working:
+						self._updatePeerCache()
+						self._prefetchProductsInBackground()
+						self._verifyProductsInBackground()
 					time.sleep(sleep_time)
 			except Exception as err:
 				logger.error(err, exc_info=True)
 			finally:
+				if self._peerCache:
+					self._peerCache.stop()
+					self._peerCache = None
 				self.disconnectConfigService()
 			logger.notice("Product cache service ended")
 			self._running = False
@@ -1002,9 +1329,13 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 			for product in os.listdir(productCacheDir):
 				deleteDir = os.path.join(productCacheDir, product)
 				shutil.rmtree(deleteDir)
+				self._verifier.index.remove_product(product)
 			self._state["products"] = {}
 			self._state["products_cached"] = False
+			self._state["cached_product_versions"] = {}
 			state.set("product_cache_service", self._state)
+			if self._peerCache:
+				self._peerCache.update_products({})
 
 	def cacheProducts(
 		self, productProgressObserver: ProgressSubjectProxy | None = None, overallProgressObserver: ProgressSubjectProxy | None = None
@@ -1093,7 +1424,9 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 				if not os.path.exists(deleteDir):
 					raise RuntimeError(f"Directory '{deleteDir}' not found")
 
+				self._setCachedProductVersion(deleteProduct, None)
 				shutil.rmtree(deleteDir)
+				self._verifier.index.remove_product(deleteProduct)
 				freedSpace += productDirSizes[deleteProduct]
 				if self._state.get("products", {}).get(deleteProduct):
 					del self._state["products"][deleteProduct]
@@ -1105,8 +1438,10 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 		except Exception as err:
 			raise RuntimeError(f"Failed to free enough disk space for product cache: {err}") from err
 
+	@rpc_profiler.operation("ProductCacheService._cacheProducts")
 	def _cacheProducts(self) -> None:
 		self._updateConfig()
+		self._updatePeerCache()
 		self._working = True
 		self._state["products_cached"] = False
 		self._state["products"] = {}
@@ -1118,10 +1453,11 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 				self.connectConfigService()
 			assert self._configService
 
+			config_snapshot = config.snapshot
 			includeProductIds, excludeProductIds = get_include_exclude_product_ids(
 				self._configService,
-				config.get("cache_service", "include_product_group_ids"),
-				config.get("cache_service", "exclude_product_group_ids"),
+				list(config_snapshot.cache_service.include_product_group_ids),
+				list(config_snapshot.cache_service.exclude_product_group_ids),
 			)
 
 			productIds = []
@@ -1129,7 +1465,7 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 				poc
 				for poc in self._configService.productOnClient_getObjects(
 					productType="LocalbootProduct",
-					clientId=config.get("global", "host_id"),
+					clientId=config_snapshot.global_.host_id,
 					actionRequest=["setup", "uninstall", "update", "always", "once", "custom"],
 					attributes=["actionRequest"],
 					productId=includeProductIds,
@@ -1146,7 +1482,7 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 			if not productIds:
 				logger.notice("No product action request set => no products to cache")
 			else:
-				masterDepotId = config.get("depot_server", "master_depot_id")
+				masterDepotId = config_snapshot.depot_server.master_depot_id
 
 				# Get all productOnDepots!
 				productOnDepots = self._configService.productOnDepot_getObjects(depotId=masterDepotId)
@@ -1229,6 +1565,12 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 						title="Cache products", description=f"Caching products: {p_list}", category="product_caching", durationEvent=True
 					)
 
+					try:
+						# Select the depot for all products at once, the cached selection is reused for the single products
+						config.getDepot(configService=self._configService, productIds=productIds)
+					except Exception as err:
+						logger.warning("Failed to select depot for products %s: %s", p_list, err)
+
 					errorsOccured = []
 					try:
 						for productId in productIds:
@@ -1303,7 +1645,7 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 					ProductOnClient(
 						productId=productId,
 						productType="LocalbootProduct",
-						clientId=config.get("global", "host_id"),
+						clientId=config.snapshot.global_.host_id,
 						actionProgress=actionProgress,
 						installationStatus=installationStatus,
 						actionResult=actionResult,
@@ -1360,13 +1702,127 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 		)
 		return self._repository
 
-	def _cacheProduct(self, productId: str, neededProducts: list[str]) -> None:
+	def _downloadLargeFiles(
+		self,
+		productId: str,
+		packageInfo: dict[str, dict[str, Any]],
+		priority: TransferPriority = TransferPriority.CACHING,
+		shouldStop: Callable[[], bool] | None = None,
+	) -> None:
+		"""
+		Downloads large product files from webdav depots resumable before the product is synchronized.
+		The synchronizer keeps existing files with matching size and checksum.
+		"""
+		min_size = config.get("cache_service", "resumable_download_min_size")
+		url = config.get("depot_server", "url")
+		if min_size <= 0 or not str(urlparse(url).scheme).startswith("webdav"):
+			return
+
+		downloader = None
+		for path, fileInfo in packageInfo.items():
+			if fileInfo.get("type") != "f" or int(fileInfo.get("size", 0)) < min_size:
+				continue
+			destination = os.path.join(self._productCacheDir, productId, path)
+			if os.path.exists(destination) and os.path.getsize(destination) == int(fileInfo["size"]):
+				continue
+			if shouldStop and shouldStop():
+				raise PrefetchCanceled("Prefetching cancelled")
+			if not downloader:
+				ca_cert_file = None
+				if (config.get("global", "verify_server_cert") or config.get("global", "verify_server_cert_by_ca")) and os.path.exists(
+					config.ca_cert_file
+				):
+					ca_cert_file = config.ca_cert_file
+				downloader = DepotFileDownloader(
+					url,
+					partial_dir=os.path.join(self._tempDir, "partial"),
+					username=config.get("global", "host_id"),
+					password=config.get("global", "opsi_host_key"),
+					ca_cert_file=ca_cert_file,
+					max_retries=config.get("cache_service", "download_max_retries"),
+					max_bandwidth=self._maxBandwidth,
+					priority=priority,
+					connections=config.get("cache_service", "parallel_download_connections"),
+					parallel_min_size=config.get("cache_service", "parallel_download_min_size"),
+				)
+			logger.info("Downloading large file '%s' of product '%s' (%d bytes)", path, productId, int(fileInfo["size"]))
+			downloader.download(f"{productId}/{path}", destination, size=int(fileInfo["size"]), md5sum=fileInfo.get("md5sum"))
+
+	def _downloadFromPeers(
+		self,
+		productId: str,
+		productVersion: str,
+		packageInfo: dict[str, dict[str, Any]],
+		priority: TransferPriority = TransferPriority.CACHING,
+	) -> None:
+		"""
+		Downloads the product files from clients on the local network which have cached the same product version.
+		The files are verified against the package content file of the depot,
+		files which cannot be fetched from a peer are synchronized from the depot.
+		"""
+		if not self._peerCache:
+			return
+		peers = self._peerCache.get_peers(productId, productVersion)
+		if not peers:
+			logger.info("Product '%s' (%s) not cached by any peer", productId, productVersion)
+			return
+
+		if not os.path.exists(config.ca_cert_file):
+			logger.warning("CA certificate file '%s' not found, not fetching product '%s' from peers", config.ca_cert_file, productId)
+			return
+
+		secret = config.get("cache_service", "peer_cache_secret")
+
+		def createDownloader(peer: Peer) -> DepotFileDownloader:
+			# The control server certificates are issued by the opsi CA for the host id
+			return DepotFileDownloader(
+				peer.url,
+				partial_dir=os.path.join(self._tempDir, "partial"),
+				username=PEER_CACHE_USERNAME,
+				password=secret,
+				ca_cert_file=config.ca_cert_file,
+				server_hostname=peer.host_id,
+				max_retries=1,
+				priority=priority,
+				manager=peer_bandwidth_manager,
+			)
+
+		logger.info("Fetching product '%s' (%s) from peers %s", productId, productVersion, [peer.host_id for peer in peers])
+		result = fetch_from_peers(
+			peers,
+			productId,
+			packageInfo,
+			os.path.join(self._productCacheDir, productId),
+			createDownloader,
+			on_peer_failed=self._peerCache.block_peer,
+		)
 		logger.notice(
-			"Caching product '%s' (max bandwidth: %s, dynamic bandwidth: %s)", productId, self._maxBandwidth, self._dynamicBandwidth
+			"Fetched %d files (%0.3f MB) of product '%s' from peers, %d files left to fetch from the depot",
+			result.files,
+			float(result.size) / (1000 * 1000),
+			productId,
+			len(result.failed),
 		)
-		self._setProductCacheState(productId, "started", time.time())
+
+	def _cacheProduct(self, productId: str, neededProducts: list[str], prefetch: bool = False) -> None:
+		"""
+		Caches the depot version of the product.
+		Prefetched products are cached at the lowest transfer priority, without reporting the progress to the service
+		and without freeing space of other cached products.
+		"""
+		logger.notice(
+			"%s product '%s' (max bandwidth: %s, dynamic bandwidth: %s)",
+			"Prefetching" if prefetch else "Caching",
+			productId,
+			self._maxBandwidth,
+			self._dynamicBandwidth,
+		)
+		priority = TransferPriority.PREFETCH if prefetch else TransferPriority.CACHING
+		self._setProductCacheState(productId, "started", time.time(), updateProductOnClient=not prefetch)
 		self._setProductCacheState(productId, "completed", None, updateProductOnClient=False)
 		self._setProductCacheState(productId, "failure", None, updateProductOnClient=False)
+		# The files are modified while caching
+		self._setCachedProductVersion(productId, None)
 
 		eventId = None
 		repository = None
@@ -1428,6 +1884,8 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 						productId,
 						float(productSize) / (1000 * 1000),
 					)
+					if prefetch:
+						raise RuntimeError("Product cache size limit reached, not freeing space for prefetching")
 					freeSpace = self._productCacheMaxSize - productCacheDirSize
 					neededSpace = productSize - freeSpace + 1000
 					self._freeProductCacheSpace(neededSpace=neededSpace, neededProducts=neededProducts)
@@ -1440,7 +1898,7 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 				)
 
 			eventId = timeline.addEvent(
-				title=f"Cache product {productId} {product_version}",
+				title=f"{'Prefetch' if prefetch else 'Cache'} product {productId} {product_version}",
 				description=(
 					f"Caching product '{productId}' ({product_version}) of size {(float(productSize) / (1000 * 1000)):0.2f} MB\n"
 					f"max bandwidth: {self._maxBandwidth}, dynamic bandwidth: {self._dynamicBandwidth}"
@@ -1449,18 +1907,42 @@ class ProductCacheService(ServiceConnection, threading.Thread):
 				durationEvent=True,
 			)
 
-			productSynchronizer = DepotToLocalDirectorySychronizer(
-				sourceDepot=repository,
-				destinationDirectory=self._productCacheDir,
-				productIds=[productId],
-				maxBandwidth=self._maxBandwidth,
-				dynamicBandwidth=self._dynamicBandwidth,
-			)
-			productSynchronizer.synchronize(
-				productProgressObserver=self._productProgressObserver, overallProgressObserver=self._overallProgressObserver
-			)
+			self._downloadFromPeers(productId, product_version, packageInfo, priority)
+			self._downloadLargeFiles(productId, packageInfo, priority, shouldStop=self._prefetchCanceled if prefetch else None)
+
+			def setBandwidth(maxBandwidth: int) -> None:
+				assert repository
+				repository.setBandwidth(dynamicBandwidth=self._dynamicBandwidth, maxBandwidth=maxBandwidth)
+
+			# The repository meters the transferred bytes itself, the bandwidth manager adjusts its limit
+			with bandwidth_manager.transfer(
+				f"Cache product {productId}", priority, max_bandwidth=self._maxBandwidth, on_limit=setBandwidth
+			) as transfer:
+				productSynchronizer = DepotToLocalDirectorySychronizer(
+					sourceDepot=repository,
+					destinationDirectory=self._productCacheDir,
+					productIds=[productId],
+					maxBandwidth=transfer.limit,
+					dynamicBandwidth=self._dynamicBandwidth,
+				)
+				if prefetch:
+					# Aborts the running synchronization as soon as products are to be cached
+					productSynchronizer.synchronize(productProgressObserver=PrefetchProgressObserver(self._prefetchCanceled))
+				else:
+					productSynchronizer.synchronize(
+						productProgressObserver=self._productProgressObserver, overallProgressObserver=self._overallProgressObserver
+					)
+			# Builds the verification index, later verifications only need to hash changed files
+			result = self.verifyProduct(productId)
+			if not result.verified:
+				raise RuntimeError(f"Verification of cached product files failed: {result.errors}")
 			logger.notice("Product '%s' (%s) cached", productId, product_version)
-			self._setProductCacheState(productId, "completed", time.time())
+			self._setProductCacheState(productId, "completed", time.time(), updateProductOnClient=not prefetch)
+			self._setCachedProductVersion(productId, product_version)
+		except PrefetchCanceled as err:
+			# The partially synchronized files are kept for the next synchronization
+			logger.notice("Prefetching product '%s' cancelled", productId)
+			exception = err
 		except Exception as err:
 			logger.error("Failed to cache product %s: %s", productId, err, exc_info=True)
 			exception = err
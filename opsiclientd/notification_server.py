@@ -8,14 +8,44 @@
 from __future__ import annotations
 
 import json
-from asyncio import AbstractEventLoop, BaseTransport, Protocol, Server, Transport, get_event_loop, run, sleep
+from asyncio import (
+	AbstractEventLoop,
+	BaseTransport,
+	Future,
+	Protocol,
+	Server,
+	Transport,
+	get_event_loop,
+	run,
+	run_coroutine_threadsafe,
+	wait,
+	wait_for,
+)
+from asyncio import Event as AsyncioEvent
+from asyncio import TimeoutError as AsyncioTimeoutError
+from collections import OrderedDict
 from dataclasses import asdict, dataclass, field
-from threading import Event, Lock, Thread
-from typing import Any
+from itertools import count
+from threading import Event, Lock, Thread, get_ident
+from typing import Any, Callable, Hashable, Literal
 
+import msgspec
 from OPSI.Util.Message import ChoiceSubject, Subject, SubjectsObserver  # type: ignore[import]
 from opsicommon.logging import get_logger, log_context
 
+# Notifications which only carry the current state of a subject and can be superseded
+COALESCABLE_METHODS = ("messageChanged", "progressChanged")
+MAX_CLIENT_QUEUE_SIZE = 1000
+CLIENT_WRITE_BUFFER_SIZE = 64 * 1024
+# Delimiters of json rpcs, the default framing understood by all notifier clients
+JSON_DELIMITERS = (b"\r\n", b"\1e")
+# Length prefix of msgpack frames (big endian unsigned int)
+MSGPACK_LENGTH_PREFIX_SIZE = 4
+MAX_FRAME_SIZE = 1024 * 1024
+
+Serialization = Literal["json", "msgpack"]
+SERIALIZATIONS = ("json", "msgpack")
+
 logger = get_logger()
 
 
@@ -32,15 +62,171 @@ class NotificationRPC:
 	def to_json(self) -> str:
 		return json.dumps(asdict(self))
 
+	@staticmethod
+	def from_msgpack(data: bytes) -> NotificationRPC:
+		return NotificationRPC(**msgpack_decoder.decode(data))
+
+	def to_msgpack(self) -> bytes:
+		return msgpack_encoder.encode(asdict(self))
+
+
+class SerializedSubject:
+	"""
+	Cached serializable state of a subject.
+	The encoded forms are created on first use and embedded into notifications as raw data,
+	so a subject is serialized only once per state change, no matter how many clients are connected.
+	"""
+
+	__slots__ = ("id", "version", "data", "_encoded")
+
+	def __init__(self, subject_id: str, version: int, data: dict[str, Any]) -> None:
+		self.id = subject_id
+		self.version = version
+		self.data = data
+		self._encoded: dict[str, msgspec.Raw] = {}
+
+	def __repr__(self) -> str:
+		return f"<{self.__class__.__name__}(id={self.id!r}, version={self.version})>"
+
+	def encoded(self, serialization: Serialization) -> msgspec.Raw:
+		raw = self._encoded.get(serialization)
+		if raw is None:
+			encoder = msgpack_encoder if serialization == "msgpack" else json_encoder
+			raw = self._encoded[serialization] = msgspec.Raw(encoder.encode(self.data))
+		return raw
+
+
+def _json_enc_hook(obj: Any) -> Any:
+	if isinstance(obj, SerializedSubject):
+		return obj.encoded("json")
+	raise NotImplementedError(f"Objects of type {type(obj)} are not supported")
+
+
+def _msgpack_enc_hook(obj: Any) -> Any:
+	if isinstance(obj, SerializedSubject):
+		return obj.encoded("msgpack")
+	raise NotImplementedError(f"Objects of type {type(obj)} are not supported")
+
+
+json_encoder = msgspec.json.Encoder(enc_hook=_json_enc_hook)
+json_decoder = msgspec.json.Decoder()
+msgpack_encoder = msgspec.msgpack.Encoder(enc_hook=_msgpack_enc_hook)
+msgpack_decoder = msgspec.msgpack.Decoder()
+
+
+def encode_frame(rpc: NotificationRPC, serialization: Serialization) -> bytes:
+	data = {"method": rpc.method, "params": rpc.params, "id": rpc.id}
+	if serialization == "msgpack":
+		payload = msgpack_encoder.encode(data)
+		return len(payload).to_bytes(MSGPACK_LENGTH_PREFIX_SIZE, "big") + payload
+	return json_encoder.encode(data) + b"\r\n"
+
+
+def decode_frame(frame: bytes, serialization: Serialization) -> NotificationRPC:
+	decoder = msgpack_decoder if serialization == "msgpack" else json_decoder
+	return NotificationRPC(**decoder.decode(frame))
+
+
+class FrameDecoder:
+	"""
+	Incremental decoder for the rpc frames received from a notifier client.
+	json: rpcs are separated by \\r\\n or \\1e, msgpack: every rpc is prefixed by its length.
+	Data is scanned only once, a partial frame is kept until the rest of it is received.
+	"""
+
+	def __init__(self, serialization: Serialization = "json") -> None:
+		self.serialization: Serialization = serialization
+		self._buffer = bytearray()
+		self._scan_pos = 0
+
+	def __len__(self) -> int:
+		return len(self._buffer)
+
+	def feed(self, data: bytes) -> None:
+		self._buffer += data
+
+	def next_frame(self) -> bytes | None:
+		"""
+		Returns the next complete frame or None if more data is needed.
+		The serialization may be changed between two calls.
+		"""
+		if self.serialization == "msgpack":
+			return self._next_msgpack_frame()
+		return self._next_json_frame()
+
+	def _next_json_frame(self) -> bytes | None:
+		end = -1
+		delimiter_size = 0
+		for delimiter in JSON_DELIMITERS:
+			pos = self._buffer.find(delimiter, self._scan_pos)
+			if pos != -1 and (end == -1 or pos < end):
+				end = pos
+				delimiter_size = len(delimiter)
+		if end == -1:
+			# A delimiter could be split across two chunks
+			self._scan_pos = max(len(self._buffer) - max(len(d) for d in JSON_DELIMITERS) + 1, 0)
+			if len(self._buffer) > MAX_FRAME_SIZE:
+				raise ValueError(f"Frame size exceeds maximum of {MAX_FRAME_SIZE} bytes")
+			return None
+		frame = bytes(self._buffer[:end])
+		del self._buffer[: end + delimiter_size]
+		self._scan_pos = 0
+		return frame
+
+	def _next_msgpack_frame(self) -> bytes | None:
+		if len(self._buffer) < MSGPACK_LENGTH_PREFIX_SIZE:
+			return None
+		size = int.from_bytes(self._buffer[:MSGPACK_LENGTH_PREFIX_SIZE], "big")
+		if size > MAX_FRAME_SIZE:
+			raise ValueError(f"Frame size {size} exceeds maximum of {MAX_FRAME_SIZE} bytes")
+		end = MSGPACK_LENGTH_PREFIX_SIZE + size
+		if len(self._buffer) < end:
+			return None
+		frame = bytes(self._buffer[MSGPACK_LENGTH_PREFIX_SIZE:end])
+		del self._buffer[:end]
+		self._scan_pos = 0
+		return frame
+
+
+class QueuedNotification:
+	"""
+	A notification which is queued for sending to one or more clients.
+	Serialization happens once per serialization format, when the notification is first sent.
+	"""
+
+	__slots__ = ("rpc", "subject", "_data")
+
+	def __init__(self, rpc: NotificationRPC, subject: SerializedSubject | None = None) -> None:
+		self.rpc = rpc
+		# The subject state carried by this notification
+		self.subject = subject
+		self._data: dict[str, bytes] = {}
+
+	def data(self, serialization: Serialization = "json") -> bytes:
+		data = self._data.get(serialization)
+		if data is None:
+			data = self._data[serialization] = encode_frame(self.rpc, serialization)
+		return data
+
 
 class NotificationServerClientConnection(Protocol):
-	def __init__(self, notification_server: NotificationServer) -> None:
+	def __init__(self, notification_server: NotificationServer, max_queue_size: int = MAX_CLIENT_QUEUE_SIZE) -> None:
 		super().__init__()
 		self._notification_server = notification_server
-		self._buffer = bytearray()
+		self._decoder = FrameDecoder()
+		# Versions of the subjects known by the client, None if the client did not negotiate subject deltas
+		self.known_subjects: dict[str, int] | None = None
 		self._peer: tuple[str, int] = ("", 0)
 		self._transport: Transport
 		self._closed = Event()
+		self._closed_future: Future | None = None
+		# Send queue, only accessed from the event loop of the notification server
+		self._queue: OrderedDict[Hashable, QueuedNotification] = OrderedDict()
+		self._queue_ids = count()
+		self._max_queue_size = max_queue_size
+		self._writing_paused = False
+		self._flush_scheduled = False
+		self._closing = False
 
 	def __str__(self) -> str:
 		return f"{self.__class__.__name__}({self._peer[0]}:{self._peer[1]})"
@@ -51,38 +237,86 @@ class NotificationServerClientConnection(Protocol):
 	def subjects(self) -> list[Subject]:
 		return self._notification_server._subjects
 
+	@property
+	def serialization(self) -> Serialization:
+		return self._decoder.serialization
+
 	def connection_made(self, transport: BaseTransport) -> None:
 		self._peer = transport.get_extra_info("peername")
 		logger.info("%s - connection made", self)
 		assert isinstance(transport, Transport)
 		self._transport = transport
+		# pause_writing / resume_writing are called based on these limits
+		self._transport.set_write_buffer_limits(high=CLIENT_WRITE_BUFFER_SIZE)
+		self._closed_future = get_event_loop().create_future()
 		self._notification_server.client_connected(self)
 
 	def connection_lost(self, exc: Exception | None = None) -> None:
 		logger.info("%s - connection lost", self)
+		self._closing = True
+		self._queue.clear()
 		self._notification_server.client_disconnected(self)
 		self._closed.set()
+		if self._closed_future and not self._closed_future.done():
+			self._closed_future.set_result(None)
+
+	def pause_writing(self) -> None:
+		logger.debug("%s - pause writing", self)
+		self._writing_paused = True
+
+	def resume_writing(self) -> None:
+		logger.debug("%s - resume writing", self)
+		self._writing_paused = False
+		self._flush()
 
 	def data_received(self, data: bytes) -> None:
-		logger.trace("%s - data received:", self, data)
-		self._buffer += data
+		logger.trace("%s - data received: %r", self, data)
+		self._decoder.feed(data)
 		rpcs = []
-		while b"\r\n" in self._buffer or b"\1e" in self._buffer:  # multiple rpc calls separated by \r\n or \1e
-			if b"\r\n" in self._buffer:
-				rpc_data, self._buffer = self._buffer.split(b"\r\n", maxsplit=1)
-			else:  # b"\1e" in byte_buffer
-				rpc_data, self._buffer = self._buffer.split(b"\1e", maxsplit=1)
-			logger.trace("Received RPC data: %r", rpc_data)
+		while True:
+			try:
+				frame = self._decoder.next_frame()
+			except ValueError as err:
+				logger.error("%s - %s, closing connection", self, err)
+				self._closing = True
+				self._transport.abort()
+				return
+			if frame is None:
+				break
+			logger.trace("Received RPC data: %r", frame)
 			try:
-				rpc = NotificationRPC.from_json(rpc_data.decode("utf-8"))
+				rpc = decode_frame(frame, self._decoder.serialization)
 				logger.debug("Received RPC: %r", rpc)
-				rpcs.append(rpc)
 			except Exception as err:
-				logger.error("Invalid RPC data %r: %s", rpc_data, err, exc_info=True)
+				logger.error("Invalid RPC data %r: %s", frame, err, exc_info=True)
+				continue
+			if rpc.method == "setSerialization":
+				# Must be handled before the next frame is decoded
+				self.set_serialization(rpc.params[0] if rpc.params else "json")
 				continue
+			rpcs.append(rpc)
 		for rpc in rpcs:
 			self.process_rpc(rpc)
 
+	def set_serialization(self, serialization: Serialization) -> None:
+		"""
+		Protocol negotiation, requested by the client with the rpc `setSerialization`.
+		The server acknowledges with `serializationChanged`, sent in the previous serialization.
+		All following frames in both directions use the new serialization.
+		The client then receives the full list of subjects and subsequent changes
+		of the subject list as deltas (`subjectsUpdated`).
+		"""
+		if serialization not in SERIALIZATIONS:
+			logger.error("%s - invalid serialization %r requested", self, serialization)
+			return
+		logger.info("%s - switching to serialization %r", self, serialization)
+		# Everything queued so far is sent in the previous serialization
+		self.send_rpc(NotificationRPC(method="serializationChanged", params=[serialization]))
+		self._flush(force=True)
+		self._decoder.serialization = serialization
+		self.known_subjects = {}
+		self._notification_server.send_subjects(clients=[self])
+
 	def eof_received(self) -> bool:
 		logger.debug("%s - EOF received", self)
 		return False
@@ -118,14 +352,53 @@ class NotificationServerClientConnection(Protocol):
 		Thread(target=self._process_rpc, args=[rpc], daemon=True).start()
 
 	def send_rpc(self, rpc: NotificationRPC) -> None:
-		self._transport.write(rpc.to_json().encode("utf-8") + b"\r\n")
+		self.send_notification(QueuedNotification(rpc))
+
+	def send_notification(self, notification: QueuedNotification, coalesce_key: Hashable | None = None) -> None:
+		"""
+		Queue notification for sending, must be called from the event loop.
+		A queued notification with the same `coalesce_key` is superseded by the new one.
+		"""
+		if self._closing:
+			return
+		if coalesce_key is None:
+			coalesce_key = next(self._queue_ids)
+		else:
+			self._queue.pop(coalesce_key, None)
+		self._queue[coalesce_key] = notification
+		if notification.subject and self.known_subjects is not None:
+			self.known_subjects[notification.subject.id] = notification.subject.version
+
+		if len(self._queue) > self._max_queue_size:
+			logger.warning("%s - client too slow, %d notifications queued, closing connection", self, len(self._queue))
+			self._closing = True
+			self._queue.clear()
+			self._transport.abort()
+			return
+
+		if not self._flush_scheduled and not self._writing_paused:
+			# Flush on next loop iteration, notifications queued until then can be coalesced
+			self._flush_scheduled = True
+			get_event_loop().call_soon(self._flush)
+
+	def _flush(self, force: bool = False) -> None:
+		self._flush_scheduled = False
+		while self._queue and (force or not self._writing_paused) and not self._transport.is_closing():
+			_key, notification = self._queue.popitem(last=False)
+			self._transport.write(notification.data(self._decoder.serialization))
 
 	def close_connection(self) -> None:
+		self._flush(force=True)
+		self._closing = True
 		self._transport.close()
 
 	def wait_closed(self, timeout: float = 5.0) -> bool:
 		return self._closed.wait(timeout=timeout)
 
+	async def async_wait_closed(self) -> None:
+		if self._closed_future:
+			await self._closed_future
+
 
 class NotificationServer(SubjectsObserver, Thread):
 	def __init__(self, address: list[str] | str, start_port: int, subjects: list[Subject], notifier_id: str | None = None) -> None:
@@ -139,9 +412,14 @@ class NotificationServer(SubjectsObserver, Thread):
 		self._port = 0
 		self._ready = Event()
 		self._should_stop = False
+		self._stop_event: AsyncioEvent | None = None
 		self._stopped = Event()
+		self._loop: AbstractEventLoop | None = None
+		self._loop_thread_id: int | None = None
 		self._error: Exception | None = None
 		self._clients: list[NotificationServerClientConnection] = []
+		self._serialized_subjects: dict[str, SerializedSubject] = {}
+		self._subject_versions = count(1)
 		self.setSubjects(subjects)
 
 	@property
@@ -164,7 +442,7 @@ class NotificationServer(SubjectsObserver, Thread):
 	def client_connected(self, client: NotificationServerClientConnection) -> None:
 		if client not in self._clients:
 			self._clients.append(client)
-			self.subjectsChanged(self.getSubjects(), clients=[client])
+			self.send_subjects(clients=[client])
 
 	def client_disconnected(self, client: NotificationServerClientConnection) -> None:
 		if client in self._clients:
@@ -175,21 +453,24 @@ class NotificationServer(SubjectsObserver, Thread):
 			logger.info("Unknown subject %s passed to messageChanged, automatically adding subject", subject)
 			self.addSubject(subject)
 		logger.debug("messageChanged: subject id '%s', message '%s'", subject.getId(), message)
-		self.notify(name="messageChanged", params=[subject.serializable(), message])
+		serialized_subject = self._serialize_subject(subject)
+		self.notify(name="messageChanged", params=[serialized_subject, message], subject=serialized_subject)
 
 	def selectedIndexesChanged(self, subject: Subject, selectedIndexes: list[int]) -> None:
 		if subject not in self.getSubjects():
 			logger.info("Unknown subject %s passed to selectedIndexesChanged, automatically adding subject", subject)
 			self.addSubject(subject)
 		logger.debug("selectedIndexesChanged: subject id '%s', selectedIndexes %s", subject.getId(), selectedIndexes)
-		self.notify(name="selectedIndexesChanged", params=[subject.serializable(), selectedIndexes])
+		serialized_subject = self._serialize_subject(subject)
+		self.notify(name="selectedIndexesChanged", params=[serialized_subject, selectedIndexes], subject=serialized_subject)
 
 	def choicesChanged(self, subject: Subject, choices: list[str]) -> None:
 		if subject not in self.getSubjects():
 			logger.info("Unknown subject %s passed to choicesChanged, automatically adding subject", subject)
 			self.addSubject(subject)
 		logger.debug("choicesChanged: subject id '%s', choices %s", subject.getId(), choices)
-		self.notify(name="choicesChanged", params=[subject.serializable(), choices])
+		serialized_subject = self._serialize_subject(subject)
+		self.notify(name="choicesChanged", params=[serialized_subject, choices], subject=serialized_subject)
 
 	def progressChanged(self, subject: Subject, state: int, percent: float, timeSpend: float, timeLeft: float, speed: float) -> None:
 		if subject not in self.getSubjects():
@@ -204,42 +485,151 @@ class NotificationServer(SubjectsObserver, Thread):
 			timeLeft,
 			speed,
 		)
-		self.notify(name="progressChanged", params=[subject.serializable(), state, percent, timeSpend, timeLeft, speed])
+		serialized_subject = self._serialize_subject(subject)
+		self.notify(
+			name="progressChanged",
+			params=[serialized_subject, state, percent, timeSpend, timeLeft, speed],
+			subject=serialized_subject,
+		)
 
 	def endChanged(self, subject: Subject, end: int) -> None:
 		if subject not in self.getSubjects():
 			logger.info("Unknown subject %s passed to endChanged, automatically adding subject", subject)
 			self.addSubject(subject)
 		logger.debug("endChanged: subject id '%s', end %s", subject.getId(), end)
-		self.notify(name="endChanged", params=[subject.serializable(), end])
+		serialized_subject = self._serialize_subject(subject)
+		self.notify(name="endChanged", params=[serialized_subject, end], subject=serialized_subject)
+
+	def _serialize_subject(self, subject: Subject) -> SerializedSubject:
+		"""
+		Serializes the current state of the subject and replaces the cached state.
+		"""
+		serialized_subject = SerializedSubject(subject.getId(), next(self._subject_versions), subject.serializable())
+		self._serialized_subjects[serialized_subject.id] = serialized_subject
+		return serialized_subject
+
+	def _get_serialized_subjects(self) -> list[SerializedSubject]:
+		serialized_subjects = []
+		for subject in self.getSubjects():
+			serialized_subject = self._serialized_subjects.get(subject.getId())
+			if not serialized_subject:
+				serialized_subject = self._serialize_subject(subject)
+			serialized_subjects.append(serialized_subject)
+		return serialized_subjects
 
 	def subjectsChanged(self, subjects: list[Subject], clients: list[NotificationServerClientConnection] | None = None) -> None:
 		logger.debug("subjectsChanged: subjects %s", subjects)
-		param = [subject.serializable() for subject in subjects]
-		self.notify(name="subjectsChanged", params=[param], clients=clients)
+		# The subject list changed, drop cached state of removed subjects and refresh the others
+		serialized_subjects = {}
+		for subject in subjects:
+			data = subject.serializable()
+			serialized_subject = self._serialized_subjects.get(subject.getId())
+			if not serialized_subject or serialized_subject.data != data:
+				serialized_subject = SerializedSubject(subject.getId(), next(self._subject_versions), data)
+			serialized_subjects[serialized_subject.id] = serialized_subject
+		self._serialized_subjects = serialized_subjects
+		self.send_subjects(clients=clients)
+
+	def send_subjects(self, clients: list[NotificationServerClientConnection] | None = None) -> None:
+		"""
+		Sends the current subjects using the cached subject states.
+		Clients which negotiated the protocol receive only the changes since the last update (`subjectsUpdated`),
+		all other clients receive the full list of subjects (`subjectsChanged`).
+		"""
+		if not clients and not self._clients:
+			return
+		self._call_in_loop(self._send_subjects, self._get_serialized_subjects(), clients)
+
+	def _send_subjects(
+		self, serialized_subjects: list[SerializedSubject], clients: list[NotificationServerClientConnection] | None
+	) -> None:
+		full_notification: QueuedNotification | None = None
+		subject_ids = {s.id for s in serialized_subjects}
+		for client in clients or self._clients:
+			try:
+				known_subjects = client.known_subjects
+				if not known_subjects:
+					if not full_notification:
+						full_notification = QueuedNotification(NotificationRPC(method="subjectsChanged", params=[serialized_subjects]))
+					client.send_notification(full_notification)
+				else:
+					changed = [s for s in serialized_subjects if known_subjects.get(s.id) != s.version]
+					removed = [subject_id for subject_id in known_subjects if subject_id not in subject_ids]
+					if not changed and not removed:
+						continue
+					client.send_notification(QueuedNotification(NotificationRPC(method="subjectsUpdated", params=[changed, removed])))
+				if known_subjects is not None:
+					client.known_subjects = {s.id: s.version for s in serialized_subjects}
+			except Exception as err:
+				logger.warning("Failed to send subjects to client %r: %s", client, err)
 
-	def requestEndConnections(self) -> None:
+	async def _end_connections(self, timeout: float = 5.0) -> None:
 		self.notify(name="endConnection", params=[])
-		for client in self._clients:
+		clients = list(self._clients)
+		for client in clients:
 			client.close_connection()
-		for client in self._clients:
-			client.wait_closed(timeout=5.0)
+		if clients:
+			await wait([get_event_loop().create_task(client.async_wait_closed()) for client in clients], timeout=timeout)
+
+	def requestEndConnections(self) -> None:
+		loop = self._loop
+		if not loop or not loop.is_running():
+			return
+		if get_ident() == self._loop_thread_id:
+			loop.create_task(self._end_connections())
+			return
+		try:
+			run_coroutine_threadsafe(self._end_connections(), loop).result(timeout=10.0)
+		except Exception as err:
+			logger.warning("Failed to end connections: %s", err)
 
-	def notify(self, name: str, params: list[Any], clients: list[NotificationServerClientConnection] | None = None) -> None:
+	def _call_in_loop(self, func: Callable, *args: Any) -> None:
+		loop = self._loop
+		if not loop or loop.is_closed():
+			return
+		if get_ident() == self._loop_thread_id:
+			func(*args)
+			return
+		try:
+			loop.call_soon_threadsafe(func, *args)
+		except RuntimeError as err:
+			# Event loop closed
+			logger.debug(err)
+
+	def notify(
+		self,
+		name: str,
+		params: list[Any],
+		clients: list[NotificationServerClientConnection] | None = None,
+		subject: SerializedSubject | None = None,
+	) -> None:
+		"""
+		Send notification to clients.
+		The notification is handed over to the event loop of the server and sent asynchronously,
+		so the calling thread is never blocked by slow clients.
+		"""
 		if not isinstance(params, list):
 			params = [params]
 
-		clients = clients or self._clients
-		logger.debug("Sending notification %r %r to %d client(s)", name, params, len(clients))
-		if not clients:
+		logger.debug("Sending notification %r %r to %d client(s)", name, params, len(clients or self._clients))
+		if not clients and not self._clients:
 			return
 
+		coalesce_key = None
+		if name in COALESCABLE_METHODS and subject:
+			coalesce_key = (name, subject.id)
+		elif name in COALESCABLE_METHODS and params and isinstance(params[0], dict):
+			coalesce_key = (name, params[0].get("id"))
 		# json-rpc: notifications have id null
-		rpc = NotificationRPC(method=name, params=params)
-		for client in clients:
+		notification = QueuedNotification(NotificationRPC(method=name, params=params), subject=subject)
+		self._call_in_loop(self._send_notification, notification, coalesce_key, clients)
+
+	def _send_notification(
+		self, notification: QueuedNotification, coalesce_key: Hashable | None, clients: list[NotificationServerClientConnection] | None
+	) -> None:
+		for client in clients or self._clients:
 			try:
-				logger.debug("Sending rpc %r to client %r", rpc, client)
-				client.send_rpc(rpc)
+				client.send_notification(notification, coalesce_key)
 			except Exception as err:
 				logger.warning("Failed to send rpc client %r: %s", client, err)
 
@@ -255,6 +645,9 @@ class NotificationServer(SubjectsObserver, Thread):
 	async def _async_main(self) -> None:
 		loop = get_event_loop()
 		loop.set_exception_handler(self._handle_asyncio_exception)
+		self._stop_event = AsyncioEvent()
+		self._loop_thread_id = get_ident()
+		self._loop = loop
 		port = self._start_port
 		for _ in range(10):
 			try:
@@ -284,11 +677,14 @@ class NotificationServer(SubjectsObserver, Thread):
 		get_event_loop().create_task(self._server.serve_forever())
 
 		while not self._should_stop:
-			await sleep(1)
+			try:
+				await wait_for(self._stop_event.wait(), 1.0)
+			except AsyncioTimeoutError:
+				pass
 
 		if self._server:
 			if self._clients:
-				self.requestEndConnections()
+				await self._end_connections()
 			try:
 				logger.debug("Closing notification server")
 				self._server.close()
@@ -302,6 +698,7 @@ class NotificationServer(SubjectsObserver, Thread):
 				self._should_stop = False
 				self._stopped.clear()
 				run(self._async_main())
+				self._loop = None
 				self._ready.clear()
 				logger.debug("Notification server stopped")
 				self._stopped.set()
@@ -310,6 +707,8 @@ class NotificationServer(SubjectsObserver, Thread):
 
 	def stop(self) -> None:
 		self._should_stop = True
+		if self._stop_event:
+			self._call_in_loop(self._stop_event.set)
 		with self._server_lock:
 			logger.debug("Waiting for NotificationServer thread to stop")
 			if not self._stopped.wait(5):
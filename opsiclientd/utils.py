@@ -11,12 +11,14 @@ utils
 
 from __future__ import annotations
 
+import datetime
 import struct
 from pathlib import Path
 from typing import TYPE_CHECKING
 
 import netifaces  # type: ignore[import]
 from opsicommon.logging import get_logger
+from opsicommon.utils import compare_versions
 
 if TYPE_CHECKING:
 	from OPSI.Backend.JSONRPC import JSONRPCBackend  # type: ignore[import]
@@ -48,6 +50,59 @@ def get_include_exclude_product_ids(
 	return includeProductIds, excludeProductIds
 
 
+def get_prefetch_product_ids(
+	installed_versions: dict[str, str],
+	depot_versions: dict[str, str],
+	group_product_ids: list[str],
+	cached_versions: dict[str, str],
+	exclude_product_ids: list[str] | None = None,
+) -> list[str]:
+	"""
+	Returns the ids of the products to prefetch in the order they should be cached.
+	Installed products with a newer version on the depot come first, followed by the products of the prefetch groups.
+	Products not available on the depot and products already cached in the depot version are skipped.
+	Versions are given as `<product version>-<package version>`.
+	"""
+	product_ids = []
+	for product_id, installed_version in sorted(installed_versions.items()):
+		depot_version = depot_versions.get(product_id)
+		if not depot_version:
+			continue
+		try:
+			newer = compare_versions(depot_version, ">", installed_version)
+		except ValueError as err:
+			logger.debug("Failed to compare versions of product '%s': %s", product_id, err)
+			newer = depot_version != installed_version
+		if newer:
+			product_ids.append(product_id)
+	product_ids += [
+		product_id for product_id in sorted(set(group_product_ids)) if product_id in depot_versions and product_id not in product_ids
+	]
+
+	exclude_product_ids = exclude_product_ids or []
+	return [
+		product_id
+		for product_id in product_ids
+		if product_id not in exclude_product_ids and cached_versions.get(product_id) != depot_versions[product_id]
+	]
+
+
+def in_working_window(working_window: str, now: datetime.time | None = None) -> bool:
+	"""
+	Checks if the current time is inside of the working window, which is specified like: 07:00-22:00
+	Working windows with a start time after the end time cross midnight.
+	"""
+	start_str, end_str = working_window.split("-")
+	start = datetime.time(int(start_str.split(":")[0]), int(start_str.split(":")[1]))
+	end = datetime.time(int(end_str.split(":")[0]), int(end_str.split(":")[1]))
+	now = now or datetime.datetime.now().time()
+	logger.debug("Working window configuration: start=%s, end=%s, now=%s", start, end, now)
+	if start <= end:
+		return start <= now <= end
+	# Crosses midnight
+	return now >= start or now <= end
+
+
 def lo_word(dword: int) -> str:
 	return str(dword & 0x0000FFFF)
 
@@ -20,7 +20,9 @@ from opsiclientd.webserver.application.index import setup as setup_index
 from opsiclientd.webserver.application.info import setup as setup_info
 from opsiclientd.webserver.application.kiosk import setup as setup_kiosk
 from opsiclientd.webserver.application.log_viewer import setup as setup_log_viewer
+from opsiclientd.webserver.application.metrics import setup as setup_metrics
 from opsiclientd.webserver.application.middleware import BaseMiddleware
+from opsiclientd.webserver.application.peer_cache import setup as setup_peer_cache
 from opsiclientd.webserver.application.terminal import setup as setup_terminal
 from opsiclientd.webserver.application.upload import setup as setup_upload
 
@@ -40,8 +42,10 @@ def setup_application(opsiclientd: Opsiclientd) -> FastAPI:
 	setup_download(app)
 	setup_control_interface(app)
 	setup_log_viewer(app)
+	setup_metrics(app)
 	setup_terminal(app)
 	setup_cache_service(app)
+	setup_peer_cache(app)
 	if config.get("control_server", "kiosk_api_active"):
 		setup_kiosk(app)
 	return app
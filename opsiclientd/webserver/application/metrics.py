@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import PlainTextResponse
+
+from opsiclientd.RPCMetrics import rpc_metrics
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("")
+def metrics() -> PlainTextResponse:
+	return PlainTextResponse(rpc_metrics.to_prometheus(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def setup(app: FastAPI) -> None:
+	app.include_router(metrics_router, prefix="/metrics")
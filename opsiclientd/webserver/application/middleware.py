@@ -10,6 +10,7 @@ application.middelware
 """
 
 import base64
+import secrets
 import uuid
 from collections import namedtuple
 from datetime import datetime, timezone
@@ -31,6 +32,7 @@ from starlette.types import Message, Receive, Scope, Send
 
 from opsiclientd import __version__
 from opsiclientd.Config import Config
+from opsiclientd.PeerCache import PEER_CACHE_PATH, PEER_CACHE_USERNAME
 
 SESSION_COOKIE_NAME = "opsiclientd-session"
 SESSION_COOKIE_ATTRIBUTES = ("SameSite=Strict", "Secure")
@@ -177,9 +179,19 @@ class BaseMiddleware:
 			if not auth.password:
 				raise BackendAuthenticationError("No password specified")
 
+			if auth.username == PEER_CACHE_USERNAME:
+				peer_cache_secret = config.get("cache_service", "peer_cache_secret")
+				if not peer_cache_secret or not secrets.compare_digest(auth.password.encode("utf-8"), peer_cache_secret.encode("utf-8")):
+					raise BackendAuthenticationError(f"Authentication of peer {session.client_addr!r} failed")
+				session.username = PEER_CACHE_USERNAME
+				session.authenticated = True
+				logger.info("Peer authenticated from %r", session.client_addr)
+				return
+
 			if not auth.username or auth.username.count(".") >= 2:
-				host_id = config.get("global", "host_id")
-				if auth.password != config.get("global", "opsi_host_key"):
+				global_config = config.snapshot.global_
+				host_id = global_config.host_id
+				if auth.password != global_config.opsi_host_key:
 					raise BackendAuthenticationError(f"Authentication of host '{host_id}' failed")
 				session.username = host_id
 				session.authenticated = True
@@ -246,6 +258,9 @@ class BaseMiddleware:
 				else:
 					raise
 
+		if session.username == PEER_CACHE_USERNAME and not scope["path"].startswith(f"{PEER_CACHE_PATH}/"):
+			raise BackendPermissionDeniedError(f"Peer {session.client_addr!r} is not allowed to access {scope['path']!r}")
+
 		async def send_wrapper(message: Message) -> None:
 			if message["type"] == "http.response.start":
 				headers = MutableHeaders(scope=message)
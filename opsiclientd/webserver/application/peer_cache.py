@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+Serves the cached product files to peers.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from fastapi import APIRouter, FastAPI, HTTPException, status
+from fastapi.responses import FileResponse, JSONResponse
+from opsicommon.logging import get_logger
+
+from opsiclientd.Config import Config
+from opsiclientd.PeerCache import PEER_CACHE_PATH
+from opsiclientd.webserver.application import get_opsiclientd
+
+if TYPE_CHECKING:
+	from opsiclientd.nonfree.CacheService import CacheService
+
+logger = get_logger()
+config = Config()
+peer_cache_router = APIRouter()
+
+
+def get_cache_service() -> CacheService:
+	if not config.get("cache_service", "peer_cache_enabled"):
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Peer cache disabled")
+	try:
+		return get_opsiclientd().getCacheService()
+	except RuntimeError as err:
+		raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(err)) from err
+
+
+@peer_cache_router.get("/products")
+def products() -> JSONResponse:
+	return JSONResponse(get_cache_service().getCachedProductVersions())
+
+
+@peer_cache_router.get("/files/{product_id}/{path:path}")
+def product_file(product_id: str, path: str) -> FileResponse:
+	try:
+		file = get_cache_service().getPeerCacheFile(product_id, path)
+	except FileNotFoundError as err:
+		raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(err)) from err
+	logger.info("Serving file '%s' of product '%s' to peer", path, product_id)
+	return FileResponse(file)
+
+
+def setup(app: FastAPI) -> None:
+	app.include_router(peer_cache_router, prefix=PEER_CACHE_PATH)
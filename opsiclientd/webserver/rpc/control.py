@@ -37,16 +37,22 @@ from opsicommon import __version__ as opsicommon_version
 from opsicommon.logging import get_logger, secret_filter
 from opsicommon.objects import ConfigState, ObjectToGroup, Product, ProductDependency, ProductOnClient, ProductOnDepot
 from opsicommon.system.info import is_windows
-from opsicommon.types import forceBool, forceInt, forceProductIdList, forceUnicode, forceHostId
+from opsicommon.types import forceBool, forceFloat, forceInt, forceProductIdList, forceUnicode, forceHostId
 from opsicommon.utils import generate_opsi_host_key
 
 from opsiclientd import __version__
 from opsiclientd.Config import OPSI_SETUP_USER_NAME
+from opsiclientd.DepotSelection import latency_depot_selector
+from opsiclientd.EventProcessing import get_phase_history
 from opsiclientd.Events.SwOnDemand import SwOnDemandEventGenerator
 from opsiclientd.Events.Utilities.Configs import getEventConfigs
 from opsiclientd.Events.Utilities.Generators import getEventGenerator, getEventGenerators
+from opsiclientd.Events.Utilities.Queue import event_queue
+from opsiclientd.Events.Utilities.Scheduler import event_scheduler
 from opsiclientd.Localization import _, get_translation_info
 from opsiclientd.OpsiService import ServiceConnection, download_from_depot
+from opsiclientd.RPCMetrics import rpc_metrics
+from opsiclientd.RPCProfiler import rpc_profiler
 from opsiclientd.Timeline import Timeline
 from opsiclientd.webserver.rpc.interface import Interface
 
@@ -79,15 +85,20 @@ class PipeControlInterface(Interface):
 			if not connected and disconnect:
 				service_connection.disconnectConfigService()
 
-	def _fireEvent(self, name: str, can_cancel: bool = True, event_info: dict[str, str | list[str]] | None = None) -> None:
+	def _fireEvent(self, name: str, can_cancel: bool = True, event_info: dict[str, str | list[str]] | None = None) -> str:
+		"""
+		Returns "queued" if the event is queued because another event is running, otherwise "fired".
+		"""
 		# can_cancel: Allow event cancellation for new events called via the ControlServer
 		can_cancel = forceBool(can_cancel)
 		event_info = event_info or {}
 		event_generator = getEventGenerator(name)
 		logger.notice("rpc firing event %r, event_info=%r, can_cancel=%r", name, event_info, can_cancel)
-		event_generator.createAndFireEvent(eventInfo=event_info, can_cancel=can_cancel)
+		if event_generator.createAndFireEvent(eventInfo=event_info, can_cancel=can_cancel):
+			return "queued"
+		return "fired"
 
-	def _processActionRequests(self, product_ids: list[str] | None = None) -> None:
+	def _processActionRequests(self, product_ids: list[str] | None = None) -> str:
 		event = self.opsiclientd.config.get("control_server", "process_actions_event")
 		if not event or event == "auto":
 			timer_active = False
@@ -108,7 +119,7 @@ class PipeControlInterface(Interface):
 		event_info: dict[str, str | list[str]] = {}
 		if product_ids:
 			event_info = {"product_ids": forceProductIdList(product_ids)}
-		self._fireEvent(name=event, event_info=event_info)
+		return self._fireEvent(name=event, event_info=event_info)
 
 	def getPossibleMethods_listOfHashes(self) -> list[dict[str, Any]]:
 		return self._interface_list
@@ -145,7 +156,7 @@ class KioskControlInterface(PipeControlInterface):
 	def getClientId(self) -> str:
 		return self.opsiclientd.config.get("global", "host_id")
 
-	def processActionRequests(self, product_ids: list[str] | None = None) -> None:
+	def processActionRequests(self, product_ids: list[str] | None = None) -> str:
 		return self._processActionRequests(product_ids=product_ids)
 
 	def fireEvent_software_on_demand(self) -> None:
@@ -251,6 +262,9 @@ class ControlInterface(PipeControlInterface):
 	def cacheService_getProductCacheState(self) -> dict[str, Any]:
 		return self.opsiclientd.getCacheService().getProductCacheState()
 
+	def cacheService_verifyProducts(self, productIds: list[str] | None = None) -> dict[str, dict[str, Any]]:
+		return self.opsiclientd.getCacheService().verifyProducts(productIds)
+
 	def cacheService_getConfigModifications(self) -> dict[str, Any]:
 		return self.opsiclientd.getCacheService().getConfigModifications()
 
@@ -402,10 +416,10 @@ class ControlInterface(PipeControlInterface):
 		logger.notice("rpc uptime: opsiclientd is running for %d seconds", uptime)
 		return uptime
 
-	def fireEvent(self, name: str, can_cancel: bool = True, event_info: dict[str, str | list[str]] | None = None) -> None:
+	def fireEvent(self, name: str, can_cancel: bool = True, event_info: dict[str, str | list[str]] | None = None) -> str:
 		return self._fireEvent(name=name, can_cancel=can_cancel, event_info=event_info)
 
-	def processActionRequests(self, product_ids: list[str] | None = None) -> None:
+	def processActionRequests(self, product_ids: list[str] | None = None) -> str:
 		return self._processActionRequests(product_ids=product_ids)
 
 	def setStatusMessage(self, sessionId: int, message: str) -> None:
@@ -426,14 +440,71 @@ class ControlInterface(PipeControlInterface):
 				break
 		return running
 
-	def getRunningEvents(self) -> list[str]:
+	def getRunningEvents(self, withSchedule: bool = False) -> list[str] | dict[str, Any]:
 		"""
 		Returns a list with running events.
+		If `withSchedule` is true, a dict with the running events, the next fire times (unix timestamps)
+		of the event generators and the jobs of the event scheduler is returned.
 		"""
 		running = [ept.event.eventConfig.getId() for ept in self.opsiclientd.getEventProcessingThreads()]
 		if not running:
 			logger.debug("Currently no event is running")
-		return running
+		if not forceBool(withSchedule):
+			return running
+		return {
+			"running": running,
+			"next_fire_times": {eventGenerator.getId(): eventGenerator.getNextFireTime() for eventGenerator in getEventGenerators()},
+			"scheduled_jobs": [job.to_dict() for job in event_scheduler.get_jobs()],
+		}
+
+	def getEventQueue(self) -> dict[str, Any]:
+		"""
+		Returns the depth of the queue of events waiting for the running event to end,
+		the queued events with their wait times and the wait time statistics of dispatched events.
+		"""
+		return event_queue.get_state()
+
+	def clearEventQueue(self) -> int:
+		"""
+		Removes all queued events, returns the number of removed events.
+		"""
+		count = event_queue.clear()
+		logger.notice("Event queue cleared, %d events removed", count)
+		return count
+
+	def getRpcMetrics(self, reset: bool = False) -> dict[str, Any]:
+		"""
+		Returns the latency histograms, error counts and payload sizes of the processed RPCs
+		per interface and method and the counters per transport (http, pipe, messagebus).
+		If `reset` is true, the metrics are reset afterwards.
+		"""
+		metrics = rpc_metrics.get_metrics()
+		if forceBool(reset):
+			rpc_metrics.reset()
+		return metrics
+
+	def getRpcProfile(self, reset: bool = False) -> dict[str, Any]:
+		"""
+		Returns the RPCs sent to the config service per calling operation and method
+		with call counts, durations and transferred bytes.
+		If `reset` is true, the profile is reset afterwards.
+		"""
+		profile = rpc_profiler.get_profile()
+		if forceBool(reset):
+			rpc_profiler.reset()
+		return profile
+
+	def getEventProcessingPhases(self) -> list[dict[str, Any]]:
+		"""
+		Returns the processing phases of the last finished and all running event occurrences.
+		"""
+		phases = get_phase_history()
+		for ept in self.opsiclientd.getEventProcessingThreads():
+			info = ept.getPhaseInfo()
+			if not info["end"]:
+				# Finished event processing threads are already part of the history
+				phases.append(info)
+		return phases
 
 	def cancelEvents(self, ids: list[str] | None = None) -> bool:
 		for ept in self.opsiclientd.getEventProcessingThreads():
@@ -931,7 +1002,31 @@ class ControlInterface(PipeControlInterface):
 		self.opsiclientd.restart(2)
 
 	def getProcessInfo(self, interval: float = 5.0) -> dict[str, Any]:
-		info: dict[str, Any] = {"threads": []}
+		interval = forceFloat(interval)
+		try:
+			summary = self.opsiclientd.getProcessSampler().get_summary(seconds=interval)
+		except RuntimeError:
+			summary = {}
+		if summary and summary["duration"] >= interval * 0.5:
+			# Use sampled history instead of blocking the rpc for interval seconds
+			info: dict[str, Any] = {"threads": [], "cpu_times": summary["cpu_times"], "cpu_percent": summary["cpu_percent"]}
+			thread_by_id = {t.native_id: t for t in threading.enumerate()}
+			for s_thread in summary["threads"]:
+				thread = thread_by_id.get(s_thread["id"])
+				if not thread:
+					continue
+				info["threads"].append(
+					{
+						"id": s_thread["id"],
+						"name": thread.name,
+						"run_func": str(thread.run),
+						"cpu_times": s_thread["cpu_times"],
+						"cpu_percent": summary["cpu_percent"] * s_thread["cpu_share"],
+					}
+				)
+			return info
+
+		info = {"threads": []}
 		proc = psutil.Process()
 		proc.cpu_percent()
 		cpu_times_start = proc.cpu_times()._asdict()
@@ -964,6 +1059,15 @@ class ControlInterface(PipeControlInterface):
 			)
 		return info
 
+	def getProcessInfoHistory(self, seconds: float = 300.0) -> list[dict[str, Any]]:
+		return self.opsiclientd.getProcessSampler().get_samples(seconds=forceFloat(seconds))
+
+	def getProcessInfoSummary(self, seconds: float = 60.0) -> dict[str, Any]:
+		return self.opsiclientd.getProcessSampler().get_summary(seconds=forceFloat(seconds))
+
+	def getDepotProbeHistory(self) -> dict[str, Any]:
+		return latency_depot_selector.history.to_dict()
+
 	def getLocalizationInfo(self) -> dict[str, Any]:
 		return get_translation_info()
 
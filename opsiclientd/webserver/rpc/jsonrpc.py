@@ -28,6 +28,7 @@ from opsicommon.objects import deserialize, serialize
 from opsicommon.utils import compress_data, decompress_data
 from starlette.concurrency import run_in_threadpool
 
+from opsiclientd.RPCMetrics import rpc_metrics
 from opsiclientd.webserver.rpc.interface import Interface
 
 logger = get_logger()
@@ -275,8 +276,9 @@ async def process_rpc(request: JSONRPC20Request | JSONRPCRequest, interface: Int
 
 
 async def process_rpcs(
-	interface: Interface, *requests: JSONRPC20Request | JSONRPCRequest
+	interface: Interface, *requests: JSONRPC20Request | JSONRPCRequest, transport: str = "http"
 ) -> AsyncGenerator[JSONRPC20Response | JSONRPC20ErrorResponse | JSONRPCResponse | JSONRPCErrorResponse, None]:
+	interface_name = interface.__class__.__name__
 	for request in requests:
 		response: JSONRPC20Response | JSONRPC20ErrorResponse | JSONRPCResponse | JSONRPCErrorResponse
 		start = time.time()
@@ -293,6 +295,7 @@ async def process_rpcs(
 			logger.error(err, exc_info=True)
 			response = await process_rpc_error(err, request)
 		end = time.time()
+		rpc_metrics.observe(interface_name, request.method, end - start, error=is_error, transport=transport)
 
 		logger.trace(response)
 		logger.notice(
@@ -313,6 +316,8 @@ async def process_request(interface: Interface, request: Request, response: Resp
 	response_compression = None
 	response_serialization = None
 	client = ""
+	requests: list[JSONRPCRequest | JSONRPC20Request] = []
+	request_size = 0
 	# TODO:
 	# session = contextvar_client_session.get()
 	# if session:
@@ -336,6 +341,7 @@ async def process_request(interface: Interface, request: Request, response: Resp
 		request_data = await request.body()
 		if not isinstance(request_data, bytes):
 			raise ValueError("Request data must be bytes")
+		request_size = len(request_data)
 		if request_data:
 			if request_compression:
 				request_data = await run_in_threadpool(decompress_data, request_data, request_compression)
@@ -374,6 +380,8 @@ async def process_request(interface: Interface, request: Request, response: Resp
 		data = await run_in_threadpool(compress_data, data, response_compression, 0, lz4_block_linked)
 
 	content_length = len(data)
+	if requests:
+		rpc_metrics.observe_payload(interface.__class__.__name__, [rpc.method for rpc in requests], request_size, content_length)
 	response.headers["content-length"] = str(content_length)
 	response.body = data
 	logger.debug("Sending result (len: %d)", content_length)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_action_processor_update
+"""
+
+from __future__ import annotations
+
+import shutil
+from hashlib import md5
+from pathlib import Path
+
+import pytest
+
+from opsiclientd.ActionProcessorUpdate import (
+	InstalledManifest,
+	build_action_processor_dir,
+	get_action_processor_files,
+	swap_directories,
+)
+
+FILES = {
+	"linux/x64/opsi-script": b"binary",
+	"linux/x64/lib/libssl.so": b"library",
+	"common/lib/opsi-script.lib": b"script library",
+	"windows/x86/opsi-script.exe": b"windows binary",
+}
+
+
+def create_depot(depot_dir: Path, files: dict[str, bytes]) -> None:
+	product_dir = depot_dir / "opsi-script"
+	if product_dir.exists():
+		shutil.rmtree(product_dir)
+	lines = []
+	for path, data in files.items():
+		file = product_dir / path
+		file.parent.mkdir(parents=True, exist_ok=True)
+		file.write_bytes(data)
+		lines.append(f"f '{path}' {len(data)} {md5(data).hexdigest()}")
+	for directory in ("linux", "linux/x64", "linux/x64/lib", "common", "common/lib"):
+		lines.append(f"d '{directory}' 0")
+	(product_dir / "opsi-script.files").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def test_get_action_processor_files(tmp_path: Path) -> None:
+	create_depot(tmp_path, FILES)
+	files = get_action_processor_files(str(tmp_path), "opsi-script/linux/x64", "opsi-script/common")
+	assert sorted(files) == ["lib", "lib/libssl.so", "lib/opsi-script.lib", "opsi-script"]
+	assert files["opsi-script"].source == "opsi-script/linux/x64/opsi-script"
+	assert files["opsi-script"].size == 6
+	assert files["lib/opsi-script.lib"].md5sum == md5(b"script library").hexdigest()
+
+	with pytest.raises(FileNotFoundError):
+		get_action_processor_files(str(tmp_path), "opsi-winst/files/opsi-winst")
+	with pytest.raises(ValueError):
+		get_action_processor_files(str(tmp_path), "opsi-script")
+
+
+def test_incremental_update(tmp_path: Path) -> None:
+	depot_dir = tmp_path / "depot"
+	local_dir = tmp_path / "opsi-script"
+	manifest = InstalledManifest(tmp_path / "action_processor_manifest.json")
+	create_depot(depot_dir, FILES)
+	files = get_action_processor_files(str(depot_dir), "opsi-script/linux/x64", "opsi-script/common")
+
+	transferred_files: list[str] = []
+
+	def copy_function(source: str, destination: str) -> None:
+		transferred_files.append(Path(source).name)
+		shutil.copy2(source, destination)
+
+	# Initial installation
+	changed = manifest.changed_files(str(local_dir), files)
+	assert sorted(changed) == sorted(files)
+	assert not manifest.path.exists()
+	build_action_processor_dir(files, str(depot_dir), str(local_dir), f"{local_dir}.tmp", changed, copy_function)
+	swap_directories(f"{local_dir}.tmp", str(local_dir))
+	manifest.save(str(local_dir), files)
+	assert sorted(transferred_files) == ["libssl.so", "opsi-script", "opsi-script.lib"]
+	assert (local_dir / "lib" / "opsi-script.lib").read_bytes() == b"script library"
+	assert not Path(f"{local_dir}.tmp").exists()
+	assert manifest.changed_files(str(local_dir), files) == []
+
+	# A missing manifest is created from the installed files
+	manifest.remove()
+	assert manifest.changed_files(str(local_dir), files) == []
+	assert manifest.path.exists()
+
+	# Only changed files are transferred
+	create_depot(depot_dir, FILES | {"linux/x64/opsi-script": b"new binary"})
+	files = get_action_processor_files(str(depot_dir), "opsi-script/linux/x64", "opsi-script/common")
+	changed = manifest.changed_files(str(local_dir), files)
+	assert changed == ["opsi-script"]
+	transferred_files.clear()
+	assert build_action_processor_dir(files, str(depot_dir), str(local_dir), f"{local_dir}.tmp", changed, copy_function) == 1
+	swap_directories(f"{local_dir}.tmp", str(local_dir))
+	assert transferred_files == ["opsi-script"]
+	assert (local_dir / "opsi-script").read_bytes() == b"new binary"
+	assert (local_dir / "lib" / "libssl.so").read_bytes() == b"library"
+
+	# Transferred files are verified
+	(depot_dir / "opsi-script" / "linux" / "x64" / "opsi-script").write_bytes(b"corrupt!!!")
+	with pytest.raises(RuntimeError, match="Checksum mismatch"):
+		build_action_processor_dir(files, str(depot_dir), str(local_dir), f"{local_dir}.tmp", ["opsi-script"], copy_function)
+	assert (local_dir / "opsi-script").read_bytes() == b"new binary"
+
+
+def test_swap_directories(tmp_path: Path) -> None:
+	(tmp_path / "new").mkdir()
+	(tmp_path / "new" / "file").write_text("new", encoding="utf-8")
+	(tmp_path / "dir").mkdir()
+	(tmp_path / "dir" / "file").write_text("old", encoding="utf-8")
+	swap_directories(str(tmp_path / "new"), str(tmp_path / "dir"))
+	assert (tmp_path / "dir" / "file").read_text(encoding="utf-8") == "new"
+	assert sorted(path.name for path in tmp_path.iterdir()) == ["dir"]
+
+	# The old dir is restored on failure
+	with pytest.raises(OSError):
+		swap_directories(str(tmp_path / "missing"), str(tmp_path / "dir"))
+	assert (tmp_path / "dir" / "file").read_text(encoding="utf-8") == "new"
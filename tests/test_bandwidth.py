@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_bandwidth
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import time
+from pathlib import Path
+from threading import Thread
+
+from opsiclientd.Bandwidth import MIN_RATE, RATE_SAMPLE_INTERVAL, RATE_WINDOW, BandwidthManager, TransferPriority
+
+
+def test_global_bandwidth_limit() -> None:
+	manager = BandwidthManager(max_bandwidth=200_000)
+
+	def transfer(name: str) -> None:
+		with manager.transfer(name, TransferPriority.CACHING) as transfer:
+			for _ in range(10):
+				transfer.consume(10_000)
+
+	start = time.monotonic()
+	threads = [Thread(target=transfer, args=(f"transfer{num}",)) for num in range(2)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	# 200 kB over both transfers take about one second
+	assert time.monotonic() - start >= 0.8
+
+	state = manager.get_state()
+	assert state["rate_limit"] == 200_000
+	assert state["current_rate"] > 0
+	assert state["queued_bytes"] == 0
+	assert not state["transfers"]
+
+
+def test_transfer_priority() -> None:
+	manager = BandwidthManager()
+	limits: list[int] = []
+	caching = manager.open_transfer("caching", TransferPriority.CACHING, max_bandwidth=1_000_000, on_limit=limits.append)
+	assert caching.limit == 1_000_000
+
+	# Lower priority transfers are throttled while a higher priority transfer is running
+	with manager.transfer("action processor", TransferPriority.ACTION_PROCESSOR) as action_processor:
+		assert action_processor.limit == 0
+		assert caching.limit == MIN_RATE
+		assert [transfer["name"] for transfer in manager.get_state()["transfers"]] == ["action processor", "caching"]
+	assert caching.limit == 1_000_000
+	assert limits == [1_000_000, MIN_RATE, 1_000_000]
+	manager.close_transfer(caching)
+
+	# Waiting transfers are served by priority
+	manager.configure(max_bandwidth=100_000, dynamic=False)
+	order: list[str] = []
+	with manager.transfer("first", TransferPriority.CACHING) as first:
+		first.consume(100_000)
+
+		def consume(name: str, priority: TransferPriority) -> None:
+			with manager.transfer(name, priority) as transfer:
+				transfer.consume(1_000)
+				order.append(name)
+
+		threads = [
+			Thread(target=consume, args=("caching", TransferPriority.CACHING)),
+			Thread(target=consume, args=("action processor", TransferPriority.ACTION_PROCESSOR)),
+		]
+		for thread in threads:
+			thread.start()
+			time.sleep(0.1)
+		for thread in threads:
+			thread.join()
+	assert order == ["action processor", "caching"]
+
+
+def test_unmetered_transfer_share() -> None:
+	manager = BandwidthManager(max_bandwidth=300_000)
+	limits1: list[int] = []
+	limits2: list[int] = []
+	sync1 = manager.open_transfer("sync1", TransferPriority.CACHING, on_limit=limits1.append)
+	sync2 = manager.open_transfer("sync2", TransferPriority.CACHING, on_limit=limits2.append)
+	# Unmetered transfers share the global rate
+	assert (sync1.limit, sync2.limit) == (150_000, 150_000)
+
+	# Metered transfers together get one share of the global rate
+	with manager.transfer("download", TransferPriority.CACHING) as download:
+		assert (sync1.limit, sync2.limit) == (100_000, 100_000)
+		start = time.monotonic()
+		for _ in range(10):
+			download.consume(10_000)
+		assert time.monotonic() - start >= 0.8
+	assert (sync1.limit, sync2.limit) == (150_000, 150_000)
+
+	manager.close_transfer(sync1)
+	assert sync2.limit == 300_000
+	assert limits1 == [300_000, 150_000, 100_000, 150_000]
+	assert limits2 == [150_000, 100_000, 150_000, 300_000]
+	manager.close_transfer(sync2)
+
+
+def test_rate_samples_bounded() -> None:
+	manager = BandwidthManager()
+	with manager.transfer("download", TransferPriority.DOWNLOAD) as transfer:
+		for _ in range(10_000):
+			transfer.consume(100)
+	assert len(manager._samples) <= RATE_WINDOW / RATE_SAMPLE_INTERVAL + 2
+	assert manager.get_state()["current_rate"] == 10_000 * 100 / RATE_WINDOW
+
+
+def test_dynamic_bandwidth() -> None:
+	manager = BandwidthManager(max_bandwidth=1_000_000, dynamic=True)
+	manager.adjust_interval = 0.0
+	for _ in range(3):
+		manager.report_rtt(0.01)
+	assert manager.rate == 1_000_000
+
+	# Rising round trip times lower the rate
+	for _ in range(5):
+		manager.report_rtt(0.2)
+	assert MIN_RATE <= manager.rate < 1_000_000 * 0.7
+
+	# The rate recovers up to the maximum bandwidth
+	for _ in range(100):
+		manager.report_rtt(0.01)
+	assert manager.rate == 1_000_000
+	assert manager.get_state()["base_rtt"] == 0.01
+
+	manager.configure(max_bandwidth=0, dynamic=False)
+	assert manager.rate == 0
+
+
+def test_copy_file(tmp_path: Path) -> None:
+	manager = BandwidthManager()
+	source = tmp_path / "source"
+	(source / "sub").mkdir(parents=True)
+	(source / "sub" / "file").write_bytes(os.urandom(100_000))
+	with manager.transfer("copy", TransferPriority.ACTION_PROCESSOR) as transfer:
+		shutil.copytree(source, tmp_path / "destination", copy_function=transfer.copy_file)
+		assert transfer.transferred == 100_000
+	assert (tmp_path / "destination" / "sub" / "file").read_bytes() == (source / "sub" / "file").read_bytes()
@@ -10,15 +10,20 @@ test_config
 """
 
 import shutil
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Any
+from unittest.mock import patch
 
 import pytest
 
 from opsiclientd.Config import (
+	SNAPSHOT_BUILD_ATTEMPTS,
 	Config,
 	NoConfigOptionFoundException,
 	SectionNotFoundException,
 )
+from opsiclientd.RPCProfiler import RPCBudgetExceededError, rpc_profiler
 
 from .utils import default_config  # noqa
 
@@ -83,3 +88,229 @@ def test_update_config_file(tmp_path: Path, default_config: Config) -> None:  #
 	finally:
 		config.set("global", "config_file", conf_file)
 		config.set("global", "config_file", conf_file)
+
+
+def test_replace() -> None:
+	section = "event_replace_test"
+	config.set(section, "dir", "/opt/%event_replace_test.name%")
+	config.set(section, "name", "test")
+	config.set(section, "quoted", 'say "hello"')
+	config.set(section, "cycle1", "%event_replace_test.cycle2%")
+	config.set(section, "cycle2", "x%event_replace_test.cycle1%")
+	try:
+		assert (
+			config.replace("100% %event_replace_test.dir%/bin %unknown.option% %depot_path%")
+			== "100% /opt/test/bin %unknown.option% %depot_path%"
+		)
+		assert config.replace("%%event_replace_test.name%%") == "%test%"
+		# Circular references are not resolved
+		assert config.replace("%event_replace_test.cycle1%") == "x%event_replace_test.cycle1%"
+		assert config.replace('cmd "%event_replace_test.quoted%"', escaped=True) == 'cmd "say \\"hello\\""'
+		assert config.replace('cmd "%event_replace_test.quoted%"') == 'cmd "say "hello""'
+		# Cached result is invalidated on change
+		config.set(section, "name", "changed")
+		assert config.replace("%event_replace_test.dir%") == "/opt/changed"
+		assert config.get(section, "dir") == "/opt/changed"
+	finally:
+		for option in ("dir", "name", "quoted", "cycle1", "cycle2"):
+			config.del_option(section, option)
+		del config.getDict()[section]
+
+
+def test_config_snapshot() -> None:
+	snapshot = config.snapshot
+	assert config.snapshot is snapshot
+	assert snapshot.global_.host_id == config.get("global", "host_id")
+	assert snapshot.get("control_server", "port") == config.get("control_server", "port")
+	assert isinstance(snapshot.control_server.interface, tuple)
+	with pytest.raises(AttributeError):
+		snapshot.global_.host_id = "other.test.local"  # type: ignore[misc]
+	with pytest.raises(NoConfigOptionFoundException):
+		snapshot.get("global", "non_existing_option")
+
+	max_log_size = config.get("global", "max_log_size")
+	config.set("global", "max_log_size", max_log_size + 1)
+	try:
+		# Snapshot is rebuilt on change, old snapshot is unchanged
+		assert config.snapshot is not snapshot
+		assert config.snapshot.global_.max_log_size == max_log_size + 1
+		assert snapshot.global_.max_log_size == max_log_size
+	finally:
+		config.set("global", "max_log_size", max_log_size)
+
+
+def test_config_snapshot_concurrent_changes() -> None:
+	read_snapshot = config._read_snapshot
+	attempts = []
+
+	def changing_read_snapshot(*args: Any) -> Any:
+		attempts.append(1)
+		if len(attempts) <= SNAPSHOT_BUILD_ATTEMPTS:
+			raise RuntimeError("dictionary changed size during iteration")
+		return read_snapshot(*args)
+
+	# Falls back to building the snapshot under the config lock instead of retrying forever
+	with patch.object(config, "_read_snapshot", changing_read_snapshot):
+		snapshot = config._build_snapshot(config._generation, None, set())
+	assert len(attempts) == SNAPSHOT_BUILD_ATTEMPTS + 1
+	assert snapshot.global_.host_id == config.get("global", "host_id")
+
+
+def test_config_snapshot_rebuild_changed_sections() -> None:
+	snapshot = config.snapshot
+	generation = config._generation
+	config.set("global", "max_log_size", config.get("global", "max_log_size"))
+	# Setting an unchanged value does not invalidate the snapshot
+	assert config._generation == generation
+	assert config.snapshot is snapshot
+
+	base_dir = config.get("global", "base_dir", raw=True)
+	local_dir = config.get("action_processor", "local_dir", raw=True)
+	config.set("action_processor", "local_dir", "%global.base_dir%/action_processor")
+	try:
+		snapshot = config.snapshot
+		config.set("global", "base_dir", "/other/base")
+		rebuilt = config.snapshot
+		assert rebuilt.global_.base_dir == "/other/base"
+		# Sections referring to the changed section are rebuilt, also indirectly
+		assert rebuilt.action_processor.local_dir == "/other/base/action_processor"
+		assert "/other/base/action_processor/" in rebuilt.event_default.action_processor_command
+		affected = config._affected_sections({"global"})
+		assert {"global", "action_processor", "event_default"} <= affected
+		# Other sections are reused
+		assert rebuilt.control_server is snapshot.control_server
+		assert all(rebuilt[section] is snapshot[section] for section in rebuilt.sections if section not in affected)
+	finally:
+		config.set("action_processor", "local_dir", local_dir)
+		config.set("global", "base_dir", base_dir)
+	assert config.snapshot.action_processor.local_dir == config.get("action_processor", "local_dir")
+
+
+def test_update_config_file_incremental(tmp_path: Path, default_config: Config) -> None:  # noqa
+	conf_file = config.get("global", "config_file")
+	tmp_conf_file = tmp_path / "opsiclientd.conf"
+	shutil.copy(conf_file, tmp_conf_file)
+	config.set("global", "config_file", str(tmp_conf_file))
+	max_log_size = config.get("global", "max_log_size")
+	try:
+		config.updateConfigFile(force=True)
+		mtime = tmp_conf_file.stat().st_mtime_ns
+
+		# Nothing changed, file is not touched
+		config.updateConfigFile()
+		assert tmp_conf_file.stat().st_mtime_ns == mtime
+
+		config.set("global", "max_log_size", max_log_size + 1)
+		config.updateConfigFile()
+		content = tmp_conf_file.read_text(encoding="utf-8")
+		assert f"max_log_size = {max_log_size + 1}" in content
+		assert not list(tmp_path.glob("*.tmp"))
+	finally:
+		config.set("global", "max_log_size", max_log_size)
+		config.set("global", "config_file", conf_file)
+
+
+def test_update_config_file_keeps_unknown_sections(tmp_path: Path, default_config: Config) -> None:  # noqa
+	conf_file = config.get("global", "config_file")
+	tmp_conf_file = tmp_path / "opsiclientd.conf"
+	shutil.copy(conf_file, tmp_conf_file)
+	with open(tmp_conf_file, "a", encoding="utf-8") as file:
+		file.write("\n[unknown_section]\nunknown_option = value\n")
+	config.set("global", "config_file", str(tmp_conf_file))
+	max_log_size = config.get("global", "max_log_size")
+	try:
+		config.set("global", "max_log_size", max_log_size + 1)
+		config.updateConfigFile(force=True)
+		content = tmp_conf_file.read_text(encoding="utf-8")
+		assert f"max_log_size = {max_log_size + 1}" in content
+		assert "[unknown_section]" in content
+		assert "unknown_option = value" in content
+
+		# The temporary file is removed if writing fails
+		config.set("global", "max_log_size", max_log_size + 2)
+		with patch("opsiclientd.Config.os.replace", side_effect=OSError("Replace failed")):
+			config.updateConfigFile(force=True)
+		assert f"max_log_size = {max_log_size + 1}" in tmp_conf_file.read_text(encoding="utf-8")
+		assert not list(tmp_path.glob("*.tmp"))
+	finally:
+		config.set("global", "max_log_size", max_log_size)
+		config.set("global", "config_file", conf_file)
+
+
+@dataclass
+class Depot:
+	id: str
+
+
+class DepotSelectionService:
+	def __init__(self) -> None:
+		self.client_to_depotserver_calls = 0
+
+	def configState_getValues(self, config_ids: list[str], object_ids: list[str], with_defaults: bool) -> dict[str, Any]:
+		return {object_ids[0]: {"clientconfig.depot.dynamic": [True], "clientconfig.depot.protocol": ["webdav"]}}
+
+	def configState_getClientToDepotserver(self, clientIds: list[str], masterOnly: bool, productIds: list[str]) -> list[dict[str, Any]]:
+		self.client_to_depotserver_calls += 1
+		return [{"depotId": "master.opsi.test", "alternativeDepotIds": ["alternative.opsi.test"]}]
+
+	def host_getObjects(self, type: str, id: list[str]) -> list[Depot]:
+		return [Depot(id=depot_id) for depot_id in id]
+
+	def getDepotSelectionAlgorithm(self) -> str:
+		return "def selectDepot(clientConfig, masterDepot, alternativeDepots=[]):\n\treturn alternativeDepots[0]\n"
+
+
+def test_get_depot_cached(default_config: Config) -> None:  # noqa
+	default_config.clearDepotSelectionCache()
+	service = DepotSelectionService()
+	network_config = {"interface": "eth0", "ipAddress": "192.168.1.10", "netmask": "255.255.255.0", "defaultGateway": "192.168.1.1"}
+	with patch.object(Config, "_get_network_config", lambda self: network_config):
+		depot, protocol = default_config.getDepot(configService=service, productIds=["product1", "product2"])  # type: ignore[arg-type]
+		assert depot.id == "alternative.opsi.test"
+		assert protocol == "webdav"
+		# Selection for all products is reused for the single products
+		for product_id in ("product1", "product2"):
+			assert default_config.getDepot(configService=service, productIds=[product_id])[0].id == "alternative.opsi.test"  # type: ignore[arg-type]
+		assert service.client_to_depotserver_calls == 1
+
+		default_config.getDepot(configService=service, productIds=["product3"])  # type: ignore[arg-type]
+		assert service.client_to_depotserver_calls == 2
+
+		# Network change invalidates the selection
+		network_config = dict(network_config, defaultGateway="10.0.0.1")
+		default_config.getDepot(configService=service, productIds=["product1"])  # type: ignore[arg-type]
+		assert service.client_to_depotserver_calls == 3
+	default_config.clearDepotSelectionCache()
+
+
+class ProfiledDepotSelectionService(DepotSelectionService):
+	def __getattribute__(self, name: str) -> Any:
+		attr = super().__getattribute__(name)
+		if not callable(attr) or name.startswith("_"):
+			return attr
+
+		def profiled(*args: Any, **kwargs: Any) -> Any:
+			with rpc_profiler.call(name):
+				return attr(*args, **kwargs)
+
+		return profiled
+
+
+def test_get_depot_rpc_budget(default_config: Config) -> None:  # noqa
+	default_config.clearDepotSelectionCache()
+	service = ProfiledDepotSelectionService()
+	network_config = {"interface": "eth0", "ipAddress": "192.168.1.10", "netmask": "255.255.255.0", "defaultGateway": "192.168.1.1"}
+	try:
+		with patch.object(Config, "_get_network_config", lambda self: network_config):
+			with rpc_profiler.enforce_budgets({"Config.getDepot": 4}):
+				default_config.getDepot(configService=service, productIds=["product1", "product2"])  # type: ignore[arg-type]
+			# Cached depot selections do not need the service
+			with rpc_profiler.enforce_budgets({"Config.getDepot": 0}):
+				for product_id in ("product1", "product2"):
+					default_config.getDepot(configService=service, productIds=[product_id])  # type: ignore[arg-type]
+			default_config.clearDepotSelectionCache()
+			with pytest.raises(RPCBudgetExceededError, match="'Config.getDepot' exceeded its rpc call budget"):
+				with rpc_profiler.enforce_budgets({"Config.getDepot": 0}):
+					default_config.getDepot(configService=service, productIds=["product1"])  # type: ignore[arg-type]
+	finally:
+		default_config.clearDepotSelectionCache()
@@ -17,7 +17,7 @@ import time
 
 import pytest
 
-from opsiclientd.ControlPipe import ControlPipeFactory, PosixControlDomainSocket
+from opsiclientd.ControlPipe import ControlPipeFactory, JSONStreamDecoder, PosixControlDomainSocket
 from opsiclientd.Opsiclientd import Opsiclientd
 from opsiclientd.webserver.rpc.jsonrpc import JSONRPCRequest, JSONRPCResponse, deserialize_data, jsonrpc_response_from_data, serialize_data
 from .utils import default_config  # noqa
@@ -104,10 +104,77 @@ def test_control_pipe() -> None:  # noqa
 		assert len(pipe_client.data_received) == 3
 		request_dict = deserialize_data(pipe_client.data_received[2], "json")
 		print(request)
-		assert request_dict["id"] == 1
+		# Rpc ids are unique per client, blockLogin was sent with id 1
+		assert request_dict["id"] == 2
 		assert request_dict["method"] == method
 		assert request_dict["params"] == params
 
 	finally:
 		pipe_client.stop()
 		control_pipe.stop()
+
+
+def test_json_stream_decoder() -> None:
+	decoder = JSONStreamDecoder()
+	data = b'{"id": 1, "method": "m", "params": ["}{\\"[", {"a": [1, 2]}]}\0[{"id": 2}]{"id": 3, "result": null}'
+	# Feed in small chunks, documents and escape sequences are split across chunks
+	documents = []
+	for idx in range(0, len(data), 3):
+		decoder.feed(data[idx : idx + 3])
+		while (document := decoder.next_document()) is not None:
+			documents.append(deserialize_data(document, "json"))
+	assert documents == [
+		{"id": 1, "method": "m", "params": ['}{"[', {"a": [1, 2]}]},
+		[{"id": 2}],
+		{"id": 3, "result": None},
+	]
+	assert len(decoder) == 0
+
+
+@pytest.mark.linux
+def test_control_pipe_concurrent_rpcs() -> None:  # noqa
+	ocd = Opsiclientd()
+	control_pipe = ControlPipeFactory(ocd)
+	assert isinstance(control_pipe, PosixControlDomainSocket)
+	control_pipe.start()
+	time.sleep(1)
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.settimeout(5)
+	try:
+		sock.connect(control_pipe._socketName)
+		sock.sendall(serialize_data(JSONRPCRequest(id=1, method="registerClient", params=["opsi-login-blocker", "4.3.0.0"]), "json"))
+		decoder = JSONStreamDecoder()
+
+		def receive() -> dict:
+			while (document := decoder.next_document()) is None:
+				decoder.feed(sock.recv(4096))
+			return deserialize_data(document, "json")
+
+		assert receive()["result"] == "client opsi-login-blocker/4.3.0.0/#1 registered"
+		block_login = receive()
+		assert block_login["method"] == "blockLogin"
+		sock.sendall(serialize_data({"id": block_login["id"], "result": "blocking login", "error": None}, "json"))
+
+		responses: dict[int, JSONRPCResponse] = {}
+
+		def execute_rpc(num: int) -> None:
+			response = control_pipe._clients[0].executeRpc("some_method", [num])
+			assert isinstance(response, JSONRPCResponse)
+			responses[num] = response
+
+		threads = [threading.Thread(target=execute_rpc, args=[num]) for num in (1, 2)]
+		for thread in threads:
+			thread.start()
+		requests = [receive(), receive()]
+		assert requests[0]["id"] != requests[1]["id"]
+		# Both rpcs are outstanding, answer in reverse order
+		for request in reversed(requests):
+			sock.sendall(serialize_data({"id": request["id"], "result": request["params"][0] * 10, "error": None}, "json"))
+		for thread in threads:
+			thread.join(5)
+
+		assert responses[1].result == 10
+		assert responses[2].result == 20
+	finally:
+		sock.close()
+		control_pipe.stop()
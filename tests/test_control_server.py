@@ -29,6 +29,7 @@ from opsiclientd import __version__
 from opsiclientd.Events.Utilities.Configs import getEventConfigs
 from opsiclientd.Events.Utilities.Generators import createEventGenerators
 from opsiclientd.Opsiclientd import Opsiclientd
+from opsiclientd.PeerCache import PEER_CACHE_USERNAME
 from opsiclientd.webserver.application.log_viewer import LogReaderThread
 from opsiclientd.webserver.application.middleware import REDIRECTS
 from opsiclientd.webserver.rpc.control import ControlInterface, get_cache_service_interface
@@ -215,6 +216,51 @@ def test_control_jsonrpc(test_client: OpsiclientdTestClient, opsiclientd_auth: t
 		assert response["id"] == "3"
 
 
+def test_metrics(test_client: OpsiclientdTestClient, opsiclientd_auth: tuple[str, str]) -> None:  # noqa
+	with test_client as client:
+		test_client.auth = opsiclientd_auth
+		client.jsonrpc20(path="/opsiclientd", method="uptime", params=[], id="1")
+		client.jsonrpc20(path="/opsiclientd", method="invalid", params=[], id="2")
+
+		response = client.get("/metrics")
+		assert response.status_code == 200
+		assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+		assert 'opsiclientd_rpc_requests_total{interface="ControlInterface",method="uptime"}' in response.text
+		assert 'opsiclientd_rpc_errors_total{interface="ControlInterface",method="invalid"} 1' in response.text
+		assert 'opsiclientd_rpc_duration_seconds_bucket{interface="ControlInterface",method="uptime",le="+Inf"}' in response.text
+
+		response = client.jsonrpc20(path="/opsiclientd", method="getRpcMetrics", params=[], id="3")
+		metrics = response["result"]
+		assert metrics["interfaces"]["ControlInterface"]["uptime"]["requests"] >= 1
+		assert metrics["interfaces"]["ControlInterface"]["uptime"]["request_size"]["count"] >= 1
+		assert metrics["transports"]["http"]["requests"] >= 2
+
+
+def test_peer_cache_auth(default_config: Config, test_client: OpsiclientdTestClient) -> None:  # noqa
+	peer_auth = (PEER_CACHE_USERNAME, "peer cache secret")
+	test_client.set_client_address("1.2.3.4", 12345)
+	with test_client as client:
+		# No peer cache secret configured
+		response = client.get("/peer_cache/products", auth=peer_auth)
+		assert response.status_code == 401
+
+		default_config.set("cache_service", "peer_cache_secret", peer_auth[1])
+		try:
+			response = client.get("/peer_cache/products", auth=(PEER_CACHE_USERNAME, "peer cache secreT"))
+			assert response.status_code == 401
+
+			response = client.get("/peer_cache/products", auth=peer_auth)
+			# Authenticated, but the peer cache is disabled
+			assert response.status_code == 404
+
+			# Peers are restricted to the peer cache
+			response = client.get("/metrics")
+			assert response.status_code == 401
+			assert "Permission denied" in response.text
+		finally:
+			default_config.set("cache_service", "peer_cache_secret", "")
+
+
 @pytest.mark.opsiclientd_running
 def test_concurrency(opsiclientd_url: str, opsiclientd_auth: tuple[str, str]) -> None:  # noqa
 	if is_macos():
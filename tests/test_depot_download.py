@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_depot_download
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from contextlib import contextmanager
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+from typing import Generator
+
+import pytest
+
+from opsiclientd.DepotDownload import DepotFileDownloader, DownloadError
+
+
+class DepotRequestHandler(BaseHTTPRequestHandler):
+	content = os.urandom(1024 * 1024)
+	# Number of requests to abort after sending half of the requested data
+	drop_connections = 0
+	requests: list[str | None] = []
+
+	def do_GET(self) -> None:
+		if not self.path.startswith("/depot/product1/"):
+			self.send_error(404)
+			return
+		range_header = self.headers.get("Range")
+		self.requests.append(range_header)
+		start = 0
+		end = len(self.content)
+		if range_header:
+			first, last = range_header.split("=")[1].split("-")
+			start = int(first)
+			if last:
+				end = int(last) + 1
+			self.send_response(206)
+			self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(self.content)}")
+		else:
+			self.send_response(200)
+		data = self.content[start:end]
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		if DepotRequestHandler.drop_connections:
+			DepotRequestHandler.drop_connections -= 1
+			self.wfile.write(data[: len(data) // 2])
+			self.wfile.flush()
+			self.connection.close()
+			return
+		self.wfile.write(data)
+
+	def log_message(self, format: str, *args: object) -> None:
+		pass
+
+
+@contextmanager
+def depot_server() -> Generator[str, None, None]:
+	server = ThreadingHTTPServer(("127.0.0.1", 0), DepotRequestHandler)
+	thread = Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	try:
+		yield f"webdav://127.0.0.1:{server.server_address[1]}/depot"
+	finally:
+		server.shutdown()
+		server.server_close()
+
+
+def test_resume_download(tmp_path: Path) -> None:
+	content = DepotRequestHandler.content
+	destination = tmp_path / "depot" / "product1" / "large.bin"
+	DepotRequestHandler.requests = []
+	DepotRequestHandler.drop_connections = 2
+	with depot_server() as url:
+		downloader = DepotFileDownloader(url, partial_dir=tmp_path / "partial", retry_wait=0.01)
+		downloader.download("product1/large.bin", destination, size=len(content), md5sum=md5(content).hexdigest())
+
+	assert destination.read_bytes() == content
+	# Downloads are resumed at the received offset
+	assert DepotRequestHandler.requests == [None, f"bytes={len(content) // 2}-", f"bytes={len(content) * 3 // 4}-"]
+	assert not list((tmp_path / "partial").iterdir())
+
+
+def test_resume_download_next_run(tmp_path: Path) -> None:
+	content = DepotRequestHandler.content
+	destination = tmp_path / "large.bin"
+	DepotRequestHandler.requests = []
+	DepotRequestHandler.drop_connections = 3
+	with depot_server() as url:
+		downloader = DepotFileDownloader(url, partial_dir=tmp_path / "partial", retry_wait=0.01, max_retries=0)
+		with pytest.raises(DownloadError):
+			downloader.download("product1/large.bin", destination, size=len(content), md5sum=md5(content).hexdigest())
+		assert not destination.exists()
+
+		# Partial file is kept for the next run
+		DepotRequestHandler.drop_connections = 0
+		downloader.download("product1/large.bin", destination, size=len(content), md5sum=md5(content).hexdigest())
+		assert destination.read_bytes() == content
+		assert DepotRequestHandler.requests == [None, f"bytes={len(content) // 2}-"]
+
+		with pytest.raises(DownloadError, match="Checksum mismatch"):
+			downloader.download("product1/large.bin", tmp_path / "other.bin", size=len(content), md5sum="0" * 32)
+		assert not (tmp_path / "other.bin").exists()
+
+		# Client errors are not retried
+		with pytest.raises(DownloadError, match="HTTP status 404"):
+			downloader.download("other/large.bin", destination, size=len(content))
+
+
+def test_parallel_chunked_download(tmp_path: Path) -> None:
+	content = DepotRequestHandler.content
+	destination = tmp_path / "large.bin"
+	DepotRequestHandler.requests = []
+	DepotRequestHandler.drop_connections = 1
+	with depot_server() as url:
+		downloader = DepotFileDownloader(
+			url, partial_dir=tmp_path / "partial", retry_wait=0.01, connections=4, parallel_min_size=1, max_bandwidth=2 * len(content)
+		)
+		start = time.monotonic()
+		downloader.download("product1/large.bin", destination, size=len(content), md5sum=md5(content).hexdigest())
+		duration = time.monotonic() - start
+
+	assert destination.read_bytes() == content
+	chunk_size = len(content) // 4
+	# The last chunk ends at the end of the file
+	ranges = [f"bytes={start}-{start + chunk_size - 1}" for start in range(0, len(content) - chunk_size, chunk_size)]
+	ranges.append(f"bytes={len(content) - chunk_size}-")
+	# One chunk was resumed after the connection drop
+	assert len(DepotRequestHandler.requests) == 5
+	assert set(ranges) < set(DepotRequestHandler.requests)
+	# Bandwidth is limited over all connections
+	assert duration >= 0.4
+	assert not list((tmp_path / "partial").iterdir())
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_depot_selection
+"""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Generator
+
+from opsiclientd.DepotSelection import DepotProbeResult, DepotScoreHistory, LatencyDepotSelector, probe_depot
+
+
+@dataclass
+class Depot:
+	id: str
+	depotWebdavUrl: str | None
+
+
+@contextmanager
+def depot_server(delay: float = 0.0) -> Generator[str, None, None]:
+	class Handler(BaseHTTPRequestHandler):
+		def do_GET(self) -> None:
+			time.sleep(delay)
+			data = b"x" * 1024
+			self.send_response(206 if self.headers.get("Range") else 200)
+			self.send_header("Content-Length", str(len(data)))
+			self.end_headers()
+			self.wfile.write(data)
+
+		def log_message(self, format: str, *args: object) -> None:
+			pass
+
+	server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+	thread = Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	try:
+		yield f"webdav://127.0.0.1:{server.server_address[1]}/depot"
+	finally:
+		server.shutdown()
+		server.server_close()
+
+
+def test_probe_depot() -> None:
+	with depot_server() as url:
+		result = probe_depot("depot.opsi.test", url, timeout=2.0, read_size=512)
+	assert result.error is None
+	assert result.read_bytes == 512
+	assert result.connect_time > 0
+	assert result.throughput > 0
+
+	result = probe_depot("depot.opsi.test", url, timeout=1.0)
+	assert result.error
+
+
+def test_depot_score_history_decays() -> None:
+	history = DepotScoreHistory(half_life=10.0, failure_score=6.0)
+	now = time.time()
+	history.add(DepotProbeResult(depot_id="depot", timestamp=now - 100, read_time=4.0))
+	history.add(DepotProbeResult(depot_id="depot", timestamp=now, read_time=1.0))
+	score = history.score("depot", now)
+	assert score is not None
+	# The old measurement has nearly no weight
+	assert 1.0 < score < 1.01
+	history.add(DepotProbeResult(depot_id="depot", timestamp=now, error="timed out"))
+	# Failed probes count as failure score
+	assert 3.5 < (history.score("depot", now) or 0) < 3.51
+	assert history.score("unknown", now) is None
+
+
+def test_latency_depot_selection() -> None:
+	selector = LatencyDepotSelector()
+	with depot_server(delay=0.5) as slow_url, depot_server() as fast_url:
+		master = Depot(id="master.opsi.test", depotWebdavUrl=slow_url)
+		fast = Depot(id="fast.opsi.test", depotWebdavUrl=fast_url)
+		no_webdav = Depot(id="nowebdav.opsi.test", depotWebdavUrl=None)
+		assert selector.select_depot(master, [fast, no_webdav], timeout=2.0) is fast  # type: ignore[arg-type]
+		assert len(selector.history.get_results("master.opsi.test")) == 1
+
+		# Unreachable depots are not selected
+		unreachable = Depot(id="unreachable.opsi.test", depotWebdavUrl="webdav://127.0.0.1:1/depot")
+		assert selector.select_depot(master, [unreachable], timeout=2.0) is master  # type: ignore[arg-type]
+
+	# No depot reachable, fall back to the configured algorithm
+	assert selector.select_depot(unreachable, [], timeout=1.0) is None  # type: ignore[arg-type]
@@ -22,7 +22,7 @@ from opsiclientd.Events.ProcessActionRequests import ProcessActionRequestsEventC
 from opsiclientd.Events.SwOnDemand import SwOnDemandEventConfig
 from opsiclientd.Events.SyncCompleted import SyncCompletedEventConfig
 from opsiclientd.Events.Timer import TimerEventConfig
-from opsiclientd.Events.Utilities.Configs import getEventConfigs
+from opsiclientd.Events.Utilities.Configs import compileEventConfigs, getEventConfigs
 from opsiclientd.Events.Utilities.Generators import reconfigureEventGenerators
 
 from .utils import load_config_file
@@ -95,3 +95,23 @@ def test_inheritance() -> None:
 	assert configs["gui_startup"]["shutdownWarningTime"] == 12345
 	assert configs["gui_startup{cache_ready}"]["shutdownWarningTime"] == 12345
 	assert configs["gui_startup{installation_pending}"]["shutdownWarningTime"] == 12345
+
+
+def test_compile_event_configs() -> None:
+	config = load_config_file("tests/data/event_config/1.conf")
+
+	compiled = compileEventConfigs()
+	# Unchanged config is not compiled again
+	assert compileEventConfigs() is compiled
+	# Callers get copies
+	configs = getEventConfigs()
+	configs["on_demand"]["excludeProductGroupIds"].append("modified")
+	assert "modified" not in compiled.configs["on_demand"]["excludeProductGroupIds"]
+
+	config.set(section="event_on_demand", option="shutdown_warning_time", value=4711)
+	recompiled = compileEventConfigs()
+	assert recompiled.hash != compiled.hash
+	assert recompiled.configs["on_demand"]["shutdownWarningTime"] == 4711
+	# Only the fingerprints of the affected events change
+	changed = {event_id for event_id, fingerprint in recompiled.fingerprints.items() if compiled.fingerprints[event_id] != fingerprint}
+	assert changed == {"on_demand"}
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_event_processing
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Generator
+
+import pytest
+
+from opsiclientd.EventConfiguration import EventConfig
+from opsiclientd.EventProcessing import (
+	EventProcessingCanceled,
+	EventProcessingThread,
+	ProductInfo,
+	_phase_history,
+	get_phase_history,
+	state,
+)
+from opsiclientd.Events.Basic import Event
+from opsiclientd.Timeline import Timeline
+from opsiclientd.webserver.rpc.control import get_control_interface
+
+
+@dataclass
+class ProductOnClient:
+	productId: str
+	productVersion: str
+	packageVersion: str
+	actionRequest: str = "setup"
+
+
+@dataclass
+class ProductOnDepot:
+	productId: str
+	productVersion: str
+	packageVersion: str
+
+
+@dataclass
+class Product:
+	id: str
+	productVersion: str
+	packageVersion: str
+	name: str
+
+
+PRODUCT_ON_CLIENTS = [
+	ProductOnClient("firefox", "120.0", "1"),
+	ProductOnClient("7zip", "23.01", "2", actionRequest="update"),
+	ProductOnClient("firefox", "120.0", "1", actionRequest="once"),
+	# Not on the depot
+	ProductOnClient("legacy", "1.0", "1"),
+	ProductOnClient("vlc", "3.0", "1"),
+]
+PRODUCT_ON_DEPOTS = [
+	ProductOnDepot("vlc", "3.0", "2"),
+	ProductOnDepot("firefox", "121.0", "2"),
+	ProductOnDepot("7zip", "23.01", "2"),
+	ProductOnDepot("office", "2021", "1"),
+]
+PRODUCTS = [
+	Product("firefox", "120.0", "1", "Firefox 120"),
+	Product("firefox", "121.0", "1", "Firefox 121 broken package"),
+	Product("firefox", "121.0", "2", "Firefox 121"),
+	# Matched by the version filters of other products
+	Product("firefox", "23.01", "2", "Firefox wrong version"),
+	Product("7zip", "23.01", "1", "7-Zip old package"),
+	Product("7zip", "23.01", "2", "7-Zip"),
+	Product("legacy", "1.0", "1", "Legacy"),
+	Product("vlc", "3.0", "1", "VLC old package"),
+	Product("vlc", "3.0", "2", "VLC"),
+	Product("office", "2021", "1", "Office"),
+]
+
+
+class ConfigService:
+	def __init__(self) -> None:
+		self.product_filters: list[dict[str, Any]] = []
+
+	def productOnClient_getObjects(self, productId: list[str], **kwargs: Any) -> list[ProductOnClient]:
+		return [poc for poc in PRODUCT_ON_CLIENTS if not productId or poc.productId in productId]
+
+	def productOnDepot_getObjects(self, productId: list[str], **kwargs: Any) -> list[ProductOnDepot]:
+		return [pod for pod in PRODUCT_ON_DEPOTS if pod.productId in productId]
+
+	def product_getObjects(self, id: list[str], productVersion: list[str], packageVersion: list[str], **kwargs: Any) -> list[Product]:
+		self.product_filters.append({"id": id, "productVersion": productVersion, "packageVersion": packageVersion})
+		return [
+			product
+			for product in PRODUCTS
+			if product.id in id and product.productVersion in productVersion and product.packageVersion in packageVersion
+		]
+
+	def productOnClient_getIdents(self, **kwargs: Any) -> list[dict[str, str]]:
+		return []
+
+
+def join_nested_loops() -> list[ProductInfo]:
+	"""
+	The product info joined like before the dict indexes, from all versions of the products.
+	"""
+	product_info: list[ProductInfo] = []
+	for poc in PRODUCT_ON_CLIENTS:
+		if poc.productId not in [p_info.id for p_info in product_info]:
+			product_info.append(ProductInfo(poc.productId, poc.productVersion, poc.packageVersion, ""))
+	for pod in PRODUCT_ON_DEPOTS:
+		for p_info in product_info:
+			if p_info.id == pod.productId:
+				p_info.productVersion = pod.productVersion
+				p_info.packageVersion = pod.packageVersion
+				break
+	for product in PRODUCTS:
+		for p_info in product_info:
+			if (
+				p_info.id == product.id
+				and p_info.productVersion == product.productVersion
+				and p_info.packageVersion == product.packageVersion
+			):
+				p_info.name = product.name
+	return product_info
+
+
+class Opsiclientd:
+	def __init__(self) -> None:
+		self.event_processing_threads: list[EventProcessingThread] = []
+
+	def getCacheService(self) -> Any:
+		raise RuntimeError("Cache service not started")
+
+	def getEventProcessingThreads(self) -> list[EventProcessingThread]:
+		return self.event_processing_threads
+
+
+@dataclass
+class Response:
+	headers: dict[str, str] = field(default_factory=dict)
+
+
+class ServiceClient:
+	def request(self, method: str, path: str, data: bytes | None = None) -> Response:
+		return Response(headers={"Content-Length": "100"} if method == "POST" else {})
+
+
+class JSONRPCBackend:
+	def __init__(self) -> None:
+		self.service = ServiceClient()
+
+
+@pytest.fixture
+def timeline_events(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Generator[list[dict[str, Any]], None, None]:
+	events: list[dict[str, Any]] = []
+
+	def add_event(self: Timeline, **kwargs: Any) -> int:
+		events.append(kwargs)
+		return len(events)
+
+	monkeypatch.setattr(Timeline, "addEvent", add_event)
+	monkeypatch.setattr(state, "_stateFile", str(tmp_path / "state.json"))
+	_phase_history.clear()
+	yield events
+	_phase_history.clear()
+
+
+def create_event_processing_thread(opsiclientd: Opsiclientd, event_id: str = "on_demand") -> EventProcessingThread:
+	return EventProcessingThread(opsiclientd, Event(EventConfig(event_id)))  # type: ignore[arg-type]
+
+
+def test_phase_spans(timeline_events: list[dict[str, Any]]) -> None:
+	ept = create_event_processing_thread(Opsiclientd())
+	with ept.phase("outer") as outer:
+		with ept.phase("inner") as inner:
+			assert inner.depth == 1
+			assert inner.end is None
+		with pytest.raises(ValueError):
+			with ept.phase("failing"):
+				raise ValueError("Failed")
+	with pytest.raises(EventProcessingCanceled):
+		with ept.phase("canceled"):
+			raise EventProcessingCanceled()
+
+	phases = ept.getPhaseInfo()["phases"]
+	assert [(phase["name"], phase["depth"], phase["error"]) for phase in phases] == [
+		("outer", 0, None),
+		("inner", 1, None),
+		("failing", 1, "Failed"),
+		("canceled", 0, "EventProcessingCanceled"),
+	]
+	for phase in phases:
+		assert phase["start"] <= phase["end"]
+		assert phase["duration"] == pytest.approx(phase["end"] - phase["start"])
+	# Nested phases are within the outer phase
+	assert outer.start <= inner.start and inner.end and outer.end and inner.end <= outer.end
+	# Every finished phase is added to the timeline, canceled phases are no error
+	assert [(event["title"], event["isError"], event["category"]) for event in timeline_events] == [
+		("Phase inner", False, "event_processing_phase"),
+		("Phase failing", True, "event_processing_phase"),
+		("Phase outer", False, "event_processing_phase"),
+		("Phase canceled", False, "event_processing_phase"),
+	]
+
+
+def test_phase_rpc_statistics(timeline_events: list[dict[str, Any]]) -> None:
+	ept = create_event_processing_thread(Opsiclientd())
+	ept._configService = JSONRPCBackend()  # type: ignore[assignment]
+	ept._count_service_requests()
+	service = ept._configService.service  # type: ignore[union-attr]
+
+	service.request("POST", "/rpc", data=b"x" * 10)
+	with ept.phase("phase1"):
+		service.request("POST", "/rpc", data=b"x" * 20)
+		service.request("GET", "/status")
+		with ept.phase("phase2"):
+			service.request("POST", "/rpc", data="y" * 30)
+
+	statistics = ept.getRPCStatistics()
+	assert (statistics.rpc_count, statistics.request_count, statistics.bytes_sent, statistics.bytes_received) == (3, 4, 60, 300)
+	phases = {phase["name"]: phase for phase in ept.getPhaseInfo()["phases"]}
+	# Only the requests during the phase are counted, including the requests of nested phases
+	assert {key: phases["phase1"][key] for key in ("rpc_count", "request_count", "bytes_sent", "bytes_received")} == {
+		"rpc_count": 2,
+		"request_count": 3,
+		"bytes_sent": 50,
+		"bytes_received": 200,
+	}
+	assert {key: phases["phase2"][key] for key in ("rpc_count", "request_count", "bytes_sent", "bytes_received")} == {
+		"rpc_count": 1,
+		"request_count": 1,
+		"bytes_sent": 30,
+		"bytes_received": 100,
+	}
+
+
+def test_phase_history_bound(timeline_events: list[dict[str, Any]]) -> None:
+	opsiclientd = Opsiclientd()
+	for num in range(30):
+		ept = create_event_processing_thread(opsiclientd, f"event{num}")
+		with ept.phase("phase"):
+			pass
+		ept._finishPhases()
+	# Event processing threads without phases are not added
+	create_event_processing_thread(opsiclientd, "no_phases")._finishPhases()
+
+	history = get_phase_history()
+	assert len(history) == 25
+	assert [info["event_id"] for info in history] == [f"event{num}" for num in range(5, 30)]
+	assert all(info["end"] for info in history)
+
+
+def test_get_event_processing_phases(timeline_events: list[dict[str, Any]]) -> None:
+	opsiclientd = Opsiclientd()
+	finished = create_event_processing_thread(opsiclientd, "timer")
+	with finished.phase("sync_config"):
+		pass
+	finished._finishPhases()
+	running = create_event_processing_thread(opsiclientd, "on_demand")
+	running.running = True
+	running._startTime = 1.0
+	opsiclientd.event_processing_threads.extend([finished, running])
+
+	with running.phase("process_product_action_requests"):
+		phases = get_control_interface(opsiclientd).getEventProcessingPhases()  # type: ignore[arg-type]
+	# The finished event processing thread is only returned once, from the history
+	assert [(info["event_id"], info["running"], bool(info["end"])) for info in phases] == [
+		("timer", False, True),
+		("on_demand", True, False),
+	]
+	assert [phase["name"] for phase in phases[0]["phases"]] == ["sync_config"]
+	assert [(phase["name"], phase["end"]) for phase in phases[1]["phases"]] == [("process_product_action_requests", None)]
+	assert phases[1]["start"] == 1.0
+
+
+def test_process_product_action_requests_product_info(timeline_events: list[dict[str, Any]], monkeypatch: pytest.MonkeyPatch) -> None:
+	ept = create_event_processing_thread(Opsiclientd())
+	config_service = ConfigService()
+	ept._configService = config_service
+	processed: list[list[ProductInfo]] = []
+	monkeypatch.setattr(ept, "setStatusMessage", lambda message: None)
+	monkeypatch.setattr(ept, "processActionWarningTime", lambda productInfo: None)
+	monkeypatch.setattr(ept, "runActions", lambda productInfo, additionalParams="": processed.append(productInfo))
+
+	ept.processProductActionRequests()
+
+	assert processed == [join_nested_loops()]
+	assert [(p_info.id, p_info.productVersion, p_info.packageVersion, p_info.name) for p_info in processed[0]] == [
+		("firefox", "121.0", "2", "Firefox 121"),
+		("7zip", "23.01", "2", "7-Zip"),
+		("legacy", "1.0", "1", "Legacy"),
+		("vlc", "3.0", "2", "VLC"),
+	]
+	# Only the versions on the depot are requested, with a single call
+	assert len(config_service.product_filters) == 1
+	assert sorted(config_service.product_filters[0]["productVersion"]) == ["1.0", "121.0", "23.01", "3.0"]
+	assert sorted(config_service.product_filters[0]["packageVersion"]) == ["1", "2"]
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_event_queue
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+
+from opsiclientd.EventConfiguration import EventConfig
+from opsiclientd.Events.Basic import CannotCancelEventError, Event, EventGenerator, EventListener
+from opsiclientd.Events.Custom import CustomEventConfig, CustomEventGenerator
+from opsiclientd.Events.DaemonShutdown import DaemonShutdownEventConfig, DaemonShutdownEventGenerator
+from opsiclientd.Events.DaemonStartup import DaemonStartupEventConfig, DaemonStartupEventGenerator
+from opsiclientd.Events.SwOnDemand import SwOnDemandEventConfig, SwOnDemandEventGenerator
+from opsiclientd.Events.SyncCompleted import SyncCompletedEventConfig, SyncCompletedEventGenerator
+from opsiclientd.Events.Timer import TimerEventConfig, TimerEventGenerator
+from opsiclientd.Events.Utilities.Queue import EventQueue, event_queue
+from opsiclientd.Opsiclientd import Opsiclientd as OpsiclientdDaemon
+from opsiclientd.webserver.rpc.control import get_control_interface
+
+
+def test_event_queue(tmp_path: Path) -> None:
+	queue_file = tmp_path / "event_queue.json"
+	queue = EventQueue(queue_file)
+	queue.put("timer", "timer", {"n": "1"})
+	queue.put("on_demand", "on_demand{user_logged_in}", priority=1)
+	# Coalesced with the first timer event
+	queue.put("timer", "timer", {"n": "2"})
+	queue.put("sync_completed", "sync_completed", key="sync")
+	queue.put("timer_sync", "timer_sync", key="sync")
+	assert len(queue) == 3
+
+	state = queue.get_state()
+	assert state["depth"] == 3
+	assert [(event["key"], event["occurrences"]) for event in state["events"]] == [("on_demand", 1), ("timer", 2), ("sync", 2)]
+	assert state["events"][1]["event_info"] == {"n": "2"}
+	assert state["events"][2]["generator_id"] == "timer_sync"
+
+	# The queue is persistent
+	queue = EventQueue()
+	queue.load(queue_file)
+	queued_event = queue.pop()
+	assert queued_event and queued_event.key == "on_demand"
+	queued_event = queue.pop()
+	assert queued_event and queued_event.key == "timer"
+	# Requeued events keep their place
+	queue.requeue(queued_event)
+	queued_event = queue.pop()
+	assert queued_event and queued_event.key == "timer"
+	queue.dispatched(queued_event)
+	assert queue.get_state()["dispatched"] == 1
+	assert queue.clear() == 1
+	queue = EventQueue()
+	queue.load(queue_file)
+	assert not len(queue)
+
+
+def test_event_queue_load_ignore_generators(tmp_path: Path) -> None:
+	queue_file = tmp_path / "event_queue.json"
+	queue = EventQueue(queue_file)
+	queue.put("timer", "timer")
+	queue.put("daemon_shutdown", "daemon_shutdown")
+
+	queue = EventQueue()
+	# Queued before the file is loaded
+	queue.put("on_demand", "on_demand")
+	queue.load(queue_file, ignore_generator_ids=["daemon_shutdown"])
+	assert [event["key"] for event in queue.get_state()["events"]] == ["on_demand", "timer"]
+	# The ignored events are removed from the file
+	queue = EventQueue()
+	queue.load(queue_file)
+	assert [event["key"] for event in queue.get_state()["events"]] == ["on_demand", "timer"]
+
+
+class Listener(EventListener):
+	def canProcessEvent(self, event: Event, can_cancel: bool = False) -> bool:
+		raise CannotCancelEventError("Already processing a non-cancelable event: other")
+
+	def processEvent(self, event: Event) -> None:
+		pass
+
+
+class Opsiclientd:
+	def __init__(self) -> None:
+		self.eventLock = threading.Lock()
+
+
+def test_queue_event_if_busy() -> None:
+	opsiclientd: Any = Opsiclientd()
+	config = TimerEventConfig("timer", queuePriority=2)
+	generator = TimerEventGenerator(opsiclientd, config)
+	generator.addEventConfig(config)
+	generator.addEventListener(Listener())
+	event_queue.clear()
+	try:
+		generator._fireNextEvent(generator.createEvent({"info": "1"}))
+		generator._fireNextEvent(generator.createEvent({"info": "2"}))
+		# The event lock is released
+		assert not opsiclientd.eventLock.locked()
+		state = event_queue.get_state()
+		assert [(event["key"], event["priority"], event["occurrences"], event["event_info"]) for event in state["events"]] == [
+			("timer", 2, 2, {"info": "2"})
+		]
+
+		config.queueIfBusy = False
+		event_queue.clear()
+		generator._fireNextEvent(generator.createEvent())
+		assert not len(event_queue)
+	finally:
+		event_queue.clear()
+
+
+@pytest.mark.parametrize(
+	"generator",
+	(
+		DaemonStartupEventGenerator(Opsiclientd(), DaemonStartupEventConfig("daemon_startup")),  # type: ignore[arg-type]
+		DaemonShutdownEventGenerator(Opsiclientd(), DaemonShutdownEventConfig("daemon_shutdown")),  # type: ignore[arg-type]
+		CustomEventGenerator(Opsiclientd(), CustomEventConfig("on_shutdown")),  # type: ignore[arg-type]
+		CustomEventGenerator(Opsiclientd(), CustomEventConfig("on_shutdown{installation_pending}", queueIfBusy=True)),  # type: ignore[arg-type]
+	),
+)
+def test_lifecycle_events_not_queued(generator: EventGenerator) -> None:
+	generator.addEventConfig(generator._generatorConfig)
+	generator.addEventListener(Listener())
+	assert not generator.canQueueEvents()
+	event_queue.clear()
+	try:
+		with pytest.raises(CannotCancelEventError):
+			generator.createAndFireEvent()
+		assert not len(event_queue)
+	finally:
+		event_queue.clear()
+
+
+@dataclass
+class RunningEvent:
+	event: Event
+
+	def is_cancelable(self) -> bool:
+		return False
+
+
+class RecordingOpsiclientd(OpsiclientdDaemon):
+	def __init__(self) -> None:
+		super().__init__()
+		self.processed_events: list[str] = []
+		self.event_processed = threading.Event()
+
+	def processEvent(self, event: Event) -> None:
+		self.processed_events.append(event.eventConfig.getId())
+		self.eventLock.release()
+		self.event_processed.set()
+
+
+def test_queue_fired_events_if_busy() -> None:
+	opsiclientd = RecordingOpsiclientd()
+	sync_completed = SyncCompletedEventGenerator(opsiclientd, SyncCompletedEventConfig("sync_completed"))
+	sync_completed.addEventConfig(SyncCompletedEventConfig("sync_completed"))
+	on_demand = SwOnDemandEventGenerator(opsiclientd, SwOnDemandEventConfig("on_demand"))
+	on_demand.addEventConfig(SwOnDemandEventConfig("on_demand"))
+	generators = {"sync_completed": sync_completed, "on_demand": on_demand}
+	for generator in generators.values():
+		generator.addEventListener(opsiclientd)
+
+	event_queue.clear()
+	try:
+		with patch.dict("opsiclientd.Events.Utilities.Generators._EVENT_GENERATORS", generators):
+			opsiclientd._eventProcessingThreads.append(RunningEvent(Event(EventConfig("running"))))  # type: ignore[arg-type]
+			# Fired like after a config sync and like by the control server
+			assert sync_completed.createAndFireEvent()
+			assert get_control_interface(opsiclientd).fireEvent("on_demand") == "queued"
+			assert get_control_interface(opsiclientd).fireEvent("on_demand") == "queued"
+			assert not opsiclientd.eventLock.locked()
+			assert [(event["key"], event["occurrences"]) for event in event_queue.get_state()["events"]] == [
+				("sync_completed", 1),
+				("on_demand", 2),
+			]
+
+			# Queued events are not processed while the event is running
+			opsiclientd.processEventQueue()
+			assert len(event_queue) == 2
+			assert not opsiclientd.processed_events
+
+			opsiclientd._eventProcessingThreads.clear()
+			for expected in (["sync_completed"], ["sync_completed", "on_demand"]):
+				opsiclientd.event_processed.clear()
+				opsiclientd.processEventQueue()
+				assert opsiclientd.event_processed.wait(5)
+				assert opsiclientd.processed_events == expected
+			assert not len(event_queue)
+			assert event_queue.get_state()["dispatched"] >= 2
+	finally:
+		event_queue.clear()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_event_scheduler
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any
+
+from opsiclientd.Events.Basic import Event, EventListener
+from opsiclientd.Events.Timer import TimerEventConfig, TimerEventGenerator
+from opsiclientd.Events.Utilities.Scheduler import EventScheduler
+
+
+class Listener(EventListener):
+	def __init__(self, opsiclientd: Any) -> None:
+		super().__init__()
+		self.opsiclientd = opsiclientd
+		self.events: list[tuple[float, Event]] = []
+
+	def canProcessEvent(self, event: Event, can_cancel: bool = False) -> bool:
+		return True
+
+	def processEvent(self, event: Event) -> None:
+		self.events.append((time.monotonic(), event))
+		self.opsiclientd.eventLock.release()
+
+
+class Opsiclientd:
+	def __init__(self) -> None:
+		self.eventLock = threading.Lock()
+
+
+def test_scheduler_order_and_cancel() -> None:
+	scheduler = EventScheduler(max_workers=2)
+	calls: list[str] = []
+	scheduler.schedule(0.2, calls.append, "second")
+	scheduler.schedule(0.1, calls.append, "first")
+	cancelled = scheduler.schedule(0.15, calls.append, "cancelled", name="cancelled job")
+	assert [job.name for job in scheduler.get_jobs()] == ["append", "cancelled job", "append"]
+	assert time.time() < scheduler.get_jobs()[0].next_fire_time < time.time() + 0.2
+
+	scheduler.cancel(cancelled)
+	time.sleep(0.4)
+	assert calls == ["first", "second"]
+	assert not scheduler.get_jobs()
+	# Failing jobs do not stop the scheduler
+	scheduler.schedule(0, calls.pop, 10)
+	scheduler.schedule(0.05, calls.append, "third")
+	time.sleep(0.2)
+	assert calls == ["first", "second", "third"]
+	scheduler.stop()
+
+
+def test_scheduled_event_generator() -> None:
+	opsiclientd = Opsiclientd()
+	listener = Listener(opsiclientd)
+	config = TimerEventConfig("timer", startInterval=1, interval=1, maxRepetitions=1, notificationDelay=1)
+	generator = TimerEventGenerator(opsiclientd, config)  # type: ignore[arg-type]
+	generator.addEventConfig(config)
+	generator.addEventListener(listener)
+	threads = threading.active_count()
+
+	start = time.monotonic()
+	generator.start()
+	assert generator.isScheduled()
+	time.sleep(0.2)
+	# No thread per generator
+	assert threading.active_count() <= threads + 2
+	next_fire_time = generator.getNextFireTime()
+	assert next_fire_time and time.time() < next_fire_time < time.time() + 1
+	assert generator.is_alive()
+
+	time.sleep(3.5)
+	# Start interval + notification delay, interval + notification delay
+	assert [round(fired - start) for fired, _event in listener.events] == [2, 3]
+	# maxRepetitions reached
+	assert not generator.is_alive()
+	assert generator.getNextFireTime() is None
+	generator.stop()
+	generator.join(1)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_event_sources
+"""
+
+from __future__ import annotations
+
+import select
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from opsiclientd.Events.Basic import Event, EventListener
+from opsiclientd.Events.Posix.Sources import (
+	IFA_LOCAL,
+	IFADDRMSG,
+	IFF_RUNNING,
+	IFINFOMSG,
+	IFLA_IFNAME,
+	NLMSGHDR,
+	RTATTR,
+	RTM_DELADDR,
+	RTM_NEWADDR,
+	RTM_NEWLINK,
+	EventSource,
+	InotifySource,
+	LogindSource,
+	NetlinkSource,
+	SourceEventConfig,
+	SourceEventGenerator,
+	merge_event_info,
+)
+from opsiclientd.SystemCheck import RUNNING_ON_LINUX
+
+pytestmark = pytest.mark.skipif(not RUNNING_ON_LINUX, reason="Linux only")
+
+
+class Listener(EventListener):
+	def __init__(self, opsiclientd: Any) -> None:
+		super().__init__()
+		self.opsiclientd = opsiclientd
+		self.events: list[Event] = []
+
+	def canProcessEvent(self, event: Event, can_cancel: bool = False) -> bool:
+		return True
+
+	def processEvent(self, event: Event) -> None:
+		self.events.append(event)
+		self.opsiclientd.eventLock.release()
+
+
+class Opsiclientd:
+	def __init__(self) -> None:
+		self.eventLock = threading.Lock()
+
+	def is_stopping(self) -> bool:
+		return False
+
+
+def read_source(source: EventSource, timeout: float = 2.0) -> list[dict[str, Any]]:
+	select.select([source], [], [], timeout)
+	return source.read()  # type: ignore[return-value]
+
+
+def test_inotify_source(tmp_path: Path) -> None:
+	source = InotifySource([str(tmp_path), str(tmp_path / "missing")], ["create", "delete"])
+	source.open()
+	try:
+		(tmp_path / "file").write_bytes(b"data")
+		(tmp_path / "dir").mkdir()
+		infos = read_source(source)
+		assert infos == [
+			{
+				"source": "inotify",
+				"watch_path": str(tmp_path),
+				"path": str(tmp_path / "file"),
+				"name": "file",
+				"events": ["create"],
+				"is_dir": "false",
+			},
+			{
+				"source": "inotify",
+				"watch_path": str(tmp_path),
+				"path": str(tmp_path / "dir"),
+				"name": "dir",
+				"events": ["create"],
+				"is_dir": "true",
+			},
+		]
+		# Modifications are not watched
+		(tmp_path / "file").write_bytes(b"data2")
+		(tmp_path / "file").unlink()
+		assert [info["events"] for info in read_source(source)] == [["delete"]]
+	finally:
+		source.close()
+
+	with pytest.raises(ValueError, match="Invalid watch event"):
+		InotifySource([str(tmp_path)], ["changed"])
+	with pytest.raises(OSError, match="can be watched"):
+		InotifySource([str(tmp_path / "missing")]).open()
+
+
+def test_logind_source(tmp_path: Path) -> None:
+	(tmp_path / "1").write_text("UID=0\nUSER=root\nACTIVE=1\n", encoding="utf-8")
+	source = LogindSource(["login", "logout"], sessions_dir=str(tmp_path))
+	source.open()
+	try:
+		# logind writes a temporary file which is renamed
+		(tmp_path / ".#2abc").write_text("# This is private data. Do not parse.\nUID=1000\nUSER=user\nTYPE=x11\n", encoding="utf-8")
+		(tmp_path / ".#2abc").rename(tmp_path / "2")
+		(tmp_path / "2.ref").touch()
+		infos = read_source(source)
+		assert infos == [{"source": "logind", "event": "login", "session_id": "2", "uid": "1000", "user": "user", "type": "x11"}]
+
+		# State changes of known sessions are no logins
+		(tmp_path / ".#2def").write_text("UID=1000\nUSER=user\nTYPE=x11\nSTATE=active\n", encoding="utf-8")
+		(tmp_path / ".#2def").rename(tmp_path / "2")
+		(tmp_path / "1").unlink()
+		infos = read_source(source)
+		assert infos == [{"source": "logind", "event": "logout", "session_id": "1", "uid": "0", "user": "root", "active": "1"}]
+	finally:
+		source.close()
+
+
+def netlink_message(msg_type: int, payload: bytes, seq: int = 0) -> bytes:
+	message = NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, 0, seq, 0) + payload
+	return message + b"\0" * (-len(message) % 4)
+
+
+def rtattr(attr_type: int, data: bytes) -> bytes:
+	attribute = RTATTR.pack(RTATTR.size + len(data), attr_type) + data
+	return attribute + b"\0" * (-len(attribute) % 4)
+
+
+def link_message(index: int, name: str, running: bool, seq: int = 0) -> bytes:
+	payload = IFINFOMSG.pack(socket.AF_UNSPEC, 1, index, IFF_RUNNING if running else 0, 0) + rtattr(IFLA_IFNAME, name.encode() + b"\0")
+	return netlink_message(RTM_NEWLINK, payload, seq)
+
+
+def test_netlink_source_parse() -> None:
+	source = NetlinkSource(["link_up", "link_down", "address_added", "address_removed"])
+	source._dump_seq = 1
+	# Link states of the dump are no changes
+	assert source.parse(link_message(2, "eth0", True, seq=1) + link_message(3, "eth1", False, seq=1)) == []
+	# Changes of other attributes are no changes of the link state
+	assert source.parse(link_message(2, "eth0", True)) == []
+	assert source.parse(link_message(2, "eth0", False) + link_message(3, "eth1", True)) == [
+		{"source": "netlink", "event": "link_down", "interface": "eth0", "index": "2"},
+		{"source": "netlink", "event": "link_up", "interface": "eth1", "index": "3"},
+	]
+
+	address = IFADDRMSG.pack(socket.AF_INET, 24, 0, 0, 3) + rtattr(IFA_LOCAL, socket.inet_pton(socket.AF_INET, "192.168.1.10"))
+	infos = source.parse(netlink_message(RTM_NEWADDR, address) + netlink_message(RTM_DELADDR, address))
+	assert infos == [
+		{
+			"source": "netlink",
+			"event": event,
+			"interface": "eth1",
+			"index": "3",
+			"family": "ipv4",
+			"address": "192.168.1.10",
+			"prefix_length": "24",
+		}
+		for event in ("address_added", "address_removed")
+	]
+
+	source = NetlinkSource(["link_up"], interfaces=["eth1"])
+	assert source.parse(link_message(2, "eth0", True) + link_message(3, "eth1", True)) == [
+		{"source": "netlink", "event": "link_up", "interface": "eth1", "index": "3"}
+	]
+
+
+def test_merge_event_info() -> None:
+	assert merge_event_info(
+		[
+			{"source": "inotify", "path": "/a", "events": ["create"]},
+			{"source": "inotify", "path": "/b", "events": ["create", "close_write"]},
+		]
+	) == {"source": "inotify", "path": ["/a", "/b"], "events": ["create", "close_write"]}
+
+
+def test_source_event_generator(tmp_path: Path) -> None:
+	opsiclientd = Opsiclientd()
+	listener = Listener(opsiclientd)
+	config = SourceEventConfig("watch", watchPaths=[str(tmp_path)])
+	generator = SourceEventGenerator(opsiclientd, config)  # type: ignore[arg-type]
+	generator.addEventConfig(config)
+	generator.addEventListener(listener)
+	assert not generator.isScheduled()
+	assert SourceEventGenerator(opsiclientd, SourceEventConfig("timer", interval=10)).isScheduled()  # type: ignore[arg-type]
+
+	generator.start()
+	try:
+		time.sleep(0.5)
+		start = time.monotonic()
+		(tmp_path / "file1").write_bytes(b"data")
+		(tmp_path / "file2").write_bytes(b"data")
+		for _ in range(30):
+			if listener.events:
+				break
+			time.sleep(0.1)
+		assert time.monotonic() - start < 2
+		assert len(listener.events) == 1
+		event_info = listener.events[0].eventInfo
+		assert event_info["path"] == [str(tmp_path / "file1"), str(tmp_path / "file2")]
+		assert event_info["events"] == ["create", "close_write"]
+	finally:
+		generator.stop()
+		generator.join(3)
+	assert not generator.is_alive()
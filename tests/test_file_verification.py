@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_file_verification
+"""
+
+from __future__ import annotations
+
+import os
+from hashlib import md5
+from pathlib import Path
+from typing import Any
+
+from opsiclientd.FileVerification import MMAP_MIN_SIZE, ProductVerifier, VerificationIndex, hash_file
+
+
+def create_product(product_dir: Path) -> dict[str, dict[str, Any]]:
+	files = {
+		"setup.opsiscript": b"Message 'test'\n",
+		"files/large.bin": os.urandom(MMAP_MIN_SIZE + 1),
+		"files/empty.txt": b"",
+	}
+	package_info: dict[str, dict[str, Any]] = {"files": {"type": "d"}}
+	for path, data in files.items():
+		(product_dir / path).parent.mkdir(parents=True, exist_ok=True)
+		(product_dir / path).write_bytes(data)
+		package_info[path] = {"type": "f", "size": len(data), "md5sum": md5(data).hexdigest()}
+	return package_info
+
+
+def test_hash_file(tmp_path: Path) -> None:
+	for size in (0, 100, MMAP_MIN_SIZE + 100):
+		data = os.urandom(size)
+		(tmp_path / "file").write_bytes(data)
+		assert hash_file(tmp_path / "file") == md5(data).hexdigest()
+
+
+def test_verify_product(tmp_path: Path) -> None:
+	product_dir = tmp_path / "depot" / "product1"
+	package_info = create_product(product_dir)
+	index_file = tmp_path / "verification.json"
+	verifier = ProductVerifier(VerificationIndex(index_file), max_workers=2)
+
+	result = verifier.verify("product1", product_dir, package_info)
+	assert result.verified
+	assert result.files == 3
+	assert result.hashed_files == 3
+
+	# Unchanged files are not hashed again, the index is persistent
+	verifier = ProductVerifier(VerificationIndex(index_file))
+	result = verifier.verify("product1", product_dir, package_info)
+	assert result.verified
+	assert result.hashed_files == 0
+
+	# Changed files are hashed again
+	large_file = product_dir / "files" / "large.bin"
+	data = bytearray(large_file.read_bytes())
+	data[0] ^= 0xFF
+	large_file.write_bytes(data)
+	os.utime(large_file, ns=(0, 1_000_000_000))
+	result = verifier.verify("product1", product_dir, package_info)
+	assert not result.verified
+	assert result.hashed_files == 1
+	assert result.errors == {"files/large.bin": "checksum mismatch"}
+	# The mismatch is remembered without hashing
+	result = verifier.verify("product1", product_dir, package_info)
+	assert result.hashed_files == 0
+	assert result.errors == {"files/large.bin": "checksum mismatch"}
+
+	(product_dir / "setup.opsiscript").unlink()
+	(product_dir / "files" / "empty.txt").write_bytes(b"x")
+	result = verifier.verify("product1", product_dir, package_info)
+	assert set(result.errors) == {"setup.opsiscript", "files/large.bin", "files/empty.txt"}
+	assert result.errors["files/empty.txt"] == "size mismatch: 1 != 0"
+
+
+def test_verify_product_cancelled(tmp_path: Path) -> None:
+	product_dir = tmp_path / "product1"
+	package_info = create_product(product_dir)
+	verifier = ProductVerifier(VerificationIndex(tmp_path / "verification.json"))
+	result = verifier.verify("product1", product_dir, package_info, should_stop=lambda: True)
+	assert result.cancelled
+	assert not result.verified
+	assert result.hashed_files == 0
@@ -13,9 +13,9 @@ import socket
 import time
 from threading import Thread
 
-from OPSI.Util.Message import ChoiceSubject  # type: ignore[import]
+from OPSI.Util.Message import ChoiceSubject, MessageSubject, ProgressSubject  # type: ignore[import]
 
-from opsiclientd.notification_server import NotificationRPC, NotificationServer
+from opsiclientd.notification_server import FrameDecoder, NotificationRPC, NotificationServer, decode_frame, encode_frame
 
 
 def test_start_stop_notification_server() -> None:
@@ -44,31 +44,28 @@ class NotificationClient(Thread):
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.sock.connect((address, port))
 		self.rpcs_received: list[NotificationRPC] = []
-		self._buffer = bytearray()
+		self._decoder = FrameDecoder()
 		self.start()
 
 	def run(self) -> None:
 		while data := self.sock.recv(4096):
-			self._buffer += data
-			while b"\r\n" in self._buffer or b"\1e" in self._buffer:  # multiple rpc calls separated by \r\n or \1e
-				if b"\r\n" in self._buffer:
-					rpc_data, self._buffer = self._buffer.split(b"\r\n", maxsplit=1)
-				else:  # b"\1e" in byte_buffer
-					rpc_data, self._buffer = self._buffer.split(b"\1e", maxsplit=1)
-
+			self._decoder.feed(data)
+			while (rpc_data := self._decoder.next_frame()) is not None:
 				# print(f"Received rpc_data: {rpc_data!r}")
 				try:
-					rpc = NotificationRPC.from_json(rpc_data.decode("utf-8"))
+					rpc = decode_frame(rpc_data, self._decoder.serialization)
 				except Exception as err:
 					print(f"Error decoding rpc_data {rpc_data!r}: {err}")
 					continue
 				# print(f"Received rpc: {rpc!r}")
 				self.rpcs_received.append(rpc)
+				if rpc.method == "serializationChanged":
+					self._decoder.serialization = rpc.params[0]
 				if rpc.method == "endConnection":
 					return
 
-	def send_rpc(self, rpc: NotificationRPC) -> None:
-		self.sock.sendall(rpc.to_json().encode("utf-8") + b"\r\n")
+	def send_rpc(self, rpc: NotificationRPC, serialization: str = "json") -> None:
+		self.sock.sendall(encode_frame(rpc, serialization))  # type: ignore[arg-type]
 
 	def stop(self) -> None:
 		self.sock.close()
@@ -138,3 +135,102 @@ def test_notification_server_multi_client() -> None:
 		assert client.rpcs_received[-1].method == "endConnection"
 		assert client.rpcs_received[-1].params == []
 		assert not client.is_alive()
+
+
+def test_notification_server_coalesce_progress() -> None:
+	address = "127.0.0.1"
+	start_port = 44044
+
+	progress_subject = ProgressSubject(id="progress")
+	notification_server = NotificationServer(address=address, start_port=start_port, subjects=[progress_subject])
+	notification_server.start()
+	notification_server.wait_ready(5)
+
+	client = NotificationClient(address, notification_server.port)
+	time.sleep(1)
+	for state in range(1, 10001):
+		progress_subject.setState(state)
+	time.sleep(1)
+
+	progress_rpcs = [rpc for rpc in client.rpcs_received if rpc.method == "progressChanged"]
+	# Superseded progress updates are not sent
+	assert 0 < len(progress_rpcs) < 10000
+	assert progress_rpcs[-1].params[1] == 10000
+
+	notification_server.stop()
+	client.join(5)
+	assert client.rpcs_received[-1].method == "endConnection"
+
+
+def test_frame_decoder() -> None:
+	rpc = NotificationRPC(method="messageChanged", params=[{"id": "message", "message": "line1\r\nline2"}, "line1\r\nline2"])
+	json_frame = encode_frame(rpc, "json")
+	msgpack_frame = encode_frame(rpc, "msgpack")
+	decoder = FrameDecoder()
+	# Partial frames and delimiters split across chunks
+	data = json_frame + b'{"method": "selectChoice", "params": ["choice"]}\1e' + json_frame
+	for idx in range(0, len(data), 7):
+		decoder.feed(data[idx : idx + 7])
+	assert decode_frame(decoder.next_frame() or b"", "json") == rpc
+	assert decode_frame(decoder.next_frame() or b"", "json").method == "selectChoice"
+	assert decode_frame(decoder.next_frame() or b"", "json") == rpc
+	assert decoder.next_frame() is None
+
+	decoder.serialization = "msgpack"
+	decoder.feed(msgpack_frame[:3])
+	assert decoder.next_frame() is None
+	decoder.feed(msgpack_frame[3:] + msgpack_frame)
+	assert decode_frame(decoder.next_frame() or b"", "msgpack") == rpc
+	assert decode_frame(decoder.next_frame() or b"", "msgpack") == rpc
+	assert decoder.next_frame() is None
+	assert len(decoder) == 0
+
+
+def test_notification_server_msgpack_subject_deltas() -> None:
+	address = "127.0.0.1"
+	start_port = 44044
+
+	choice_subject = ChoiceSubject(id="choice")
+	choice_subject.setChoices(["abort", "start"])
+	message_subject = MessageSubject(id="message")
+	notification_server = NotificationServer(address=address, start_port=start_port, subjects=[choice_subject, message_subject])
+	notification_server.start()
+	notification_server.wait_ready(5)
+
+	json_client = NotificationClient(address, notification_server.port)
+	client = NotificationClient(address, notification_server.port)
+	time.sleep(1)
+	client.send_rpc(NotificationRPC(method="setSerialization", params=["msgpack"]))
+	time.sleep(1)
+
+	assert [rpc.method for rpc in client.rpcs_received] == ["subjectsChanged", "serializationChanged", "subjectsChanged"]
+	assert client.rpcs_received[2].params[0] == [choice_subject.serializable(), message_subject.serializable()]
+
+	# Client to server rpcs are msgpack encoded after negotiation
+	client.send_rpc(NotificationRPC(method="setSelectedIndexes", params=["choice", 1]), serialization="msgpack")
+	time.sleep(1)
+	message_subject.setMessage("new message")
+	time.sleep(1)
+	assert [rpc.method for rpc in client.rpcs_received[3:]] == ["selectedIndexesChanged", "messageChanged"]
+	assert client.rpcs_received[4].params == [message_subject.serializable(), "new message"]
+	client.rpcs_received = []
+	json_client.rpcs_received = []
+
+	new_subject = MessageSubject(id="new")
+	notification_server.setSubjects([choice_subject, new_subject])
+	time.sleep(1)
+	# Only the changes are sent to the client which negotiated the protocol
+	assert len(client.rpcs_received) == 1
+	assert client.rpcs_received[0].method == "subjectsUpdated"
+	changed, removed = client.rpcs_received[0].params
+	assert changed == [new_subject.serializable()]
+	assert removed == ["message"]
+	# Legacy clients receive the full list
+	assert len(json_client.rpcs_received) == 1
+	assert json_client.rpcs_received[0].method == "subjectsChanged"
+	assert json_client.rpcs_received[0].params[0] == [choice_subject.serializable(), new_subject.serializable()]
+
+	notification_server.stop()
+	for _client in (client, json_client):
+		_client.join(5)
+		assert _client.rpcs_received[-1].method == "endConnection"
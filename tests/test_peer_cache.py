@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_peer_cache
+"""
+
+from __future__ import annotations
+
+import ssl
+import time
+from contextlib import contextmanager
+from functools import partial
+from hashlib import md5
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+from typing import Any, Generator
+
+from opsicommon.ssl import as_pem, create_ca, create_server_cert
+
+from opsiclientd.DepotDownload import DepotFileDownloader
+from opsiclientd.PeerCache import (
+	MAX_PROPERTIES_SIZE,
+	Peer,
+	PeerCacheDiscovery,
+	decode_properties,
+	encode_properties,
+	fetch_from_peers,
+)
+
+FILES = {"setup.opsiscript": b"setup script", "files/installer.exe": b"installer" * 1000, "files/empty": b""}
+
+
+class PeerRequestHandler(SimpleHTTPRequestHandler):
+	def log_message(self, format: str, *args: object) -> None:
+		pass
+
+
+@contextmanager
+def peer_server(directory: Path, cert_file: Path | None = None) -> Generator[int, None, None]:
+	server = ThreadingHTTPServer(("127.0.0.1", 0), partial(PeerRequestHandler, directory=str(directory)))
+	if cert_file:
+		context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+		context.load_cert_chain(cert_file)
+		server.socket = context.wrap_socket(server.socket, server_side=True)
+	thread = Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	try:
+		yield server.server_address[1]
+	finally:
+		server.shutdown()
+		server.server_close()
+
+
+def create_product(directory: Path, files: dict[str, bytes]) -> dict[str, dict[str, Any]]:
+	package_info: dict[str, dict[str, Any]] = {"files": {"type": "d"}}
+	for path, data in files.items():
+		file = directory / "product1" / path
+		file.parent.mkdir(parents=True, exist_ok=True)
+		file.write_bytes(data)
+		package_info[path] = {"type": "f", "size": len(data), "md5sum": md5(data).hexdigest()}
+	return package_info
+
+
+def test_properties() -> None:
+	properties = encode_properties("client.test.local", {"product1": "1.0-1", "product2": "2.0-3"})
+	assert properties == {"host_id": "client.test.local", "p:product1": "1.0-1", "p:product2": "2.0-3"}
+	encoded = {key.encode(): value.encode() for key, value in properties.items()} | {b"flag": None}
+	assert decode_properties(encoded) == ("client.test.local", {"product1": "1.0-1", "product2": "2.0-3"})
+
+	products = {f"product{num:03d}": "1.0-1" for num in range(200)}
+	properties = encode_properties("client.test.local", products)
+	assert 1 < len(properties) < len(products)
+	assert sum(len(key) + len(value) + 2 for key, value in properties.items()) <= MAX_PROPERTIES_SIZE
+
+
+def test_get_peers() -> None:
+	discovery = PeerCacheDiscovery("client1.test.local", 4441, addresses=["127.0.0.1"])
+	discovery.add_peer(
+		Peer(name="client2", host_id="client2.test.local", addresses=["127.0.0.2"], port=4441, products={"product1": "1.0-1"})
+	)
+	discovery.add_peer(Peer(name="client3", host_id="client3.test.local", addresses=["::1"], port=4441, products={"product1": "1.0-2"}))
+	assert [peer.host_id for peer in discovery.get_peers("product1", "1.0-1")] == ["client2.test.local"]
+	assert discovery.get_peers("product1", "1.0-2")[0].url == "https://[::1]:4441/peer_cache/files"
+	assert discovery.get_peers("product2", "1.0-1") == []
+
+	peer = discovery.get_peers("product1", "1.0-1")[0]
+	discovery.block_peer(peer)
+	assert discovery.get_peers("product1", "1.0-1") == []
+	# The block is kept on updates of the peer
+	discovery.add_peer(
+		Peer(name="client2", host_id="client2.test.local", addresses=["127.0.0.2"], port=4441, products={"product1": "1.0-1"})
+	)
+	assert discovery.get_peers("product1", "1.0-1") == []
+
+	discovery.remove_peer("client3")
+	assert discovery.get_peers("product1", "1.0-2") == []
+
+
+def wait_for_peers(discovery: PeerCacheDiscovery, product_id: str, version: str, count: int = 1) -> list[Peer]:
+	for _ in range(100):
+		peers = discovery.get_peers(product_id, version)
+		if len(peers) == count:
+			break
+		time.sleep(0.1)
+	return peers
+
+
+def test_discovery() -> None:
+	discovery1 = PeerCacheDiscovery("client1.test.local", 4441, addresses=["127.0.0.1"])
+	discovery2 = PeerCacheDiscovery("client2.test.local", 4442, addresses=["127.0.0.1"])
+	discovery1.start({"product1": "1.0-1"})
+	try:
+		discovery2.start({})
+		try:
+			peers = wait_for_peers(discovery2, "product1", "1.0-1")
+			assert [(peer.host_id, peer.port, peer.addresses) for peer in peers] == [("client1.test.local", 4441, ["127.0.0.1"])]
+			# A client does not find itself
+			assert discovery1.get_peers("product1", "1.0-1") == []
+
+			discovery1.update_products({"product1": "1.0-2"})
+			assert len(wait_for_peers(discovery2, "product1", "1.0-2")) == 1
+			assert discovery2.get_peers("product1", "1.0-1") == []
+		finally:
+			discovery2.stop()
+		assert discovery2.get_peers("product1", "1.0-2") == []
+	finally:
+		discovery1.stop()
+
+
+def test_fetch_from_peers(tmp_path: Path) -> None:
+	package_info = create_product(tmp_path / "good", FILES)
+	create_product(tmp_path / "corrupt", {path: data.upper() for path, data in FILES.items()})
+	product_dir = tmp_path / "cache" / "product1"
+	product_dir.mkdir(parents=True)
+	(product_dir / "setup.opsiscript").write_bytes(FILES["setup.opsiscript"])
+
+	def create_downloader(peer: Peer) -> DepotFileDownloader:
+		return DepotFileDownloader(f"http://127.0.0.1:{peer.port}", partial_dir=tmp_path / "partial", max_retries=0)
+
+	failed_peers: list[str] = []
+	with peer_server(tmp_path / "good") as good_port, peer_server(tmp_path / "corrupt") as corrupt_port:
+		peers = [
+			Peer(name="corrupt", host_id="corrupt.test.local", addresses=["127.0.0.1"], port=corrupt_port),
+			Peer(name="good", host_id="good.test.local", addresses=["127.0.0.1"], port=good_port),
+		]
+		result = fetch_from_peers(
+			peers, "product1", package_info, str(product_dir), create_downloader, on_peer_failed=lambda peer: failed_peers.append(peer.name)
+		)
+		# Existing and empty files are not fetched
+		assert (result.files, result.size, result.failed) == (1, len(FILES["files/installer.exe"]), [])
+		assert failed_peers == ["corrupt"]
+		assert (product_dir / "files" / "installer.exe").read_bytes() == FILES["files/installer.exe"]
+
+		# Files no peer can deliver are left for the depot
+		(product_dir / "files" / "installer.exe").unlink()
+		package_info["files/missing.exe"] = {"type": "f", "size": 10, "md5sum": "0" * 32}
+		result = fetch_from_peers(peers[1:], "product1", package_info, str(product_dir), create_downloader)
+		assert (result.files, result.failed) == (1, ["files/missing.exe"])
+
+
+def create_server_cert_file(cert_file: Path, host_id: str, ca: tuple[Any, Any]) -> None:
+	ca_cert, ca_key = ca
+	cert, key = create_server_cert(
+		subject={"commonName": host_id},
+		valid_days=1,
+		ip_addresses={"127.0.0.1"},
+		hostnames={host_id},
+		ca_key=ca_key,
+		ca_cert=ca_cert,
+	)
+	cert_file.write_text(as_pem(key) + as_pem(cert), encoding="utf-8")
+
+
+def test_fetch_from_peers_verifies_certificate(tmp_path: Path) -> None:
+	package_info = create_product(tmp_path / "files", FILES)
+	product_dir = tmp_path / "cache" / "product1"
+	product_dir.mkdir(parents=True)
+
+	opsi_ca = create_ca(subject={"commonName": "opsi CA"}, valid_days=1)
+	ca_cert_file = tmp_path / "opsi-ca-cert.pem"
+	ca_cert_file.write_text(as_pem(opsi_ca[0]), encoding="utf-8")
+	create_server_cert_file(tmp_path / "good.pem", "good.test.local", opsi_ca)
+	create_server_cert_file(tmp_path / "untrusted.pem", "untrusted.test.local", create_ca(subject={"commonName": "Other CA"}, valid_days=1))
+
+	def create_downloader(peer: Peer) -> DepotFileDownloader:
+		return DepotFileDownloader(
+			f"https://127.0.0.1:{peer.port}",
+			partial_dir=tmp_path / "partial",
+			ca_cert_file=str(ca_cert_file),
+			server_hostname=peer.host_id,
+			max_retries=0,
+		)
+
+	failed_peers: list[str] = []
+	with (
+		peer_server(tmp_path / "files", tmp_path / "good.pem") as good_port,
+		peer_server(tmp_path / "files", tmp_path / "untrusted.pem") as untrusted_port,
+	):
+		peers = [
+			# Certificate issued by another CA
+			Peer(name="untrusted", host_id="untrusted.test.local", addresses=["127.0.0.1"], port=untrusted_port),
+			# Certificate of another host
+			Peer(name="spoofed", host_id="spoofed.test.local", addresses=["127.0.0.1"], port=good_port),
+			Peer(name="good", host_id="good.test.local", addresses=["127.0.0.1"], port=good_port),
+		]
+		result = fetch_from_peers(
+			peers, "product1", package_info, str(product_dir), create_downloader, on_peer_failed=lambda peer: failed_peers.append(peer.name)
+		)
+	assert failed_peers == ["untrusted", "spoofed"]
+	assert (result.files, result.failed) == (2, [])
+	assert (product_dir / "files" / "installer.exe").read_bytes() == FILES["files/installer.exe"]
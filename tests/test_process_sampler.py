@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_process_sampler
+"""
+
+import threading
+import time
+
+import psutil  # type: ignore[import]
+
+from opsiclientd.ProcessSampler import ProcessSampler
+from opsiclientd.webserver.rpc.control import ControlInterface
+
+
+def test_process_sampler_history() -> None:
+	sampler = ProcessSampler(interval=0.1, history_size=5)
+	stop_busy = threading.Event()
+
+	def busy() -> None:
+		while not stop_busy.is_set():
+			sum(range(1000))
+
+	busy_thread = threading.Thread(target=busy, name="BusyTestThread", daemon=True)
+	busy_thread.start()
+	sampler.start()
+	try:
+		time.sleep(1.0)
+	finally:
+		sampler.stop()
+		sampler.join(2)
+		stop_busy.set()
+		busy_thread.join(2)
+
+	samples = sampler.get_samples()
+	# Ring buffer size
+	assert len(samples) == 5
+	assert samples[0]["timestamp"] < samples[-1]["timestamp"]
+	assert samples[-1]["memory_rss"] > 0
+	assert samples[-1]["open_files"] > 0
+	assert "BusyTestThread" in [t["name"] for t in samples[-1]["threads"]]
+
+	summary = sampler.get_summary(seconds=10)
+	assert summary["samples"] == 5
+	assert summary["duration"] > 0
+	busy_info = [t for t in summary["threads"] if t["name"] == "BusyTestThread"][0]
+	assert busy_info["cpu_percent"] > 0
+	# Threads are sorted by cpu usage
+	assert summary["threads"][0]["cpu_percent"] >= summary["threads"][-1]["cpu_percent"]
+
+
+def test_process_sampler_empty() -> None:
+	sampler = ProcessSampler(interval=1)
+	assert sampler.get_samples() == []
+	assert sampler.get_summary() == {}
+	sampler.sample()
+	assert len(sampler.get_samples(seconds=10)) == 1
+
+
+class Opsiclientd:
+	def __init__(self, sampler: ProcessSampler | None = None) -> None:
+		self.sampler = sampler
+
+	def getProcessSampler(self) -> ProcessSampler:
+		if not self.sampler:
+			raise RuntimeError("Process sampler not running")
+		return self.sampler
+
+
+def test_process_info_sampled() -> None:
+	sampler = ProcessSampler(interval=1)
+	sampler.sample()
+	time.sleep(0.2)
+	sampler.sample()
+
+	# The sampled history is used if it covers the interval, the interval is passed as string by some clients
+	start = time.monotonic()
+	sampled = ControlInterface(Opsiclientd(sampler)).getProcessInfo(interval="0.2")  # type: ignore[arg-type]
+	assert time.monotonic() - start < 0.2
+	measured = ControlInterface(Opsiclientd()).getProcessInfo(interval="0.2")  # type: ignore[arg-type]
+
+	# Same structure on both paths
+	assert list(sampled) == list(measured)
+	assert list(sampled["cpu_times"]) == list(measured["cpu_times"]) == list(psutil.Process().cpu_times()._asdict())
+	main_thread = threading.main_thread()
+	for info in (sampled, measured):
+		thread = [t for t in info["threads"] if t["id"] == main_thread.native_id][0]
+		assert list(thread) == ["id", "name", "run_func", "cpu_times", "cpu_percent"]
+		assert thread["name"] == main_thread.name
+		assert thread["run_func"] == str(main_thread.run)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_product_cache_service
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from hashlib import md5
+from pathlib import Path
+from typing import Any, Generator
+from unittest.mock import patch
+
+import pytest
+
+from opsiclientd.Config import Config
+from opsiclientd.FileVerification import hash_file
+from opsiclientd.nonfree.CacheService import CacheService, PrefetchCanceled, ProductCacheService, state
+
+config = Config()
+
+
+@dataclass
+class ProductOnDepot:
+	productId: str
+	productVersion: str = "1.0"
+	packageVersion: str = "1"
+
+
+@dataclass
+class Product:
+	id: str
+	productVersion: str = "1.0"
+	packageVersion: str = "1"
+	name: str = ""
+
+
+class ConfigService:
+	hostname = "opsi.test.local"
+
+	def productOnDepot_getObjects(self, depotId: str, productId: list[str]) -> list[ProductOnDepot]:
+		return [ProductOnDepot(product_id) for product_id in productId]
+
+
+def create_cached_product(product_cache_dir: Path, product_id: str, files: int) -> None:
+	product_dir = product_cache_dir / product_id
+	product_dir.mkdir(parents=True)
+	lines = []
+	for num in range(files):
+		data = f"{product_id} {num}".encode()
+		(product_dir / f"file{num}").write_bytes(data)
+		lines.append(f"f 'file{num}' {len(data)} {md5(data).hexdigest()}")
+	(product_dir / f"{product_id}.files").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+@pytest.fixture
+def product_cache_service(tmp_path: Path) -> Generator[ProductCacheService, None, None]:
+	storage_dir = config.get("cache_service", "storage_dir")
+	state_file = state._stateFile
+	config.set("cache_service", "storage_dir", str(tmp_path))
+	state._stateFile = str(tmp_path / "state.json")
+	try:
+		yield ProductCacheService(None)  # type: ignore[arg-type]
+	finally:
+		config.set("cache_service", "storage_dir", storage_dir)
+		state._stateFile = state_file
+
+
+def test_background_verification_cancelled_by_use(product_cache_service: ProductCacheService) -> None:
+	product_cache_dir = Path(product_cache_service.getProductCacheDir())
+	create_cached_product(product_cache_dir, "background", files=50)
+	create_cached_product(product_cache_dir, "used", files=2)
+	product_cache_service._state = {
+		"products": {
+			product_id: {"completed": time.time(), "productVersion": "1.0", "packageVersion": "1"} for product_id in ("background", "used")
+		}
+	}
+	cache_service = CacheService(None)  # type: ignore[arg-type]
+	cache_service._productCacheService = product_cache_service
+
+	background_hashing = threading.Event()
+	hashed_files: list[str] = []
+
+	def slow_hash_file(path: str | Path) -> str:
+		if Path(path).parent.name == "background":
+			background_hashing.set()
+			time.sleep(0.1)
+		hashed_files.append(Path(path).parent.name)
+		return hash_file(path)
+
+	with patch("opsiclientd.FileVerification.hash_file", slow_hash_file):
+		background = threading.Thread(target=product_cache_service._verifyProductsInBackground)
+		background.start()
+		assert background_hashing.wait(5)
+
+		start = time.monotonic()
+		assert cache_service.productCacheCompleted(ConfigService(), ["used"])
+		# The check before use does not wait for the background pass to complete
+		assert time.monotonic() - start < 2
+		background.join(5)
+
+	assert not background.is_alive()
+	assert hashed_files.count("used") == 2
+	assert hashed_files.count("background") < 50
+	# The cancelled background pass is repeated later
+	assert "products_verified" not in product_cache_service._state
+	assert product_cache_service._state["products"]["used"]["verified"]
+
+
+class PrefetchConfigService(ConfigService):
+	def productOnDepot_getObjects(self, depotId: str, productId: str | list[str]) -> list[ProductOnDepot]:
+		return super().productOnDepot_getObjects(depotId, [productId] if isinstance(productId, str) else productId)
+
+	def product_getObjects(self, id: str, **kwargs: Any) -> list[Product]:
+		return [Product(id)]
+
+
+class Repository:
+	def download(self, source: str, destination: str) -> None:
+		Path(destination).write_text("f 'file0' 4 00000000000000000000000000000000\n", encoding="utf-8")
+
+	def setBandwidth(self, dynamicBandwidth: bool, maxBandwidth: int) -> None:
+		pass
+
+	def disconnect(self) -> None:
+		pass
+
+
+def test_prefetch_cancelled_while_synchronizing(product_cache_service: ProductCacheService) -> None:
+	synchronized: list[int] = []
+
+	class ProductSynchronizer:
+		def __init__(self, **kwargs: Any) -> None:
+			pass
+
+		def synchronize(self, productProgressObserver: Any = None, overallProgressObserver: Any = None) -> None:
+			assert productProgressObserver
+			for num in range(10):
+				if num == 3:
+					# Products are to be cached while the prefetched product is synchronized
+					product_cache_service.cacheProducts()
+				productProgressObserver.progressChanged(None, num, num * 10.0, 0.0, 0.0, 0.0)
+				synchronized.append(num)
+
+	product_cache_service._configService = PrefetchConfigService()
+	product_cache_service._productCacheMaxSize = 0
+	with (
+		patch.dict(config._config["depot_server"], {"master_depot_id": "depot.test.local"}),
+		patch.object(product_cache_service, "_getRepository", lambda productId: Repository()),
+		patch("opsiclientd.nonfree.CacheService.DepotToLocalDirectorySychronizer", ProductSynchronizer),
+		patch("opsiclientd.nonfree.CacheService.System.getDiskSpaceUsage", lambda path: {"available": 10**12}),
+	):
+		with pytest.raises(PrefetchCanceled):
+			product_cache_service._cacheProduct("prefetched", ["prefetched"], prefetch=True)
+
+	# The synchronization is aborted on the next progress change
+	assert synchronized == [0, 1, 2]
+	product_state = product_cache_service._state["products"]["prefetched"]
+	assert product_state["started"]
+	assert not product_state["completed"]
+	assert not product_state["failure"]
+	assert "prefetched" not in product_cache_service.getCachedProductVersions()
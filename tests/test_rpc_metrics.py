@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_rpc_metrics
+"""
+
+from __future__ import annotations
+
+import random
+
+from opsiclientd.RPCMetrics import LogLinearHistogram, RPCMetrics
+
+
+def test_log_linear_histogram() -> None:
+	histogram = LogLinearHistogram()
+	values = [random.randint(0, 10_000_000) for _ in range(10_000)] + [0, 1, 15, 16, 17]
+	for value in values:
+		histogram.record(value)
+	values.sort()
+	assert histogram.count == len(values)
+	assert histogram.sum == sum(values)
+	assert (histogram.min, histogram.max) == (0, values[-1])
+	for percentile in (1, 50, 90, 99, 99.9):
+		expected = values[round(len(values) * percentile / 100) - 1]
+		assert abs(histogram.percentile(percentile) - expected) <= expected / 16 + 1
+
+	# Every value lies in the range of its bucket
+	for value in (0, 15, 16, 31, 32, 1000, 2**40 + 12345):
+		lower, upper = histogram.bucket_range(histogram._index(value))
+		assert lower <= value < upper
+		assert upper - lower <= max(1, lower / 16)
+
+
+def test_rpc_metrics() -> None:
+	metrics = RPCMetrics()
+	metrics.observe("ControlInterface", "uptime", 0.002)
+	metrics.observe("ControlInterface", "uptime", 0.2, error=True)
+	metrics.observe("ControlInterface", "fireEvent", 1.5, transport="messagebus")
+	metrics.observe_payload("ControlInterface", ["uptime", "uptime"], 200, 1000)
+
+	result = metrics.get_metrics()
+	uptime = result["interfaces"]["ControlInterface"]["uptime"]
+	assert (uptime["requests"], uptime["errors"]) == (2, 1)
+	assert round(uptime["duration"]["max"], 6) == 0.2
+	assert uptime["request_size"]["sum"] == 200
+	assert uptime["response_size"]["max"] == 500
+	assert result["transports"] == {
+		"http": {"requests": 2, "errors": 1, "request_bytes": 200, "response_bytes": 1000},
+		"messagebus": {"requests": 1, "errors": 0, "request_bytes": 0, "response_bytes": 0},
+	}
+
+	lines = metrics.to_prometheus().splitlines()
+	labels = 'interface="ControlInterface",method="uptime"'
+	assert f"opsiclientd_rpc_requests_total{{{labels}}} 2" in lines
+	assert f"opsiclientd_rpc_errors_total{{{labels}}} 1" in lines
+	assert f'opsiclientd_rpc_duration_seconds_bucket{{{labels},le="0.001"}} 0' in lines
+	assert f'opsiclientd_rpc_duration_seconds_bucket{{{labels},le="0.005"}} 1' in lines
+	assert f'opsiclientd_rpc_duration_seconds_bucket{{{labels},le="0.25"}} 2' in lines
+	assert f'opsiclientd_rpc_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in lines
+	assert f"opsiclientd_rpc_duration_seconds_count{{{labels}}} 2" in lines
+	assert 'opsiclientd_rpc_transport_requests_total{transport="messagebus"} 1' in lines
+	assert "# TYPE opsiclientd_rpc_duration_seconds histogram" in lines
+
+	metrics.reset()
+	assert metrics.get_metrics()["interfaces"] == {}
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_rpc_profiler
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any
+
+import pytest
+
+from opsiclientd.OpsiService import ServiceConnection
+from opsiclientd.RPCProfiler import MAX_VIOLATIONS, RPCBudgetExceededError, parse_budgets, rpc_profiler
+from opsiclientd.Timeline import Timeline
+
+
+class Response:
+	def __init__(self, size: int) -> None:
+		self.headers = {"Content-Length": str(size)}
+
+
+class ServiceClient:
+	def request(self, method: str, path: str, data: bytes | None = None) -> Response:
+		return Response(size=100)
+
+	def jsonrpc(self, method: str, params: list[Any] | None = None) -> Any:
+		self.request("POST", "/rpc", data=json.dumps({"method": method, "params": params or []}).encode())
+		if method == "backend_fail":
+			raise RuntimeError("failed")
+		return []
+
+
+class Backend:
+	def __init__(self) -> None:
+		self.service = ServiceClient()
+
+	def __getattr__(self, name: str) -> Any:
+		return lambda *params: self.service.jsonrpc(name, list(params))
+
+
+timeline_events: list[dict[str, Any]] = []
+
+
+@pytest.fixture
+def backend(monkeypatch: pytest.MonkeyPatch) -> Backend:
+	monkeypatch.setattr(Timeline, "addEvent", lambda self, **kwargs: timeline_events.append(kwargs) or 1)
+	timeline_events.clear()
+	rpc_profiler.reset()
+	service_connection = ServiceConnection()
+	backend = Backend()
+	service_connection._configService = backend
+	service_connection._count_service_requests()
+	return backend
+
+
+def test_rpc_profiler(backend: Backend) -> None:
+	backend.host_getObjects()
+	with rpc_profiler.operation("ProductCacheService._cacheProducts") as profile:
+		backend.productOnClient_getObjects(["client.test.local"])
+		backend.productOnClient_getObjects()
+		with rpc_profiler.operation("Config.getDepot"):
+			backend.configState_getClientToDepotserver()
+		with pytest.raises(RuntimeError):
+			backend.backend_fail()
+
+	assert profile.calls == 4
+	assert profile.errors == 1
+	assert profile.bytes_received == 400
+	assert profile.methods["productOnClient_getObjects"].calls == 2
+	assert profile.methods["productOnClient_getObjects"].bytes_sent == len(
+		json.dumps({"method": "productOnClient_getObjects", "params": [["client.test.local"]]})
+	) + len(json.dumps({"method": "productOnClient_getObjects", "params": []}))
+
+	totals = rpc_profiler.get_profile()
+	assert sorted(totals) == ["-", "Config.getDepot", "ProductCacheService._cacheProducts"]
+	assert totals["-"]["methods"] == {
+		"host_getObjects": {"calls": 1, "errors": 0, "duration": pytest.approx(0.0, abs=1), "bytes_sent": 43, "bytes_received": 100}
+	}
+	assert totals["Config.getDepot"]["calls"] == 1
+	assert totals["ProductCacheService._cacheProducts"]["executions"] == 1
+
+	# One summary per operation with rpcs
+	assert [event["title"] for event in timeline_events] == ["RPCs Config.getDepot", "RPCs ProductCacheService._cacheProducts"]
+	assert timeline_events[1]["category"] == "rpc_profile"
+	assert "productOnClient_getObjects: 2 calls" in timeline_events[1]["description"]
+
+
+def test_rpc_call_budget(backend: Backend) -> None:
+	@rpc_profiler.operation("Config.getDepot")
+	def get_depot(calls: int) -> None:
+		for _ in range(calls):
+			backend.configState_getClientToDepotserver()
+
+	with rpc_profiler.enforce_budgets({"Config.getDepot": 2}):
+		get_depot(2)
+	assert not timeline_events[0]["isError"]
+
+	with pytest.raises(RPCBudgetExceededError, match=r"'Config.getDepot' exceeded its rpc call budget: 3 > 2"):
+		with rpc_profiler.enforce_budgets("Config.getDepot:2"):
+			get_depot(3)
+	assert timeline_events[1]["isError"]
+	# The budgets are only enforced inside of the context
+	assert not rpc_profiler.budgets
+	get_depot(3)
+
+	# Only the latest violations are kept
+	with pytest.raises(RPCBudgetExceededError) as exc_info:
+		with rpc_profiler.enforce_budgets({"Config.getDepot": 0}):
+			for _ in range(MAX_VIOLATIONS + 10):
+				get_depot(1)
+	assert len(rpc_profiler.violations) == MAX_VIOLATIONS
+	assert len(str(exc_info.value).splitlines()) == MAX_VIOLATIONS
+
+
+def test_parse_budgets() -> None:
+	assert parse_budgets("") == {}
+	assert parse_budgets(" Config.getDepot:10, process_product_action_requests : 50 ") == {
+		"Config.getDepot": 10,
+		"process_product_action_requests": 50,
+	}
+	with pytest.raises(ValueError):
+		parse_budgets("Config.getDepot")
+	with pytest.raises(ValueError):
+		parse_budgets("Config.getDepot:many")
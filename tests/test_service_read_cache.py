@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_service_read_cache
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+from opsiclientd.ServiceReadCache import ServiceReadCache, is_memoized_method, is_read_method
+
+
+class Backend:
+	def __init__(self) -> None:
+		self.calls: list[str] = []
+		self.service = "service"
+
+	def __getattr__(self, name: str) -> Any:
+		def rpc(*args: Any, **kwargs: Any) -> Any:
+			self.calls.append(name)
+			return [{"method": name, "args": list(args), "kwargs": kwargs}]
+
+		return rpc
+
+
+def test_is_memoized_method() -> None:
+	assert is_memoized_method("productOnDepot_getObjects")
+	assert is_memoized_method("objectToGroup_getIdents")
+	assert is_memoized_method("configState_getValues")
+	assert not is_memoized_method("configState_getClientToDepotserver")
+	assert not is_memoized_method("productOnClient_updateObjects")
+
+
+def test_is_read_method() -> None:
+	assert is_read_method("productOnDepot_getObjects")
+	assert is_read_method("configState_getClientToDepotserver")
+	assert is_read_method("getDepotSelectionAlgorithm")
+	assert is_read_method("backend_info")
+	assert not is_read_method("productOnClient_updateObjects")
+	assert not is_read_method("setProductActionRequest")
+	assert not is_read_method("log_write")
+
+
+def test_service_read_cache() -> None:
+	backend = Backend()
+	cache: Any = ServiceReadCache(backend)
+	assert cache.service == "service"
+
+	result = cache.productOnClient_getObjects(clientId="client.test.local", productId=["b", "a"])
+	# Normalized arguments
+	assert cache.productOnClient_getObjects(productId=["a", "b", "a"], clientId="client.test.local") == result
+	# Results are copies
+	result[0]["method"] = "changed"
+	assert cache.productOnClient_getObjects(clientId="client.test.local", productId=["a", "b"])[0]["method"] == "productOnClient_getObjects"
+	assert backend.calls == ["productOnClient_getObjects"]
+
+	cache.productOnClient_getObjects(clientId="client.test.local", productId=["a"])
+	cache.productOnDepot_getIdents(returnType="dict")
+	cache.configState_getValues(["opsiclientd.global.log_level"], "client.test.local")
+	# Reads which are not memoized
+	cache.configState_getClientToDepotserver(clientIds="client.test.local")
+	cache.configState_getClientToDepotserver(clientIds="client.test.local")
+	assert backend.calls.count("productOnClient_getObjects") == 2
+	assert backend.calls.count("configState_getClientToDepotserver") == 2
+	assert cache.get_statistics() == {"hits": 2, "misses": 4, "entries": 4}
+
+	# Writes invalidate the object class
+	cache.productOnClient_updateObjects([])
+	cache.productOnClient_getObjects(clientId="client.test.local", productId=["a"])
+	cache.productOnDepot_getIdents(returnType="dict")
+	assert backend.calls.count("productOnClient_getObjects") == 3
+	assert backend.calls.count("productOnDepot_getIdents") == 1
+
+	# And the dependent object classes
+	cache.config_updateObjects([])
+	cache.configState_getValues(["opsiclientd.global.log_level"], "client.test.local")
+	assert backend.calls.count("configState_getValues") == 2
+
+	cache.clear()
+	cache.productOnDepot_getIdents(returnType="dict")
+	assert backend.calls.count("productOnDepot_getIdents") == 2
+
+	# Writes which do not match an object class remove all memoized reads
+	cache.productOnClient_getObjects(clientId="client.test.local", productId=["a"])
+	calls = backend.calls.count("productOnClient_getObjects")
+	cache.getDepotSelectionAlgorithm()
+	cache.productOnClient_getObjects(clientId="client.test.local", productId=["a"])
+	assert backend.calls.count("productOnClient_getObjects") == calls
+	cache.setProductActionRequest("a", "client.test.local", "setup")
+	cache.productOnClient_getObjects(clientId="client.test.local", productId=["a"])
+	cache.productOnDepot_getIdents(returnType="dict")
+	assert backend.calls.count("productOnClient_getObjects") == calls + 1
+	assert backend.calls.count("productOnDepot_getIdents") == 3
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+# opsiclientd is part of the desktop management solution opsi http://www.opsi.org
+# Copyright (c) 2010-2024 uib GmbH <info@uib.de>
+# This code is owned by the uib GmbH, Mainz, Germany (uib.de). All rights reserved.
+# License: AGPL-3.0
+
+"""
+test_utils
+"""
+
+from __future__ import annotations
+
+import datetime
+
+import pytest
+
+from opsiclientd.utils import get_prefetch_product_ids, in_working_window
+
+
+@pytest.mark.parametrize(
+	"working_window, now, expected",
+	(
+		("07:00-22:00", datetime.time(12, 0), True),
+		("07:00-22:00", datetime.time(7, 0), True),
+		("07:00-22:00", datetime.time(22, 1), False),
+		("20:00-06:00", datetime.time(23, 30), True),
+		("20:00-06:00", datetime.time(5, 59), True),
+		("20:00-06:00", datetime.time(12, 0), False),
+	),
+)
+def test_in_working_window(working_window: str, now: datetime.time, expected: bool) -> None:
+	assert in_working_window(working_window, now) is expected
+
+
+def test_in_working_window_invalid() -> None:
+	with pytest.raises(ValueError):
+		in_working_window("07:00", datetime.time(12, 0))
+
+
+def test_get_prefetch_product_ids() -> None:
+	installed_versions = {"firefox": "120.0-1", "7zip": "23.01-2", "notepad": "8.6-1", "removed": "1.0-1"}
+	depot_versions = {"firefox": "121.0-1", "7zip": "23.01-3", "notepad": "8.6-1", "office": "2021-5", "vlc": "3.0-1"}
+	product_ids = get_prefetch_product_ids(installed_versions, depot_versions, ["vlc", "office", "firefox", "missing"], {})
+	# Installed products with newer versions first, products not on the depot are skipped
+	assert product_ids == ["7zip", "firefox", "office", "vlc"]
+
+	product_ids = get_prefetch_product_ids(
+		installed_versions,
+		depot_versions,
+		["vlc", "office"],
+		{"firefox": "121.0-1", "vlc": "2.0-1"},
+		exclude_product_ids=["office"],
+	)
+	# Products already cached in the depot version and excluded products are skipped
+	assert product_ids == ["7zip", "vlc"]